@@ -39,13 +39,11 @@ Brian
 __docformat__ = "restructuredtext en"
 
 import warnings as _warnings
+import sys as _sys
+import imp as _imp
+import types as _types
+import scipy as _scipy
 from scipy import *
-try:
-    from pylab import *
-except:
-    _warnings.warn("Couldn't import pylab.")
-if 'x' in globals(): del x # for some reason x is defined as 'symlog' by pylab!
-if 'f' in globals(): del f
 
 from clock import *
 from connections import *
@@ -54,12 +52,12 @@ from directcontrol import *
 from stateupdater import *
 from monitor import *
 from network import *
+from networkprofiler import *
+from memoryusage import *
 from neurongroup import *
-from plotting import *
 from reset import *
 from threshold import *
 from units import *
-from tools import *
 from equations import *
 from globalprefs import *
 from unitsafefunctions import *
@@ -70,6 +68,7 @@ from log import *
 from magic import *
 from stdp import *
 from stp import *
+from eventdriven import *
 from timedarray import *
 from deprecated.multiplespikegeneratorgroup import *
 from tests.simpletest import *
@@ -107,6 +106,31 @@ define_global_preference(
          ''')
 set_global_preferences(gcc_options=['-ffast-math'])
 
+define_global_preference(
+    'useweavecache', 'True',
+    desc='''
+         Whether or not to store the modules compiled by weave in a persistent
+         cache shared by all processes (see ``weavecachedir``), instead of the
+         weave catalog. Each module is stored under a hash of its code,
+         argument types, compiler and compiler options, so that simulations
+         started at the same time compile each module only once.
+         ''')
+set_global_preferences(useweavecache=True)
+define_global_preference(
+    'weavecachedir', 'None',
+    desc='''
+         The directory of the cache of compiled modules. If ``None``, the
+         directory ``.brian/kernelcache`` in the home directory is used.
+         ''')
+set_global_preferences(weavecachedir=None)
+define_global_preference(
+    'weavecachesize', '500',
+    desc='''
+         Maximum size of the cache of compiled modules, in megabytes. The
+         least recently used modules are deleted first.
+         ''')
+set_global_preferences(weavecachesize=500)
+
 define_global_preference(
     'openmp', 'False',
     desc='''
@@ -165,6 +189,36 @@ define_global_preference(
          ''')
 set_global_preferences(usecstdp=False)
 
+define_global_preference(
+    'usenumexpr', 'False',
+    desc='''
+         Whether or not to evaluate the equations of compiled nonlinear state
+         updaters (``compile=True``) with the numexpr package, if it is
+         installed. Each equation is then evaluated in a single
+         multithreaded pass.
+         ''')
+set_global_preferences(usenumexpr=False)
+
+define_global_preference(
+    'defaultdtype', 'float64',
+    desc='''
+         The floating point type of the state variables of groups, of
+         connection weights and of recorded values, if not specified with
+         the ``dtype`` keyword (any value accepted by ``numpy.dtype``, e.g.
+         ``float32`` or ``'float32'``). Single precision halves the memory
+         footprint and bandwidth of large networks, at the cost of accuracy.
+         ''')
+set_global_preferences(defaultdtype='float64')
+
+define_global_preference(
+    'expectedrate', '10 * Hz',
+    desc='''
+         The expected firing rate of neurons, used to size the buffers which
+         store the recent spikes of groups (the buffers grow if more spikes
+         are stored, but then the spikes are copied).
+         ''')
+set_global_preferences(expectedrate=10 * Hz)
+
 define_global_preference(
     'brianhears_usegpu', 'False',
     desc='''
@@ -178,8 +232,8 @@ set_global_preferences(brianhears_usegpu=False)
 # behaviour for magic functions accordingly
 import inspect as _inspect
 import os as _os
-_of = _inspect.getouterframes(_inspect.currentframe())
-if len(_of) > 1 and _os.path.exists(_of[1][1]):
+_of = _inspect.currentframe().f_back # getouterframes is slow, it reads the source
+if _of is not None and _os.path.exists(_of.f_code.co_filename):
     _magic_useframes = True
 else:
     _magic_useframes = False
@@ -216,3 +270,89 @@ except ImportError:
 
     def run_all_tests():
         print "Brian test framework requires 'nose' package."
+
+### Deferred imports
+# pylab and the names from the plotting module and the tools package are only
+# imported when they are first used (see _BrianModule below), the weave, sympy
+# and C++ accelerators are imported on first use where they are needed (see
+# brian.utils.lazyimport)
+
+_lazy_names = dict.fromkeys(['raster_plot', 'raster_plot_spiketimes',
+                             'hist_plot'], 'plotting')
+_lazy_names.update(dict.fromkeys([
+    # tools.io
+    'read_neuron_dat', 'read_atf', 'load_aer',
+    # tools.tabulate
+    'Tabulate', 'TabulateInterp',
+    # tools.statistics
+    'firing_rate', 'CV', 'correlogram', 'autocorrelogram', 'CCF', 'ACF',
+    'CCVF', 'ACVF', 'group_correlations', 'sort_spikes', 'total_correlation',
+    'vector_strength', 'gamma_factor', 'get_gamma_factor_matrix',
+    'get_gamma_factor', 'spike_triggered_average',
+    # tools.parameters
+    'attribdict', 'Parameters',
+    # tools.correlatedspikes
+    'rectified_gaussian', 'inv_rectified_gaussian',
+    'HomogeneousCorrelatedSpikeTrains',
+    'MixtureHomogeneousCorrelatedSpikeTrains', 'CorrelatedSpikeTrains',
+    'mixture_process', 'find_mixture',
+    # tools.remotecontrol
+    'RemoteControlServer', 'RemoteControlClient'], 'tools'))
+
+# for some reason x and f are defined by pylab!
+_pylab_excluded = set(['x', 'f'])
+
+
+class _BrianModule(_types.ModuleType):
+    '''
+    The brian package, with the names from pylab, :mod:`brian.plotting` and
+    :mod:`brian.tools` imported on first access. ``from brian import *``
+    imports everything, with the same precedence as before: Brian's names
+    override pylab's, which override scipy's.
+    '''
+    _pylab_loaded = False
+
+    def _load_pylab(self):
+        self._pylab_loaded = True
+        try:
+            import pylab
+        except:
+            _warnings.warn("Couldn't import pylab.")
+            return
+        d = self.__dict__
+        for name, value in pylab.__dict__.iteritems():
+            if (name.startswith('_') or name in _pylab_excluded or
+                name in _lazy_names):
+                continue
+            if name not in d or d[name] is getattr(_scipy, name, None):
+                d[name] = value
+
+    def __getattr__(self, name):
+        if name in _lazy_names:
+            module = __import__('brian.' + _lazy_names[name], fromlist=[name])
+            value = getattr(module, name)
+            setattr(self, name, value)
+            return value
+        if not name.startswith('_') and not self._pylab_loaded:
+            try:
+                # do not import pylab for Brian subpackages, e.g. brian.hears
+                _imp.find_module(name, self.__path__)
+            except ImportError:
+                self._load_pylab()
+                if name in self.__dict__:
+                    return self.__dict__[name]
+        raise AttributeError("'module' object has no attribute '" + name + "'")
+
+    @property
+    def __all__(self):
+        if not self._pylab_loaded:
+            self._load_pylab()
+        names = set(name for name in self.__dict__ if not name.startswith('_'))
+        return list(names.union(_lazy_names))
+
+_module = _BrianModule(__name__, __doc__)
+_module.__dict__.update(globals())
+# keep the original module alive, otherwise Python clears its globals which
+# are used by the functions defined above
+_module._original_module = _sys.modules[__name__]
+_sys.modules[__name__] = _module
@@ -0,0 +1,304 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+"""
+Binary checkpoints of the state of a :class:`Network`
+
+A checkpoint is a directory with one ``.npy`` file for each array of the
+network state and a small pickled manifest, ``manifest.pkl``, which is
+written last (so that a directory without manifest is an incomplete
+checkpoint). Arrays are loaded with ``numpy.load(..., mmap_mode='r')`` and
+copied into the existing arrays of the network, so that a checkpoint can be
+restored without holding two copies of large arrays in memory.
+
+The checkpoint only contains the dynamical state: the restored network must
+have been built by the same script (same objects, created in the same order),
+which is checked against the shapes of the saved arrays. Monitors are not
+saved.
+"""
+import os
+import cPickle as pickle
+import numpy
+from numpy import asarray, array, cumsum, hstack, zeros
+from scipy import sparse
+from brian.connections import Connection
+from brian.connections.connectionmatrix import (DenseConnectionMatrix,
+                                                SparseConnectionMatrix,
+                                                DynamicConnectionMatrix)
+
+__all__ = ['save_checkpoint', 'load_checkpoint']
+
+CHECKPOINT_VERSION = 1
+MANIFEST = 'manifest.pkl'
+
+
+class CheckpointWriter(object):
+    '''
+    Writes arrays and values to the checkpoint directory path.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {}
+        self.values = {}
+
+    def save_array(self, key, value):
+        value = asarray(value)
+        filename = key + '.npy'
+        numpy.save(os.path.join(self.path, filename), value)
+        self.arrays[key] = (filename, value.shape, value.dtype.str)
+
+    def save_value(self, key, value):
+        self.values[key] = value
+
+
+class CheckpointReader(object):
+    '''
+    Reads the arrays and values of the checkpoint directory path.
+    '''
+    def __init__(self, path):
+        self.path = path
+        try:
+            manifest = pickle.load(open(os.path.join(path, MANIFEST), 'rb'))
+        except IOError:
+            raise IOError('No complete checkpoint in ' + path)
+        if manifest['version'] != CHECKPOINT_VERSION:
+            raise IOError('Unsupported checkpoint version ' + str(manifest['version']))
+        self.arrays = manifest['arrays']
+        self.values = manifest['values']
+        self.clocks = manifest['clocks']
+
+    def load_array(self, key):
+        if key not in self.arrays:
+            raise ValueError('The network does not match the checkpoint (' + key + ' is missing)')
+        return numpy.load(os.path.join(self.path, self.arrays[key][0]), mmap_mode='r')
+
+    def load_value(self, key):
+        if key not in self.values:
+            raise ValueError('The network does not match the checkpoint (' + key + ' is missing)')
+        return self.values[key]
+
+    def copy_array(self, key, target):
+        '''
+        Copies the saved array key into the array target (in place).
+        '''
+        X = self.load_array(key)
+        if X.shape != target.shape:
+            raise ValueError('The network does not match the checkpoint (' + key +
+                             ' has shape ' + str(X.shape) + ' instead of ' +
+                             str(target.shape) + ')')
+        # asarray bypasses the restricted indexing of connection matrices
+        asarray(target)[...] = X
+
+
+def _clocks(net):
+    '''
+    Returns the clocks of the network, in the order of the groups and
+    operations they belong to (unlike ``net.clocks``, which is unordered).
+    '''
+    if not hasattr(net, 'clocks'):
+        return [net.clock]
+    clocks = []
+    for obj in net.groups + net.operations:
+        if not any(obj.clock is clock for clock in clocks):
+            clocks.append(obj.clock)
+    return clocks
+
+
+def _connections(net):
+    '''
+    Returns the connections of the network in the order in which they were
+    added (:meth:`Network.prepare` merges some of them into MultiConnection
+    objects, in an arbitrary order).
+    '''
+    connections = []
+    ids = set()
+    for obj in net._added_objects:
+        if isinstance(obj, Connection) and id(obj) not in ids:
+            connections.append(obj)
+            ids.add(id(obj))
+    return connections
+
+
+def _is_spikequeue(C):
+    return hasattr(C, 'currenttime') and hasattr(C, 'X') and hasattr(C, 'n')
+
+
+def _save_matrix(writer, key, W):
+    if isinstance(W, DenseConnectionMatrix):
+        writer.save_array(key, W)
+    elif isinstance(W, SparseConnectionMatrix):
+        writer.save_array(key + '.alldata', W.alldata)
+    elif isinstance(W, DynamicConnectionMatrix):
+        # the structure can change, so we save it in CSR form
+        writer.save_array(key + '.rowlengths', array([len(j) for j in W.rowj], dtype=int))
+        if W.nnz:
+            writer.save_array(key + '.rowj', hstack(W.rowj))
+            writer.save_array(key + '.data', W.alldata[hstack(W.rowdataind)])
+        else:
+            writer.save_array(key + '.rowj', zeros(0, dtype=int))
+            writer.save_array(key + '.data', zeros(0))
+    else:
+        raise TypeError('Cannot checkpoint connection matrices of type ' + W.__class__.__name__)
+
+
+def _load_matrix(reader, key, W):
+    '''
+    Restores the values of connection matrix W in place, or returns a new
+    matrix if the structure of a dynamic matrix has changed (otherwise
+    returns W).
+    '''
+    if isinstance(W, DenseConnectionMatrix):
+        reader.copy_array(key, W)
+    elif isinstance(W, SparseConnectionMatrix):
+        reader.copy_array(key + '.alldata', W.alldata)
+    elif isinstance(W, DynamicConnectionMatrix):
+        rowlengths = reader.load_array(key + '.rowlengths')
+        rowj = reader.load_array(key + '.rowj')
+        data = reader.load_array(key + '.data')
+        if len(rowlengths) != W.shape[0]:
+            raise ValueError('The network does not match the checkpoint (' + key + ' has a different shape)')
+        rowstart = hstack(([0], cumsum(rowlengths)))
+        if all(len(j) == n for j, n in zip(W.rowj, rowlengths)) and \
+           all((j == rowj[s:e]).all() for j, s, e in zip(W.rowj, rowstart[:-1], rowstart[1:])):
+            for i, (s, e) in enumerate(zip(rowstart[:-1], rowstart[1:])):
+                W.alldata[W.rowdataind[i]] = data[s:e]
+        else:
+            val = sparse.csr_matrix((array(data), array(rowj), rowstart), shape=W.shape)
+            return DynamicConnectionMatrix(val.tolil(), nnzmax=W.nnzmax,
+                                           dynamic_array_const=W.dynamic_array_const)
+    else:
+        raise TypeError('Cannot checkpoint connection matrices of type ' + W.__class__.__name__)
+    return W
+
+
+def save_checkpoint(net, path):
+    '''
+    Saves the state of the prepared network net in the directory path.
+    
+    See :meth:`Network.checkpoint`.
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        # an interrupted checkpoint must not look complete
+        os.remove(manifest_path)
+    writer = CheckpointWriter(path)
+    for k, G in enumerate(net.groups):
+        key = 'group%d' % k
+        if hasattr(G, 'catch_up'):
+            # event-driven groups store the states of different time steps
+            G.catch_up()
+        writer.save_array(key + '._S', G._S)
+        if hasattr(G, '_next_allowed_spiketime'):
+            writer.save_array(key + '._next_allowed_spiketime', G._next_allowed_spiketime)
+        if hasattr(G, 'LS') and G._owner is G:
+            # spikes of each time bin, from the oldest to the most recent
+            bins = [asarray(G.LS[i], dtype=int) for i in xrange(G.LS.m - 1, -1, -1)]
+            writer.save_array(key + '.LS.counts', array([len(b) for b in bins], dtype=int))
+            writer.save_array(key + '.LS.spikes', hstack(bins + [zeros(0, dtype=int)]))
+            # number of steps ahead of the clock (block updates)
+            writer.save_value(key + '._lead', int(G._lead))
+    for k, C in enumerate(_connections(net)):
+        key = 'connection%d' % k
+        if _is_spikequeue(C):
+            writer.save_array(key + '.X', C.X)
+            writer.save_array(key + '.n', C.n)
+            writer.save_value(key + '.currenttime', int(C.currenttime))
+        elif hasattr(C, 'n_maxevents'):
+            raise TypeError('Cannot checkpoint the C++ version of SpikeQueue')
+        elif getattr(C, 'W', None) is not None:
+            _save_matrix(writer, key + '.W', C.W)
+            if hasattr(C, '_delayedreaction'):
+                _save_matrix(writer, key + '.delayvec', C.delayvec)
+                writer.save_array(key + '._delayedreaction', C._delayedreaction)
+                writer.save_value(key + '._cur_delay_ind', int(C._cur_delay_ind))
+    clocks = _clocks(net)
+    manifest = {'version': CHECKPOINT_VERSION,
+                'arrays': writer.arrays,
+                'values': writer.values,
+                'clocks': [clock.get_state() for clock in clocks]}
+    # write the manifest atomically, a checkpoint is complete when it exists
+    tmp_path = manifest_path + '.tmp'
+    f = open(tmp_path, 'wb')
+    pickle.dump(manifest, f, 2)
+    f.close()
+    os.rename(tmp_path, manifest_path)
+
+
+def load_checkpoint(net, path):
+    '''
+    Restores the state of the prepared network net from the directory path.
+    
+    See :meth:`Network.restore`.
+    '''
+    reader = CheckpointReader(path)
+    clocks = _clocks(net)
+    if len(clocks) != len(reader.clocks):
+        raise ValueError('The network does not match the checkpoint (different number of clocks)')
+    for k, G in enumerate(net.groups):
+        key = 'group%d' % k
+        reader.copy_array(key + '._S', G._S)
+        if hasattr(G, '_next_allowed_spiketime'):
+            reader.copy_array(key + '._next_allowed_spiketime', G._next_allowed_spiketime)
+        if hasattr(G, 'LS') and G._owner is G:
+            counts = reader.load_array(key + '.LS.counts')
+            spikes = reader.load_array(key + '.LS.spikes')
+            G.LS.reinit()
+            start = 0
+            for n in counts:
+                G.LS.push(array(spikes[start:start + n], dtype=int))
+                start += n
+            G._lead = reader.values.get(key + '._lead', 0)
+    for k, C in enumerate(_connections(net)):
+        key = 'connection%d' % k
+        if _is_spikequeue(C):
+            # the queue may have been resized, so we replace its arrays
+            C.X = array(reader.load_array(key + '.X'), dtype=C.X.dtype)
+            C.X_flat = C.X.reshape(C.X.size,)
+            C.n = array(reader.load_array(key + '.n'))
+            C.currenttime = reader.load_value(key + '.currenttime')
+        elif getattr(C, 'W', None) is not None:
+            C.W = _load_matrix(reader, key + '.W', C.W)
+            if hasattr(C, '_delayedreaction'):
+                C.delayvec = _load_matrix(reader, key + '.delayvec', C.delayvec)
+                reader.copy_array(key + '._delayedreaction', C._delayedreaction)
+                C._cur_delay_ind = reader.load_value(key + '._cur_delay_ind')
+    for clock, state in zip(clocks, reader.clocks):
+        clock.set_state(state)
+    for G in net.groups:
+        if getattr(G, '_refractory_set', None) is not None and G._owner is G:
+            G._rebuild_refractory_set()
+        if hasattr(G, 'invalidate'):
+            G.invalidate()
@@ -130,6 +130,17 @@ class Clock(magic.InstanceTracker):
     
         Returns a ``bool`` to indicate whether the current
         simulation is still running.
+
+    .. method:: remaining_steps()
+    
+        The number of ticks until the current simulation ends (``None``
+        for clocks that cannot determine this in advance).
+
+    .. method:: get_state()
+                set_state(state)
+    
+        Get or exactly restore the current time (used by
+        :meth:`Network.checkpoint`).
     
     For reasons of efficiency, we recommend using the methods
     :meth:`tick`, :meth:`set_duration` and :meth:`still_running`
@@ -211,6 +222,25 @@ class Clock(magic.InstanceTracker):
     def still_running(self):
         return self.__t < self.__end
 
+    def remaining_steps(self):
+        '''
+        Returns the number of ticks until the current simulation ends.
+        '''
+        return max(self.__end - self.__t, 0)
+
+    def get_state(self):
+        '''
+        Returns the current time as a tuple (ticks, offset) of built-in types.
+        '''
+        return (int(self.__t), float(self._gridoffset))
+
+    def set_state(self, state):
+        '''
+        Restores the current time returned by :meth:`get_state`.
+        '''
+        self.__t = int(state[0])
+        self._gridoffset = float(state[1])
+
     epsilon = 1e-14
 
     def __lt__(self, other):
@@ -316,6 +346,18 @@ class FloatClock(Clock):
         """
         return self._t < self._end
 
+    def remaining_steps(self):
+        """Returns ``None``, because accumulated floating point errors mean
+        the number of remaining ticks cannot be known in advance
+        """
+        return None
+
+    def get_state(self):
+        return (0, float(self._t))
+
+    def set_state(self, state):
+        self._t = float(state[1])
+
     epsilon = 1e-8
 
 
@@ -8,11 +8,8 @@ import types
 from .. import magic
 from ..log import log_warn, log_info, log_debug
 from numpy import *
-try:
-    import weave
-except ImportError:
-    from scipy import weave
-from scipy import sparse, stats, rand, linalg
+from ..utils.kernelcache import weave
+from scipy import sparse, rand, linalg
 import scipy
 import scipy.sparse
 import numpy
@@ -63,6 +63,10 @@ class Connection(magic.InstanceTracker, ObjectContainer):
         If ``weight`` is specified and ``sparseness`` is not, a full
         connection is assumed, otherwise random connectivity with this
         level of sparseness is assumed.
+    ``dtype``
+        The type of the weights (and delays), by default the type of the
+        state matrix of the target group (see the ``dtype`` keyword of
+        :class:`NeuronGroup`).
     
     **Methods**
     
@@ -193,6 +197,8 @@ class Connection(magic.InstanceTracker, ObjectContainer):
             self._nstate_mod = modulation # source state index
         if isinstance(structure, str):
             structure = construction_matrix_register[structure]
+            if hasattr(target, '_S'):
+                kwds.setdefault('dtype', target._S.dtype)
         self.W = structure((len(source), len(target)), **kwds)
         self.iscompressed = False # True if compress() has been called
         source.set_max_delay(delay)
@@ -275,6 +281,7 @@ class Connection(magic.InstanceTracker, ObjectContainer):
                     else:
                         code = propagate_weave_code_dense_modulation
                         codevars = propagate_weave_code_dense_modulation_vars
+                code = weight_type_code(code, rows[0].dtype)
                 weave.inline(code, codevars,
                              compiler=self._cpp_compiler,
                              #type_converters=weave.converters.blitz,
@@ -302,6 +309,17 @@ class Connection(magic.InstanceTracker, ObjectContainer):
         '''
         return (P._origin - self.source._origin, Q._origin - self.target._origin)
 
+    def _trial_blocks(self, P, Q):
+        '''
+        Returns the list of pairs (P.trial(k), Q.trial(k)) if P and Q are
+        groups with the same number of trials (more than one), otherwise None.
+        Connections between such groups are block diagonal.
+        '''
+        trials = getattr(P, 'trials', 1)
+        if trials > 1 and getattr(Q, 'trials', 1) == trials:
+            return [(P.trial(k), Q.trial(k)) for k in xrange(trials)]
+        return None
+
     # TODO: rewrite all the connection functions to work row by row for memory and time efficiency 
 
     # TODO: change this
@@ -322,9 +340,18 @@ class Connection(magic.InstanceTracker, ObjectContainer):
         with given weight (default 1).
         The weight can be a quantity or a function of i (in P) and j (in Q).
         If ``fixed`` is True, then the number of presynaptic neurons per neuron is constant.
+        If P and Q have the same number of trials, neurons are only connected
+        within each trial (with the same structure in each trial if a seed
+        is given).
         '''
         P = source or self.source
         Q = target or self.target
+        blocks = self._trial_blocks(P, Q)
+        if blocks is not None:
+            for Pk, Qk in blocks:
+                self.connect_random(Pk, Qk, p=p, weight=weight, fixed=fixed,
+                                    seed=seed, sparseness=sparseness)
+            return
         if sparseness is not None: p = sparseness # synonym
         if seed is not None:
             random_state = numpy.random.get_state()
@@ -365,9 +392,16 @@ class Connection(magic.InstanceTracker, ObjectContainer):
         Connects the neurons in group P to all neurons in group Q,
         with given weight (default 1).
         The weight can be a quantity or a function of i (in P) and j (in Q).
+        If P and Q have the same number of trials, neurons are only connected
+        within each trial.
         '''
         P = source or self.source
         Q = target or self.target
+        blocks = self._trial_blocks(P, Q)
+        if blocks is not None:
+            for Pk, Qk in blocks:
+                self.connect_full(Pk, Qk, weight=weight)
+            return
         # TODO: check units
         if callable(weight):
             # Check units
@@ -412,6 +446,11 @@ class Connection(magic.InstanceTracker, ObjectContainer):
         '''
         P = source or self.source
         Q = target or self.target
+        blocks = self._trial_blocks(P, Q)
+        if blocks is not None:
+            for Pk, Qk in blocks:
+                self.connect_one_to_one(Pk, Qk, weight=weight)
+            return
         if (len(P) != len(Q)):
             raise AttributeError, 'The connected (sub)groups must have the same size.'
         # TODO: unit checking
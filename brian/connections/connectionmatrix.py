@@ -147,7 +147,8 @@ class DenseConnectionMatrix(ConnectionMatrix, numpy.ndarray):
 
     This matrix implements a dense connection matrix. It is just
     a numpy array. The ``get_row`` and ``get_col`` methods return
-    :class:`DenseConnectionVector`` objects.
+    :class:`DenseConnectionVector`` objects. The ``dtype`` keyword sets
+    the type of the values.
     '''
     def __new__(subtype, data, **kwds):
         if 'copy' not in kwds:
@@ -240,15 +241,20 @@ class SparseConnectionMatrix(ConnectionMatrix):
     
     TODO: update size numbers when use_minimal_indices=True for different
     architectures.
+    
+    The ``dtype`` keyword sets the type of the values (e.g. ``float32``,
+    which uses 4 bytes per entry instead of 8), by default the global
+    preference ``defaultdtype``.
     '''
-    def __init__(self, val, column_access=True, use_minimal_indices=False, **kwds):
+    def __init__(self, val, column_access=True, use_minimal_indices=False, dtype=None, **kwds):
+        from ..group import get_state_dtype
         self._useaccel = get_global_preference('useweave')
         self._cpp_compiler = get_global_preference('weavecompiler')
         self._extra_compile_args = ['-O3']
         if self._cpp_compiler == 'gcc':
             self._extra_compile_args += get_global_preference('gcc_options') # ['-march=native', '-ffast-math']
         self.nnz = nnz = val.getnnz()# nnz stands for number of nonzero entries
-        alldata = numpy.zeros(nnz)
+        alldata = numpy.zeros(nnz, dtype=get_state_dtype(dtype))
         self.neuron_index_dtype = int
         self.synapse_index_dtype = int
         if use_minimal_indices:
@@ -488,15 +494,18 @@ class DynamicConnectionMatrix(ConnectionMatrix):
     of an array of column indices for each row, with ``coli`` containing arrays
     of row indices for each column. Similarly, ``rowdataind`` and ``coldataind``
     consist of arrays of pointers to the indices in the ``alldata`` array. 
+    The ``dtype`` keyword sets the type of the values, by default the global
+    preference ``defaultdtype``.
     '''
-    def __init__(self, val, nnzmax=None, dynamic_array_const=2, **kwds):
+    def __init__(self, val, nnzmax=None, dynamic_array_const=2, dtype=None, **kwds):
+        from ..group import get_state_dtype
         self.shape = val.shape
         self.dynamic_array_const = dynamic_array_const
         if nnzmax is None or nnzmax < val.getnnz():
             nnzmax = val.getnnz()
         self.nnzmax = nnzmax
         self.nnz = val.getnnz()
-        self.alldata = numpy.zeros(nnzmax)
+        self.alldata = numpy.zeros(nnzmax, dtype=get_state_dtype(dtype))
         self.unusedinds = range(self.nnz, self.nnzmax)
         i = 0
         self.rowj = []
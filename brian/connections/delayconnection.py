@@ -98,7 +98,8 @@ class DelayConnection(Connection):
         # stores the row corresponding to the current time, so that _cur_delay_ind+1 corresponds
         # to that time + target.clock.dt, and so on. When _cur_delay_ind reaches _max_delay it
         # resets to zero.
-        self._delayedreaction = numpy.zeros((self._max_delay, len(target)))
+        self._delayedreaction = numpy.zeros((self._max_delay, len(target)),
+                                            dtype=target._S.dtype)
         # vector of delay times, can be changed during a run
         if isinstance(structure, str):
             structure = construction_matrix_register[structure]
@@ -197,6 +198,7 @@ class DelayConnection(Connection):
                     else:
                         code = delay_propagate_weave_code_dense_modulation
                         codevars = delay_propagate_weave_code_dense_modulation_vars
+                code = weight_type_code(code, rows[0].dtype)
                 weave.inline(code, codevars,
                              compiler=self._cpp_compiler,
                              type_converters=weave.converters.blitz,
@@ -82,3 +82,8 @@ class MultiConnection(Connection):
         return '<%s, containing %d connections from %s>' % (self.__class__.__name__,
                                                             len(self.connections),
                                                             repr(self.source))
+
+    def __str__(self):
+        return '%s from %s, containing %d connections' % (self.__class__.__name__,
+                                                          str(self.source),
+                                                          len(self.connections))
@@ -1,3 +1,21 @@
+import numpy
+
+def weight_type_code(code, dtype):
+    '''
+    Adapts the propagation code below, written for double precision weights
+    and delays, to the type dtype of the connection matrices: the lines
+    converting the weight and delay rows use float instead of double if
+    dtype is float32.
+    '''
+    if numpy.dtype(dtype) != numpy.float32:
+        return code
+    lines = code.split('\n')
+    for i, line in enumerate(lines):
+        if '"data"' in line or '"row"' in line or '"dvecrow"' in line or \
+           '_data->data' in line or '_row->data' in line:
+            lines[i] = line.replace('PyArray_DOUBLE', 'PyArray_FLOAT').replace('double', 'float')
+    return '\n'.join(lines)
+
 ################################################################################
 ################## NO DELAYS ###################################################
 ################################################################################
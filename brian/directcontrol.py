@@ -47,7 +47,7 @@ from stateupdater import *
 from units import *
 import random as pyrandom
 from numpy import where, array, zeros, ones, inf, nonzero, tile, sum, isscalar,\
-                  cumsum, hstack, bincount,  ceil, ndarray, ascontiguousarray
+                  cumsum, hstack, bincount,  ceil, ndarray, ascontiguousarray, asarray
 from copy import copy
 from clock import guess_clock
 from utils.approximatecomparisons import *
@@ -93,6 +93,12 @@ class SpikeGeneratorGroup(NeuronGroup):
         timestep. (Deprecated since Brian 1.3.1)
     ``sort=True``
         Set to False if your spike events are already sorted.
+    ``stream=False``
+        Set to True to read the spikes during the run rather than prior to it
+        (see below). ``spiketimes`` is then a tuple of two arrays (indices and
+        times in seconds) sorted by time, or an iterator over such tuples
+        (chunks of spikes), or a callable object which returns such an
+        iterator. Memory-mapped arrays are always read during the run.
     
     Has an attribute:
     
@@ -127,6 +133,24 @@ class SpikeGeneratorGroup(NeuronGroup):
     is detected.
 
     Also, if you want to use a SpikeGeneratorGroup with many spikes and/or neurons, please use an initialization with arrays.
+
+    For spike trains which do not fit in memory, use memory-mapped arrays
+    (sorted by time), which are read block by block during the run::
+
+        indices = numpy.load('indices.npy', mmap_mode='r')
+        times = numpy.load('times.npy', mmap_mode='r')
+        P = SpikeGeneratorGroup(N, (indices, times))
+
+    or chunks of spikes, e.g. read from a file with a generator function::
+
+        def chunks():
+            for i in range(100):
+                data = numpy.load('spikes%d.npy' % i)
+                yield data[0], data[1]
+        P = SpikeGeneratorGroup(N, chunks, stream=True)
+
+    Each time step then only reads its own spikes, and with a period the
+    spikes are read again from the start at each period.
     
     Also note that if you pass a generator, then reinitialising the group will not have the
     expected effect because a generator object cannot be reinitialised. Instead, you should
@@ -139,10 +163,11 @@ class SpikeGeneratorGroup(NeuronGroup):
     container.
     """
     def __init__(self, N, spiketimes, clock=None, period=None, 
-                 sort=True, gather=None):
+                 sort=True, gather=None, stream=False):
         clock = guess_clock(clock)
         self.N = N
         self.period = period
+        self.stream = stream
         if gather:
             log_warn('brian.SpikeGeneratorGroup', 'SpikeGeneratorGroup\'s gather keyword use is deprecated')
         fallback = False # fall back on old SpikeGeneratorThreshold or not
@@ -185,15 +210,23 @@ class SpikeGeneratorGroup(NeuronGroup):
             # spiketimes is a ndarray, with first col is index and second time
             idx = spiketimes[:,0]
             times = spiketimes[:,1]
+        elif stream:
+            # spiketimes is an iterator over chunks (idx, times), or a callable
+            # object which returns one
+            idx = times = None
         else:
             log_warn('brian.SpikeGeneratorGroup', 'Using (slow) threshold because spiketimes is assumed to be a generator/iterator')
             # spiketimes is a callable object, so falling back on old SpikeGeneratorThreshold
             fallback = True
 
-        if not fallback:
-            thresh = FastSpikeGeneratorThreshold(N, idx, times, dt=clock.dt, period=period)
-        else:
+        if fallback:
             thresh = SpikeGeneratorThreshold(N, spiketimes, period=period, sort=sort)
+        elif stream or isinstance(idx, numpy.memmap) or isinstance(times, numpy.memmap):
+            if idx is not None:
+                spiketimes = (idx, times)
+            thresh = StreamingSpikeGeneratorThreshold(N, spiketimes, clock.dt, period=period)
+        else:
+            thresh = FastSpikeGeneratorThreshold(N, idx, times, dt=clock.dt, period=period)
         
         if not hasattr(self, '_initialized'):
             NeuronGroup.__init__(self, N, model=LazyStateUpdater(), threshold=thresh, clock=clock)
@@ -209,7 +242,7 @@ class SpikeGeneratorGroup(NeuronGroup):
         return self._threshold.spiketimes
     
     def set_spiketimes(self, values):
-        self.__init__(self.N, values, period = self.period)
+        self.__init__(self.N, values, period = self.period, stream = self.stream)
     
     # changed due to the 2.5 issue
     spiketimes = property(get_spiketimes, set_spiketimes)
@@ -287,6 +320,141 @@ class FastSpikeGeneratorThreshold(Threshold):
         return 'Fast threshold mechanism for the SpikeGenerator group'
     
 
+class StreamingSpikeGeneratorThreshold(Threshold):
+    '''
+    A version of the FastSpikeGeneratorThreshold where spikes are read during
+    the run instead of prior to it, so that they are never all in memory
+    (e.g. recorded datasets with hundreds of millions of spikes).
+
+    The spikes are given by ``source``: either a pair of arrays
+    ``(indices, times)`` sorted by time, such as memory-mapped arrays (see
+    ``numpy.load`` with ``mmap_mode='r'``), which are read in blocks of
+    ``blocksize`` spikes; or an iterator over such pairs of arrays (chunks),
+    or a callable returning one (so that it can be restarted by ``reinit``
+    and at each period). Times are in seconds. With a ``period``, the source
+    must be a pair of arrays or a callable, since an iterator cannot be
+    restarted.
+
+    The spikes read are kept in a buffer with a cursor on the next spikes, so
+    that each time step only looks at its own spikes. If the clock jumps,
+    the cursor moves with a binary search in the times (arrays), or by
+    skipping the spikes in between (chunks). With a period, the cursor goes
+    back to the first spike at the start of each period.
+    '''
+    blocksize = 65536
+
+    def __init__(self, N, source, dt, period=None):
+        if isinstance(source, tuple):
+            # no copy, even for memory-mapped arrays
+            source = (asarray(source[0]), asarray(source[1]))
+        elif period is not None and not callable(source):
+            raise ValueError('With a period, the spikes must be given as a pair '
+                             'of arrays or a callable returning an iterator')
+        self.N = N
+        self.source = source
+        self.dt = float(dt)
+        self.period = period
+        self.reinit()
+
+    def reinit(self):
+        self.curperiod = -1
+        self._restart()
+
+    def _restart(self, position=0):
+        if isinstance(self.source, tuple):
+            self._chunks = None
+        elif callable(self.source):
+            self._chunks = iter(self.source())
+        else:
+            self._chunks = iter(self.source)
+        self._position = position # next spike to read in the arrays
+        self._indices = zeros(0, dtype=int)
+        self._steps = zeros(0, dtype=int)
+        self._cursor = 0 # next spike in the buffer
+        self._exhausted = False
+        self._next_step = None
+
+    def _seek(self, step):
+        '''
+        Moves the cursor to the spikes of the given time step.
+        '''
+        if self._chunks is None:
+            # the spikes before position are at least two steps before step
+            times = self.source[1]
+            position = int(times.searchsorted((step - 2) * self.dt)) if step > 1 else 0
+            self._restart(position)
+        elif self._next_step is not None and step < self._next_step:
+            self._restart()
+
+    def _read(self):
+        '''
+        Returns the next chunk (indices, steps), or None at the end.
+        '''
+        if self._chunks is None:
+            indices, times = self.source
+            start = self._position
+            if start >= len(times):
+                return None
+            self._position = min(start + self.blocksize, len(times))
+            indices, times = indices[start:self._position], times[start:self._position]
+        else:
+            try:
+                indices, times = self._chunks.next()
+            except StopIteration:
+                return None
+        # same conversion as FastSpikeGeneratorThreshold
+        steps = array(ceil(asarray(times) / self.dt), dtype=int)
+        return array(indices, dtype=int), steps
+
+    def _load(self, step):
+        '''
+        Reads chunks until the buffer has all the spikes of the given time
+        step (and the spikes before it are dropped).
+        '''
+        while not self._exhausted and (self._cursor == len(self._steps) or
+                                       self._steps[-1] <= step):
+            chunk = self._read()
+            if chunk is None:
+                self._exhausted = True
+                break
+            indices, steps = chunk
+            if (len(steps) > 1 and (steps[1:] < steps[:-1]).any()) or \
+               (len(steps) and len(self._steps) and steps[0] < self._steps[-1]):
+                raise ValueError('Spike times must be sorted')
+            cursor = self._cursor + self._steps[self._cursor:].searchsorted(step)
+            self._indices = hstack((self._indices[cursor:], indices))
+            self._steps = hstack((self._steps[cursor:], steps))
+            self._cursor = 0
+
+    def __call__(self, P):
+        t = P.clock.t
+        if self.period is not None:
+            cp = int(t / self.period)
+            if cp > self.curperiod:
+                self.reinit()
+                self.curperiod = cp
+            t = t - cp * self.period
+        step = int(round(t / P.clock.dt))
+        if step != self._next_step:
+            self._seek(step)
+        self._next_step = step + 1
+        self._load(step)
+        steps = self._steps[self._cursor:]
+        start = self._cursor + steps.searchsorted(step)
+        stop = self._cursor + steps.searchsorted(step, 'right')
+        self._cursor = stop
+        return self._indices[start:stop]
+
+    @property
+    def spiketimes(self):
+        return self.source
+
+    def __repr__(self):
+        return '<StreamingSpikeGeneratorThreshold>'
+
+    def __str__(self):
+        return 'Streaming threshold mechanism for the SpikeGenerator group'
+
 class SpikeGeneratorThreshold(Threshold):
     """
     Old threshold object for the SpikeGeneratorGroup
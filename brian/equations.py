@@ -41,29 +41,26 @@ from units import *
 from stdunits import *
 from inspection import *
 from scipy import exp
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from utils.lazyimport import LazyModule, module_available
+from utils.kernelcache import weave
 from globalprefs import *
 import re
+import ast
 import inspect
 import optimiser
 import warnings
 import uuid
-from numpy import zeros, ones
+from numpy import zeros, ones, arange, ndarray
 import numpy
 from log import *
 from optimiser import *
 from scipy import optimize
 import unitsafefunctions
 import copy
-try:
-    import sympy
-    use_sympy = True
-except:
+sympy = LazyModule('sympy')
+use_sympy = module_available('sympy')
+if not use_sympy:
     warnings.warn('sympy not installed')
-    use_sympy = False
 
 __all__ = ['Equations', 'unique_id']
 
@@ -424,7 +421,7 @@ class Equations(object):
             # Find variables
             vars = [var for var in get_identifiers(expr) if var in all_variables]
             if freeze:
-                expr = optimiser.freeze(expr, all_variables, namespace)
+                expr = optimiser.fold_constants(optimiser.freeze(expr, all_variables, namespace))
                 #self._string[name]=expr # should we?
                 #namespace={}
             s = "lambda " + ','.join(vars) + ":" + expr
@@ -643,6 +640,149 @@ class Equations(object):
                 return False
         return True
 
+    def is_parametrically_linear(self):
+        '''
+        Returns True if the differential equations are linear with respect to
+        all the (nonconstant) state variables, with coefficients which may
+        depend on parameters (variables with a zero derivative), e.g.
+        ``dv/dt=-v/tau`` with a parameter ``tau``. Parameters which enter
+        additively are already handled by :meth:`is_linear`.
+        '''
+        if self.is_time_dependent():
+            return False
+        for f in self._namespace.iterkeys():
+            if any([type(key) == types.FunctionType for key in self._namespace[f].itervalues()]):
+                return False
+        for var in self._diffeq_names_nonzero:
+            S = self._units.copy()
+            for name in self._diffeq_names_nonzero:
+                S[name] = AffineFunction()
+            try:
+                self.apply(var, S)
+            except:
+                return False
+        return True
+
+    def gating_variables(self):
+        '''
+        Returns the list of gating variables, that is, the variables x other
+        than the membrane potential whose equation has the form dx/dt=a*x+b,
+        where a and b do not depend on x or on other gating variables, e.g.
+        dx/dt=(x_inf-x)/tau_x or dx/dt=alpha*(1-x)-beta*x where x_inf, tau_x,
+        alpha and beta depend on the membrane potential.
+        '''
+        # Equations have to be prepared for it to work.
+        candidates = []
+        for var in self._diffeq_names_nonzero:
+            if var == self.get_Vm() or self.is_stochastic(var) or \
+               var not in self._function[var].func_code.co_varnames:
+                continue
+            S = self._units.copy()
+            S[var] = AffineFunction()
+            try:
+                self.apply(var, S)
+            except:
+                continue
+            candidates.append(var)
+        return [var for var in candidates if
+                all([name == var or name not in candidates
+                     for name in self._function[var].func_code.co_varnames])]
+
+    def linear_variables(self):
+        '''
+        Returns the list of the variables of the largest linear subsystem,
+        that is, the differential equations which are affine with constant
+        coefficients and only depend on variables of the subsystem, e.g.
+        the synaptic conductances in dge/dt=-ge/taue, while the membrane
+        equation depending on them may be nonlinear. The subsystem can then
+        be solved exactly, independently of the other equations.
+        '''
+        # Equations have to be prepared for it to work.
+        # Equations calling functions (e.g. exp in the membrane equation) are
+        # not candidates, but do not prevent other equations from being
+        candidates = [var for var in self._diffeq_names_nonzero if
+                      not any([type(value) == types.FunctionType
+                               for value in self._namespace[var].itervalues()])
+                      and not self.is_stochastic(var) and not self.is_time_dependent(var)
+                      and is_affine(self._function[var])]
+        # remove the variables depending on variables outside the subsystem
+        while True:
+            remaining = [var for var in candidates if
+                         all([name in candidates for name in self._function[var].func_code.co_varnames])]
+            if len(remaining) == len(candidates):
+                return remaining
+            candidates = remaining
+
+    def tabulate(self, var, xmin, xmax, n):
+        '''
+        Replaces the subexpressions of the differential equations that only
+        depend on the variable var and contain function calls (typically
+        the rate functions alpha(V), beta(V) of ionic channels) by functions
+        tabulated at n points between xmin and xmax, with linear
+        interpolation (see :class:`~brian.tools.tabulate.TabulateInterp`).
+        Values of var outside [xmin,xmax] give NaN (for the neurons concerned
+        only, the others are not affected).
+        
+        The equations must be prepared. Returns a dictionary with the
+        maximum interpolation error of each tabulated subexpression (in SI
+        units), evaluated between the points of the table, which is also
+        logged (info level). The tables are built from the frozen
+        subexpressions and return plain values; the unit of each
+        subexpression is restored by a multiplication in the equation.
+        '''
+        from tools.tabulate import TabulateInterp
+        all_variables = self._eq_names + self._diffeq_names + self._alias.keys() + ['t']
+        xmin, xmax = float(xmin), float(xmax)
+        dx = (xmax - xmin) / (n - 1)
+        x = xmin + dx * (arange((n - 1) * 4) + .5) / 4 # between the points
+        tables = {}
+        errors = {}
+        for name in self._diffeq_names_nonzero:
+            namespace = self._namespace[name]
+            replaced = []
+            def replace(node):
+                if isinstance(node, ast.Name):
+                    return None
+                names = [subnode.id for subnode in ast.walk(node) if isinstance(subnode, ast.Name)]
+                if var not in names or not any(isinstance(subnode, ast.Call) for subnode in ast.walk(node)):
+                    return None
+                for id in names:
+                    if id != var and (id in all_variables or id not in namespace or \
+                                      (isinstance(namespace[id], ndarray) and namespace[id].ndim > 0)):
+                        return None
+                expr = optimiser._source(node)
+                source = optimiser.freeze(expr, [var], namespace)
+                if source is None:
+                    return None
+                if source not in tables:
+                    try:
+                        unit = get_unit(eval(expr, namespace, {var: self._units[var]}))
+                    except DimensionMismatchError:
+                        return None
+                    f = eval('lambda ' + var + ': ' + source, namespace)
+                    table = TabulateInterp(f, xmin, xmax, n)
+                    tables[source] = ('_tab_' + var + '_' + str(len(tables)), table, unit)
+                    y = f(x)
+                    errors[source] = abs(table(x) - y).max()
+                    log_info('brian.equations', 'Tabulated ' + source + ', maximum error: ' +
+                             str(errors[source]) + ' (relative: ' +
+                             str(errors[source] / abs(y).max()) + ')')
+                tabname, table, unit = tables[source]
+                namespace[tabname] = table
+                replaced.append(tabname)
+                if is_dimensionless(unit):
+                    return tabname + '(' + var + ')'
+                namespace[tabname + '_unit'] = unit
+                return '(' + tabname + '(' + var + ')*' + tabname + '_unit)'
+            try:
+                expr = optimiser.substitute_subexpressions(self._string[name], replace)
+            except (NotImplementedError, SyntaxError):
+                continue
+            if replaced:
+                self._string[name] = expr
+        self.compile_functions()
+        return errors
+
     """
     -----------------------------------------------------------------------
     NUMERICAL INTEGRATION (to be replaced by code generation)
@@ -669,6 +809,9 @@ class Equations(object):
     def forward_euler_code_string(self):
         '''
         Generates Python code for a forward Euler step.
+        Subexpressions common to several equations are computed once, in
+        variables ``_cse0``, ``_cse1``, etc. (see
+        :func:`~brian.optimiser.common_subexpressions`).
         '''
         # TODO: check if it can really be frozen
         # TODO: change /a to *(1/a) with precalculation (use parser)
@@ -677,9 +820,16 @@ class Equations(object):
         vars_tmp = [name + '__tmp' for name in self._diffeq_names]
         lines = ','.join(self._diffeq_names) + '=P._S\n'
         lines += ','.join(vars_tmp) + '=P._dS\n'
-        for name in self._diffeq_names_nonzero:
-            namespace = self._namespace[name]
-            expr = optimiser.freeze(self._string[name], all_variables, namespace)
+        exprs = [optimiser.fold_constants(optimiser.freeze(self._string[name], all_variables,
+                                                           self._namespace[name]))
+                 for name in self._diffeq_names_nonzero]
+        try:
+            definitions, exprs = optimiser.common_subexpressions(exprs, all_variables)
+        except (NotImplementedError, SyntaxError):
+            definitions = []
+        for name, expr in definitions:
+            lines += name + '=' + expr + '\n'
+        for name, expr in zip(self._diffeq_names_nonzero, exprs):
             lines += name + '__tmp[:]=' + expr + '\n'
         lines += 'P._S+=dt*P._dS\n'
         #print lines
@@ -691,20 +841,7 @@ class Equations(object):
         '''
         Generates Python code for a forward Euler step.
         '''
-        # TODO: check if it can really be frozen
-        # TODO: change /a to *(1/a) with precalculation (use parser)
-        all_variables = self._eq_names + self._diffeq_names + self._alias.keys() + ['t']
-        # nonzero? insert dt?
-        vars_tmp = [name + '__tmp' for name in self._diffeq_names]
-        lines = ','.join(self._diffeq_names) + '=P._S\n'
-        lines += ','.join(vars_tmp) + '=P._dS\n'
-        for name in self._diffeq_names_nonzero:
-            namespace = self._namespace[name]
-            expr = optimiser.freeze(self._string[name], all_variables, namespace)
-            lines += name + '__tmp[:]=' + expr + '\n'
-        lines += 'P._S+=dt*P._dS\n'
-        #print lines
-        return compile(lines, 'Euler update code', 'exec')
+        return compile(self.forward_euler_code_string(), 'Euler update code', 'exec')
         # Return a function f(P) or a namespace (exec code in namespace)
         # 1st option: include directly in neurongroup._state_updater (good?)
 
@@ -785,6 +922,48 @@ class Equations(object):
                 S[varname] *= exp(A[varname] * dt)
                 S[varname] -= B[varname]
 
+    def rush_larsen(self, S, dt, gating, order=1):
+        '''
+        Updates the value of the state variables in dictionary S
+        with the Rush-Larsen method over step dt: the gating variables
+        (see :meth:`gating_variables`) are integrated exactly with the other
+        variables held fixed, as in :meth:`exponential_euler`, and the other
+        variables with the Euler (order=1) or Runge-Kutta midpoint (order=2)
+        method, with the gating variables held fixed.
+        '''
+        others = [var for var in self._diffeq_names_nonzero if var not in gating]
+        # Coefficients of dx/dt=a*x+b for the gating variables
+        A = {}
+        B = {}
+        for varname in gating:
+            f = self._function[varname]
+            oldval = S[varname]
+            S[varname] = 0 * oldval
+            B[varname] = f(*[S[var] for var in f.func_code.co_varnames])
+            S[varname] = 0 * oldval + 1
+            A[varname] = f(*[S[var] for var in f.func_code.co_varnames]) - B[varname]
+            B[varname] = B[varname] / A[varname]
+            S[varname] = oldval
+        # Derivatives of the other variables
+        buffer = {}
+        for varname in others:
+            f = self._function[varname]
+            buffer[varname] = f(*[S[var] for var in f.func_code.co_varnames])
+        if order == 2:
+            S_half = S.copy()
+            for var in others:
+                S_half[var] = S[var] + .5 * dt * buffer[var]
+            for varname in others:
+                f = self._function[varname]
+                buffer[varname] = f(*[S_half[var] for var in f.func_code.co_varnames])
+        # Update variables
+        for var in others:
+            S[var] += dt * buffer[var]
+        for varname in gating:
+            S[varname] += B[varname]
+            S[varname] *= exp(A[varname] * dt)
+            S[varname] -= B[varname]
+
     def exponential_euler_code(self):
         '''
         Generates Python code for an exponential Euler step.
@@ -819,6 +998,130 @@ class Equations(object):
         #print lines
         return compile(lines, 'Exponential Euler update code', 'exec')
 
+    def forward_euler_inplace_code(self, use_numexpr=False):
+        '''
+        Generates code for a forward Euler step that does not create
+        temporary arrays (see :class:`~brian.optimiser.InPlaceCode`), or
+        returns None if the equations cannot be translated.
+        The increments are computed in the scratch rows ``name__tmp``
+        (or the new values if numexpr is used) before the variables are
+        updated. Subexpressions common to several equations are computed
+        once.
+        '''
+        all_variables = self._eq_names + self._diffeq_names + self._alias.keys() + ['t']
+        code = optimiser.InPlaceCode(self._diffeq_names, ['t', 'dt'], use_numexpr=use_numexpr)
+        try:
+            exprs = []
+            for name in self._diffeq_names_nonzero:
+                expr = optimiser.freeze(self._string[name], all_variables, self._namespace[name])
+                if expr is None:
+                    return None
+                exprs.append(expr)
+            namespaces = [self._namespace[name] for name in self._diffeq_names_nonzero]
+            exprs = code.share(exprs, namespaces)
+            for name, expr, namespace in zip(self._diffeq_names_nonzero, exprs, namespaces):
+                if code.use_numexpr:
+                    expr = name + '+dt*(' + expr + ')'
+                else:
+                    expr = 'dt*(' + expr + ')'
+                code.assign(code.new_row(name + '__tmp'), expr, namespace)
+            for name in self._diffeq_names_nonzero:
+                if code.use_numexpr:
+                    code.assign(name, name + '__tmp')
+                else:
+                    code.assign(name, name + '+' + name + '__tmp')
+        except (NotImplementedError, SyntaxError):
+            return None
+        return code
+
+    def exponential_euler_inplace_code(self, use_numexpr=False):
+        '''
+        Generates code for an exponential Euler step that does not create
+        temporary arrays (see :class:`~brian.optimiser.InPlaceCode`), or
+        returns None if the equations cannot be translated.
+        As in :meth:`exponential_euler`, the coefficients of dx/dt=a*x+b are
+        obtained by evaluating the right hand side at x=0 and x=1.
+        '''
+        return self._exponential_inplace_code(self._diffeq_names_nonzero, use_numexpr)
+
+    def rush_larsen_inplace_code(self, gating, use_numexpr=False):
+        '''
+        Generates code for a first order Rush-Larsen step (see
+        :meth:`rush_larsen`) that does not create temporary arrays, or
+        returns None if the equations cannot be translated.
+        '''
+        return self._exponential_inplace_code(gating, use_numexpr)
+
+    def _exponential_inplace_code(self, exponential, use_numexpr):
+        '''
+        In-place code for a step where the variables in the list exponential
+        are integrated with the exponential Euler method and the other ones
+        with the Euler method. Subexpressions common to several equations or
+        to the two evaluations of the right hand side are computed once.
+        '''
+        all_variables = self._eq_names + self._diffeq_names + self._alias.keys() + ['t']
+        code = optimiser.InPlaceCode(self._diffeq_names, ['t', 'dt'], use_numexpr=use_numexpr)
+        updates = []
+        try:
+            exprs, namespaces = [], []
+            for name in self._diffeq_names_nonzero:
+                expr = optimiser.freeze(self._string[name], all_variables, self._namespace[name])
+                namespace = dict(self._namespace[name], exp=numpy.exp)
+                if expr is None:
+                    return None
+                if name in exponential:
+                    # right hand side at x=0 and x=1
+                    exprs += [re.sub(r'\b' + name + r'\b', '0.0', expr),
+                              re.sub(r'\b' + name + r'\b', '1.0', expr)]
+                    namespaces += [namespace, namespace]
+                else:
+                    exprs.append(expr)
+                    namespaces.append(namespace)
+            shared = iter(zip(code.share(exprs, namespaces), namespaces))
+            for name in self._diffeq_names_nonzero:
+                expr, namespace = shared.next()
+                if name not in exponential:
+                    code.assign(code.new_row(name + '__tmp'), name + '+dt*(' + expr + ')',
+                                namespace)
+                    updates.append((name, name + '__tmp'))
+                    continue
+                b = '(' + expr + ')'
+                f1 = shared.next()[0]
+                a = '(' + f1 + '-' + b + ')'
+                a = code.scalar(a, namespace) or a
+                if not re.search(r'[^\d.e+-]', a) and float(a) == 0:
+                    # not actually dependent on x: Euler step
+                    code.assign(code.new_row(name + '__tmp'), name + '+dt*' + b,
+                                namespace)
+                    updates.append((name, name + '__tmp'))
+                    continue
+                B = code.new_row(name + '__tmp')
+                if a[0] == '(':
+                    # a depends on arrays, computed once, as b
+                    code.assign(B, b, namespace)
+                    b = B
+                    code.assign(code.new_row(name + '__a'), '(' + f1 + '-' + b + ')', namespace)
+                    a = name + '__a'
+                if code.use_numexpr:
+                    B = b + '/' + a
+                    code.assign(name + '__tmp',
+                                '-' + B + '+(' + name + '+' + B + ')*exp(' + a + '*dt)',
+                                namespace)
+                    updates.append((name, name + '__tmp'))
+                    continue
+                # x <- (x+b/a)*exp(a*dt)-b/a
+                code.assign(B, b + '/' + a, namespace)
+                E = code.scalar('exp(' + a + '*dt)', namespace)
+                if E is None:
+                    E = a
+                    code.assign(E, 'exp(' + a + '*dt)', namespace)
+                updates.append((name, '(' + name + '+' + B + ')*' + E + '-' + B))
+            for name, expr in updates:
+                code.assign(name, expr)
+        except (NotImplementedError, SyntaxError):
+            return None
+        return code
+
     """
     -------------------
     COMBINING EQUATIONS
@@ -0,0 +1,666 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+'''
+Event-driven simulation of linear integrate-and-fire neurons
+
+A :class:`NeuronGroup` updates all its neurons at every time step. For
+neurons with linear dynamics without noise, the state after ``k`` time steps
+without input is given exactly by the ``k``-th power of the update matrix
+(the propagator), so that a neuron which receives few inputs does not need
+to be updated at every time step: its state can be brought up to date when
+something happens to it. The :class:`EventDrivenNeuronGroup` stores, for
+each neuron, the time step of its last update, applies the propagator
+lazily (with precomputed powers of two of the update matrix) when the neuron
+receives a synaptic event, and predicts the time step of its next threshold
+crossing, at which it is updated and spikes.
+
+The predictions are computed from the membrane potential at the next time
+steps, which is a linear function of the state of the neuron. An upper bound
+of this potential over all future time steps is precomputed as well, so that
+most neurons whose potential is decaying are proven silent without looking
+for the crossing.
+'''
+from numpy import (zeros, ones, empty, arange, asarray, dot, hstack, vstack,
+                   unique, argsort, diff, split, clip, minimum, maximum,
+                   floor, isfinite, errstate, identity)
+from numpy.linalg import lstsq
+
+from brian.log import log_info, log_warn
+from brian.network import NetworkOperation
+from brian.neurongroup import NeuronGroup
+from brian.reset import Reset, Refractoriness, NoReset
+from brian.stateupdater import LinearStateUpdater
+from brian.threshold import Threshold
+from brian.units import msecond
+
+__all__ = ['EventDrivenNeuronGroup']
+
+
+class EventDrivenNeuronGroup(NeuronGroup):
+    '''
+    Group of linear integrate-and-fire neurons simulated with events
+
+    Initialised as a :class:`NeuronGroup`, with arguments ``N``, ``model``,
+    ``threshold``, ``reset``, ``refractory``, ``clock``, ``max_delay``,
+    ``unit_checking``, ``level`` and ``dtype``. The group gives the same
+    spikes as a :class:`NeuronGroup` with the same arguments (up to rounding
+    errors), but the neurons are only updated when they receive a synaptic
+    event, when they spike, or when their state is read, which is much faster
+    when the inputs are sparse, i.e., when few neurons receive events at each
+    time step.
+
+    The model must be linear without noise (so that the
+    :class:`LinearStateUpdater` is used), the threshold must be a fixed value
+    of a single variable (e.g. ``'v > -50 * mV'``), and the reset must be a
+    fixed value (possibly with a fixed refractory period), or no reset.
+    Otherwise, a ``TypeError`` is raised.
+
+    The inputs are found when the network is prepared: :class:`Connection`
+    objects (only the neurons of the rows of the spiking neurons are updated,
+    all the target neurons for other subclasses except
+    :class:`IdentityConnection`) and :class:`Synapses` objects targeting
+    the group. :class:`DelayConnection` objects are not supported.
+
+    The spikes occur at the time steps at which the threshold is crossed, as
+    with a :class:`NeuronGroup` (they are not interpolated between time
+    steps). Reading a state variable of the group, e.g. with a
+    :class:`StateMonitor` or ``G.v``, brings all the neurons up to date, and
+    values written to the state variables are taken into account at the next
+    time step, as long as they are accessed through the group at each time
+    step (not through arrays kept by a network operation). The method
+    :meth:`invalidate` must be called if the state matrix ``_S`` is
+    modified directly.
+
+    **Methods**
+
+    .. method:: catch_up()
+
+        Brings all the neurons up to the current time step.
+
+    .. method:: invalidate()
+
+        Predicts the spikes of all neurons again at the next update, from
+        the current state matrix.
+    '''
+    # ends of the chunks of time steps of the search for threshold crossings,
+    # the neurons are checked again at the end of the last one
+    _chunk_ends = (32, 96, 224, 480)
+    # number of time steps of the windows of the event calendar
+    _window = 32
+    # set until the first update (and by invalidate()): the spikes of all
+    # neurons are then predicted from the state matrix
+    _predict_all = True
+
+    def __init__(self, N, model=None, threshold=None, reset=NoReset(),
+                 refractory=0 * msecond, clock=None, max_delay=0 * msecond,
+                 unit_checking=True, level=0, dtype=None):
+        NeuronGroup.__init__(self, N, model, threshold=threshold, reset=reset,
+                             refractory=refractory, clock=clock,
+                             max_delay=max_delay, unit_checking=unit_checking,
+                             level=level + 1, method='linear', dtype=dtype)
+        updater = self._state_updater
+        if type(updater) is not LinearStateUpdater:
+            raise TypeError('Event-driven groups need linear equations without noise')
+        if type(self._threshold) is not Threshold:
+            raise TypeError('Event-driven groups need a threshold on a single '
+                            'variable, e.g. "v > 1"')
+        self._threshold_variable = self.get_var_index(self._threshold.state)
+        self._threshold_value = float(self._threshold.threshold)
+        resetfun = self._resetfun
+        if isinstance(resetfun, NoReset):
+            self._reset_variable = None
+            self._reset_value = 0.
+            self._reset_period = 1
+        elif (type(resetfun) is Reset or
+              (type(resetfun) is Refractoriness and not self._variable_refractory_time)):
+            self._reset_variable = self.get_var_index(resetfun.state)
+            self._reset_value = float(resetfun.resetvalue)
+            if type(resetfun) is Refractoriness:
+                # same number of time steps as Refractoriness
+                self._reset_period = int(resetfun.period / self.clock.dt) + 1
+            else:
+                self._reset_period = 1
+        else:
+            raise TypeError('Event-driven groups need a fixed reset value, '
+                            'with a fixed refractory period or none')
+        # augmented update matrices [[A, C], [0, 1]], without and with the
+        # reset variable clamped, and their powers of two
+        m = len(updater)
+        M = zeros((m + 1, m + 1))
+        M[:m, :m] = updater.A
+        if updater._useB:
+            M[:m, m] = asarray(updater._C, dtype=float).reshape(m)
+        M[m, m] = 1
+        Mc = M.copy()
+        if self._reset_variable is not None:
+            Mc[self._reset_variable, :] = 0
+            Mc[self._reset_variable, m] = self._reset_value
+        self._powers = {False: [M], True: [Mc]}
+        self._prepare_prediction()
+        self._last = zeros(N, dtype=int) # time step of the stored state
+        self._refractory_end = -ones(N, dtype=int) # last clamped time step
+        self._allowed = -ones(N, dtype=int) # first time step a spike is allowed
+        self._next_event = -ones(N, dtype=int) # -1 if the neuron is silent
+        self._events = {} # window -> list of (neurons, time steps)
+        self._touched = [] # arrays of neurons to predict again
+        self._snapshot = None # state matrix when it was last read
+        self._current = -1
+        self._reset_done = False
+        self._connections = []
+        self._synapses = []
+        self.contained_objects = [NetworkOperation(lambda: self._connection_inputs(),
+                                                   clock=self.clock, when='before_connections'),
+                                  NetworkOperation(lambda: self._synapse_inputs(),
+                                                   clock=self.clock, when='after_connections')]
+
+    def _prepare_prediction(self):
+        '''
+        Precomputes the rows giving the threshold variable after each time
+        step of the horizon of the predictions as a function of the
+        (augmented) state, after the clamped steps of the refractory period,
+        and the bounds of these rows over all future time steps.
+        
+        The bounds are computed for the deviation of the state from a fixed
+        point of the dynamics, if there is one, which makes them much
+        tighter for neurons decaying to a resting potential.
+        '''
+        M, Mc = self._powers[False][0], self._powers[True][0]
+        e = zeros(len(M))
+        e[self._threshold_variable] = 1
+        K = self._chunk_ends[-1]
+        rows = empty((K, len(M)))
+        row = e
+        for k in xrange(K):
+            row = dot(row, M)
+            rows[k] = row
+        self._rows = rows
+        # clamped steps: the update is applied to the clamped state
+        self._clamped_rows = empty((self._reset_period - 1, len(M)))
+        row = dot(e, M)
+        for j in xrange(self._reset_period - 1):
+            self._clamped_rows[j] = row
+            row = dot(row, Mc)
+        # fixed point X* of the dynamics (A X* + C = X*), the bounds are on
+        # the rows for the augmented deviation [X - X*, 1]
+        m = len(M) - 1
+        self._fixed_point = zeros(m)
+        C = M[:m, m]
+        if abs(C).max() > 0:
+            fixed_point = lstsq(identity(m) - M[:m, :m], C, rcond=-1)[0]
+            if abs(fixed_point - dot(M[:m, :m], fixed_point) - C).max() <= 1e-9 * abs(C).max():
+                self._fixed_point = fixed_point
+        T = identity(m + 1)
+        T[:m, m] = self._fixed_point
+        tail = self._tail_bounds(rows[-1], T)
+        rows = dot(rows, T)
+        if tail is None:
+            log_warn('brian.eventdriven', 'The dynamics do not converge, '
+                     'neurons are never proven silent')
+            self._bounds = None
+            return
+        # upper and lower bounds of the rows after each chunk
+        self._bounds = []
+        for start in (0,) + self._chunk_ends:
+            hi, lo = tail
+            if start < K:
+                hi = maximum(hi, rows[start:].max(axis=0))
+                lo = minimum(lo, rows[start:].min(axis=0))
+            self._bounds.append((hi, lo))
+
+    def _tail_bounds(self, row, T, maxsteps=10 ** 7):
+        '''
+        Bounds of the rows after the given row (the last of the horizon),
+        in the coordinates given by T, computed until they are within a
+        tolerance of their limit, or ``None`` if they do not converge.
+        '''
+        M = self._powers[False][0]
+        scale = abs(dot(self._rows, T)).max(axis=0)
+        # limit, at time steps K+2^j
+        limit = None
+        power = M
+        previous = dot(dot(row, power), T)
+        with errstate(all='ignore'):
+            for _ in xrange(64):
+                power = dot(power, power)
+                current = dot(dot(row, power), T)
+                if not isfinite(current).all():
+                    return None
+                if (abs(current - previous) <= 1e-10 * maximum(scale, abs(current))).all():
+                    limit = current
+                    break
+                previous = current
+        if limit is None:
+            return None
+        tolerance = 1e-9 * maximum(scale, abs(limit)) + 1e-300
+        # all the rows of the next blocks, with A^1..A^B
+        B = len(self._rows)
+        stack = empty((B, len(M), len(M)))
+        stack[0] = M
+        for b in xrange(1, B):
+            stack[b] = dot(stack[b - 1], M)
+        hi = lo = dot(row, T)
+        for _ in xrange(maxsteps // B):
+            block = dot(row, stack)
+            row = block[-1]
+            block = dot(block, T)
+            hi = maximum(hi, block.max(axis=0))
+            lo = minimum(lo, block.min(axis=0))
+            if (abs(block - limit) <= tolerance).all():
+                return maximum(hi, limit + tolerance), minimum(lo, limit - tolerance)
+        return None
+
+    def _advance(self, X, steps, clamped):
+        '''
+        Advances the states X (one column per neuron) by the given numbers
+        of time steps, with the reset variable clamped or not.
+        '''
+        powers = self._powers[clamped]
+        m = len(X)
+        top = int(steps.max()) if len(steps) else 0
+        j = 0
+        while top >> j:
+            if j == len(powers):
+                powers.append(dot(powers[-1], powers[-1]))
+            P = powers[j]
+            selected = ((steps >> j) & 1).nonzero()[0]
+            if len(selected):
+                X[:, selected] = dot(P[:m, :m], X[:, selected]) + P[:m, m:]
+            j += 1
+        return X
+
+    def _step(self):
+        clock = self.clock
+        return int(round((clock._t - getattr(clock, '_gridoffset', 0.)) / clock._dt))
+
+    def _catch_up(self, indices, n):
+        '''
+        Brings the neurons (unique indexes) to time step n, before the reset
+        of that step if it has not been done yet.
+        '''
+        steps = n - self._last[indices]
+        indices = indices[steps > 0]
+        if not len(indices):
+            return
+        steps = steps[steps > 0]
+        end = self._refractory_end[indices]
+        X = asarray(self._S[:, indices], dtype=float)
+        if self._reset_period > 1:
+            clamped = clip(minimum(n - 1, end) - self._last[indices], 0, steps)
+            X = self._advance(X, clamped, True)
+            steps = steps - clamped
+        self._S[:, indices] = self._advance(X, steps, False)
+        self._last[indices] = n
+        if self._reset_variable is not None:
+            late = indices[end >= n]
+            if self._reset_done:
+                self._S[self._reset_variable, late] = self._reset_value
+            else:
+                self._touched.append(late)
+
+    def _predict(self, indices):
+        '''
+        Predicts the next threshold crossings of the neurons (unique indexes,
+        updated at the previous time step) and schedules them.
+        '''
+        if not len(indices):
+            return
+        theta = self._threshold_value
+        last = self._last[indices]
+        end = self._refractory_end[indices]
+        allowed = self._allowed[indices]
+        X = vstack((asarray(self._S[:, indices], dtype=float), ones(len(indices))))
+        # deviation from the fixed point, for the bounds
+        Z = X.copy()
+        Z[:-1] -= self._fixed_point[:, None]
+        event = -ones(len(indices), dtype=int)
+        # crossings in the clamped steps of the refractory period
+        clamped = end - last
+        refractory = (clamped > 0).nonzero()[0]
+        if len(refractory):
+            V = dot(self._clamped_rows, X[:, refractory])
+            steps = arange(1, len(V) + 1)[:, None]
+            crossing = ((V > theta) & (steps <= clamped[refractory]) &
+                        (last[refractory] + steps >= allowed[refractory]))
+            found = crossing.any(axis=0)
+            event[refractory[found]] = last[refractory[found]] + crossing.argmax(axis=0)[found] + 1
+            refractory = refractory[~found]
+            X[:-1, refractory] = self._advance(X[:-1, refractory], clamped[refractory], True)
+            Z[:-1, refractory] = X[:-1, refractory] - self._fixed_point[:, None]
+        base = maximum(last, end)
+        todo = (event < 0).nonzero()[0]
+        start = 0
+        for c, end in enumerate(self._chunk_ends):
+            todo = todo[~self._silent(Z[:, todo], c)]
+            if not len(todo):
+                break
+            V = dot(self._rows[start:end], X[:, todo])
+            steps = arange(start + 1, end + 1)[:, None]
+            crossing = (V > theta) & (base[todo] + steps >= allowed[todo])
+            found = crossing.any(axis=0)
+            event[todo[found]] = base[todo[found]] + start + crossing.argmax(axis=0)[found] + 1
+            todo = todo[~found]
+            start = end
+        # neurons which are not proven silent are checked again at the end of
+        # the horizon
+        todo = todo[~self._silent(Z[:, todo], len(self._chunk_ends))]
+        event[todo] = base[todo] + start
+        self._schedule(indices, event)
+
+    def _silent(self, X, c):
+        '''
+        Whether the threshold cannot be crossed after chunk c, for the
+        augmented deviations X from the fixed point.
+        '''
+        if self._bounds is None:
+            return zeros(X.shape[1], dtype=bool)
+        hi, lo = self._bounds[c]
+        upper = maximum(hi[:, None] * X, lo[:, None] * X)
+        slack = 1e-9 * (maximum(abs(hi), abs(lo))[:, None] * abs(X)).sum(axis=0)
+        return upper.sum(axis=0) + slack < self._threshold_value
+
+    def _schedule(self, indices, steps):
+        '''
+        Schedules the events of the neurons (-1 for none), in the windows of
+        the calendar.
+        '''
+        self._next_event[indices] = steps
+        scheduled = steps >= 0
+        indices, steps = indices[scheduled], steps[scheduled]
+        if not len(steps):
+            return
+        windows = steps // self._window
+        order = argsort(windows, kind='mergesort')
+        indices, steps, windows = indices[order], steps[order], windows[order]
+        starts = diff(windows).nonzero()[0] + 1
+        events = self._events
+        for window, group, groupsteps in zip(windows[hstack(([0], starts))],
+                                             split(indices, starts), split(steps, starts)):
+            events.setdefault(int(window), []).append((group, groupsteps))
+
+    def _pop_events(self, n):
+        '''
+        Returns the neurons with an event at time step n (unique indexes).
+        '''
+        window = n // self._window
+        events = self._events.get(window)
+        if events is None:
+            return zeros(0, dtype=int)
+        if len(events) > 1:
+            indices = hstack([group for group, _ in events])
+            steps = hstack([groupsteps for _, groupsteps in events])
+        else:
+            indices, steps = events[0]
+        later = steps > n
+        if later.any():
+            self._events[window] = [(indices[later], steps[later])]
+        else:
+            del self._events[window]
+        indices = unique(indices[steps == n])
+        return indices[self._next_event[indices] == n]
+
+    def _take_touched(self):
+        if not self._touched:
+            return zeros(0, dtype=int)
+        touched = unique(hstack(self._touched))
+        self._touched = []
+        return touched
+
+    def _check_snapshot(self):
+        '''
+        Finds the neurons whose state was modified since the state variables
+        were last read.
+        '''
+        if self._snapshot is not None:
+            changed = (self._S != self._snapshot).any(axis=0).nonzero()[0]
+            self._snapshot = None
+            if len(changed):
+                self._touched.append(changed)
+
+    def _start(self, n):
+        '''
+        Takes the state matrix as the state at the end of time step n-1, and
+        predicts the spikes of all neurons.
+        '''
+        N = len(self)
+        self._last[:] = n - 1
+        self._current = n - 1
+        self._next_event[:] = -1
+        self._events = {}
+        self._touched = []
+        self._snapshot = None
+        self._refractory_end[:] = -1
+        if self._reset_variable is not None:
+            p = self._reset_period
+            for age in xrange(p - 1, -1, -1):
+                self._refractory_end[self.LS[age]] = n - 1 - age + p - 1
+        self._allowed[:] = -1
+        if self._use_next_allowed_spiketime_refractoriness:
+            t = self.clock._t - self.clock._dt
+            waiting = (self._next_allowed_spiketime > t).nonzero()[0]
+            self._allowed[waiting] = n - 1 + floor((self._next_allowed_spiketime[waiting] - t) /
+                                                   self.clock._dt)
+        self._predict_all = False
+        self._predict(arange(N))
+
+    def update(self):
+        '''
+        Predicts the spikes of the neurons which received events at the
+        previous time step, and updates the neurons which spike.
+        '''
+        n = self._step()
+        self._reset_done = False
+        if self._predict_all:
+            self._start(n)
+        else:
+            self._check_snapshot()
+            self._predict(self._take_touched())
+        self._current = n
+        spikes = zeros(0, dtype=int)
+        indices = self._pop_events(n)
+        if len(indices):
+            self._next_event[indices] = -1
+            self._catch_up(indices, n)
+            self._touched.append(indices)
+            spikes = indices[self._S[self._threshold_variable, indices] > self._threshold_value]
+            if self._use_next_allowed_spiketime_refractoriness:
+                t = self.clock._t
+                spikes = spikes[self._next_allowed_spiketime[spikes] <= t]
+                self._next_allowed_spiketime[spikes] = t + self._refractory_time
+                self._allowed[spikes] = n + int(floor(self._refractory_time / self.clock._dt))
+        self.LS.push(spikes)
+
+    def reset(self):
+        '''
+        Resets the neurons which have spiked, and clamps the refractory
+        neurons which received events.
+        '''
+        self._check_snapshot()
+        self._reset_done = True
+        if self._reset_variable is None:
+            return
+        n = self._current
+        self._refractory_end[self.LS.lastspikes()] = n + self._reset_period - 1
+        if self._touched:
+            touched = hstack(self._touched)
+            touched = touched[self._refractory_end[touched] >= n]
+            self._S[self._reset_variable, touched] = self._reset_value
+
+    def catch_up(self):
+        '''
+        Brings all the neurons up to the current time step.
+        '''
+        owner = self._owner
+        if not owner._predict_all:
+            owner._catch_up(arange(len(owner)), owner._current)
+
+    def invalidate(self):
+        '''
+        Takes the state matrix as the state at the end of the previous time
+        step and predicts all the spikes again at the next update, e.g. after
+        the state matrix has been modified directly.
+        '''
+        self._owner._predict_all = True
+
+    def touch(self, indices):
+        '''
+        Predicts the spikes of the neurons (indexes in the group) again at
+        the next update, after their state has been modified directly.
+        '''
+        owner = self._owner
+        if not owner._predict_all:
+            owner._touched.append(asarray(indices, dtype=int) + self._origin)
+
+    def state_(self, name):
+        owner = self.__dict__.get('_owner')
+        if owner is not None and name != 't' and not owner._predict_all:
+            owner.catch_up()
+            if owner._snapshot is None:
+                owner._snapshot = owner._S.copy()
+        return NeuronGroup.state_(self, name)
+    state = state_
+
+    def rest(self):
+        '''
+        Sets the variables at rest.
+        '''
+        self.catch_up()
+        NeuronGroup.rest(self)
+        self.touch(arange(len(self)))
+
+    def reinit(self, states=True):
+        '''
+        Resets the variables.
+        '''
+        if self._owner is self:
+            if not states:
+                self.catch_up()
+            NeuronGroup.reinit(self, states)
+            self.invalidate()
+
+    def set_inputs(self, net):
+        '''
+        Finds the connections and synapses of the network which modify the
+        state of the group, or read it (called by :meth:`Network.prepare`).
+        '''
+        from brian.connections import Connection, MultiConnection, IdentityConnection, DelayConnection
+        from brian.monitor import SpikeMonitor
+        connections = []
+        for C in net.connections:
+            if isinstance(C, MultiConnection):
+                connections.extend(C.connections)
+            else:
+                connections.append(C)
+        propagate = Connection.propagate.im_func
+        self._connections = []
+        for C in connections:
+            if isinstance(C, SpikeMonitor):
+                continue
+            # (connection, kind of the targets, catch up the spiking neurons)
+            reads = getattr(C, '_nstate_mod', None) is not None and C.source._owner is self
+            target = getattr(C, 'target', None)
+            if target is None or target._owner is not self:
+                if reads:
+                    self._connections.append((C, None, True))
+                continue
+            if isinstance(C, DelayConnection):
+                raise TypeError('DelayConnection objects targeting event-driven '
+                                'groups are not supported')
+            if isinstance(C, IdentityConnection):
+                kind = 'identity'
+            elif type(C).propagate.im_func is propagate:
+                kind = 'rows'
+            else:
+                log_warn('brian.eventdriven', 'All the target neurons of %s are '
+                         'updated at every time step' % C.__class__.__name__)
+                kind = 'all'
+            self._connections.append((C, kind, reads))
+        self._synapses = []
+        for S in net.groups:
+            if hasattr(S, 'presynaptic'):
+                pre, post = S.source._owner is self, S.target._owner is self
+                if pre or post:
+                    self._synapses.append((S, pre, post))
+        log_info('brian.eventdriven', '%d connections and %d synapses for the '
+                 'event-driven group' % (len(self._connections), len(self._synapses)))
+
+    def _inputs(self, indices):
+        if indices:
+            indices = unique(hstack(indices))
+            self._catch_up(indices, self._current)
+            self._touched.append(indices)
+
+    def _connection_inputs(self):
+        '''
+        Updates the target neurons of the spikes propagated by the
+        connections in this time step.
+        '''
+        from brian.connections import SparseConnectionVector
+        indices = []
+        for C, kind, reads in self._connections:
+            if kind == 'all':
+                indices.append(arange(C.target._origin, C.target._origin + len(C.target)))
+                continue
+            spikes = C.source.get_spikes(C.delay)
+            if not len(spikes):
+                continue
+            if reads:
+                indices.append(asarray(spikes, dtype=int) + C.source._origin)
+            if kind == 'identity':
+                indices.append(asarray(spikes, dtype=int) + C.target._origin)
+            elif kind == 'rows':
+                if not C.iscompressed:
+                    C.compress()
+                rows = C.W.get_rows(spikes)
+                if isinstance(rows[0], SparseConnectionVector):
+                    indices.extend(asarray(row.ind, dtype=int) + C.target._origin for row in rows)
+                else:
+                    indices.append(arange(C.target._origin, C.target._origin + len(C.target)))
+        self._inputs(indices)
+
+    def _synapse_inputs(self):
+        '''
+        Updates the neurons whose synaptic events are processed by the
+        synapses in this time step.
+        '''
+        indices = []
+        for S, pre, post in self._synapses:
+            for queue in S.queues:
+                synapses = queue.peek()
+                if len(synapses):
+                    if pre:
+                        indices.append(asarray(S.presynaptic[synapses], dtype=int) + S.source._origin)
+                    if post:
+                        indices.append(asarray(S.postsynaptic[synapses], dtype=int) + S.target._origin)
+        self._inputs(indices)
@@ -22,10 +22,7 @@ else:
     from ..optimiser import freeze
     from ..utils.separate_equations import separate_equations
     from codegen.c_support_code import *
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from brian.utils.kernelcache import weave
 import re
 
 __all__ = ['CSTDP']
@@ -1,4 +1,5 @@
-from ...optimiser import freeze
+from ...optimiser import freeze, fold_constants, common_subexpressions
+from ...inspection import get_identifiers
 from string import Template
 import re
 from rewriting import *
@@ -108,6 +109,12 @@ class CodeGenerator(object):
     call the method ``func`` of the code generator with the given ``args`` and be replaced by
     that expression. Typically, this is used for the :meth:`substitute` method.
     
+    Within each block, the subexpressions that occur in several right hand sides
+    (after substitutions and constant folding) are computed once at the start of
+    the block, in variables ``_cse<block>_<n>`` (see
+    :func:`~brian.optimiser.common_subexpressions`), unless they depend on a
+    variable assigned in the block.
+    
     Example scheme::
 
         rk2_scheme = [
@@ -161,12 +168,13 @@ class CodeGenerator(object):
         code = ''
         all_variables = eqs._eq_names + eqs._diffeq_names + eqs._alias.keys() + ['t']
         vartype = self.vartype()
-        for block_specifier, block_code in scheme:
+        for block, (block_specifier, block_code) in enumerate(scheme):
             # for the moment, processing of block_specifier is very crude
             if block_specifier == ('foreachvar', 'all'):
                 vars_to_use = eqs._diffeq_names
             elif block_specifier == ('foreachvar', 'nonzero'):
                 vars_to_use = eqs._diffeq_names_nonzero
+            statements = []
             for line in block_code.split('\n'):
                 line = line.strip()
                 if line:
@@ -199,7 +207,33 @@ class CodeGenerator(object):
                                          'var':var,
                                          'var_expr':var_expr}
                         t = Template(line)
-                        code += self.single_statement(t.substitute(**substitutions)) + '\n'
+                        statements.append(t.substitute(**substitutions))
+            code += self.block(statements, '_cse%d_' % block)
+        return code
+
+    def block(self, statements, prefix='_cse'):
+        # code for the statements of a block, where the common subexpressions
+        # of the right hand sides are computed first
+        targets, expressions = [], []
+        for statement in statements:
+            m = re.search(r'[^><=]=', statement)
+            if not m:
+                return ''.join(self.single_statement(s) + '\n' for s in statements)
+            targets.append(statement[:m.end()])
+            expressions.append(fold_constants(statement[m.end():], zeros=True))
+        assigned = [re.findall(r'\w+', target)[-1] for target in targets]
+        variables = set(name for expr in expressions for name in get_identifiers(expr))
+        try:
+            definitions, expressions = common_subexpressions(expressions, variables,
+                                                             prefix=prefix, exclude=assigned)
+        except (NotImplementedError, SyntaxError):
+            return ''.join(self.single_statement(s) + '\n' for s in statements)
+        vartype = self.vartype()
+        code = ''
+        for name, expr in definitions:
+            code += self.single_statement(vartype + ' ' + name + ' = ' + expr) + '\n'
+        for target, expr in zip(targets, expressions):
+            code += self.single_statement(target + ' ' + expr) + '\n'
         return code
 
     def single_substitute(self, s):
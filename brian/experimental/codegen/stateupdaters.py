@@ -6,10 +6,7 @@ from codegen_c import *
 from codegen_python import *
 from integration_schemes import *
 import time
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from brian.utils.kernelcache import weave
 import numpy, scipy
 import re
 from c_support_code import *
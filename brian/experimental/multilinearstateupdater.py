@@ -1,3 +1,10 @@
+'''
+Linear state updaters with different parameters for each neuron.
+
+Superseded by :class:`brian.stateupdater.HeterogeneousLinearStateUpdater`,
+which :class:`NeuronGroup` uses automatically for equations which are linear
+with parameters, e.g. ``dv/dt=-v/tau`` with a parameter ``tau``.
+'''
 from brian import *
 from brian.stateupdater import get_linear_equations_solution_numerically, get_linear_equations
 try:
@@ -98,10 +98,7 @@ else:
     from ..globalprefs import get_global_preference
     from codegen.c_support_code import *
 import numpy
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from brian.utils.kernelcache import weave
 import new
 
 __all__ = ['make_new_connection',
@@ -0,0 +1,412 @@
+'''
+Networks partitioned over several processes
+
+See :class:`PartitionedNetwork`. This relies on the ``fork`` system call to
+give each worker process a copy of the network, so it only works on Unix-like
+systems.
+'''
+from brian import *
+from __builtin__ import any, min, max
+from brian.monitor import Monitor
+from brian.network import Network
+from brian.log import log_info
+from brian.utils.progressreporting import ProgressReporter
+import numpy
+import mmap
+import multiprocessing
+import cPickle
+import traceback
+
+__all__ = ['PartitionedNetwork']
+
+
+def _shared_array(shape, dtype):
+    '''
+    Returns an array in anonymous shared memory which is kept across forks.
+
+    The pages are only allocated by the operating system when they are first
+    written to, so large arrays that are mostly unused cost little memory.
+    '''
+    dtype = numpy.dtype(dtype)
+    size = max(int(numpy.prod(shape)) * dtype.itemsize, 1)
+    return numpy.ndarray(shape, dtype=dtype, buffer=mmap.mmap(-1, size))
+
+
+class SharedSpikeRing(object):
+    '''
+    Ring buffer of the spikes of one group in shared memory
+
+    Holds the spikes of the last ``numslots`` time steps. The spikes of step
+    ``i`` are stored in row ``i % numslots`` of an array of size
+    ``(numslots, N)``, with the number of spikes stored separately.
+    '''
+    def __init__(self, N, numslots):
+        self.N = N
+        self.numslots = numslots
+        self.counts = _shared_array(numslots, int)
+        self.data = _shared_array((numslots, N), numpy.int32)
+
+    def put(self, step, spikes):
+        slot = step % self.numslots
+        n = len(spikes)
+        self.data[slot, :n] = spikes
+        self.counts[slot] = n
+
+    def get(self, step):
+        slot = step % self.numslots
+        return self.data[slot, :self.counts[slot]]
+
+
+class RemoteSpikeContainer(object):
+    '''
+    Replaces the :class:`SpikeContainer` of a group owned by another process
+
+    Answers ``get_spikes(delay, origin, N)`` queries from the
+    :class:`SharedSpikeRing` of the group, for the current time step of the
+    worker process (stored in ``stepcounter[0]``).
+    '''
+    def __init__(self, ring, stepcounter):
+        self.ring = ring
+        self.stepcounter = stepcounter
+
+    def get_spikes(self, delay, origin, N):
+        spikes = self.ring.get(self.stepcounter[0] - delay)
+        if origin != 0 or N != self.ring.N:
+            spikes = spikes[spikes.searchsorted(origin):spikes.searchsorted(origin + N)] - origin
+        return numpy.array(spikes, dtype=int)
+
+    def __getitem__(self, i):
+        return self.get_spikes(i, 0, self.ring.N)
+
+    def lastspikes(self):
+        return self[0]
+
+
+class ProcessBarrier(object):
+    '''
+    Reusable barrier for ``n`` processes
+
+    ``wait()`` returns when ``n`` processes have called it. If another
+    process calls ``abort()`` (because of an error), ``wait()`` raises a
+    ``RuntimeError`` instead of blocking forever.
+    '''
+    def __init__(self, n):
+        self.n = n
+        self._count = multiprocessing.Value('i', 0, lock=False)
+        self._generation = multiprocessing.Value('i', 0, lock=False)
+        self._aborted = multiprocessing.Value('i', 0, lock=False)
+        self._condition = multiprocessing.Condition()
+
+    def wait(self):
+        self._condition.acquire()
+        try:
+            generation = self._generation.value
+            self._count.value += 1
+            if self._count.value == self.n:
+                self._count.value = 0
+                self._generation.value += 1
+                self._condition.notify_all()
+            while self._generation.value == generation:
+                if self._aborted.value:
+                    raise RuntimeError('Another process of the partitioned network failed.')
+                self._condition.wait(1.0)
+        finally:
+            self._condition.release()
+
+    def abort(self):
+        self._condition.acquire()
+        try:
+            self._aborted.value = 1
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+
+def _monitor_data(obj):
+    '''
+    Returns the attributes of a monitor that should be sent back to the
+    main process, i.e. the recorded data but not references to groups,
+    clocks, functions, etc.
+    '''
+    data = {}
+    for k, v in obj.__dict__.iteritems():
+        if isinstance(v, (NeuronGroup, Connection, NetworkOperation, Clock)) or callable(v):
+            continue
+        try:
+            cPickle.dumps(v, 2)
+        except Exception:
+            continue
+        data[k] = v
+    return data
+
+
+class PartitionedNetwork(Network):
+    '''
+    A :class:`Network` whose groups are simulated in several processes
+
+    Initialised as a :class:`Network`, with the additional keywords:
+
+    ``numprocesses=None``
+        The number of worker processes, by default the number of CPUs.
+    ``partition=None``
+        Optionally, a list of lists of groups giving the groups simulated by
+        each process. By default, the groups are distributed so as to balance
+        the number of neurons in each process.
+
+    At each call of :meth:`run`, one worker process is forked for each
+    partition. A worker updates its own groups, the connections targeting
+    them, the monitors recording from them and the network operations
+    belonging to them (operations that do not belong to a group, e.g. a
+    user defined :func:`network_operation`, are run by the first worker).
+    Spikes are exchanged through a :class:`SharedSpikeRing` for each group in
+    shared memory: connections whose source is simulated in another process
+    read the spikes from the ring rather than from the group's
+    :class:`SpikeContainer`. Since a spike only affects its targets after the
+    connection delay, the workers only need to synchronise once every
+    ``d`` steps, where ``d`` is the minimum delay of the connections between
+    partitions.
+
+    During the run, each worker updates the state matrices ``_S`` of its
+    groups in its own (copy-on-write) memory, and only copies them to shared
+    memory at the end of the run. The state matrices are not moved to shared
+    memory for the run, because other objects keep references to them (e.g.
+    compiled resets, variable refractory periods, :class:`StateSpikeMonitor`
+    objects, or state variables held by the user),
+    and these would silently keep reading and writing the original arrays.
+    Only the spikes are exchanged during the run. At the end of the run, the
+    state matrices, the refractory times and the spike containers are copied
+    back into the groups of the main process (in place, so that references
+    to state variables remain valid) along with the data recorded by
+    monitors (instances of :class:`Monitor`).
+
+    Restrictions:
+
+    * The network must have a single :class:`Clock` (not a
+      :class:`FloatClock`).
+    * Connections between groups in different partitions must have a
+      homogeneous delay of at least one time step, and can't use
+      ``modulation`` or be :class:`DelayConnection` objects.
+    * :class:`Synapses` are not supported, and changes made by plasticity
+      rules to connection matrices in the worker processes are not copied
+      back.
+    * Network operations in the first worker must not read the state of
+      groups simulated by other workers, and :func:`stop` only takes
+      effect at the end of the current synchronisation window.
+    * The random number generator of each worker is reseeded, so results
+      with noise differ from a single process simulation.
+    '''
+    def __init__(self, *args, **kwds):
+        self.numprocesses = kwds.pop('numprocesses', None)
+        self.partition = kwds.pop('partition', None)
+        Network.__init__(self, *args, **kwds)
+
+    def _make_partition(self):
+        '''
+        Returns a list of lists of groups, one list for each process.
+        '''
+        groups = [G for G in self.groups]
+        if self.partition is not None:
+            partition = [list(part) for part in self.partition]
+            assigned = [G for part in partition for G in part]
+            for G in groups:
+                if not any(G is H for H in assigned):
+                    raise ValueError('Group ' + str(G) + ' is not in the partition.')
+            return partition
+        numprocesses = self.numprocesses
+        if numprocesses is None:
+            numprocesses = multiprocessing.cpu_count()
+        numprocesses = max(min(numprocesses, len(groups)), 1)
+        # Largest groups first, each one goes to the least loaded process
+        partition = [[] for _ in xrange(numprocesses)]
+        load = [0] * numprocesses
+        for G in sorted(groups, key=len, reverse=True):
+            i = load.index(min(load))
+            partition[i].append(G)
+            load[i] += len(G)
+        return partition
+
+    def _assign_objects(self, partition):
+        '''
+        Returns a list giving for each process the list of objects it
+        simulates, the list of pairs (source group, connection) crossing
+        partitions, and a dictionary mapping object ids to process numbers.
+        '''
+        owner = {}
+        for i, part in enumerate(partition):
+            for G in part:
+                owner[id(G)] = i
+        objects = [[] for _ in partition]
+        crossing = []
+        for obj in self._added_objects:
+            if hasattr(obj, 'presynaptic'):
+                raise NotImplementedError('Synapses are not supported by PartitionedNetwork.')
+            if isinstance(obj, NeuronGroup):
+                i = owner[id(obj)]
+            elif isinstance(obj, Connection):
+                source = owner[id(obj.source._owner)]
+                if obj.target is None: # monitors
+                    i = source
+                else:
+                    i = owner[id(obj.target._owner)]
+                if i != source:
+                    if isinstance(obj, DelayConnection) or obj._nstate_mod is not None:
+                        raise NotImplementedError('Connections between partitions cannot use '
+                                                  'heterogeneous delays or modulation.')
+                    if obj.delay < 1:
+                        raise ValueError('Connections between partitions must have a delay '
+                                         'of at least one time step.')
+                    crossing.append((obj.source._owner, obj))
+            elif hasattr(obj, 'P') and isinstance(obj.P, NeuronGroup): # e.g. StateMonitor
+                i = owner[id(obj.P._owner)]
+            else:
+                i = 0
+            owner[id(obj)] = i
+            objects[i].append(obj)
+        # Objects contained in groups and connections are simulated with them
+        for i in xrange(len(objects)):
+            for obj in objects[i]:
+                contained = getattr(obj, 'contained_objects', None)
+                for sub in (contained or []):
+                    if id(sub) in owner and owner[id(sub)] != owner[id(obj)]:
+                        j = owner[id(sub)]
+                        objects[j] = [o for o in objects[j] if o is not sub]
+                        objects[owner[id(obj)]].append(sub)
+                        owner[id(sub)] = owner[id(obj)]
+        return objects, crossing, owner
+
+    def run(self, duration, threads=1, report=None, report_period=10 * second):
+        '''
+        Runs the simulation for the given duration in several processes.
+
+        The ``threads`` keyword is ignored, ``report`` only reports the end
+        of the run.
+        '''
+        if not self.prepared:
+            self.prepare()
+        if not self.same_clocks():
+            raise NotImplementedError('PartitionedNetwork only supports a single clock.')
+        clock = self.clock
+        clock.set_duration(duration)
+        numsteps = clock.remaining_steps()
+        if numsteps is None:
+            raise NotImplementedError('PartitionedNetwork cannot be used with a FloatClock.')
+        if numsteps == 0:
+            return
+        partition = self._make_partition()
+        objects, crossing, owner = self._assign_objects(partition)
+        numprocesses = len(partition)
+        # Synchronisation window and ring buffer size
+        if crossing:
+            window = min(C.delay for _, C in crossing)
+            maxdelay = max(C.delay for _, C in crossing)
+        else:
+            window = numsteps
+            maxdelay = 0
+        groups = [G for part in partition for G in part]
+        numslots = max([maxdelay + window + 1] + [G._max_delay for G in groups])
+        log_info('brian.experimental.partitionednetwork',
+                 '%d processes, synchronisation every %d steps' % (numprocesses, window))
+        # Shared memory, allocated before forking. The rings are prefilled
+        # with the spikes of the previous steps (step -k is in LS[k-1]). The
+        # state arrays only receive the final states of the workers, which
+        # run on their own copies of _S (see the class docstring)
+        rings = {}
+        states = {}
+        for G in groups:
+            ring = SharedSpikeRing(len(G), numslots)
+            for k in xrange(1, min(numslots - window, G._max_delay)):
+                ring.put(-k, G.LS[k - 1])
+            rings[id(G)] = ring
+            states[id(G)] = (_shared_array(G._S.shape, G._S.dtype),
+                             _shared_array(G._next_allowed_spiketime.shape, float))
+        barrier = ProcessBarrier(numprocesses)
+        stopflag = multiprocessing.Value('i', 0, lock=False)
+        stepsdone = multiprocessing.Value('i', 0, lock=False)
+        pipes = []
+        processes = []
+        for i in xrange(numprocesses):
+            parent_end, child_end = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=self._worker,
+                                        args=(i, partition, objects[i], crossing, owner,
+                                              rings, states, barrier, stopflag,
+                                              stepsdone, numsteps, window, child_end))
+            p.start()
+            pipes.append(parent_end)
+            processes.append(p)
+        results = [pipe.recv() for pipe in pipes]
+        for p in processes:
+            p.join()
+        for result in results:
+            if result[0] == 'error':
+                raise RuntimeError('Error in a worker process of the partitioned network:\n' + result[1])
+        # Copy the results back into the objects of this process
+        steps = stepsdone.value
+        for G in groups:
+            S, nextspike = states[id(G)]
+            G._S[:] = S
+            G._next_allowed_spiketime[:] = nextspike
+            ring = rings[id(G)]
+            for step in xrange(max(steps - G._max_delay, 0), steps):
+                G.LS.push(numpy.array(ring.get(step), dtype=int))
+        for _, data in results:
+            for index, attributes in data:
+                self._added_objects[index].__dict__.update(attributes)
+        for _ in xrange(steps):
+            clock.tick()
+        if report is not None:
+            if not isinstance(report, ProgressReporter):
+                report = ProgressReporter(report, report_period)
+            report.update(1.0)
+
+    def _worker(self, number, partition, objects, crossing, owner, rings, states,
+                barrier, stopflag, stepsdone, numsteps, window, pipe):
+        '''
+        Runs in the forked worker process ``number``.
+        '''
+        import brian.network
+        try:
+            numpy.random.seed()
+            local = partition[number]
+            stepcounter = [0]
+            # Groups of other processes are read from the shared rings
+            for G, C in crossing:
+                if owner[id(C)] == number and not isinstance(G.LS, RemoteSpikeContainer):
+                    remote = RemoteSpikeContainer(rings[id(G)], stepcounter)
+                    G.LS = remote
+                    for H in G._subgroup_set.get():
+                        H.LS = remote
+            net = Network(objects)
+            net.prepare(fused=False)
+            clock = net.clock = self.clock
+            local_rings = [(G.LS, rings[id(G)]) for G in local]
+            update = net.update
+            tick = clock.tick
+            step = 0
+            while step < numsteps:
+                stepcounter[0] = step
+                update()
+                for LS, ring in local_rings:
+                    ring.put(step, LS.lastspikes())
+                tick()
+                step += 1
+                if step % window == 0 or step == numsteps:
+                    if net.stopped or brian.network.globally_stopped:
+                        stopflag.value = 1
+                    barrier.wait()
+                    if stopflag.value:
+                        break
+            if number == 0:
+                stepsdone.value = step
+            for G in local:
+                S, nextspike = states[id(G)]
+                S[:] = G._S
+                nextspike[:] = G._next_allowed_spiketime
+            indices = dict((id(obj), i) for i, obj in enumerate(self._added_objects))
+            data = [(indices[id(obj)], _monitor_data(obj)) for obj in objects
+                    if isinstance(obj, Monitor)]
+            pipe.send(('ok', data))
+        except:
+            barrier.abort()
+            pipe.send(('error', traceback.format_exc()))
+        finally:
+            pipe.close()
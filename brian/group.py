@@ -1,6 +1,21 @@
 from brian import *
+from globalprefs import get_global_preference
+import numpy
 
-__all__ = ['Group', 'MultiGroup']
+__all__ = ['Group', 'MultiGroup', 'get_state_dtype']
+
+
+def get_state_dtype(dtype=None):
+    '''
+    The floating point type ``dtype`` as a ``numpy.dtype``, or the global
+    preference ``defaultdtype`` if ``dtype`` is ``None``.
+    '''
+    if dtype is None:
+        dtype = get_global_preference('defaultdtype')
+    dtype = numpy.dtype(dtype)
+    if dtype.kind != 'f':
+        raise TypeError('State variables must have a floating point type, not ' + str(dtype))
+    return dtype
 
 
 class Group(object):
@@ -12,16 +27,17 @@ class Group(object):
     different variables.
     
     Each differential equation in ``equations`` is allocated an array of
-    length ``N`` in the attribute ``_S`` of the object. Unit consistency
+    length ``N`` in the attribute ``_S`` of the object, of type ``dtype``
+    (by default the global preference ``defaultdtype``). Unit consistency
     checking is performed.
     '''
-    def __init__(self, equations, N, level=0, unit_checking=True):
+    def __init__(self, equations, N, level=0, unit_checking=True, dtype=None):
         if isinstance(equations, str):
             equations = Equations(equations, level=level + 1)
         equations.prepare(check_units=unit_checking)
         var_names = equations._diffeq_names
         M = len(var_names)
-        self._S = zeros((M, N))
+        self._S = zeros((M, N), dtype=get_state_dtype(dtype))
         self.staticvars = dict([(name, equations._function[name]) for name in equations._eq_names])
         self.var_index = dict(zip(var_names, range(M)))
         self.var_index.update(zip(range(M), range(M))) # name integer i -> state variable i
@@ -0,0 +1,210 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+"""
+Estimates of the memory used by the objects of a :class:`Network`
+"""
+import sys
+from numpy import ndarray
+from scipy import sparse
+from brian.connections import MultiConnection
+from brian.connections.connectionmatrix import ConnectionMatrix
+from brian.utils.circular import CircularVector, SpikeContainer
+from brian.utils.dynamicarray import DynamicArray
+
+__all__ = ['NetworkMemoryUsage']
+
+# long lists of Python objects are estimated from this number of elements
+SAMPLE_SIZE = 100
+
+# objects whose attributes are buffers of the object that holds them
+container_types = (ConnectionMatrix, sparse.spmatrix, CircularVector,
+                   SpikeContainer, DynamicArray)
+
+
+def nbytes(x, seen):
+    '''
+    Returns the number of bytes held by x, not counting the arrays whose id
+    is in the set seen (to which the arrays counted are added). Only arrays,
+    lists, tuples, dicts and the internal containers of Brian (connection
+    matrices, spike containers, dynamic arrays) are taken into account, other
+    objects count for nothing.
+    '''
+    if isinstance(x, ndarray):
+        # views are counted as the array that owns the memory
+        while isinstance(x.base, ndarray):
+            x = x.base
+        if id(x) in seen:
+            return 0
+        seen.add(id(x))
+        return x.nbytes
+    if isinstance(x, (list, tuple)):
+        if id(x) in seen:
+            return 0
+        seen.add(id(x))
+        n = sys.getsizeof(x)
+        if len(x) > SAMPLE_SIZE and not isinstance(x[0], (ndarray, list, tuple, dict)):
+            # e.g. the list of spike times of a monitor
+            return n + sum(sys.getsizeof(y) for y in x[:SAMPLE_SIZE]) * len(x) // SAMPLE_SIZE
+        if len(x) > SAMPLE_SIZE and isinstance(x[0], tuple):
+            # e.g. the list of (i, t) pairs of a SpikeMonitor
+            sample = sum(sys.getsizeof(y) + sum(sys.getsizeof(z) for z in y)
+                         for y in x[:SAMPLE_SIZE])
+            return n + sample * len(x) // SAMPLE_SIZE
+        return n + sum(_element_bytes(y, seen) for y in x)
+    if isinstance(x, dict):
+        if id(x) in seen:
+            return 0
+        seen.add(id(x))
+        return sum(nbytes(y, seen) for y in x.itervalues())
+    if isinstance(x, container_types):
+        if id(x) in seen:
+            return 0
+        seen.add(id(x))
+        return sum(nbytes(y, seen) for y in getattr(x, '__dict__', {}).itervalues())
+    return 0
+
+
+def _element_bytes(x, seen):
+    if isinstance(x, (ndarray, list, tuple, dict) + container_types):
+        return nbytes(x, seen)
+    return sys.getsizeof(x)
+
+
+def memory_usage(obj, seen=None):
+    '''
+    Returns a dictionary whose keys are the names of the buffers (attributes)
+    of obj and values the number of bytes they hold (see :func:`nbytes`).
+    Only buffers with a positive size are included.
+    '''
+    if seen is None:
+        seen = set()
+    attributes = sorted(getattr(obj, '__dict__', {}).iteritems())
+    usage = {}
+    # arrays first, so that views elsewhere are not counted for them
+    for name, value in [(n, v) for n, v in attributes if isinstance(v, ndarray)] + \
+                       [(n, v) for n, v in attributes if not isinstance(v, ndarray)]:
+        size = nbytes(value, seen)
+        if size > 0:
+            usage[name] = size
+    return usage
+
+
+class NetworkMemoryUsage(object):
+    '''
+    Memory used by the objects of a :class:`Network`
+    
+    Returned by :meth:`Network.memory_usage`. The sizes are the number of
+    bytes of the NumPy arrays held by each object, and estimates for the
+    lists of Python objects (such as the spikes recorded by a
+    :class:`SpikeMonitor`). Arrays shared by several objects are only counted
+    once, for the first one.
+    
+    **Attributes**
+    
+    ``entries``
+        A list of tuples ``(obj, kind, buffers)`` where ``kind`` is one of
+        ``'group'``, ``'synapses'``, ``'connection'``, ``'monitor'`` and
+        ``'operation'``, and ``buffers`` is a dictionary giving the number of
+        bytes held by each internal buffer (attribute) of ``obj``.
+    ``total``
+        The total number of bytes.
+    
+    **Methods**
+    
+    .. method:: report()
+    
+        Returns the entries as a list of dictionaries with keys ``'object'``,
+        ``'kind'``, ``'buffers'`` and ``'total'``, sorted by decreasing size.
+    
+    .. method:: table()
+    
+        Returns the report formatted as a table (also given by ``str()``),
+        with a line for each buffer.
+    '''
+    def __init__(self, net):
+        from brian.monitor import Monitor
+        seen = set()
+        self.entries = []
+        for obj in net.groups:
+            if hasattr(obj, 'presynaptic'):
+                kind = 'synapses'
+            else:
+                kind = 'group'
+            self.entries.append((obj, kind, memory_usage(obj, seen)))
+        connections = []
+        for obj in net.connections:
+            # connections merged by Network.prepare are reported separately
+            if isinstance(obj, MultiConnection):
+                connections.extend(obj.connections)
+            else:
+                connections.append(obj)
+        for obj in connections:
+            if obj.__class__.__name__ == 'SpikeQueue':
+                kind = 'synapses'
+            elif isinstance(obj, Monitor):
+                kind = 'monitor'
+            else:
+                kind = 'connection'
+            self.entries.append((obj, kind, memory_usage(obj, seen)))
+        for obj in net.operations:
+            if isinstance(obj, Monitor):
+                kind = 'monitor'
+            else:
+                kind = 'operation'
+            self.entries.append((obj, kind, memory_usage(obj, seen)))
+        self.total = sum(sum(buffers.itervalues()) for _, _, buffers in self.entries)
+
+    def report(self):
+        entries = [{'object': obj, 'kind': kind, 'buffers': buffers,
+                    'total': sum(buffers.itervalues())}
+                   for obj, kind, buffers in self.entries]
+        entries.sort(key=lambda entry:-entry['total'])
+        return entries
+
+    def table(self):
+        lines = ['%-50s %-10s %14s' % ('object / buffer', 'kind', 'bytes')]
+        for entry in self.report():
+            lines.append('%-50s %-10s %14d' % (str(entry['object'])[:50], entry['kind'],
+                                               entry['total']))
+            for name, size in sorted(entry['buffers'].iteritems(), key=lambda item:-item[1]):
+                lines.append('    %-57s %14d' % (name[:57], size))
+        lines.append('Total: %d bytes (%.1f MB)' % (self.total, self.total / 2.0 ** 20))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.table()
+
+    def __repr__(self):
+        return '<NetworkMemoryUsage of %d objects, %d bytes>' % (len(self.entries), self.total)
@@ -47,7 +47,6 @@ from numpy import array, zeros, mean, histogram, linspace, tile, digitize,     \
         copy, ones, rint, exp, arange, convolve, argsort, mod, floor, asarray, \
         maximum, Inf, amin, amax, sort, nonzero, setdiff1d, diag, hstack, resize,\
          inf, var, tril, empty, float64, array, sum, int32, ceil
-from scipy.spatial.distance import sqeuclidean
 from itertools import repeat, izip
 from clock import guess_clock, EventClock, Clock
 from network import NetworkOperation, network_operation
@@ -55,27 +54,96 @@ from stdunits import ms, Hz
 from collections import defaultdict
 import types
 from operator import isSequenceType
-from tools.statistics import firing_rate
 from neurongroup import NeuronGroup
+from group import get_state_dtype
 import bisect
 from base import *
 from time import time
+from memoryusage import memory_usage
 import datetime
-try:
-    import pylab, matplotlib
-except:
-    pass
-
-
+import warnings
 from globalprefs import *
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from utils.lazyimport import LazyModule
+pylab = LazyModule('pylab')
+matplotlib = LazyModule('matplotlib')
+from utils.kernelcache import weave
+
+
+set_global_preferences(monitormemorybudget=None,
+                       monitormemorybudgetaction='warn')
+define_global_preference('monitormemorybudget', 'None',
+                         desc='''
+                              The default memory budget, in bytes, of each
+                              :class:`SpikeMonitor` and :class:`StateMonitor`,
+                              or ``None`` for no budget
+                              (see :meth:`Monitor.set_memory_budget`).
+                              ''')
+define_global_preference('monitormemorybudgetaction', "'warn'",
+                         desc='''
+                              What monitors do when their memory budget is
+                              exceeded, ``'warn'`` or ``'raise'``.
+                              ''')
 
 
 class Monitor(object):
-    pass
+    '''
+    Base class of monitors
+    
+    Monitors that record their data in memory (:class:`SpikeMonitor` and
+    :class:`StateMonitor`) can be given a memory budget, checked while the
+    network runs.
+    
+    .. method:: set_memory_budget(budget[, action='warn'])
+    
+        Sets the memory budget in bytes (``None`` for no budget). If the
+        recorded data exceeds the budget, a warning is issued (once) if
+        ``action='warn'``, or a ``MemoryError`` is raised if
+        ``action='raise'``. The default budget is set by the global
+        preferences ``monitormemorybudget`` and ``monitormemorybudgetaction``.
+    
+    .. method:: memory_usage()
+    
+        Returns an estimate of the number of bytes held by the monitor.
+    '''
+    _memory_budget = None
+    _memory_budget_action = 'warn'
+    # the number of recorded items at which the memory is checked next
+    _memory_check_at = None
+
+    def set_memory_budget(self, budget, action='warn'):
+        if action not in ('warn', 'raise'):
+            raise ValueError("action should be 'warn' or 'raise'")
+        self._memory_budget = budget
+        self._memory_budget_action = action
+        self._reset_memory_check()
+
+    def _reset_memory_check(self):
+        if self._memory_budget is None:
+            self._memory_check_at = None
+        else:
+            self._memory_check_at = 0
+
+    def memory_usage(self):
+        return sum(memory_usage(self).values())
+
+    def _check_memory_budget(self, count):
+        '''
+        Checks the memory budget after count items have been recorded, and
+        sets the count at which it should be checked again, extrapolating the
+        memory used per item so that checks become rarer as the budget is
+        approached from far below.
+        '''
+        used = self.memory_usage()
+        budget = self._memory_budget
+        if used > budget:
+            message = '%s uses %d bytes, exceeding its memory budget of %d bytes' % (str(self), used, budget)
+            if self._memory_budget_action == 'raise':
+                raise MemoryError(message)
+            warnings.warn(message)
+            self._memory_check_at = None
+        else:
+            remaining = int((budget - used) * count / max(used, 1))
+            self._memory_check_at = count + max(remaining // 2, 1)
 
 
 class SpikeMonitor(Connection, Monitor):
@@ -119,6 +187,11 @@ class SpikeMonitor(Connection, Monitor):
     ``M[i]``
         An array of the spike times of neuron ``i``.
 
+    If the source group was created with ``trials=K``, the method
+    ``split_trials()`` returns a list of ``K`` lists of pairs ``(i,t)``,
+    one for each trial, where ``i`` is the index of the neuron within
+    the trial.
+
     Notes:
 
     :class:`SpikeMonitor` is subclassed from :class:`Connection`.
@@ -141,6 +214,8 @@ class SpikeMonitor(Connection, Monitor):
         self.custom_function = function is not None
         if self.custom_function:
             self.propagate = function
+        self.set_memory_budget(get_global_preference('monitormemorybudget'),
+                               get_global_preference('monitormemorybudgetaction'))
 
     def reinit(self):
         """
@@ -149,6 +224,7 @@ class SpikeMonitor(Connection, Monitor):
         self.nspikes = 0
         self.spikes = []
         self._newspikes = True #recreate self._spiketimes on next access
+        self._reset_memory_check()
 
     def propagate(self, spikes):
         '''
@@ -161,6 +237,8 @@ class SpikeMonitor(Connection, Monitor):
             self.nspikes += len(spikes)
             if self.record:
                 self.spikes += zip(spikes, repeat(self.source.clock.t))
+                if self._memory_check_at is not None and self.nspikes >= self._memory_check_at:
+                    self._check_memory_budget(self.nspikes)
 
     def origin(self, P, Q):
         '''
@@ -188,6 +266,17 @@ class SpikeMonitor(Connection, Monitor):
         return self._spiketimes
     spiketimes = property(fget=getspiketimes)
     
+    def split_trials(self):
+        '''
+        Returns the list of recorded spikes (i, t) for each trial of the
+        source group, with neuron indices relative to the trial.
+        '''
+        n = getattr(self.source, 'trial_size', len(self.source))
+        trials = [[] for _ in xrange(getattr(self.source, 'trials', 1))]
+        for i, t in self.spikes:
+            trials[i // n].append((i % n, t))
+        return trials
+
     @property
     def it(self):
         if len(self.spikes)==0:
@@ -254,7 +343,7 @@ class AutoCorrelogram(SpikeMonitor):
         spikes_set = set(spikes)
         if self.record == True:
             for i in xrange(self.delay): # Not a brilliant implementation
-                self._autocorrelogram[spikes_set.intersection(self.source.LS[i]), i] += 1
+                self._autocorrelogram[spikes_set.intersection(self.source.get_spikes(i)), i] += 1
 
     def __getitem__(self, i):
         # TODO: returns the autocorrelogram of neuron i
@@ -373,6 +462,10 @@ class StateSpikeMonitor(SpikeMonitor):
         Returns an array of the values of variable ``var`` for the
         whole monitored group, or just for neuron ``i`` if specified.
     '''
+    # the monitor reads the state of the source when it spikes, see
+    # Network._build_block_schedule
+    _reads_source_state = True
+
     def __init__(self, source, var):
         SpikeMonitor.__init__(self, source)
         if isinstance(var, (str, int)) or not isSequenceType(var):
@@ -715,6 +808,11 @@ class StateMonitor(NetworkOperation, Monitor):
         be taken into account, as network updates are done clock by clock.
         Use the ``timestep`` parameter if you need recordings to be made at a
         precise point in the network update step.
+    ``dtype``
+        The floating point type of the recorded values, by default the type
+        of the state matrix of ``P`` (e.g. ``float32`` halves the memory
+        used by the recordings). The times and the summary statistics
+        (``mean``, ``var``) are always computed in double precision.
 
     The :class:`StateMonitor` object has the following properties:
 
@@ -769,6 +867,12 @@ class StateMonitor(NetworkOperation, Monitor):
 
         Inserts spikes into recorded traces (for plotting). State values
         at spike times are replaced with the given value (peak value of spike).
+
+    .. method:: split_trials()
+
+        If ``P`` was created with ``trials=K``, returns a list of ``K``
+        2D arrays, the recorded values of each trial (rows are the recorded
+        neurons of that trial, in the order of ``record``).
     '''
     mean = property(fget=lambda self:self._mu / self.N)
     _mean = mean
@@ -782,7 +886,8 @@ class StateMonitor(NetworkOperation, Monitor):
     values = property(fget=lambda self:self.getvalues())
     values_ = values
 
-    def __init__(self, P, varname, clock=None, record=False, timestep=1, when='end'):
+    def __init__(self, P, varname, clock=None, record=False, timestep=1, when='end',
+                 dtype=None):
         '''
         -- P is the neuron group
         -- varname is the variable name
@@ -810,12 +915,17 @@ class StateMonitor(NetworkOperation, Monitor):
         self._values = None
         self.P = P
         self.varname = varname
+        if dtype is None and hasattr(P, '_S'):
+            dtype = P._S.dtype
+        self.dtype = get_state_dtype(dtype)
         self.N = 0 # number of steps
         self._recordstep = 0
         if record is False:
             self._mu = zeros(len(P)) # sum
             self._sqr = zeros(len(P)) # sum of squares
         self.unit = 1.0 * P.unit(varname)
+        self._memory_budget = get_global_preference('monitormemorybudget')
+        self._memory_budget_action = get_global_preference('monitormemorybudgetaction')
         self.reinit()
 
     def __call__(self):
@@ -829,11 +939,13 @@ class StateMonitor(NetworkOperation, Monitor):
         elif self.curtimestep == self.timestep:
             i = self._recordstep
             if not isinstance(self.record, bool):
-                self._values.append(V[self.record])
+                self._values.append(asarray(V[self.record], dtype=self.dtype))
             elif self.record is True:
-                self._values.append(V.copy())
+                self._values.append(array(V, dtype=self.dtype))
             self._times.append(self.clock._t)
             self._recordstep += 1
+            if self._memory_check_at is not None and self._recordstep >= self._memory_check_at:
+                self._check_memory_budget(self._recordstep)
         self.curtimestep -= 1
         if self.curtimestep == 0: self.curtimestep = self.timestep
         self.N += 1
@@ -858,7 +970,7 @@ class StateMonitor(NetworkOperation, Monitor):
 
     def getvalues(self):
         if len(self._values):
-            newvalues = array(self._values)
+            newvalues = array(self._values, dtype=self.dtype)
             if len(newvalues.shape)==1:
                 newvalues.shape = (1, newvalues.size)
             else:
@@ -875,11 +987,12 @@ class StateMonitor(NetworkOperation, Monitor):
         self._values = []
         self._times = []
         ri = self.get_record_indices()
-        self._values_cache = zeros((len(ri), 0))
+        self._values_cache = zeros((len(ri), 0), dtype=self.dtype)
         self.N = 0
         self._recordstep = 0
         self._mu = zeros(len(self.P))
         self._sqr = zeros(len(self.P))
+        self._reset_memory_check()
 
     def get_record_indices(self):
         """Returns the list of neuron numbers which were recorded.
@@ -893,6 +1006,18 @@ class StateMonitor(NetworkOperation, Monitor):
         else:
             return self.record
 
+    def split_trials(self):
+        '''
+        Returns the list of the recorded values of each trial of P.
+        '''
+        if self.record is False:
+            raise IndexError('No neuron was recorded.')
+        n = getattr(self.P, 'trial_size', len(self.P))
+        indices = array(self.get_record_indices(), dtype=int)
+        values = self.values
+        return [values[(indices >= k * n) & (indices < (k + 1) * n)]
+                for k in xrange(getattr(self.P, 'trials', 1))]
+
     def plot(self, indices=None, cmap=None, refresh=None, showlast=None, redraw=True):
         lines = []
         inds = []
@@ -1019,8 +1144,10 @@ class RecentStateMonitor(StateMonitor):
     
         plot(M.times, M.values[:, i])
     '''
-    def __init__(self, P, varname, duration=5 * ms, clock=None, record=True, timestep=1, when='end'):
-        StateMonitor.__init__(self, P, varname, clock=clock, record=record, timestep=timestep, when=when)
+    def __init__(self, P, varname, duration=5 * ms, clock=None, record=True, timestep=1, when='end',
+                 dtype=None):
+        StateMonitor.__init__(self, P, varname, clock=clock, record=record, timestep=timestep, when=when,
+                              dtype=dtype)
         self.duration = duration
         self.num_duration = int(duration / (timestep * self.clock.dt)) + 1
         if record is False:
@@ -1031,7 +1158,7 @@ class RecentStateMonitor(StateMonitor):
             self.record_size = 1
         else:
             self.record_size = len(record)
-        self._values = zeros((self.num_duration, self.record_size))
+        self._values = zeros((self.num_duration, self.record_size), dtype=self.dtype)
         self._times = zeros(self.num_duration)
         self.current_time_index = 0
         self.has_looped = False
@@ -34,7 +34,9 @@
 #
 import copy
 import gc
+import heapq
 import magic
+import sys
 import time
 from collections import defaultdict
 from itertools import chain
@@ -42,12 +44,19 @@ from operator import isSequenceType
 from inspect import *
  
 from brian.base import *
+from brian.checkpoint import save_checkpoint, load_checkpoint
 from brian.clock import guess_clock, Clock
 from brian.connections import *
 from brian.globalprefs import *
+from brian.memoryusage import NetworkMemoryUsage
 from brian.neurongroup import NeuronGroup
+from brian.networkprofiler import NetworkProfile
+from brian.reset import NoReset
+from brian.stateupdater import LazyStateUpdater
+from brian.threshold import NoThreshold
 from brian.units import second
 from brian.utils.progressreporting import *
+from brian.utils.threadpool import ThreadPool
 
 '''
 Network class
@@ -58,6 +67,138 @@ __all__ = ['Network', 'MagicNetwork', 'NetworkOperation', 'network_operation', '
 
 globally_stopped = False
 
+set_global_preferences(usefusedschedule=False)
+define_global_preference('usefusedschedule', 'False',
+                         desc='''
+                              Whether or not :meth:`Network.prepare` should
+                              compile the update schedule of each clock into a
+                              single fused step function. The fused function
+                              resolves all methods in advance, drops entries
+                              that do nothing (e.g. :class:`NoReset`) and runs
+                              several time steps per call, which reduces the
+                              per-step overhead of networks with many small
+                              objects. Note that the objects' state updaters,
+                              thresholds and resets are resolved when the
+                              network is prepared, so if you replace them
+                              afterwards you should call ``prepare()`` again.
+                              ''')
+set_global_preferences(useblockupdates=False, blockupdatesteps=16)
+define_global_preference('useblockupdates', 'False',
+                         desc='''
+                              Whether or not :meth:`Network.prepare` should
+                              advance the groups that receive no input, or
+                              only input delayed by several time steps,
+                              several time steps at once (see
+                              :meth:`Network._build_block_schedule`).
+                              ''')
+define_global_preference('blockupdatesteps', '16',
+                         desc='''
+                              The maximum number of time steps by which a
+                              group is advanced at once when
+                              ``useblockupdates`` is set.
+                              ''')
+set_global_preferences(usefusedresets=False)
+define_global_preference('usefusedresets', 'False',
+                         desc='''
+                              Whether or not :meth:`Network.prepare` should
+                              compute the threshold, refractoriness and reset
+                              of the groups in a single pass in their update
+                              step when this does not change the results (see
+                              :meth:`Network._build_threshold_reset_schedule`).
+                              ''')
+
+
+class GroupBlockUpdater(object):
+    '''
+    Advances a group several time steps at once
+    
+    Called at every time step in place of the ``update()`` and ``reset()``
+    methods of the group and of the propagation of its incoming connections
+    (see :meth:`Network._build_block_schedule`). Every ``steps`` time steps
+    (or fewer at the end of a run), it runs these for the next time steps
+    in an inner loop, ticking the clock and setting it back afterwards. In
+    between, it only counts down ``group._lead``, the number of time steps
+    the group is ahead of its clock, which :meth:`NeuronGroup.get_spikes`
+    takes into account so that the spikes are seen at the right time by the
+    rest of the network.
+    
+    ``inputs`` is a list of triples ``(C, delay, slope)``: at the ``j``-th
+    step of the inner loop, ``C`` propagates the spikes
+    ``C.source.get_spikes(delay - slope * j)``.
+    '''
+    def __init__(self, group, steps, inputs):
+        self.group = group
+        self.steps = steps
+        self.inputs = inputs
+
+    def __call__(self):
+        G = self.group
+        if G._lead:
+            G._lead -= 1
+            return
+        clock = G.clock
+        steps = min(self.steps, clock.remaining_steps())
+        state = clock.get_state()
+        update, reset, inputs = G.update, G.reset, self.inputs
+        for j in xrange(steps):
+            update()
+            for C, delay, slope in inputs:
+                C.propagate(C.source.get_spikes(delay - slope * j))
+            reset()
+            clock.tick()
+        clock.set_state(state)
+        G._lead = steps - 1
+
+    def __repr__(self):
+        return '<GroupBlockUpdater of %s, %d steps>' % (str(self.group), self.steps)
+
+
+class MultiClockScheduler(object):
+    '''
+    Priority queue of clocks used by :meth:`Network.run` with several clocks
+    
+    Initialised with a list of clocks. The clocks are kept in a heap keyed by
+    their current time, so that finding the clocks that are due does not
+    require scanning every clock. The method ``pop_due()`` removes and returns
+    the clocks whose time is equal (in the sense of :meth:`Clock.__lt__`, i.e.
+    up to the clock's ``epsilon``) to the earliest time, sorted by their
+    ``order`` attribute. After updating them, they should be given back with
+    ``push(clocks)``. Processing the returned clocks in sequence gives exactly
+    the same ordering as repeatedly taking ``min(clocks)``.
+    '''
+    def __init__(self, clocks):
+        # the index i breaks ties between equal keys, so that clocks are
+        # never compared directly
+        self._index = dict((id(clock), i) for i, clock in enumerate(clocks))
+        self._heap = [(clock._t, clock.order, i, clock) for i, clock in enumerate(clocks)]
+        heapq.heapify(self._heap)
+
+    def pop_due(self):
+        heap = self._heap
+        entry = heapq.heappop(heap)
+        due = [entry]
+        t, clock = entry[0], entry[3]
+        tolerance = clock.epsilon * abs(t)
+        while heap and heap[0][0] - t <= tolerance:
+            due.append(heapq.heappop(heap))
+        if len(due) > 1:
+            due.sort(key=lambda entry: (entry[1], entry[2]))
+        return [entry[3] for entry in due]
+
+    def push(self, clocks):
+        index = self._index
+        heap = self._heap
+        for clock in clocks:
+            heapq.heappush(heap, (clock._t, clock.order, index[id(clock)], clock))
+
+    def first(self):
+        '''
+        Returns the next clock without removing it from the queue.
+        '''
+        due = self.pop_due()
+        self.push(due)
+        return due[0]
+
 
 class Network(object):
     '''
@@ -96,10 +237,11 @@ class Network(object):
         as initialisation.
     ``remove(...)``
         Remove objects from the Network.
-    ``run(duration[, report[, report_period]])``
+    ``run(duration[, threads[, report[, report_period]]])``
         Runs the network for the given duration. See below for details about
         what happens when you do this. See documentation for :func:`run` for
-        an explanation of the ``report`` and ``report_period`` keywords.
+        an explanation of the ``threads``, ``report`` and ``report_period``
+        keywords.
     ``reinit(states=True)``
         Reinitialises the network, runs each object's ``reinit()`` and each
         clock's ``reinit()`` method (resetting them to 0). If ``states=False``
@@ -137,6 +279,9 @@ class Network(object):
     ``update()`` method, the clock is advanced by one tick, and if
     multiple clocks are being used, the next clock is determined (this
     is the clock whose value of ``t`` is minimal amongst all the clocks).
+    With multiple clocks, the clocks are kept in a priority queue (see
+    :class:`MultiClockScheduler`), and all clocks that are due at the same
+    time are taken from the queue together and updated in turn.
     For example, if you had two clocks in operation, say ``clock1`` with
     ``dt=3*ms`` and ``clock2`` with ``dt=5*ms`` then this will happen:
     
@@ -189,6 +334,32 @@ class Network(object):
     schedule with the ``set_update_schedule`` method (see that method's API documentation for
     details). This might be useful for example if you have a sequence of network
     operations which need to be run in a given order.    
+    
+    **Fused update schedules**
+    
+    For networks with many small objects, the Python overhead of going
+    through the update schedule can dominate the numerical work. Calling
+    ``prepare(fused=True)`` (or setting the global preference
+    ``usefusedschedule``) compiles the schedule of each clock into a single
+    function that runs many time steps per call, see
+    :meth:`_build_fused_schedule`. This is only used for networks with a
+    single :class:`Clock`.
+    
+    **Block updates**
+    
+    Groups that receive no input, or only input delayed by at least a few
+    time steps, can be advanced several time steps at once without going
+    through the rest of the update schedule. Calling ``prepare(blocks=True)``
+    (or setting the global preference ``useblockupdates``) detects these
+    groups, see :meth:`_build_block_schedule`.
+    
+    **Fused resets**
+    
+    Calling ``prepare(fusedresets=True)`` (or setting the global preference
+    ``usefusedresets``) moves the resets of the groups to their update step,
+    where the threshold, refractoriness and reset are computed in a single
+    pass over the neurons, when nothing in between reads or modifies the
+    variables involved, see :meth:`_build_threshold_reset_schedule`.
     '''
 
     operations = property(fget=lambda self:self._all_operations)
@@ -200,8 +371,15 @@ class Network(object):
         # The following dict keeps a copy of which operations are in which slot
         self._operations_dict = defaultdict(list)
         self._all_operations = []
+        self._use_fused = False
+        self._use_blocks = False
+        self._use_fused_resets = False
+        self._fused_schedule = {}
+        self._threaded_schedule = {}
+        self._thread_pool = None
         self.update_schedule_standard()
         self.prepared = False
+        self.stopped = False
         self._added_objects = []
         for o in chain(args, kwds.itervalues()):
             self.add(o)
@@ -310,15 +488,31 @@ class Network(object):
                 else:
                     P.reinit()
 
-    def prepare(self):
+    def prepare(self, fused=None, blocks=None, fusedresets=None):
         '''
         Prepares the network for simulation:
         + Checks the clocks of the neuron groups
         + Gather connections with identical subgroups
         + Compresses the connection matrices for faster simulation
+        + Optionally compiles a fused step function for each clock
         Calling this function is not mandatory but speeds up the simulation.
+        
+        If ``fused`` is ``None``, the global preference ``usefusedschedule``
+        decides whether fused step functions are built (see
+        :meth:`_build_fused_schedule`). Similarly, ``blocks`` (or the global
+        preference ``useblockupdates``) decides whether groups are advanced
+        several steps at once when possible (see :meth:`_build_block_schedule`),
+        and ``fusedresets`` (or the global preference ``usefusedresets``)
+        whether resets are done in the update step of the groups (see
+        :meth:`_build_threshold_reset_schedule`).
         '''
         self.unprepare()
+        if fused is None:
+            fused = get_global_preference('usefusedschedule')
+        if blocks is None:
+            blocks = get_global_preference('useblockupdates')
+        if fusedresets is None:
+            fusedresets = get_global_preference('usefusedresets')
         # Set the clock
         if self.same_clocks():
             self.set_clock()
@@ -351,6 +545,11 @@ class Network(object):
             if hasattr(N,'compress'):
                 N.compress()
 
+        # Event-driven groups find the objects which modify their state
+        for N in self.groups:
+            if hasattr(N, 'set_inputs'):
+                N.set_inputs(self)
+
         # Experimental support for new propagation code
         if get_global_preference('usenewpropagate') and get_global_preference('useweave'):
             from experimental.new_c_propagate import make_new_connection
@@ -358,6 +557,9 @@ class Network(object):
                 make_new_connection(C)
 
         # build operations list for each clock
+        self._use_fused = fused
+        self._use_blocks = blocks
+        self._use_fused_resets = fusedresets
         self._build_update_schedule()
 
         self.prepared = True
@@ -512,78 +714,572 @@ class Network(object):
                     useclockset = clockset
                 for clock in useclockset:
                     self._update_schedule[id(clock)].append(f)
+        for G in self.groups:
+            if '_threshold_reset' in G.__dict__:
+                del G._threshold_reset
+        if getattr(self, '_use_fused_resets', False):
+            self._build_threshold_reset_schedule()
+        if getattr(self, '_use_blocks', False):
+            self._build_block_schedule()
+        self._fused_schedule = {}
+        if getattr(self, '_use_fused', False):
+            self._build_fused_schedule()
+        self._build_threaded_schedule()
+
+    def _build_block_schedule(self):
+        '''
+        Advances the groups whose inputs are known in advance in blocks
+        
+        A group can be updated ``n`` time steps in advance if nothing reads
+        or modifies its state in the meantime, and if its inputs during
+        these steps are already known. This is the case for groups with the
+        standard ``update()`` and ``reset()`` methods, whose incoming
+        connections are all plain :class:`Connection` objects with delays of
+        at least ``n`` time steps (except connections from the group to
+        itself) or which have no incoming connections at all, if they are
+        not modified by :class:`Synapses` or :class:`DelayConnection`
+        objects, not recorded by a :class:`StateMonitor`, and if their state
+        is not read by their outgoing connections (``modulation``,
+        :class:`StateSpikeMonitor`). Other network operations can read or
+        modify any state, so groups are only advanced in blocks in networks
+        without them, and with a single clock. ``n`` is at most the global
+        preference ``blockupdatesteps``.
+        
+        Each of these groups is updated by a :class:`GroupBlockUpdater`,
+        inserted before the group updates, which replaces the update and reset
+        of the group and the propagation of its incoming connections. The
+        spike container of the group is enlarged so that it can hold ``n``
+        more time steps, note that this loses the previous spikes.
+        '''
+        if hasattr(self, 'clocks') or self.clock.remaining_steps() is None:
+            return
+        maxsteps = int(get_global_preference('blockupdatesteps'))
+        if maxsteps < 2:
+            return
+        neurongroup_update = NeuronGroup.update.im_func
+        neurongroup_reset = NeuronGroup.reset.im_func
+        connection_propagate = Connection.do_propagate.im_func
+        connections = []
+        for C in self.connections:
+            if isinstance(C, MultiConnection):
+                connections.extend(C.connections)
+            else:
+                connections.append(C)
+        excluded = set()
+        # StateMonitor and DelayConnection operations only concern one group
+        delayed_propagates = dict((id(C.delayed_propagate), C.target._owner) for C in connections
+                                  if hasattr(C, 'delayed_propagate'))
+        for op in self.operations:
+            if isinstance(getattr(op, 'P', None), NeuronGroup) and hasattr(op, 'varname'):
+                excluded.add(id(op.P._owner))
+            elif id(op) in delayed_propagates:
+                excluded.add(id(delayed_propagates[id(op)]))
+            else:
+                return
+        incoming = defaultdict(list)
+        for C in connections:
+            if getattr(C, '_nstate_mod', None) is not None or getattr(C, '_reads_source_state', False):
+                excluded.add(id(C.source._owner))
+            if getattr(C, 'target', None) is not None:
+                if type(C) is Connection:
+                    incoming[id(C.target._owner)].append(C)
+                else:
+                    excluded.add(id(C.target._owner))
+        for G in self.groups:
+            if hasattr(G, 'presynaptic'):
+                # Synapses
+                excluded.add(id(G))
+                excluded.add(id(G.target._owner))
+        updaters = []
+        blockgroups = set()
+        removed = set()
+        for G in self.groups:
+            if (id(G) in excluded or G._owner is not G or
+                    type(G).update.im_func is not neurongroup_update or
+                    type(G).reset.im_func is not neurongroup_reset):
+                continue
+            steps = maxsteps
+            for C in incoming[id(G)]:
+                if C.source._owner is not G:
+                    steps = min(steps, C.delay)
+            if steps < 2:
+                continue
+            # spikes at inner step j, at time t+j: t+j-delay
+            inputs = []
+            for C in incoming[id(G)]:
+                source = C.source._owner
+                if source is G:
+                    inputs.append((C, C.delay, 0))
+                elif id(source) in blockgroups:
+                    # already updated for the current time step
+                    inputs.append((C, C.delay, 1))
+                else:
+                    inputs.append((C, C.delay - 1, 1))
+                removed.add(id(C))
+            if steps > G._block_capacity:
+                G.set_max_delay((G._max_delay + steps - G._block_capacity) * G.clock.dt)
+                G._block_capacity = steps
+            blockgroups.add(id(G))
+            updaters.append(GroupBlockUpdater(G, steps, inputs))
+        if not updaters:
+            return
+        schedule = []
+        for f in self._update_schedule[id(self.clock)]:
+            obj = getattr(f, 'im_self', None)
+            fun = getattr(f, 'im_func', None)
+            if updaters and (fun is neurongroup_update or id(obj) in blockgroups):
+                schedule.extend(updaters)
+                updaters = []
+            if fun in (neurongroup_update, neurongroup_reset) and id(obj) in blockgroups:
+                continue
+            if fun is connection_propagate:
+                if isinstance(obj, MultiConnection):
+                    kept = [C for C in obj.connections if id(C) not in removed]
+                    if not kept:
+                        continue
+                    if len(kept) < len(obj.connections):
+                        f = MultiConnection(obj.source, kept).do_propagate
+                elif id(obj) in removed:
+                    continue
+            schedule.append(f)
+        self._update_schedule[id(self.clock)] = updaters + schedule
+
+    def _build_threshold_reset_schedule(self):
+        '''
+        Does the resets of the groups in their update step
+        
+        The threshold, refractoriness and reset of a group can be computed in
+        a single pass over the neurons, by a
+        :class:`~brian.thresholdreset.FusedThresholdReset` kernel, if the
+        group has the standard ``update()`` and ``reset()`` methods, a
+        supported threshold and reset (see
+        :func:`~brian.thresholdreset.fused_threshold_reset`), and if nothing
+        between its update and its reset in the update schedule reads the
+        variables that the reset reads or modifies, or modifies them. Such
+        entries are the updates and resets of other groups, the propagation
+        of plain connections (:class:`Connection`, :class:`DelayConnection`)
+        to other target variables and without ``modulation`` by the group,
+        of :class:`SpikeMonitor` objects of Brian without a custom function
+        (except :class:`StateSpikeMonitor` of the group) and of STDP, and
+        :class:`StateMonitor` operations of other groups. Groups modified by
+        :class:`Synapses` objects, or whose state they read, are not
+        considered.
+        
+        The kernel is stored in the ``_threshold_reset`` attribute of the
+        group, which :meth:`NeuronGroup.update` uses in place of the
+        threshold, and the reset is removed from the schedule.
+        '''
+        from brian.monitor import SpikeMonitor
+        from brian.stdp import STDP
+        from brian.thresholdreset import fused_threshold_reset
+        neurongroup_update = NeuronGroup.update.im_func
+        neurongroup_reset = NeuronGroup.reset.im_func
+        connections = []
+        for C in self.connections:
+            if isinstance(C, MultiConnection):
+                connections.extend(C.connections)
+            else:
+                connections.append(C)
+        delayed_propagates = dict((id(C.delayed_propagate), C) for C in connections
+                                  if hasattr(C, 'delayed_propagate'))
+        excluded = set()
+        for G in self.groups:
+            if hasattr(G, 'presynaptic'):
+                # Synapses
+                excluded.update([id(G), id(G.source._owner), id(G.target._owner)])
+
+        def independent(f, G, variables):
+            # whether the schedule entry f does not read or modify the state
+            # variables (indexes) of G
+            obj = getattr(f, 'im_self', None)
+            fun = getattr(f, 'im_func', None)
+            if fun in (neurongroup_update, neurongroup_reset):
+                return obj is not G
+            if isinstance(obj, Connection) and fun.__name__ == 'do_propagate':
+                if isinstance(obj, MultiConnection):
+                    objs = obj.connections
+                else:
+                    objs = [obj]
+                for C in objs:
+                    if isinstance(C, SpikeMonitor):
+                        if (getattr(C, 'custom_function', False) or
+                                type(C).__module__ not in ('brian.monitor', 'brian.stdp')):
+                            return False
+                    elif not type(C).__module__.startswith('brian.connections'):
+                        return False
+                    elif C.target._owner is G and C.nstate in variables:
+                        return False
+                    if C.source._owner is G and (getattr(C, '_nstate_mod', None) is not None or
+                                                 getattr(C, '_reads_source_state', False)):
+                        return False
+                return True
+            if isinstance(getattr(f, 'P', None), NeuronGroup) and hasattr(f, 'varname'):
+                # StateMonitor
+                return f.P._owner is not G
+            if id(f) in delayed_propagates:
+                C = delayed_propagates[id(f)]
+                return C.target._owner is not G or C.nstate not in variables
+            return type(f) is STDP
+
+        for clock_id, schedule in self._update_schedule.items():
+            position = {}
+            for i, f in enumerate(schedule):
+                fun = getattr(f, 'im_func', None)
+                if fun in (neurongroup_update, neurongroup_reset):
+                    position[id(f.im_self), fun] = i
+            fused = set()
+            for G in self.groups:
+                start = position.get((id(G), neurongroup_update))
+                end = position.get((id(G), neurongroup_reset))
+                if (start is None or end is None or start > end or id(G) in excluded or
+                        G._owner is not G or not G._spiking or
+                        type(G).update.im_func is not neurongroup_update or
+                        type(G).reset.im_func is not neurongroup_reset):
+                    continue
+                kernel = fused_threshold_reset(G)
+                if kernel is None:
+                    continue
+                if all(independent(f, G, kernel.reset_variables) for f in schedule[start + 1:end]):
+                    G._threshold_reset = kernel
+                    fused.add(id(G))
+            self._update_schedule[clock_id] = [f for f in schedule
+                                               if not (getattr(f, 'im_func', None) is neurongroup_reset and
+                                                       id(f.im_self) in fused)]
+
+    def _build_threaded_schedule(self):
+        '''
+        Groups the update schedule of each clock into parallel stages
+        
+        self._threaded_schedule[id(clock)] is a list in which each item is
+        either a function, called as in the standard schedule, or a list of
+        functions that are independent of each other and can be run
+        concurrently by :meth:`update_threaded`. These are consecutive
+        ``update()`` or ``reset()`` calls of different groups (not overridden
+        by a subclass of :class:`NeuronGroup`, and not :class:`Synapses` which
+        modify their target groups). Everything else, in particular spike
+        propagation, runs on its own after all the functions of the previous
+        stage have returned.
+        '''
+        parallel_funcs = (NeuronGroup.update.im_func, NeuronGroup.reset.im_func)
+        self._threaded_schedule = {}
+        for clock_id, schedule in self._update_schedule.iteritems():
+            stages = []
+            for f in schedule:
+                obj = getattr(f, 'im_self', None)
+                if (getattr(f, 'im_func', None) in parallel_funcs and
+                        not hasattr(obj, 'presynaptic')):
+                    if (stages and isinstance(stages[-1], list) and
+                            stages[-1][-1].im_func is f.im_func):
+                        stages[-1].append(f)
+                    else:
+                        stages.append([f])
+                else:
+                    stages.append(f)
+            # a stage with a single function doesn't need the threads
+            self._threaded_schedule[clock_id] = [stage[0] if isinstance(stage, list) and len(stage) == 1
+                                                 else stage for stage in stages]
+
+    def _build_fused_schedule(self):
+        '''
+        Compiles the update schedule of each clock into a fused step function
+        
+        For each clock, self._fused_schedule[id(clock)] is a function
+        ``step(n)`` which runs the update schedule of that clock followed by
+        a clock tick ``n`` times, and returns the number of steps actually
+        done (fewer than ``n`` if the network was stopped). The generated
+        code calls pre-resolved functions stored in local variables instead of
+        iterating over self._update_schedule, and leaves out the entries that
+        do nothing: groups without threshold call their state updater
+        directly (or nothing at all for a :class:`LazyStateUpdater`), resets
+        of groups with :class:`NoReset` are dropped, and so are network
+        operations without a function.
+        '''
+        neurongroup_update = NeuronGroup.update.im_func
+        neurongroup_reset = NeuronGroup.reset.im_func
+        if hasattr(self, 'clocks'):
+            clocks = self.clocks
+        else:
+            clocks = [self.clock]
+        for clock in clocks:
+            ns = {'_xrange': xrange,
+                  '_tick': clock.tick,
+                  '_net': self,
+                  '_network_module': sys.modules[__name__]}
+            body = []
+            has_operations = False
+            for i, f in enumerate(self._update_schedule[id(clock)]):
+                fname, argname = '_f%d' % i, '_a%d' % i
+                func, arg = f, None
+                obj = getattr(f, 'im_self', None)
+                fun = getattr(f, 'im_func', None)
+                if fun is neurongroup_update and (not obj._spiking or
+                                                  isinstance(obj._threshold, NoThreshold)):
+                    if type(obj._state_updater) is LazyStateUpdater:
+                        continue
+                    func, arg = obj._state_updater, obj
+                elif fun is neurongroup_reset:
+                    if isinstance(obj._resetfun, NoReset):
+                        continue
+                    func, arg = obj._resetfun, obj
+                elif isinstance(f, NetworkOperation):
+                    has_operations = True
+                    if type(f) is NetworkOperation:
+                        if getattr(f, 'function', None) is None:
+                            continue
+                        if hasattr(f, '_has_arg'):
+                            func = f.function
+                            if f._has_arg:
+                                arg = f.clock
+                    else:
+                        func = f.__call__
+                ns[fname] = func
+                if arg is None:
+                    body.append('%s()' % fname)
+                else:
+                    ns[argname] = arg
+                    body.append('%s(%s)' % (fname, argname))
+            body.append('_tick()')
+            if has_operations:
+                # only network operations can call stop()
+                body.extend(['if _net.stopped or _network_module.globally_stopped:',
+                             '    return _i + 1'])
+            code = '\n'.join(['def _fused_step(_n):',
+                              '    for _i in _xrange(_n):'] +
+                             ['        ' + line for line in body] +
+                             ['    return _n'])
+            exec compile(code, 'fused_step', 'exec') in ns
+            self._fused_schedule[id(clock)] = ns['_fused_step']
 
     def update(self):
         for f in self._update_schedule[id(self.clock)]:
             f()
 
-    """
-    def update_threaded(self,queue):
+    def update_threaded(self):
         '''
-        EXPERIMENTAL (not useful for the moment)
         Parallel update of the network (using threads).
+        
+        Runs the stages of self._threaded_schedule for the current clock,
+        the functions of a parallel stage are distributed over the threads
+        of self._thread_pool and all of them have returned before the next
+        stage starts (see :meth:`_build_threaded_schedule`).
         '''
-        # Update groups: one group = one thread
-        for P in self.groups:
-            queue.put(P)
-        queue.join() # Wait until job is done
-
-        # The following is done serially
-        # Propagate spikes
-        for C in self.connections:
-            C.propagate(C.source.get_spikes(C.delay))
-            
-        # Miscellanous operations
-        for op in self.operations:
-            op()
-    """
+        run_parallel = self._thread_pool.run
+        for stage in self._threaded_schedule[id(self.clock)]:
+            if isinstance(stage, list):
+                run_parallel(stage)
+            else:
+                stage()
 
-    def run(self, duration, threads=1, report=None, report_period=10 * second):
+    def run(self, duration, threads=1, report=None, report_period=10 * second,
+            profile=False):
         '''
         Runs the simulation for the given duration.
+        
+        If ``threads>1``, the state updates, thresholds and resets of different
+        groups are run concurrently in a pool of ``threads`` threads (see
+        :meth:`update_threaded`), the other operations are run in sequence.
+        This is only worthwhile for large groups, since the speed improvement
+        comes from NumPy releasing the GIL in large array operations. Note
+        that random numbers are then drawn in an unpredictable order, so
+        results with noise are not reproducible with a given seed.
+        
+        If ``profile=True``, each function of the update schedule is timed
+        and the method returns a :class:`NetworkProfile` with the time and
+        number of calls of each, and the number of spikes and synaptic
+        events propagated by connections and synapses (see
+        :meth:`_run_profiled`).
         '''
+        if profile:
+            return self._run_profiled(duration, threads, report, report_period)
         global globally_stopped
         self.stopped = False
         globally_stopped = False
         if not self.prepared:
             self.prepare()
-        self.clock.set_duration(duration)
+        if threads > 1:
+            self._thread_pool = ThreadPool(threads - 1)
+            update = self.update_threaded
+        else:
+            update = self.update
         try:
-            for c in self.clocks:
-                c.set_duration(duration)
-        except AttributeError:
-            pass
-        if report is not None:
-            start_time = time.time()
-            if not isinstance(report, ProgressReporter):
-                report = ProgressReporter(report, report_period)
-                next_report_time = start_time + float(report_period)
-            else:
-                report_period = report.period
-                next_report_time = report.next_report_time
+            self.clock.set_duration(duration)
+            try:
+                for c in self.clocks:
+                    c.set_duration(duration)
+            except AttributeError:
+                pass
+            next_report_time = None
+            if report is not None:
+                start_time = time.time()
+                if not isinstance(report, ProgressReporter):
+                    report = ProgressReporter(report, report_period)
+                    next_report_time = start_time + float(report_period)
+                else:
+                    report_period = report.period
+                    next_report_time = report.next_report_time
+
+            if self.clock.still_running() and not self.stopped and not globally_stopped:
+                not_same_clocks = not self.same_clocks()
+                clk = self.clock
+                fused_step = None
+                if not not_same_clocks and threads <= 1 and clk.remaining_steps() is not None:
+                    fused_step = self._fused_schedule.get(id(clk), None)
+                if not_same_clocks:
+                    self._run_many_clocks(update, duration, report, report_period, next_report_time)
+                elif fused_step is not None:
+                    # With progress reports, the number of steps per call is
+                    # doubled until a call takes a tenth of the report period
+                    if report is None:
+                        block = None
+                    else:
+                        block = 1
+                    while clk.still_running() and not self.stopped and not globally_stopped:
+                        if block is None:
+                            fused_step(clk.remaining_steps())
+                        else:
+                            block_start = time.time()
+                            fused_step(min(block, clk.remaining_steps()))
+                            cur_time = time.time()
+                            if cur_time - block_start < 0.1 * float(report_period):
+                                block *= 2
+                            if cur_time > next_report_time:
+                                next_report_time = cur_time + float(report_period)
+                                report.update((self.clock.t - self.clock.start) / duration)
+                else:
+                    while clk.still_running() and not self.stopped and not globally_stopped:
+                        if report is not None:
+                            cur_time = time.time()
+                            if cur_time > next_report_time:
+                                next_report_time = cur_time + float(report_period)
+                                report.update((self.clock.t - self.clock.start) / duration)
+                        update()
+                        clk.tick()
+            if report is not None:
+                report.update(1.0)
+        finally:
+            # the worker threads are stopped at the end of each run, so that
+            # no daemon threads are left when the interpreter shuts down
+            if self._thread_pool is not None:
+                self._thread_pool.close()
+                self._thread_pool = None
+
+    def _run_profiled(self, duration, threads, report, report_period):
+        '''
+        Runs the simulation with a timed copy of the update schedule
+        
+        The schedule used by :meth:`run` (the threaded schedule if
+        ``threads>1``, the standard one otherwise) is temporarily replaced
+        by timed versions of its functions, and the fused step functions are
+        not used. Returns the :class:`NetworkProfile`, which is also stored
+        in ``self.last_profile``.
+        '''
+        if not self.prepared:
+            self.prepare()
+        profiler = NetworkProfile()
+        if hasattr(self, 'clocks'):
+            clocks = self.clocks
+        else:
+            clocks = [self.clock]
+        if threads > 1:
+            attribute = '_threaded_schedule'
+        else:
+            attribute = '_update_schedule'
+        schedule = getattr(self, attribute)
+        fused_schedule = self._fused_schedule
+        setattr(self, attribute, dict((id(clock), profiler.wrap_schedule(schedule[id(clock)], clock))
+                                      for clock in clocks))
+        self._fused_schedule = {}
+        start_time = time.time()
+        try:
+            self.run(duration, threads=threads, report=report,
+                     report_period=report_period)
+        finally:
+            profiler.total_time = time.time() - start_time
+            setattr(self, attribute, schedule)
+            self._fused_schedule = fused_schedule
+        self.last_profile = profiler
+        return profiler
 
-        if self.clock.still_running() and not self.stopped and not globally_stopped:
-            not_same_clocks = not self.same_clocks()
-            clk = self.clock
-            while clk.still_running() and not self.stopped and not globally_stopped:
+    def _run_many_clocks(self, update, duration, report, report_period, next_report_time):
+        '''
+        Main loop of :meth:`run` for networks with several clocks
+        
+        The clocks that are due are taken from a :class:`MultiClockScheduler`
+        in batches and each is updated (with ``update``, or its fused step
+        function if there is one) and ticked in turn. Stops as soon as the next clock in
+        sequence has finished running, and leaves ``self.clock`` pointing
+        to that clock, as the standard loop does.
+        '''
+        scheduler = MultiClockScheduler(self.clocks)
+        if update == self.update:
+            fused_schedule = self._fused_schedule
+        else:
+            fused_schedule = {}
+        running = True
+        while running:
+            due = scheduler.pop_due()
+            for i, clk in enumerate(due):
+                if not clk.still_running() or self.stopped or globally_stopped:
+                    running = False
+                    break
+                self.clock = clk
                 if report is not None:
                     cur_time = time.time()
                     if cur_time > next_report_time:
                         next_report_time = cur_time + float(report_period)
-                        report.update((self.clock.t - self.clock.start) / duration)
-                self.update()
-                clk.tick()
-                if not_same_clocks:
-                    # Find the next clock to update
-                    #self.clock = min([(clock.t, id(clock), clock) for clock in self.clocks])[2]
-                    clk = self.clock = min(self.clocks)
-                    #heapq.heappush(self.clocks, self.clock)
-                    #clk = self.clock = heapq.heappop(self.clocks)
-                    #clk = self.clock = heapq.heappushpop(self.clocks, self.clock)
-                    #if not clk<self.clocks[0]:
-                    #    clk = self.clock = heapq.heapreplace(self.clocks, self.clock)
-        if report is not None:
-            report.update(1.0)
+                        report.update((clk.t - clk.start) / duration)
+                fused_step = fused_schedule.get(id(clk), None)
+                if fused_step is not None:
+                    fused_step(1)
+                else:
+                    update()
+                    clk.tick()
+            scheduler.push(due)
+        self.clock = scheduler.first()
+
+    def checkpoint(self, path):
+        '''
+        Saves the state of the network in the directory ``path``.
+        
+        The state variables of the groups, the connection matrices, the
+        recent spikes of the groups, the contents of the spike queues of
+        :class:`Synapses` and of the delay buffers of :class:`DelayConnection`
+        objects and the times of the clocks are written as raw ``.npy`` arrays,
+        with a small manifest, so that a long run can be stopped and resumed
+        later with :meth:`restore`. This is much faster than pickling the
+        network for large networks. Monitors are not saved. The network is
+        prepared first if necessary.
+        '''
+        if not self.prepared:
+            self.prepare()
+        save_checkpoint(self, path)
+
+    def restore(self, path):
+        '''
+        Restores the state of the network saved by :meth:`checkpoint`.
+        
+        The network must have been built in the same way as the saved one
+        (typically by the same script, creating the same objects in the same
+        order, with the same random connectivity), only its state is restored.
+        The arrays are memory mapped and copied in place, raises
+        ``ValueError`` if they do not match the network.
+        '''
+        if not self.prepared:
+            self.prepare()
+        load_checkpoint(self, path)
+        if hasattr(self, 'clocks'):
+            self.clock = MultiClockScheduler(self.clocks).first()
+
+    def memory_usage(self):
+        '''
+        Returns a :class:`NetworkMemoryUsage` object giving the number of
+        bytes held by each group, connection, synapse set, monitor and
+        operation of the network, broken down by internal buffer (state
+        matrices, connection matrices, spike containers, spike queues, delay
+        buffers, recorded values...). ``print net.memory_usage()`` shows it
+        as a table.
+        '''
+        return NetworkMemoryUsage(self)
 
     def stop(self):
         '''
@@ -621,11 +1317,7 @@ class Network(object):
         self.clock points to the current clock between considered.
         '''
         self.clocks = list(set([obj.clock for obj in self.groups + self.operations]))
-        #self.clocks.sort(key=lambda c:-c._dt)
-        #heapq.heapify(self.clocks)
-        #self.clock = min([(clock.t, clock) for clock in self.clocks])[1]
-        self.clock = min(self.clocks)
-        #self.clock = heapq.heappop(self.clocks)
+        self.clock = MultiClockScheduler(self.clocks).first()
 
     def __len__(self):
         '''
@@ -676,6 +1368,9 @@ class Network(object):
         net = copy.copy(self) # we make a copy because after returning from this function we can't restore the class
         self.__class__ = oldclass # restore the class of the original, which is now back in its original state
         net._update_schedule = None # remove the problematic element from the copy
+        net._fused_schedule = None # same for the fused step functions
+        net._threaded_schedule = None # ... and the threaded schedule
+        net._thread_pool = None # threads can't be pickled but will be recreated
         return (unpickle_network, (oldclass, net)) # the unpickle_network function called with arguments oldclass, net restores it as it was
 
 # This class just used as a general 'heap' class - has no methods but can have attributes
@@ -898,7 +1593,8 @@ class MagicNetwork(Network):
         Network.__init__(self, list(set(groups)), list(set(connections)), list(set(operations)))
 
 
-def run(duration, threads=1, report=None, report_period=10 * second):
+def run(duration, threads=1, report=None, report_period=10 * second,
+        profile=False):
     '''
     Run a network created from any suitable objects that can be found
     
@@ -906,6 +1602,9 @@ def run(duration, threads=1, report=None, report_period=10 * second):
     
     ``duration``
         the length of time to run the network for.
+    ``threads``
+        The number of threads used to update independent groups
+        concurrently, see :meth:`Network.run`.
     ``report``
         How to report progress, the default ``None`` doesn't report the
         progress. Some standard values for ``report``:
@@ -928,14 +1627,19 @@ def run(duration, threads=1, report=None, report_period=10 * second):
         reporting that the computation is finished.
     ``report_period``
         How often the progress is reported (by default, every 10s).
+    ``profile``
+        Set to ``True`` to time each object of the update schedule, the
+        function then returns a :class:`NetworkProfile` (see
+        :meth:`Network.run`).
     
     Works by constructing a :class:`MagicNetwork` object from all the suitable
     objects that could be found (:class:`NeuronGroup`, :class:`Connection`, etc.) and
     then running that network. Not suitable for repeated runs or situations
     in which you need precise control.
     '''
-    MagicNetwork(verbose=False, level=2).run(duration, threads=threads,
-                                            report=report, report_period=report_period)
+    return MagicNetwork(verbose=False, level=2).run(duration, threads=threads,
+                                                   report=report, report_period=report_period,
+                                                   profile=profile)
 
 
 def reinit(states=True):
@@ -0,0 +1,278 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+"""
+Per-object profiling of the update schedule of a :class:`Network`
+"""
+from timeit import default_timer
+from numpy import array, asarray, zeros
+from brian.connections import Connection, DelayConnection
+
+__all__ = ['NetworkProfile']
+
+timer = default_timer
+
+
+class ProfileEntry(object):
+    '''
+    Statistics of one entry of the update schedule
+    
+    ``obj`` is the object whose method ``method`` is called on clock
+    ``clock``, ``calls`` and ``time`` are the number of calls and the total
+    wall time spent in them. For connections (including monitors) and
+    synapses, ``spikes`` is the number of presynaptic spikes propagated and
+    ``synaptic_events`` the number of synapses they reached (``None`` if
+    not applicable).
+    '''
+    def __init__(self, obj, method, clock):
+        self.obj = obj
+        self.method = method
+        self.clock = clock
+        self.calls = 0
+        self.time = 0.0
+        self.spikes = None
+        self.synaptic_events = None
+
+    @property
+    def name(self):
+        function = getattr(self.obj, 'function', None)
+        if hasattr(function, '__name__'):
+            # network operations
+            return '%s %s' % (self.obj.__class__.__name__, function.__name__)
+        return '%s.%s' % (str(self.obj), self.method)
+
+    def as_dict(self):
+        return {'object': self.obj,
+                'name': self.name,
+                'method': self.method,
+                'clock': self.clock,
+                'calls': self.calls,
+                'time': self.time,
+                'spikes': self.spikes,
+                'synaptic_events': self.synaptic_events}
+
+
+def _row_sizes(W):
+    '''
+    Returns the array of the number of synapses in each row of the
+    connection matrix W, or None if it cannot be determined.
+    '''
+    if W is None:
+        return None
+    if hasattr(W, 'rowj'):
+        return array([len(j) for j in W.rowj], dtype=int)
+    if hasattr(W, 'shape') and len(W.shape) == 2:
+        sizes = zeros(W.shape[0], dtype=int)
+        sizes[:] = W.shape[1]
+        return sizes
+    return None
+
+
+def _connection_row_sizes(C):
+    '''
+    Returns the array of the number of synapses reached by a spike of each
+    source neuron of C, summed over the connections of a MultiConnection,
+    or None if there are no synapses (monitors).
+    '''
+    if hasattr(C, 'connections'):
+        sizes = [_row_sizes(getattr(c, 'W', None)) for c in C.connections]
+        sizes = [size for size in sizes if size is not None]
+        if not sizes:
+            return None
+        return sum(sizes)
+    return _row_sizes(getattr(C, 'W', None))
+
+
+class NetworkProfile(object):
+    '''
+    Wall time and call counts of the update schedule of a :class:`Network`
+    
+    Returned by ``Network.run(duration, profile=True)`` (and by the
+    :func:`run` function). Each function of the update schedule is timed
+    individually, and the propagation of spikes by :class:`Connection`
+    objects (including spike monitors) and the synaptic events processed by
+    :class:`Synapses` objects are counted. The profile of a network with
+    several clocks has one entry for each clock of each object. Note that
+    :meth:`Network.prepare` merges the connections with the same source and
+    delay into a single ``MultiConnection`` entry.
+    
+    **Attributes**
+    
+    ``entries``
+        The list of :class:`ProfileEntry` objects, in schedule order, with
+        attributes ``obj``, ``method``, ``clock``, ``calls``, ``time``,
+        ``spikes`` and ``synaptic_events``.
+    ``total_time``
+        The wall time of the whole run (including the loop overheads).
+    
+    **Methods**
+    
+    .. method:: report([sort=True])
+    
+        Returns the entries as a list of dictionaries, sorted by decreasing
+        time if ``sort=True``.
+    
+    .. method:: table([sort=True])
+    
+        Returns the report formatted as a table (also given by ``str()``).
+    
+    The timing adds a function call and two timer calls per entry and time
+    step, and the synaptic events of a :class:`Connection` are counted from
+    the number of synapses of each row at the start of the run (structural
+    changes during the run are not taken into account).
+    '''
+    def __init__(self):
+        self.entries = []
+        self.total_time = 0.0
+
+    def wrap_schedule(self, schedule, clock):
+        '''
+        Returns a copy of the list of functions ``schedule`` in which each
+        function is replaced by a timed version, and adds the corresponding
+        entries to the profile. Sublists (parallel stages of the threaded
+        schedule) are copied as lists.
+        '''
+        wrapped = []
+        for f in schedule:
+            if isinstance(f, list):
+                wrapped.append(self.wrap_schedule(f, clock))
+            else:
+                wrapped.append(self.wrap(f, clock))
+        return wrapped
+
+    def wrap(self, f, clock):
+        '''
+        Returns a timed version of the schedule function f.
+        '''
+        obj = getattr(f, 'im_self', None)
+        func = getattr(f, 'im_func', None)
+        if obj is None:
+            obj, method = f, '__call__'
+        else:
+            method = func.__name__
+        entry = ProfileEntry(obj, method, clock)
+        self.entries.append(entry)
+        if func is Connection.do_propagate.im_func or func is DelayConnection.do_propagate.im_func:
+            return self._wrap_propagate(f, obj, entry)
+        if method == 'update' and hasattr(obj, 'queues'):
+            # Synapses
+            return self._wrap_synapses(f, obj, entry)
+
+        def timed_f():
+            start = timer()
+            f()
+            entry.time += timer() - start
+            entry.calls += 1
+        return timed_f
+
+    def _wrap_propagate(self, f, C, entry):
+        # f is the connection's own do_propagate, so that the spikes are
+        # taken from the source exactly as in a run without profiling; they
+        # are counted by replacing C.propagate during the call
+        propagate = C.propagate
+        own_propagate = 'propagate' in C.__dict__
+        row_sizes = _connection_row_sizes(C)
+        entry.spikes = 0
+        if row_sizes is not None:
+            entry.synaptic_events = 0
+        received = []
+
+        def counted_propagate(spikes):
+            received.append(spikes)
+            propagate(spikes)
+
+        def timed_propagate():
+            start = timer()
+            C.propagate = counted_propagate
+            try:
+                f()
+            finally:
+                if own_propagate:
+                    C.propagate = propagate
+                else:
+                    del C.propagate
+            entry.time += timer() - start
+            entry.calls += 1
+            for spikes in received:
+                if len(spikes):
+                    entry.spikes += len(spikes)
+                    if row_sizes is not None:
+                        entry.synaptic_events += int(row_sizes[asarray(spikes, dtype=int)].sum())
+            del received[:]
+        return timed_propagate
+
+    def _wrap_synapses(self, f, S, entry):
+        queues = S.queues
+        entry.synaptic_events = 0
+
+        def timed_update():
+            start = timer()
+            events = 0
+            for queue in queues:
+                events += len(queue.peek())
+            f()
+            entry.time += timer() - start
+            entry.calls += 1
+            entry.synaptic_events += int(events)
+        return timed_update
+
+    def report(self, sort=True):
+        entries = [entry.as_dict() for entry in self.entries]
+        if sort:
+            entries.sort(key=lambda entry:-entry['time'])
+        return entries
+
+    def table(self, sort=True):
+        total = self.total_time
+        lines = ['%-50s %10s %10s %7s %10s %12s' % ('object', 'time (s)', 'calls',
+                                                     '%', 'spikes', 'syn. events')]
+        for entry in self.report(sort=sort):
+            if total > 0:
+                percent = '%7.2f' % (100.0 * entry['time'] / total)
+            else:
+                percent = '%7s' % '-'
+            spikes, events = entry['spikes'], entry['synaptic_events']
+            lines.append('%-50s %10.4f %10d %s %10s %12s' % (entry['name'][:50],
+                            entry['time'], entry['calls'], percent,
+                            '-' if spikes is None else spikes,
+                            '-' if events is None else events))
+        scheduled = sum(entry.time for entry in self.entries)
+        lines.append('Total: %.4f s, of which %.4f s in the schedule entries' % (total, scheduled))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.table()
+
+    def __repr__(self):
+        return '<NetworkProfile of %d entries, %.4f s>' % (len(self.entries), self.total_time)
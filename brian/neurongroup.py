@@ -39,10 +39,7 @@ Neuron groups
 __all__ = ['NeuronGroup', 'linked_var']
 
 from numpy import *
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from utils.kernelcache import weave
 from scipy import rand, linalg, random
 from numpy.random import exponential, randint
 import copy
@@ -173,6 +170,19 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         string, giving the name of a state variable in the group. In the case
         of these variable refractory periods, you should specify
         ``min_refractory`` (optional) and ``max_refractory`` (required).
+    ``refractory_mode='clamp'``
+        With ``'clamp'``, all the neurons are integrated at every time step
+        and the refractoriness (given by ``refractory`` or by a reset with a
+        period, e.g. :class:`Refractoriness` or :class:`CustomRefractoriness`)
+        holds the reset variable by setting it again after each update. With
+        ``'inactive'``, the group keeps the set of its refractory neurons,
+        updated from the spikes and the end of their refractory periods,
+        and the whole state of these neurons is held during their refractory
+        period: they are not integrated (the inputs they receive are added
+        to the held values). With linear equations, or nonlinear equations
+        integrated with the Euler method (without ``compile``), only the
+        other neurons are integrated when most of the group is refractory.
+        The refractory neurons are returned by :meth:`get_refractory_indices`.
     ``level=0``
         See :class:`Equations` for details.
     ``clock``
@@ -197,9 +207,34 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
     ``method=None``
         If not None, the integration method is forced. Possible values are
         linear, nonlinear, Euler, exponential_Euler (overrides implicit and order
-        keywords).
+        keywords), rush_larsen (Rush-Larsen method for conductance-based
+        models, with Euler or Runge-Kutta integration of the non-gating
+        variables depending on order), adaptive_RK (adaptive Runge-Kutta
+        method, see :class:`AdaptiveRKStateUpdater`). If None, the
+        variables of a linear subsystem of nonlinear equations (e.g.
+        synaptic conductances) are updated exactly, see
+        :class:`SplitStateUpdater`.
     ``unit_checking=True``
         Set to ``False`` to bypass unit-checking.
+    ``trials=1``
+        The number of independent copies (trials) of the group to simulate
+        at once, see below.
+    ``tabulate=None``
+        A dictionary ``{var: (xmin, xmax, n)}``: the subexpressions of the
+        differential equations that only depend on ``var`` and contain
+        function calls (e.g. the rate functions of ionic channels, depending
+        on the membrane potential) are replaced by tables of ``n`` points
+        between ``xmin`` and ``xmax`` with linear interpolation. The maximum
+        interpolation errors are logged (info level), see
+        :meth:`Equations.tabulate`.
+    ``dtype=None``
+        The floating point type of the state matrix, e.g. ``float32`` to
+        halve its memory footprint. If None, the global preference
+        ``defaultdtype`` is used (``float64`` by default). Connections,
+        synapses and monitors targeting the group use the same type by
+        default. The state updaters compute intermediate values in that type
+        too, except for matrix products and compiled C code (double
+        precision).
     
     **Methods**
     
@@ -218,6 +253,15 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
     
         Sets the neuron state values at rest for their differential
         equations.
+    
+    .. method:: trial(k)
+    
+        Returns the subgroup of the neurons of trial ``k``.
+    
+    .. method:: set_trial_values(var, values)
+    
+        Sets state variable ``var`` of each trial ``k`` to ``values[k]``,
+        which can be a single value or an array of the size of a trial.
 
     The following usages are also possible for a group ``G``:
     
@@ -245,22 +289,52 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
     almost all situations exactly as if they were groups, except that
     they cannot be passed to the :class:`Network` object.
     
+    **Trials**
+    
+    With ``trials=K``, the group consists of ``K`` copies of ``N`` neurons
+    stacked one after the other (so ``len(G)`` is ``K*N``), and the neurons
+    of trial ``k`` form the subgroup ``G.trial(k)``. Running a network of
+    such groups replaces ``K`` runs of the network with groups of ``N``
+    neurons, and is much faster for small groups because the Python
+    overheads are paid once for all trials. Parameters can be varied across
+    trials with :meth:`set_trial_values`. :class:`Connection` objects between
+    two groups with the same number of trials only connect neurons of the
+    same trial (the connection matrix is block diagonal, each block being
+    built independently by the ``connect_*`` methods, or identically if a
+    ``seed`` is given), and :class:`SpikeMonitor` and :class:`StateMonitor`
+    have a ``split_trials()`` method to separate the recordings of the
+    different trials. Note that subgroups of a group with trials, other
+    than those returned by :meth:`trial`, will mix up the neurons of several
+    trials.
+    
     **Details**
     
     TODO: details of other methods and properties for people
     wanting to write extensions?
     """
+    # the number of time steps the group is ahead of its clock, and the number
+    # of time steps added to its spike container for that (see
+    # Network._build_block_schedule)
+    _lead = 0
+    _block_capacity = 0
+    # kernel doing the threshold, refractoriness and reset in the update step
+    # (see Network._build_threshold_reset_schedule)
+    _threshold_reset = None
 
     @check_units(max_delay=second)
     def __init__(self, N, model=None, threshold=None, reset=NoReset(),
                  init=None, refractory=0 * msecond, level=0,
                  clock=None, order=1, implicit=False, unit_checking=True,
                  max_delay=0 * msecond, compile=False, freeze=False, method=None,
-                 max_refractory=None,
+                 max_refractory=None, trials=1, tabulate=None, dtype=None,
+                 refractory_mode='clamp',
                  ):#**args): # any reason why **args was included here?
         '''
         Initializes the group.
         '''
+        self.trials = trials
+        self.trial_size = N
+        N = N * trials
 
         self._useweave = get_global_preference('useweave')
         if self._useweave:
@@ -313,8 +387,9 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
                 self._state_updater, var_names = magic_state_updater(model, clock=clock, order=order,
                                                                      check_units=unit_checking, implicit=implicit,
                                                                      compile=compile, freeze=freeze,
-                                                                     method=method)
-                Group.__init__(self, model, N, unit_checking=unit_checking)
+                                                                     method=method, tabulate=tabulate)
+                Group.__init__(self, model, N, unit_checking=unit_checking,
+                               dtype=dtype)
                 self._all_units = model._units
                 # Converts S0 from dictionary to tuple
                 if self._S0 == None: # No initialization: 0 with units
@@ -357,7 +432,7 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
 
         # Initialization of the state matrix
         if not hasattr(self, '_S'):
-            self._S = zeros((len(self._state_updater), N))
+            self._S = zeros((len(self._state_updater), N), dtype=get_state_dtype(dtype))
         if self._S0 != None:
             for i in range(len(self._state_updater)):
                 self._S[i, :] = self._S0[i]
@@ -425,6 +500,19 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         else:
             self._use_next_allowed_spiketime_refractoriness = True
 
+        # Set of refractory neurons, which are not integrated
+        if refractory_mode not in ('clamp', 'inactive'):
+            raise ValueError("refractory_mode should be 'clamp' or 'inactive'")
+        self._refractory_set = None
+        self._refractory_period = 0
+        if refractory_mode == 'inactive':
+            if self._use_next_allowed_spiketime_refractoriness:
+                self._refractory_set = RefractorySet(N, int(max_refractory / clock.dt) + 2)
+            elif hasattr(self._resetfun, 'period'):
+                # same number of time steps as Refractoriness
+                self._refractory_period = int(self._resetfun.period / clock.dt) + 1
+                self._refractory_set = RefractorySet(N, self._refractory_period + 1)
+
         self._owner = self # owner (for subgroups)
         self._subgroup_set = magic.WeakSet()
         self._origin = 0 # start index from owner if subgroup
@@ -460,9 +548,8 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         _max_delay = int(max_delay / self.clock.dt) + 2 # in time bins
         if _max_delay > self._max_delay:
             self._max_delay = _max_delay
-            self.LS = SpikeContainer(self._max_delay,
-                                     useweave=get_global_preference('useweave'),
-                                     compiler=get_global_preference('weavecompiler')) # Spike storage
+            expected = float(len(self) * get_global_preference('expectedrate') * self.clock.dt)
+            self.LS = SpikeContainer(self._max_delay, expected=expected) # Spike storage
             # update all subgroups if any exist
             if hasattr(self, '_subgroup_set'): # the first time set_max_delay is called this is false
                 for G in self._owner._subgroup_set.get():
@@ -488,13 +575,25 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
                     self._S[:] = 0 # State matrix
             self._next_allowed_spiketime[:] = -1
             self.LS.reinit()
+            if self._refractory_set is not None:
+                self._refractory_set.reinit()
+            self._lead = 0
 
     def update(self):
         '''
         Updates the state variables.
         '''
-        self._state_updater(self) # update the variables
+        if self._refractory_set is not None:
+            self._update_active()
+        else:
+            self._state_updater(self) # update the variables
         if self._spiking:
+            if self._threshold_reset is not None:
+                spikes = self._threshold_reset(self) # spikes, already reset
+                self.LS.push(spikes)
+                if self._refractory_set is not None:
+                    self._add_refractory(spikes)
+                return
             spikes = self._threshold(self) # get spikes
             if not isinstance(spikes, numpy.ndarray):
                 spikes = array(spikes, dtype=int)
@@ -511,14 +610,89 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
                 else:
                     self._next_allowed_spiketime[spikes] = self.clock._t + self._refractory_time
             self.LS.push(spikes) # Store spikes
+            if self._refractory_set is not None:
+                self._add_refractory(spikes)
+
+    def _update_active(self):
+        '''
+        Updates the state variables of the neurons which are not refractory
+        (refractory_mode='inactive'), after removing the neurons whose
+        refractory period has ended from the refractory set.
+        '''
+        refractory = self._refractory_set
+        expired = refractory.advance()
+        if len(expired) and self._use_next_allowed_spiketime_refractoriness:
+            # the number of steps is estimated from the times, neurons
+            # leaving the set too early are put back
+            nextspike = self._next_allowed_spiketime[expired]
+            early = nextspike > self.clock._t
+            if early.any():
+                refractory.add(expired[early],
+                               self._refractory_steps(nextspike[early], self.clock._t))
+        n = len(refractory)
+        if n == 0:
+            self._state_updater(self)
+        elif 5 * n > 3 * len(self) and getattr(self._state_updater, 'partial_updates', False):
+            self._state_updater.update_indices(self, (~refractory.mask).nonzero()[0])
+        else:
+            inactive = refractory.indices
+            S = self._S.take(inactive, axis=1)
+            self._state_updater(self)
+            self._S[:, inactive] = S
+
+    def _refractory_steps(self, nextspike, t):
+        '''
+        Number of time steps after t at which the neurons can spike again, for
+        the times nextspike of their next allowed spikes.
+        '''
+        return asarray(ceil((nextspike - t) / self.clock._dt - 1e-3), dtype=int)
+
+    def _add_refractory(self, spikes):
+        '''
+        Adds the neurons which have just spiked to the refractory set.
+        '''
+        if self._use_next_allowed_spiketime_refractoriness:
+            t = self.clock._t
+            self._refractory_set.add(spikes, self._refractory_steps(self._next_allowed_spiketime[spikes], t))
+        else:
+            # the threshold may be crossed again while holding the reset value
+            spikes = spikes[~self._refractory_set.mask[spikes]]
+            self._refractory_set.add(spikes, self._refractory_period)
+
+    def _rebuild_refractory_set(self):
+        '''
+        Rebuilds the refractory set from the times of the next allowed spikes
+        or from the last spikes, e.g. after restoring a checkpoint.
+        '''
+        refractory = self._refractory_set
+        refractory.reinit()
+        if self._use_next_allowed_spiketime_refractoriness:
+            # time of the last update
+            t = self.clock._t - self.clock._dt
+            indices = (self._next_allowed_spiketime > t).nonzero()[0]
+            refractory.add(indices, self._refractory_steps(self._next_allowed_spiketime[indices], t))
+        else:
+            for age in xrange(self._refractory_period):
+                refractory.add(self.LS[age], self._refractory_period - age)
 
     def get_refractory_indices(self):
+        '''
+        Returns the indexes of the neurons in their refractory period (in no
+        particular order with refractory_mode='inactive').
+        '''
+        if self._refractory_set is not None:
+            indices = self._owner._refractory_set.indices
+            if self._owner is not self:
+                indices = indices[(indices >= self._origin) & (indices < self._origin + len(self))] - self._origin
+            return indices
         return (self._next_allowed_spiketime > self.clock._t).nonzero()[0]
 
     def get_spikes(self, delay=0):
         '''
         Returns indexes of neurons that spiked at time t-delay*dt.
         '''
+        # the owner can be ahead of its clock, see Network._build_block_schedule
+        delay += self._owner._lead
         if self._owner == self:
             # Group
 #            if delay==0:
@@ -541,9 +715,28 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
 
     def reset(self):
         '''
-        Resets the neurons.
+        Resets the neurons (unless this is done in the update step).
+        '''
+        if self._threshold_reset is None:
+            self._resetfun(self)
+
+    def trial(self, k):
+        '''
+        Returns the subgroup of the neurons of trial k.
+        '''
+        if not 0 <= k < self.trials:
+            raise IndexError('Trial ' + str(k) + ' does not exist.')
+        n = self.trial_size
+        return self[k * n:(k + 1) * n]
+
+    def set_trial_values(self, var, values):
+        '''
+        Sets the state variable var of trial k to values[k] for each trial.
         '''
-        self._resetfun(self)
+        if len(values) != self.trials:
+            raise ValueError('One value per trial must be given.')
+        for k in xrange(self.trials):
+            setattr(self.trial(k), var, values[k])
 
     def subgroup(self, N):
         if self._next_subgroup + N > len(self):
@@ -592,6 +785,8 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         Q.N = Q._S.shape[1]
         Q._origin = self._origin + i
         Q._next_subgroup = 0
+        Q.trials = 1
+        Q.trial_size = Q.N
         self._subgroup_set.add(Q)
         return Q
 
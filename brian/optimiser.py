@@ -38,17 +38,25 @@ Optimizations for Brian.
 import re
 import warnings
 import parser
+import ast
+import math
+import __builtin__
+import numpy
+from numpy import ndarray, ufunc
 from inspection import *
 from log import *
-try:
-    import sympy
-    use_sympy = True
-except:
+import unitsafefunctions
+from utils.lazyimport import LazyModule, module_available
+sympy = LazyModule('sympy')
+use_sympy = module_available('sympy')
+numexpr = LazyModule('numexpr')
+numexpr_available = module_available('numexpr')
+if not use_sympy:
     warnings.warn('sympy not installed')
-    use_sympy = False
 #TODO: also insert a global pref?
 
-__all__ = ['freeze', 'simplify_expr', 'symbolic_eval']
+__all__ = ['freeze', 'simplify_expr', 'symbolic_eval', 'fold_constants',
+           'common_subexpressions']
 
 def freeze(expr, vars, namespace={}, safe=False):
     """
@@ -108,3 +116,549 @@ def simplify_expr(expr):
     '''
     return str(symbolic_eval(expr))
     #return str(sympy.simplify(symbolic_eval(expr)))
+
+
+def as_ufunc(f):
+    """
+    Returns the numpy ufunc computing the same function as f (e.g. for the
+    unit-safe version of exp, math.exp or abs), or None.
+    """
+    if isinstance(f, ufunc):
+        return f
+    if f is __builtin__.abs:
+        return numpy.absolute
+    name = getattr(f, '__name__', None)
+    if name is None:
+        return None
+    for module in (unitsafefunctions, math):
+        if getattr(module, name, None) is f:
+            g = getattr(numpy, name, None)
+            if isinstance(g, ufunc):
+                return g
+    return None
+
+_binary_ufuncs = {ast.Add: numpy.add, ast.Sub: numpy.subtract,
+                  ast.Mult: numpy.multiply, ast.Div: numpy.divide,
+                  ast.Pow: numpy.power, ast.Mod: numpy.remainder,
+                  ast.FloorDiv: numpy.floor_divide}
+_binary_symbols = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+                   ast.Pow: '**', ast.Mod: '%', ast.FloorDiv: '//'}
+_unary_symbols = {ast.UAdd: '+', ast.USub: '-', ast.Not: 'not '}
+_compare_symbols = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+                    ast.Eq: '==', ast.NotEq: '!='}
+_bool_symbols = {ast.And: ' and ', ast.Or: ' or '}
+
+
+def substitute_subexpressions(expr, replace):
+    """
+    Returns the expression expr (a string) where the largest subexpressions
+    for which the function ``replace(node)`` (with ``node`` the ``ast`` node
+    of the subexpression) returns a string are replaced by that string.
+    Raises ``NotImplementedError`` for unsupported syntax (e.g. lambda).
+    """
+    return _source(ast.parse(expr.strip(), mode='eval').body, replace)
+
+
+def _constant(node):
+    # value of a number or of a negated number, or None
+    if isinstance(node, ast.Num):
+        return node.n
+    if (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and
+        isinstance(node.operand, ast.Num)):
+        return -node.operand.n
+    return None
+
+
+def _number(value):
+    # node of a number, or None if it cannot be written in an expression
+    if not isinstance(value, (int, long, float)) or not numpy.isfinite(value):
+        return None
+    if value < 0:
+        return ast.UnaryOp(op=ast.USub(), operand=ast.Num(n=-value))
+    return ast.Num(n=value)
+
+
+class _ConstantFolder(ast.NodeTransformer):
+    # folds the operations on numbers, from the leaves up
+    def __init__(self, zeros):
+        self.zeros = zeros
+
+    def _fold(self, node):
+        try:
+            return _number(eval(_source(node), {})) or node
+        except (ArithmeticError, ValueError):
+            return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        left, right = _constant(node.left), _constant(node.right)
+        if left is not None and right is not None:
+            return self._fold(node)
+        if self.zeros and isinstance(node.op, ast.Mult) and 0 in (left, right):
+            return ast.Num(n=0.0)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if _constant(node.operand) is not None and _constant(node) is None:
+            return self._fold(node)
+        return node
+
+
+def fold_constants(expr, zeros=False):
+    """
+    Returns the expression expr (a string) where the subexpressions that
+    only contain numbers (e.g. the parameters of a frozen expression, see
+    :func:`freeze`) are replaced by their value. If zeros is True, products
+    by zero are also replaced by zero (a number, even if the other factor is
+    an array). The expression is returned unchanged if it cannot be parsed.
+    """
+    try:
+        tree = ast.parse(expr.strip(), mode='eval').body
+        return _source(_ConstantFolder(zeros).visit(tree))
+    except (NotImplementedError, SyntaxError):
+        return expr
+
+
+def common_subexpressions(exprs, variables, prefix='_cse', start=0, exclude=()):
+    """
+    Common subexpression elimination over several expressions.
+    
+    Returns ``(definitions, exprs)``, where ``definitions`` is a list of
+    pairs ``(name, expr)`` to be computed in that order, the names being
+    ``prefix`` followed by a number (starting at ``start``), and ``exprs``
+    the expressions (strings) where the largest subexpressions that depend
+    on the names in ``variables`` and occur more than once are replaced by
+    these names. A subexpression occurring only within another shared one,
+    or containing a name in ``exclude`` (e.g. a variable modified between
+    the expressions), is not shared. Raises ``NotImplementedError`` for
+    unsupported syntax.
+    """
+    variables = set(variables)
+    exclude = set(exclude)
+    trees = [ast.parse(expr.strip(), mode='eval').body for expr in exprs]
+    keys = {} # source of the candidate subexpressions, by node id
+    for tree in trees:
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call)):
+                names = set(subnode.id for subnode in ast.walk(node)
+                            if isinstance(subnode, ast.Name))
+                if names & variables and not names & exclude:
+                    keys[id(node)] = _source(node)
+    def uses(key, shared):
+        # occurrences of key, where each shared subexpression is computed once
+        count = [0]
+        seen = set()
+        def walk(node):
+            k = keys.get(id(node))
+            if k == key:
+                count[0] += 1
+            if k in shared:
+                if k in seen:
+                    return
+                seen.add(k)
+            for child in ast.iter_child_nodes(node):
+                walk(child)
+        for tree in trees:
+            walk(tree)
+        return count[0]
+    candidates = {}
+    for key in keys.itervalues():
+        candidates[key] = candidates.get(key, 0) + 1
+    shared = set()
+    # larger subexpressions first
+    for key in sorted((key for key, n in candidates.iteritems() if n > 1),
+                      key=lambda key: (-len(key), key)):
+        if uses(key, shared) > 1:
+            shared.add(key)
+    names = {}
+    definitions = []
+    def replace(node):
+        key = keys.get(id(node))
+        if key not in shared:
+            return None
+        if key not in names:
+            source = _source(node, lambda subnode: None if subnode is node else replace(subnode))
+            names[key] = prefix + str(start + len(definitions))
+            definitions.append((names[key], source))
+        return names[key]
+    return definitions, [_source(tree, replace) for tree in trees]
+
+
+def _source(node, replace=lambda node: None):
+    # parenthesised source code of an expression node
+    replacement = replace(node)
+    if replacement is not None:
+        return replacement
+    if isinstance(node, ast.Num):
+        if not isinstance(node.n, complex) and node.n < 0: # e.g. in (-1)**x
+            return '(' + repr(node.n) + ')'
+        return repr(node.n)
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return _source(node.value, replace) + '.' + node.attr
+    if isinstance(node, ast.BinOp) and type(node.op) in _binary_symbols:
+        return ('(' + _source(node.left, replace) + _binary_symbols[type(node.op)] +
+                _source(node.right, replace) + ')')
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _unary_symbols:
+        return '(' + _unary_symbols[type(node.op)] + _source(node.operand, replace) + ')'
+    if isinstance(node, ast.BoolOp):
+        return ('(' + _bool_symbols[type(node.op)].join(_source(value, replace)
+                                                         for value in node.values) + ')')
+    if isinstance(node, ast.Compare) and all(type(op) in _compare_symbols for op in node.ops):
+        return ('(' + _source(node.left, replace) +
+                ''.join(_compare_symbols[type(op)] + _source(comparator, replace)
+                        for op, comparator in zip(node.ops, node.comparators)) + ')')
+    if isinstance(node, ast.Call) and not (node.starargs or node.kwargs):
+        args = [_source(arg, replace) for arg in node.args]
+        args += [keyword.arg + '=' + _source(keyword.value, replace)
+                 for keyword in node.keywords]
+        return _source(node.func, replace) + '(' + ', '.join(args) + ')'
+    raise NotImplementedError('Unsupported expression')
+
+
+class InPlaceCode(object):
+    """
+    Python code evaluating expressions over arrays without temporary arrays
+    
+    **Initialised as:** ::
+    
+        InPlaceCode(arrays[, scalars[, use_numexpr]])
+    
+    where ``arrays`` are the names of the array variables (e.g. the state
+    variables) and ``scalars`` the names of the scalars that change between
+    executions of the code (e.g. ``t`` and ``dt``).
+    
+    Each call to ``assign(target, expr, namespace)`` adds code that writes
+    the value of the (frozen, see :func:`freeze`) expression ``expr`` into the
+    array ``target``. Array operations are done with ufuncs writing into
+    scratch rows (``out`` argument), which are reused between the
+    operations and between the expressions. Scalar subexpressions are
+    evaluated once if they only contain numbers, or otherwise computed at the
+    start of the code (``prelude``), once per execution. Other names in the
+    expression are looked up in ``namespace``: arrays, numbers and functions
+    with an equivalent ufunc (see :func:`as_ufunc`), or vectorised functions
+    with an ``elementwise`` attribute set to True (e.g. tabulated functions,
+    see :class:`~brian.tools.tabulate.TabulateInterp`), whose result is
+    copied into a scratch row. If ``use_numexpr`` is
+    True and the numexpr package is installed, expressions are evaluated
+    with ``numexpr.evaluate`` in a single multithreaded pass when numexpr
+    supports them. Raises ``NotImplementedError`` if an expression cannot be
+    translated (e.g. if it calls an arbitrary function).
+    
+    Before assigning several expressions, ``share(exprs, namespaces)``
+    computes once the subexpressions they have in common (see
+    :meth:`share`). Subexpressions that only contain numbers are folded
+    (see :func:`fold_constants`), as well as additions of zero and
+    multiplications and divisions by one.
+    
+    Attributes:
+    
+    ``rows``
+        The names of the scratch rows, which must be bound to arrays of the
+        same length as the arrays before executing the code.
+    ``namespace``
+        The objects (ufuncs, arrays from the namespaces) the code refers to.
+        The code must be executed in a copy of this namespace, where the
+        arrays, the scalars, the scratch rows and ``_ns`` (the namespace
+        itself) are also defined.
+    ``code``
+        The generated code, as a string.
+    """
+    def __init__(self, arrays, scalars=(), use_numexpr=False):
+        self.arrays = set(arrays)
+        self.scalars = set(scalars)
+        self.use_numexpr = use_numexpr and numexpr_available
+        self.rows = []
+        self.namespace = {}
+        self.prelude = []
+        self.lines = []
+        self._buffers = []
+        self._free = []
+        self._hoisted = {}
+        self._namespace = {}
+
+    def new_row(self, name):
+        """
+        Adds a scratch row and returns its name.
+        """
+        self.rows.append(name)
+        self.arrays.add(name)
+        return name
+
+    @property
+    def code(self):
+        return '\n'.join(self.prelude + self.lines) + '\n'
+
+    def share(self, exprs, namespaces):
+        """
+        Computes once the subexpressions depending on arrays that occur
+        several times in the expressions exprs (with the corresponding
+        namespaces), into new scratch rows ``_cse0``, ``_cse1``, etc. (see
+        :func:`common_subexpressions`). Returns the expressions using these
+        rows, to be assigned before any of the arrays is modified. The
+        expressions are returned unchanged if a name refers to different
+        objects in different namespaces.
+        """
+        exprs = [fold_constants(expr, zeros=True) for expr in exprs]
+        namespace = {}
+        for expr, ns in zip(exprs, namespaces):
+            for name in get_identifiers(expr):
+                if name in ns:
+                    if name in namespace and namespace[name] is not ns[name]:
+                        return exprs
+                    namespace[name] = ns[name]
+        arrays = set(self.arrays)
+        for name, value in namespace.iteritems():
+            if isinstance(value, ndarray) and value.ndim > 0:
+                arrays.add(name)
+        start = len([row for row in self.rows if row.startswith('_cse')])
+        definitions, exprs = common_subexpressions(exprs, arrays, start=start)
+        for name, expr in definitions:
+            self.assign(self.new_row(name), expr, namespace)
+        return exprs
+
+    def assign(self, target, expr, namespace={}):
+        """
+        Adds code writing the value of expr into the array target.
+        """
+        self._namespace = namespace
+        expr = fold_constants(expr, zeros=True)
+        node = ast.parse(expr.strip(), mode='eval').body
+        if self.use_numexpr and self._numexpr_supports(node):
+            self.namespace['_evaluate'] = numexpr.evaluate
+            self.lines.append('_evaluate(%r, local_dict=_ns, out=%s)' % (expr.strip(), target))
+            return
+        result = self._visit(node, target)
+        if result[0] == 'scalar':
+            self.lines.append('%s[:] = %s' % (target, self._operand(result)))
+        elif result[1] != target:
+            self.lines.append('%s[:] = %s' % (target, result[1]))
+        self._free = list(self._buffers)
+
+    def scalar(self, expr, namespace={}):
+        """
+        Returns the code of a scalar with the value of expr (a number or a
+        name computed in the prelude), or None if expr depends on arrays.
+        """
+        self._namespace = namespace
+        node = ast.parse(expr.strip(), mode='eval').body
+        for subnode in ast.walk(node):
+            if isinstance(subnode, ast.Name) and self._is_array(subnode.id):
+                return None
+        result = self._visit(node)
+        if result[2]:
+            return result[1]
+        return self._hoist(result[1])
+
+    def _is_float_array(self, result):
+        # state variables and scratch rows are floating point arrays
+        if result[0] != 'array':
+            return False
+        if result[1] in self.arrays:
+            return True
+        return self.namespace[result[1]].dtype.kind == 'f'
+
+    def _is_array(self, name):
+        if name in self.arrays:
+            return True
+        value = self._namespace.get(name, None)
+        return isinstance(value, ndarray) and value.ndim > 0
+
+    def _bind(self, name, value):
+        if name in self.namespace and self.namespace[name] is not value:
+            raise NotImplementedError('Name ' + name + ' refers to different objects')
+        self.namespace[name] = value
+
+    def _function(self, name):
+        f = self._namespace.get(name, getattr(__builtin__, name, None))
+        u = as_ufunc(f)
+        if u is None or u.nout != 1:
+            raise NotImplementedError('Function ' + name + ' cannot be translated')
+        return u
+
+    def _buffer(self):
+        if self._free:
+            return self._free.pop()
+        self._buffers.append(self.new_row('_buf' + str(len(self._buffers))))
+        return self._buffers[-1]
+
+    def _hoist(self, source):
+        if re.match(r'^\w+$', source):
+            return source
+        if source not in self._hoisted:
+            name = '_c' + str(len(self._hoisted))
+            self.prelude.append(name + ' = ' + source)
+            self._hoisted[source] = name
+            self.scalars.add(name)
+        return self._hoisted[source]
+
+    def _operand(self, result):
+        if result[0] == 'scalar' and not result[2]:
+            return self._hoist(result[1])
+        return result[1]
+
+    def _scalar(self, source, constant):
+        # results are ('scalar', source, constant) or ('array', name, owned)
+        if constant:
+            try:
+                return ('scalar', repr(eval(source, dict(self.namespace))), True)
+            except (ArithmeticError, ValueError):
+                constant = False
+        return ('scalar', source, constant)
+
+    def _apply(self, u, operands, out=None):
+        name = '_' + u.__name__
+        self._bind(name, u)
+        args = [self._operand(operand) for operand in operands]
+        owned = []
+        for operand in operands:
+            if operand[0] == 'array' and operand[2] and operand[1] not in owned:
+                owned.append(operand[1])
+        if out is None:
+            if owned:
+                out = owned.pop(0)
+            else:
+                out = self._buffer()
+        self._free.extend(owned)
+        self.lines.append('%s(%s, %s)' % (name, ', '.join(args), out))
+        return ('array', out, out in self._buffers)
+
+    def _call(self, name, f, operands, out=None):
+        self._bind(name, f)
+        args = [self._operand(operand) for operand in operands]
+        if all(operand[0] == 'scalar' for operand in operands):
+            return self._scalar(name + '(' + ', '.join(args) + ')', False)
+        owned = []
+        for operand in operands:
+            if operand[0] == 'array' and operand[2] and operand[1] not in owned:
+                owned.append(operand[1])
+        if out is None:
+            if owned:
+                out = owned.pop(0)
+            else:
+                out = self._buffer()
+        self._free.extend(owned)
+        self.lines.append('%s[:] = %s(%s)' % (out, name, ', '.join(args)))
+        return ('array', out, out in self._buffers)
+
+    def _visit(self, node, out=None):
+        if isinstance(node, ast.Num):
+            return ('scalar', repr(node.n), True)
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name in self.arrays:
+                return ('array', name, False)
+            if name in self.scalars:
+                return ('scalar', name, False)
+            if name in self._namespace:
+                value = self._namespace[name]
+                if isinstance(value, ndarray) and value.ndim > 0:
+                    self._bind(name, numpy.asarray(value))
+                    return ('array', name, False)
+                if isinstance(value, (int, long, float, numpy.number, ndarray)):
+                    return ('scalar', repr(numpy.asarray(value).item()), True)
+            raise NotImplementedError('Name ' + name + ' cannot be translated')
+        if isinstance(node, ast.UnaryOp):
+            operand = self._visit(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if not isinstance(node.op, ast.USub):
+                raise NotImplementedError('Unsupported operator')
+            if operand[0] == 'scalar':
+                return self._scalar('(-' + operand[1] + ')', operand[2])
+            return self._apply(numpy.negative, [operand], out)
+        if isinstance(node, ast.BinOp):
+            op = type(node.op)
+            if op not in _binary_ufuncs:
+                raise NotImplementedError('Unsupported operator')
+            left = self._visit(node.left)
+            right = self._visit(node.right)
+            if left[0] == 'scalar' and right[0] == 'scalar':
+                return self._scalar('(' + left[1] + _binary_symbols[op] + right[1] + ')',
+                                    left[2] and right[2])
+            # x+0, 0+x, x-0, x*1, 1*x, x/1
+            neutral = {ast.Add: 0, ast.Sub: 0, ast.Mult: 1, ast.Div: 1}.get(op)
+            if (neutral is not None and right[0] == 'scalar' and right[2] and
+                float(right[1]) == neutral and self._is_float_array(left)):
+                return left
+            if (op in (ast.Add, ast.Mult) and left[0] == 'scalar' and left[2] and
+                float(left[1]) == neutral and self._is_float_array(right)):
+                return right
+            if op is ast.Pow and right[0] == 'scalar' and right[2]:
+                exponent = eval(right[1])
+                if exponent == 2:
+                    return self._apply(numpy.multiply, [left, left], out)
+                if exponent in (3, 4):
+                    # power is much slower than multiplications
+                    if exponent == 3 and left[0] == 'array' and left[2]:
+                        # the base is still needed after the square, which
+                        # must not overwrite its buffer
+                        square = self._apply(numpy.multiply, [('array', left[1], False)] * 2,
+                                             self._buffer())
+                        square = ('array', square[1], True)
+                    else:
+                        square = self._apply(numpy.multiply, [left, left])
+                    if exponent == 3:
+                        return self._apply(numpy.multiply, [square, left], out)
+                    return self._apply(numpy.multiply, [square, square], out)
+                if exponent == 0.5:
+                    return self._apply(numpy.sqrt, [left], out)
+                if exponent == 1:
+                    return left
+            return self._apply(_binary_ufuncs[op], [left, right], out)
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or node.keywords or
+                node.starargs or node.kwargs):
+                raise NotImplementedError('Unsupported function call')
+            f = self._namespace.get(node.func.id, None)
+            if getattr(f, 'elementwise', False):
+                return self._call(node.func.id, f, [self._visit(arg) for arg in node.args], out)
+            u = self._function(node.func.id)
+            if u.nin != len(node.args):
+                raise NotImplementedError('Wrong number of arguments for ' + node.func.id)
+            args = [self._visit(arg) for arg in node.args]
+            if all(arg[0] == 'scalar' for arg in args):
+                name = '_' + u.__name__
+                self._bind(name, u)
+                return self._scalar(name + '(' + ', '.join(arg[1] for arg in args) + ')',
+                                    all(arg[2] for arg in args))
+            return self._apply(u, args, out)
+        raise NotImplementedError('Unsupported expression')
+
+    def _numexpr_supports(self, node):
+        """
+        Checks that numexpr can evaluate the expression, and binds the
+        arrays and numbers of the namespace it refers to.
+        """
+        functions = numexpr.expressions.functions
+        called = set(id(subnode.func) for subnode in ast.walk(node)
+                     if isinstance(subnode, ast.Call))
+        names = {}
+        for subnode in ast.walk(node):
+            if isinstance(subnode, ast.Call):
+                if (not isinstance(subnode.func, ast.Name) or
+                    subnode.func.id not in functions or subnode.keywords or
+                    subnode.starargs or subnode.kwargs):
+                    return False
+                try:
+                    if self._function(subnode.func.id).__name__ not in (subnode.func.id, 'absolute'):
+                        return False
+                except NotImplementedError:
+                    return False
+            elif isinstance(subnode, ast.Name) and id(subnode) not in called:
+                name = subnode.id
+                if name in self.arrays or name in self.scalars:
+                    continue
+                value = self._namespace.get(name, None)
+                if not isinstance(value, (int, long, float, numpy.number, ndarray)):
+                    return False
+                names[name] = numpy.asarray(value)
+            elif not isinstance(subnode, (ast.Expression, ast.Num, ast.Name, ast.BinOp,
+                                          ast.UnaryOp, ast.operator, ast.unaryop,
+                                          ast.expr_context)):
+                return False
+        for name, value in names.iteritems():
+            self._bind(name, value)
+        return True
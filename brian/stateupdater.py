@@ -38,17 +38,17 @@ Neuron StateUpdaters
 
 __all__ = ['StateUpdater', 'LinearStateUpdater', 'NonlinearStateUpdater',
            'SynapticNoise', 'LazyStateUpdater', 'magic_state_updater',
-           'FunStateUpdater', 'get_linear_equations']
+           'FunStateUpdater', 'get_linear_equations',
+           'HeterogeneousLinearStateUpdater', 'AdaptiveRKStateUpdater',
+           'SplitStateUpdater']
 
 #from scipy.weave import blitz
 from numpy import *
 from scipy import linalg
 from scipy.linalg import LinAlgError
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from utils.kernelcache import weave
 from scipy.optimize import fsolve
+from __builtin__ import min, max
 import copy
 from operator import isSequenceType
 from inspection import *
@@ -56,16 +56,17 @@ from units import second, mvolt
 from clock import guess_clock
 import magic
 from equations import *
+import optimiser
+from threshold import NoThreshold, PoissonThreshold, EmpiricalThreshold
 from itertools import count
 from units import Quantity
 import warnings
 from log import *
 from globalprefs import *
-from experimental.codegen import *
 CStateUpdater = PythonStateUpdater = None
 
 def magic_state_updater(model, clock=None, order=1, implicit=False, compile=False, freeze=False, \
-                        method=None, check_units=True):
+                        method=None, check_units=True, tabulate=None):
     '''
     Examines the set of differential equations in 'model' (Equations object) and 
     returns a StateUpdater object and the list of dynamic variables.
@@ -73,12 +74,22 @@ def magic_state_updater(model, clock=None, order=1, implicit=False, compile=Fals
     is linear or nonlinear.
     
     Available methods:
-    * None: the method is automatically selected
+    * None: the method is automatically selected (with nonlinear equations,
+      the variables of a linear subsystem are updated exactly, see
+      SplitStateUpdater)
     * linear
     * Euler
     * RK (Runge-Kutta, second order)
     * exponential_Euler
+    * rush_larsen (gating variables updated exactly, Euler or RK for the
+      other variables depending on order)
+    * adaptive_RK (embedded Runge-Kutta pair with adaptive sub-steps, see
+      AdaptiveRKStateUpdater)
     * nonlinear: automatic selection, but not linear
+    
+    If tabulate is a dictionary {var: (xmin, xmax, n)}, the subexpressions
+    depending only on var and containing function calls are replaced by
+    tables with linear interpolation (see :meth:`Equations.tabulate`).
     '''
     global CStateUpdater, PythonStateUpdater
     if method == 'exponential_Euler':
@@ -90,6 +101,8 @@ def magic_state_updater(model, clock=None, order=1, implicit=False, compile=Fals
     elif method == 'RK':
         implicit = False
         order = 2
+    elif method == 'rush_larsen' or method == 'adaptive_RK':
+        implicit = False
     elif method == 'linear' or method is None:
         pass
     else:
@@ -101,6 +114,9 @@ def magic_state_updater(model, clock=None, order=1, implicit=False, compile=Fals
 
     model.prepare(check_units=check_units) # check units and other things
     dynamicvars = model._diffeq_names # Dynamic variables
+    if tabulate:
+        for var, (xmin, xmax, n) in tabulate.iteritems():
+            model.tabulate(var, xmin, xmax, n)
 
     # Identify stochastic equations
     noiselist = []
@@ -114,8 +130,13 @@ def magic_state_updater(model, clock=None, order=1, implicit=False, compile=Fals
 
     use_codegen = get_global_preference('usecodegen') and get_global_preference('usecodegenstateupdate')
     use_weave = get_global_preference('useweave') and get_global_preference('usecodegenweave')
-    if CStateUpdater is None:
-        from experimental.codegen.stateupdaters import CStateUpdater, PythonStateUpdater
+    if use_codegen:
+        # code generation is only imported when it is used
+        from experimental.codegen.integration_schemes import (exp_euler_scheme,
+                                                              euler_scheme,
+                                                              rk2_scheme)
+        if CStateUpdater is None:
+            from experimental.codegen.stateupdaters import CStateUpdater, PythonStateUpdater
 
     # Linearity test
     # insert this in equations
@@ -123,43 +144,68 @@ def magic_state_updater(model, clock=None, order=1, implicit=False, compile=Fals
     if allow_linear and model.is_linear():
         log_info('brian.stateupdater', "Linear model: using exact updates")
         stateupdaterobj = LinearStateUpdater(model, clock=clock)
+    elif allow_linear and model.is_parametrically_linear():
+        log_info('brian.stateupdater', "Linear model with parameters: using exact updates")
+        stateupdaterobj = HeterogeneousLinearStateUpdater(model, clock=clock)
+    elif method == 'rush_larsen':
+        if order > 2:
+            raise TypeError, "Methods with order greater than 2 are not implemented yet."
+        stateupdaterobj = RushLarsenStateUpdater(model, clock=clock, order=order, compile=compile, freeze=freeze)
+    elif method == 'adaptive_RK':
+        stateupdaterobj = AdaptiveRKStateUpdater(model, clock=clock, freeze=freeze)
     else:
+        # Variables of a linear subsystem are updated exactly, the others
+        # numerically (only with the automatic selection of the method)
+        linear_variables = []
+        if method is None and not use_codegen:
+            linear_variables = model.linear_variables()
+        numerical_model = model
+        if linear_variables:
+            log_info('brian.stateupdater', "Linear subsystem " + ', '.join(linear_variables) +
+                     ": using exact updates")
+            numerical_model = copy.copy(model)
+            numerical_model._diffeq_names_nonzero = [var for var in model._diffeq_names_nonzero
+                                                     if var not in linear_variables]
         # Nonlinear model - check order of the method
         if implicit: # implicit integration schemes
-            if model.is_conditionally_linear():
+            if numerical_model.is_conditionally_linear():
                 log_info('brian.stateupdater', "Using exponential Euler")
                 if not use_codegen:
-                    stateupdaterobj = ExponentialEulerStateUpdater(model, clock=clock, compile=compile, freeze=freeze)
+                    stateupdaterobj = ExponentialEulerStateUpdater(numerical_model, clock=clock, compile=compile, freeze=freeze)
                 elif use_weave:
-                    stateupdaterobj = CStateUpdater(model, exp_euler_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = CStateUpdater(numerical_model, exp_euler_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen CStateUpdater')
                 else:
-                    stateupdaterobj = PythonStateUpdater(model, exp_euler_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = PythonStateUpdater(numerical_model, exp_euler_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen PythonStateUpdater')
             else:
                 raise TypeError, "General implicit methods are not implemented yet."
         else: # explicit method
             if order == 1:
                 if not use_codegen:
-                    stateupdaterobj = NonlinearStateUpdater(model, clock=clock, compile=compile, freeze=freeze)
+                    stateupdaterobj = NonlinearStateUpdater(numerical_model, clock=clock, compile=compile, freeze=freeze)
                 elif use_weave:
-                    stateupdaterobj = CStateUpdater(model, euler_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = CStateUpdater(numerical_model, euler_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen CStateUpdater')
                 else:
-                    stateupdaterobj = PythonStateUpdater(model, euler_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = PythonStateUpdater(numerical_model, euler_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen PythonStateUpdater')
             elif order == 2:
                 if not use_codegen:
-                    stateupdaterobj = RK2StateUpdater(model, clock=clock, compile=compile, freeze=freeze)
+                    stateupdaterobj = RK2StateUpdater(numerical_model, clock=clock, compile=compile, freeze=freeze)
                 elif use_weave:
-                    stateupdaterobj = CStateUpdater(model, rk2_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = CStateUpdater(numerical_model, rk2_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen CStateUpdater')
                 else:
-                    stateupdaterobj = PythonStateUpdater(model, rk2_scheme, clock=clock, freeze=freeze)
+                    stateupdaterobj = PythonStateUpdater(numerical_model, rk2_scheme, clock=clock, freeze=freeze)
                     log_warn('brian.stateupdater', 'Using codegen PythonStateUpdater')
             else:
                 raise TypeError, "Methods with order greater than 2 are not implemented yet."
 
+        if linear_variables:
+            stateupdaterobj = SplitStateUpdater(model, linear_variables, stateupdaterobj,
+                                                clock=clock, order=order)
+
     # Insert noise
     for var, sigma in noiselist:
         # TODO: noise with mu = 0
@@ -178,7 +224,13 @@ class StateUpdater(object):
     S[:]=0 (not S=0)
     otherwise operations are not done in place (a new object is created),
     so that all views are compromised (the reference to the data changes).
+    
+    State updaters with ``partial_updates = True`` have a method
+    ``update_indices(P, indices)`` which updates the neurons with the given
+    indexes only.
     '''
+    partial_updates = False
+
     def __init__(self, clock=None):
         '''
         Default model: dv/dt=-v
@@ -320,6 +372,182 @@ define_global_preference('useweave_linear_diffeq', 'False',
                                   some platforms, typically new ones, this is actually
                                   slower.
                                   """)
+set_global_preferences(usestructured_linear_diffeq=True)
+define_global_preference('usestructured_linear_diffeq', 'True',
+                           desc="""
+                                  Whether to exploit the structure of linear
+                                  differential equations (independent, diagonal
+                                  or triangular blocks) in their solution, rather
+                                  than multiplying by the full update matrix.
+                                  """)
+
+
+def linear_structure(M):
+    '''
+    Returns a boolean matrix R such that R[i, j] is False if variable i does
+    not depend on variable j in the solution of dX/dt = MX + c, i.e., if
+    exp(M t)[i, j] is zero for all t. It is the transitive closure of the
+    nonzero pattern of M.
+    '''
+    R = (asarray(M) != 0) | eye(len(M), dtype=bool)
+    while True:
+        newR = dot(R.astype(int), R.astype(int)) > 0
+        if (newR == R).all():
+            return R
+        R = newR
+
+
+def linear_update_steps(A, C=None):
+    '''
+    Returns a list of steps computing X <- AX + C in place, exploiting the
+    structure of A (see :class:`LinearStateUpdater`), or None if A has no
+    structure to exploit.
+    
+    The variables are split into blocks of mutually dependent variables (the
+    strongly connected components of the graph of nonzero entries of A).
+    The blocks are updated in place, each one before the blocks it depends
+    on, so that only the old values of the variables are used. Variables
+    which are not changed by the update are skipped. Each step is one of:
+    
+    ``('scale', start, stop, d, c)``
+        Variables ``start:stop`` are independent and are multiplied by the
+        column vector ``d`` (``c`` is the constant term, or None).
+    ``('block', indices, terms, constants)``
+        A block of at most 3 variables, where ``terms[r]`` is the list of
+        ``(j, a)`` such that the new value of variable ``indices[r]`` is the
+        sum of the ``a*X[j]``, and ``constants[r]`` is the constant term.
+    ``('dense', indices, A, c)``
+        A larger block, whose new values are ``dot(A, X) + c``.
+    '''
+    m = len(A)
+    if C is None:
+        C = zeros(m)
+    else:
+        C = asarray(C, dtype=float).reshape(m)
+    R = linear_structure(A)
+    if m > 1 and R.all():
+        return None
+    # blocks, ordered by decreasing number of variables they depend on, so
+    # that each block comes before the blocks it depends on
+    blocks = []
+    assigned = set()
+    for i in xrange(m):
+        if i not in assigned:
+            blocks.append([j for j in xrange(m) if R[i, j] and R[j, i]])
+            assigned.update(blocks[-1])
+    blocks.sort(key=lambda block: (-R[block[0]].sum(), block[0]))
+    steps = []
+    for block in blocks:
+        i = block[0]
+        if R[i].sum() == 1: # independent variable
+            if A[i, i] == 1 and C[i] == 0: # unchanged
+                continue
+            if (steps and steps[-1][0] == 'scale' and steps[-1][2] == i):
+                steps[-1][2] = i + 1
+            else:
+                steps.append(['scale', i, i + 1])
+        elif len(block) <= 3:
+            terms = []
+            for k in block:
+                # the diagonal term first, so that the variable can be
+                # multiplied in place
+                columns = [k] + [j for j in xrange(m) if j != k]
+                terms.append(tuple((j, float(A[k, j])) for j in columns
+                                   if A[k, j] != 0))
+            steps.append(('block', tuple(block), tuple(terms),
+                          tuple(float(C[k]) for k in block)))
+        else:
+            steps.append(('dense', array(block), array(A[block, :], order='C'),
+                          C[block].reshape((len(block), 1))))
+    for step in steps:
+        if step[0] == 'scale':
+            start, stop = step[1:3]
+            d = diag(A)[start:stop].reshape((stop - start, 1))
+            c = C[start:stop].reshape((stop - start, 1))
+            step.extend([d, c if c.any() else None])
+    return [tuple(step) for step in steps]
+
+
+def apply_linear_update_steps(steps, S, scratch):
+    '''
+    Updates S in place with the steps from :func:`linear_update_steps`,
+    where scratch is an array with three rows of the size of S, used for
+    intermediate results.
+    '''
+    for step in steps:
+        if step[0] == 'scale':
+            _, start, stop, d, c = step
+            X = S[start:stop]
+            if d.dtype != S.dtype:
+                # e.g. single precision state variables, mixed types are
+                # much slower
+                d = d.astype(S.dtype)
+                if c is not None:
+                    c = c.astype(S.dtype)
+            multiply(X, d, X)
+            if c is not None:
+                add(X, c, X)
+        elif step[0] == 'block':
+            # the new values of all variables but the last one are
+            # written to scratch rows, the last one is updated in place
+            _, indices, terms, constants = step
+            last = len(indices) - 1
+            tmp = scratch[last]
+            for r, i in enumerate(indices):
+                if r == last:
+                    out = S[i]
+                else:
+                    out = scratch[r]
+                if terms[r]:
+                    j, a = terms[r][0]
+                    multiply(S[j], a, out)
+                    for j, a in terms[r][1:]:
+                        multiply(S[j], a, tmp)
+                        add(out, tmp, out)
+                else:
+                    out[:] = 0
+                if constants[r]:
+                    add(out, constants[r], out)
+            for r in xrange(last):
+                S[indices[r]] = scratch[r]
+        else:
+            _, indices, A, c = step
+            S[indices] = dot(A, S) + c
+
+
+def get_linear_update(eqs, variables, dt):
+    '''
+    Returns the matrix A and the vector C of the exact update X <- AX + C
+    over a time step dt of the variables X of a linear subsystem of the
+    equations (see :meth:`Equations.linear_variables`). The update is the
+    exponential of an augmented matrix, so that it also works when the
+    linear system is degenerate (e.g. dx/dt=1/tau).
+    '''
+    n = len(variables)
+    d = dict((var, 0. * eqs._units[var]) for var in variables)
+    c = zeros(n)
+    for j, var in enumerate(variables):
+        c[j] = eqs.apply(var, d)
+    M = zeros((n, n))
+    for i in range(n):
+        for var in variables:
+            d[var] = 0. * eqs._units[var]
+        if isinstance(eqs._units[variables[i]], Quantity):
+            d[variables[i]] = Quantity.with_dimensions(1., eqs._units[variables[i]].get_dimensions())
+        else:
+            d[variables[i]] = 1.
+        for j, var in enumerate(variables):
+            M[j, i] = float(eqs.apply(var, d)) - c[j]
+    E = zeros((n + 1, n + 1))
+    E[:n, :n] = M
+    E[:n, n] = c
+    E = linalg.expm(E * dt)
+    A, C = E[:n, :n], E[:n, n]
+    # exact zeros
+    R = linear_structure(M)
+    A[~R] = 0
+    C[~dot(R, c != 0)] = 0
+    return A, C
 
 
 class LinearStateUpdater(StateUpdater):
@@ -342,9 +570,19 @@ class LinearStateUpdater(StateUpdater):
     Computes an update matrix A=exp(M dt) for the linear system,
     and performs the update step.
     
+    Unless the global preference ``usestructured_linear_diffeq`` is
+    ``False``, the structure of A is analysed once (see
+    :func:`linear_update_steps`): independent variables are multiplied
+    elementwise, small blocks of dependent variables (up to 3x3, e.g. a
+    membrane potential and its synaptic conductances) are updated with
+    elementwise operations in place, and only larger blocks use a matrix
+    product.
+    
     TODO: more mathematical details? 
     '''
     #TODO: sparse linear models (e.g. cable equations)
+    partial_updates = True
+
     def __init__(self, M, B=None, clock=None):
         '''
         Initialize a linear model with dynamics dX/dt = M(X-B) or dX/dt = MX,
@@ -387,6 +625,15 @@ class LinearStateUpdater(StateUpdater):
         self.A = array(self.A, order='C')
         if self._useB:
             self._C = array(self._C, order='C')
+        if isinstance(M, ndarray):
+            # exact zeros, which expm does not always preserve
+            self.A[~linear_structure(M)] = 0
+        self._steps = None
+        if (get_global_preference('usestructured_linear_diffeq') and
+            not self._useaccel):
+            self._steps = linear_update_steps(self.A,
+                                              self._C if self._useB else None)
+        self._scratch = None
 
     def rest(self, P):
         if self._useB:
@@ -404,7 +651,9 @@ class LinearStateUpdater(StateUpdater):
         Careful here: always use the slice operation for affectations.
         P is the neuron group.
         '''
-        if self._useB: # This could be removed
+        if getattr(self, '_steps', None) is not None:
+            self._structured_update(P._S)
+        elif self._useB: # This could be removed
             if not self._useaccel:
                 #P._S[:]=dot(self.A,P._S)+self._C
                 P._S[:] = dot(self.A, P._S)
@@ -463,8 +712,35 @@ class LinearStateUpdater(StateUpdater):
                              type_converters=weave.converters.blitz,
                              extra_compile_args=self._extra_compile_args)
 
+    def update_indices(self, P, indices):
+        '''
+        Updates the state variables of the neurons with the given indexes
+        only (used by groups whose refractory neurons are inactive).
+        '''
+        S = P._S.take(indices, axis=1)
+        if getattr(self, '_steps', None) is not None:
+            apply_linear_update_steps(self._steps, S, empty((3, S.shape[1]), dtype=S.dtype))
+        else:
+            S = dot(self.A, S)
+            if self._useB:
+                add(S, self._C, S)
+        P._S[:, indices] = S
+
+    def _structured_update(self, S):
+        '''
+        Updates S in place with the steps from :func:`linear_update_steps`,
+        using three preallocated rows for intermediate results.
+        '''
+        n = S.shape[1]
+        scratch = self._scratch
+        if scratch is None or scratch.shape[1] != n or scratch.dtype != S.dtype:
+            scratch = self._scratch = empty((3, n), dtype=S.dtype)
+        apply_linear_update_steps(self._steps, S, scratch)
+
     def __getstate__(self):
         pickle_dict = self.__dict__.copy()
+        # the scratch space is reallocated when needed
+        pickle_dict['_scratch'] = None
         # NotImplemented is not pickable, replace it with a string instead
         # (will be reverted when doing the unpickling in __setstate__)
         if 'B' in pickle_dict and pickle_dict['B'] == NotImplemented:
@@ -484,11 +760,340 @@ class LinearStateUpdater(StateUpdater):
         return self.A.shape[0]
 
 
+def get_heterogeneous_linear_equations(eqs, parameters, n):
+    '''
+    Returns arrays M and K of shapes (m, m, n) and (m, n) such that the
+    nonconstant variables of eqs follow dX/dt = M[:, :, i]X + K[:, i] for
+    neuron i, where ``parameters`` is a dictionary of the n values of each
+    parameter (variables with a zero derivative).
+    '''
+    dynamicvars = eqs._diffeq_names_nonzero
+    m = len(dynamicvars)
+    d = dict(parameters)
+    for var in dynamicvars:
+        d[var] = zeros(n)
+    K = zeros((m, n))
+    for i, var in enumerate(dynamicvars):
+        K[i] = eqs.apply(var, d)
+    M = zeros((m, m, n))
+    for j, varj in enumerate(dynamicvars):
+        d[varj] = ones(n)
+        for i, var in enumerate(dynamicvars):
+            M[i, j] = eqs.apply(var, d) - K[i]
+        d[varj] = zeros(n)
+    return M, K
+
+
+def batched_expm(M):
+    '''
+    Returns the array of exp(M[:, :, i]) for an array M of shape (m, m, n),
+    computed with scaling and squaring of the Taylor series, vectorised over
+    the last axis.
+    '''
+    m = M.shape[0]
+    def product(X, Y):
+        P = X[:, 0, newaxis, :] * Y[newaxis, 0, :, :]
+        for j in xrange(1, m):
+            P += X[:, j, newaxis, :] * Y[newaxis, j, :, :]
+        return P
+    norm = abs(M).sum(axis=1).max() # largest infinity norm
+    if norm > 0.5:
+        s = int(ceil(log2(norm / 0.5)))
+    else:
+        s = 0
+    X = M / 2. ** s
+    E = eye(m)[:, :, newaxis] + X
+    T = X
+    for k in xrange(2, 30):
+        T = product(T, X) / k
+        E += T
+        if abs(T).max() < 1e-17:
+            break
+    for _ in xrange(s):
+        E = product(E, E)
+    return E
+
+
+class HeterogeneousLinearStateUpdater(StateUpdater):
+    '''
+    A linear model dX/dt = M X + K where M and K depend on parameters, whose
+    values can be different for each neuron, e.g. ``dv/dt=-v/tau`` with a
+    parameter ``tau``.
+    
+    **Initialised as:** ::
+    
+        HeterogeneousLinearStateUpdater(eqs[,clock])
+    
+    with arguments:
+    
+    ``eqs``
+        :class:`Equations` object, linear in the nonconstant variables (see
+        :meth:`Equations.is_parametrically_linear`).
+    ``clock``
+        Optional clock.
+    
+    The update matrices A=exp(M dt) and constant terms of all neurons are
+    computed at the first update, and again for the neurons whose parameters
+    have changed since the previous update. If M is diagonal, the closed form exp(M dt) is used
+    elementwise, otherwise the exponential of the augmented matrix
+    [[M, K], [0, 0]] dt is computed for all neurons at once (see
+    :func:`batched_expm`). The update of each variable only sums over the
+    variables it depends on.
+    '''
+    def __init__(self, eqs, clock=None):
+        if clock is None:
+            clock = guess_clock()
+        self.eqs = eqs
+        self._dt = float(clock.dt)
+        names = eqs._diffeq_names
+        self._rows = [names.index(var) for var in eqs._diffeq_names_nonzero]
+        self._parameters = [var for var in names
+                            if var not in eqs._diffeq_names_nonzero]
+        self._param_rows = [names.index(var) for var in self._parameters]
+        self._paramvalues = None
+        self.A = None
+        self.C = None
+        self._diagonal = False
+        self._terms = None
+        self._scratch = None
+
+    def _changed_neurons(self, S):
+        '''
+        Returns the indices of the neurons whose parameters changed since the
+        last update, or None if there are no update matrices yet.
+        '''
+        if self._paramvalues is None or self._paramvalues.shape[1] != S.shape[1]:
+            return None
+        changed = zeros(S.shape[1], dtype=bool)
+        for r, i in enumerate(self._param_rows):
+            changed |= S[i] != self._paramvalues[r]
+        return changed.nonzero()[0]
+
+    def _compute_update(self, S, neurons=None):
+        '''
+        Computes the update matrices and constant terms for the current values
+        of the parameters, for the given neurons or for all neurons.
+        '''
+        if neurons is None:
+            neurons = arange(S.shape[1])
+        n = len(neurons)
+        m = len(self._rows)
+        values = S[self._param_rows][:, neurons]
+        M, K = get_heterogeneous_linear_equations(self.eqs,
+                                                  dict(zip(self._parameters, values)),
+                                                  n)
+        offdiagonal = M.copy()
+        offdiagonal[range(m), range(m)] = 0
+        diagonal = not offdiagonal.any()
+        if n < S.shape[1]:
+            if self._diagonal and not diagonal:
+                # the structure changed, use the general form for all neurons
+                self._compute_update(S)
+                return
+        else:
+            self._paramvalues = empty((len(self._param_rows), n))
+            self._diagonal = diagonal
+            if diagonal:
+                self.A = empty((m, n))
+                self.C = empty((m, n))
+            else:
+                self.A = empty((m, m, n))
+                self.C = empty((m, n))
+                self._scratch = empty((m + 1, n))
+        self._paramvalues[:, neurons] = values
+        dt = self._dt
+        if self._diagonal:
+            x = M[range(m), range(m)] * dt
+            self.A[:, neurons] = exp(x)
+            # K dt (exp(x)-1)/x, which is K dt if x=0
+            factor = ones((m, n))
+            nonzero = x != 0
+            factor[nonzero] = expm1(x[nonzero]) / x[nonzero]
+            self.C[:, neurons] = K * dt * factor
+        else:
+            augmented = zeros((m + 1, m + 1, n))
+            augmented[:m, :m] = M * dt
+            augmented[:m, m] = K * dt
+            E = batched_expm(augmented)
+            self.A[:, :, neurons] = E[:m, :m]
+            self.C[:, neurons] = E[:m, m]
+            self._terms = [[c for c in xrange(m) if self.A[r, c].any()] or [r]
+                           for r in xrange(m)]
+
+    def rest(self, P):
+        '''
+        Sets the variables at rest (the fixed point of each neuron).
+        '''
+        S = P._S
+        n = S.shape[1]
+        parameters = dict((var, S[i]) for var, i in zip(self._parameters,
+                                                         self._param_rows))
+        M, K = get_heterogeneous_linear_equations(self.eqs, parameters, n)
+        try:
+            for i in xrange(n):
+                S[self._rows, i] = -linalg.solve(M[:, :, i], K[:, i])
+        except LinAlgError:
+            raise NotImplementedError, \
+                "The resting potential cannot be found because the equations are degenerate"
+
+    def __call__(self, P):
+        '''
+        Updates the state variables.
+        P is the neuron group.
+        '''
+        S = P._S
+        neurons = self._changed_neurons(S)
+        if neurons is None:
+            self._compute_update(S)
+        elif len(neurons):
+            self._compute_update(S, neurons)
+        rows = self._rows
+        if self._diagonal:
+            for r, i in enumerate(rows):
+                multiply(S[i], self.A[r], S[i])
+                add(S[i], self.C[r], S[i])
+        else:
+            # new values are written to scratch rows, the last row is
+            # used for intermediate products
+            X = self._scratch
+            tmp = X[-1]
+            for r, terms in enumerate(self._terms):
+                out = X[r]
+                c = terms[0]
+                multiply(self.A[r, c], S[rows[c]], out)
+                for c in terms[1:]:
+                    multiply(self.A[r, c], S[rows[c]], tmp)
+                    add(out, tmp, out)
+                add(out, self.C[r], out)
+            for r, i in enumerate(rows):
+                S[i] = X[r]
+
+    def __getstate__(self):
+        pickle_dict = self.__dict__.copy()
+        # recomputed at the next update
+        pickle_dict['_paramvalues'] = None
+        pickle_dict['_scratch'] = None
+        return pickle_dict
+
+    def __len__(self):
+        '''
+        Number of state variables
+        '''
+        return len(self.eqs)
+
+    def __repr__(self):
+        return 'Linear StateUpdater with heterogeneous parameters for ' + \
+               str(len(self._rows)) + ' variables'
+    __str__ = __repr__
+
+
+class SplitStateUpdater(StateUpdater):
+    '''
+    A model with a linear subsystem (see :meth:`Equations.linear_variables`)
+    and other, nonlinear, equations. The linear subsystem is updated
+    exactly, the other variables by a nonlinear state updater.
+    
+    **Initialised as:** ::
+    
+        SplitStateUpdater(eqs, linear_variables, nonlinear_updater[, clock[, order]])
+    
+    with arguments:
+    
+    ``eqs``
+        The (prepared) Equations object.
+    ``linear_variables``
+        The variables of the linear subsystem.
+    ``nonlinear_updater``
+        The state updater for the other variables. It must only update these
+        variables, e.g. a :class:`NonlinearStateUpdater` for a copy of the
+        equations where the linear variables are not in
+        ``_diffeq_names_nonzero`` (as built by :func:`magic_state_updater`).
+    ``order``
+        With order 1, the nonlinear variables are updated first (with the
+        values of the linear variables at the start of the step), then the
+        linear variables. With order 2 (e.g. with :class:`RK2StateUpdater`),
+        the linear variables are updated over half a step before and after
+        the nonlinear update (Strang splitting).
+    
+    The linear update is done in place with the steps of
+    :func:`linear_update_steps`, as for :class:`LinearStateUpdater`, which
+    only touch the rows of the linear variables.
+    '''
+    def __init__(self, eqs, linear_variables, nonlinear_updater, clock=None, order=1):
+        if clock is None:
+            clock = guess_clock()
+        self.eqs = eqs
+        self.linear_variables = linear_variables
+        self.nonlinear_updater = nonlinear_updater
+        self.order = order
+        indices = [eqs._diffeq_names.index(var) for var in linear_variables]
+        n = len(eqs._diffeq_names)
+        if order == 2:
+            dt = clock.dt / 2
+        else:
+            dt = clock.dt
+        A, C = get_linear_update(eqs, linear_variables, dt)
+        self.A = eye(n)
+        self.A[ix_(indices, indices)] = A
+        self._C = zeros(n)
+        self._C[indices] = C
+        self._steps = linear_update_steps(self.A, self._C)
+        self._scratch = None
+
+    def _linear_update(self, S):
+        n = S.shape[1]
+        scratch = self._scratch
+        if scratch is None or scratch.shape[1] != n or scratch.dtype != S.dtype:
+            scratch = self._scratch = empty((3, n), dtype=S.dtype)
+        apply_linear_update_steps(self._steps, S, scratch)
+
+    def rest(self, P):
+        '''
+        Sets the variables at rest.
+        '''
+        for name, value in self.eqs.fixed_point().iteritems():
+            P.state(name)[:] = value
+
+    def __call__(self, P):
+        if self.order == 2:
+            self._linear_update(P._S)
+            self.nonlinear_updater(P)
+            self._linear_update(P._S)
+        else:
+            self.nonlinear_updater(P)
+            self._linear_update(P._S)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_scratch'] = None
+        return state
+
+    def __len__(self):
+        '''
+        Number of state variables
+        '''
+        return len(self.eqs)
+
+    def __repr__(self):
+        return 'Split StateUpdater (exact updates of ' + ', '.join(self.linear_variables) + \
+               ') with ' + str(len(self)) + ' state variables'
+    __str__ = __repr__
+
+
 class NonlinearStateUpdater(StateUpdater):
     '''
     A nonlinear model with dynamics dX/dt = f(X).
     Uses an Equations object.
     By default, uses Euler integration.
+    
+    If compile is True, the update code is generated so that it does not
+    create temporary arrays (see :meth:`Equations.forward_euler_inplace_code`):
+    it uses in-place ufuncs writing into scratch rows, allocated once with
+    the size of the group, and constant subexpressions are only computed
+    once. If the global preference ``usenumexpr`` is True and the numexpr
+    package is installed, each equation is instead evaluated by numexpr in a
+    single multithreaded pass. Equations that cannot be translated (e.g.
+    calling arbitrary functions) use the former generated code.
     '''
     def __init__(self, eqs, clock=None, compile=False, freeze=False):
         '''
@@ -503,8 +1108,69 @@ class NonlinearStateUpdater(StateUpdater):
         if freeze:
             self.eqs.compile_functions(freeze=freeze)
         self._frozen=freeze
+        # only the forward Euler update of uncompiled equations is done on
+        # subsets of the neurons
+        self.partial_updates = not compile and self.__class__ is NonlinearStateUpdater
+        self._inplace = None
         if compile:
-            self._code = self.eqs.forward_euler_code()
+            self._inplace = self.eqs.forward_euler_inplace_code(use_numexpr=self._use_numexpr())
+            if self._inplace is None:
+                self._code = self.eqs.forward_euler_code()
+        self._inplace_namespace = None
+
+    def _use_numexpr(self):
+        if not get_global_preference('usenumexpr'):
+            return False
+        if not optimiser.numexpr_available:
+            log_warn('brian.stateupdater', 'numexpr is not installed, using in-place code instead')
+            return False
+        return True
+
+    def _inplace_update(self, P):
+        '''
+        Executes the in-place update code, binding the variables to the
+        state matrix and to scratch rows the first time (or if the state
+        matrix has changed).
+        '''
+        ns = self._inplace_namespace
+        if ns is None or ns['_S'] is not P._S:
+            S = P._S
+            code = self._inplace
+            self._scratch = zeros((len(code.rows), S.shape[1]), dtype=S.dtype)
+            ns = dict(code.namespace)
+            for i, name in enumerate(self.eqs._diffeq_names):
+                ns[name] = S[i]
+            for i, name in enumerate(code.rows):
+                ns[name] = self._scratch[i]
+            ns['_S'] = S
+            ns['_ns'] = ns
+            ns['_code'] = compile(code.code, 'In-place update code', 'exec')
+            self._inplace_namespace = ns
+        ns['dt'] = P.clock._dt
+        ns['t'] = P.clock._t
+        exec ns['_code'] in ns
+
+    def update_indices(self, P, indices):
+        '''
+        Updates the state variables of the neurons with the given indexes
+        only (used by groups whose refractory neurons are inactive).
+        '''
+        S = P._S.take(indices, axis=1)
+        states = dict(zip(self.eqs._diffeq_names, S))
+        if self._frozen:
+            states['t'] = P.clock._t # without units
+        else:
+            states['t'] = P.clock.t
+        self.eqs.forward_euler(states, P.clock._dt)
+        P._S[:, indices] = S
+
+    def __getstate__(self):
+        # the namespace contains a code object, and the scratch rows are
+        # only allocated when needed
+        state = self.__dict__.copy()
+        state['_inplace_namespace'] = None
+        state.pop('_scratch', None)
+        return state
 
     def rest(self, P):
         '''
@@ -527,6 +1193,9 @@ class NonlinearStateUpdater(StateUpdater):
         #states=dict.fromkeys(self.eqs.dynamicvars)
         # store that in the neurongroup?
         if self.optimized:
+            if self._inplace is not None:
+                self._inplace_update(P)
+                return
             if self._first_time:
                 self._first_time = False
                 P._dS = 0 * P._S
@@ -602,8 +1271,12 @@ class ExponentialEulerStateUpdater(NonlinearStateUpdater):
         if freeze:
             self.eqs.compile_functions(freeze=freeze)
         self._frozen=freeze
+        self._inplace = None
         if compile:
-            self._code = self.eqs.exponential_euler_code()
+            self._inplace = self.eqs.exponential_euler_inplace_code(use_numexpr=self._use_numexpr())
+            if self._inplace is None:
+                self._code = self.eqs.exponential_euler_code()
+        self._inplace_namespace = None
 
     def __call__(self, P):
         '''
@@ -612,6 +1285,9 @@ class ExponentialEulerStateUpdater(NonlinearStateUpdater):
         P is the neuron group.
         '''
         if self.optimized:
+            if self._inplace is not None:
+                self._inplace_update(P)
+                return
             if self._first_time:
                 self._first_time = False
                 P._dS = P._S.copy()
@@ -630,6 +1306,243 @@ class ExponentialEulerStateUpdater(NonlinearStateUpdater):
             self.eqs.exponential_euler(states, P.clock._dt)
 
 
+class RushLarsenStateUpdater(NonlinearStateUpdater):
+    '''
+    A nonlinear model with dynamics dX/dt = f(X), typically a
+    conductance-based model.
+    Uses the Rush-Larsen method: the gating variables (see
+    :meth:`Equations.gating_variables`), with dx/dt=(x_inf-x)/tau_x, are
+    updated exactly with the other variables held fixed, and the other
+    variables are integrated with the Euler (order=1) or Runge-Kutta midpoint
+    (order=2) method.
+    '''
+    def __init__(self, eqs, clock=None, order=1, compile=False, freeze=False):
+        '''
+        Initialize a nonlinear model with dynamics dX/dt = f(X).
+        If compile is True (only with order=1), in-place update code is
+        generated as for :class:`NonlinearStateUpdater`.
+        '''
+        self.eqs = eqs
+        self.order = order
+        self.gating = eqs.gating_variables()
+        log_info('brian.stateupdater', 'Rush-Larsen method, gating variables: ' + ', '.join(self.gating))
+        self.optimized = False
+        self._first_time = True
+        if freeze:
+            self.eqs.compile_functions(freeze=freeze)
+        self._frozen = freeze
+        self._inplace = None
+        if compile:
+            if order == 1:
+                self._inplace = self.eqs.rush_larsen_inplace_code(self.gating,
+                                                                  use_numexpr=self._use_numexpr())
+                self.optimized = self._inplace is not None
+            else:
+                warnings.warn('Compilation is not implemented yet for second order Rush-Larsen integration.')
+        self._inplace_namespace = None
+
+    def __call__(self, P):
+        '''
+        Updates the state variables.
+        Careful here: always use the slice operation for affectations.
+        P is the neuron group.
+        '''
+        if self.optimized:
+            self._inplace_update(P)
+        else:
+            states = dict.fromkeys(self.eqs._diffeq_names)
+            for var in self.eqs._diffeq_names:
+                states[var] = P.state_(var)
+            if self._frozen:
+                states['t'] = P.clock._t # without units
+            else:
+                states['t'] = P.clock.t #time
+            self.eqs.rush_larsen(states, P.clock._dt, self.gating, self.order)
+
+
+class AdaptiveRKStateUpdater(NonlinearStateUpdater):
+    '''
+    A nonlinear model with dynamics dX/dt = f(X), integrated with the
+    embedded Runge-Kutta pair of Bogacki and Shampine (third order, with a
+    second order error estimate).
+    
+    Each clock tick is divided into sub-steps whose size is adapted to the
+    error of the whole group: a sub-step is accepted if, for all neurons and
+    variables, the error estimate is below ``atol+rtol*abs(x)``. The last
+    sub-step size is kept for the next tick.
+    
+    Threshold crossings are located within the tick: when the threshold
+    condition of the group becomes true during a sub-step, the crossing time
+    is found by bisection on the cubic Hermite interpolation of the sub-step,
+    the neuron is set to its (interpolated) state just after the crossing and
+    is not integrated until the end of the tick. The threshold thus fires on
+    the correct tick, and short excursions after a spike (e.g. the divergence
+    of an exponential integrate-and-fire model) do not reduce the sub-steps.
+    At the next tick, the neuron is first integrated over the time between
+    the crossing and the end of the tick, from its state after the reset if
+    there is one (so that the reset effectively occurs at the crossing time)
+    or from its state at the crossing otherwise.
+    The time of the last crossing of each neuron is stored in the array
+    ``crossing_times`` (in seconds). This is not done for stochastic
+    thresholds (:class:`PoissonThreshold`) or :class:`EmpiricalThreshold`.
+    
+    Initialised with arguments:
+    
+    ``eqs``
+        The :class:`Equations` object.
+    ``clock``
+        The clock.
+    ``rtol=1e-3``
+        The relative tolerance.
+    ``atol=1e-6``
+        The absolute tolerance, in SI units (e.g. volt), or a dictionary
+        with the absolute tolerances of some variables (with units),
+        1e-6 being used for the others.
+    ``freeze=False``
+        If True, parameters are replaced by their values at initialisation.
+    '''
+    def __init__(self, eqs, clock=None, rtol=1e-3, atol=1e-6, freeze=False):
+        self.eqs = eqs
+        self.optimized = False
+        self._first_time = True
+        if freeze:
+            self.eqs.compile_functions(freeze=freeze)
+        self._frozen = freeze
+        self.rtol = rtol
+        if not isinstance(atol, dict):
+            atol = dict.fromkeys(eqs._diffeq_names, atol)
+        self.atol = array([float(atol.get(var, 1e-6)) for var in eqs._diffeq_names])
+        self._h = None
+        self._lag = None
+        self.crossing_times = None
+        self.substeps = 0 # Number of accepted sub-steps
+        self.rejected = 0 # Number of rejected sub-steps
+
+    def _derivatives(self, S, t):
+        '''
+        Returns the matrix of derivatives at the state matrix S and time t.
+        '''
+        states = dict(zip(self.eqs._diffeq_names, S))
+        if self._frozen:
+            states['t'] = t
+        else:
+            states['t'] = t * second
+        dS = zeros(S.shape)
+        for i, var in enumerate(self.eqs._diffeq_names):
+            if var in self.eqs._diffeq_names_nonzero:
+                f = self.eqs._function[var]
+                dS[i] = f(*[states[name] for name in f.func_code.co_varnames])
+        return dS
+
+    def _above_threshold(self, P, S, neurons):
+        '''
+        Returns the neurons (among the indices in neurons) for which the
+        threshold condition holds with state matrix S (values for those
+        neurons only).
+        '''
+        old = P._S[:, neurons]
+        P._S[:, neurons] = S
+        spikes = P._threshold(P)
+        P._S[:, neurons] = old
+        return neurons[in1d(neurons, spikes)]
+
+    def __call__(self, P):
+        '''
+        Updates the state variables over one clock tick.
+        P is the neuron group.
+        '''
+        S = P._S
+        N = S.shape[1]
+        t = P.clock._t
+        tend = t + P.clock._dt
+        h = self._h or P.clock._dt
+        if self.crossing_times is None or len(self.crossing_times) != N:
+            self.crossing_times = zeros(N) * nan
+            self._lag = zeros(N)
+        threshold = getattr(P, '_threshold', None)
+        locate = (threshold is not None and
+                  not isinstance(threshold, (NoThreshold, PoissonThreshold, EmpiricalThreshold)))
+        # Neurons which crossed the threshold during the previous tick,
+        # whether they have been reset or not
+        if self._lag.any():
+            self._catch_up(S, t, self._lag)
+        self._lag = zeros(N)
+        if locate:
+            # Only the neurons below threshold at the start of the tick
+            below = ones(N, dtype=bool)
+            below[threshold(P)] = False
+        active = ones(N, dtype=bool)
+        atol = self.atol[:, newaxis]
+        k1 = self._derivatives(S, t)
+        while tend - t > 1e-9 * P.clock._dt:
+            h = min(h, tend - t)
+            k2 = self._derivatives(S + .5 * h * k1, t + .5 * h)
+            k3 = self._derivatives(S + .75 * h * k2, t + .75 * h)
+            S3 = S + h * (2. / 9 * k1 + 1. / 3 * k2 + 4. / 9 * k3)
+            S3[:, ~active] = S[:, ~active]
+            k4 = self._derivatives(S3, t + h)
+            E = h * (-5. / 72 * k1 + 1. / 12 * k2 + 1. / 9 * k3 - 1. / 8 * k4)
+            E /= atol + self.rtol * maximum(abs(S), abs(S3))
+            E[:, ~active] = 0
+            err = abs(E).max() if N else 0.
+            if not isfinite(err):
+                err = Inf
+            if err <= 1:
+                self.substeps += 1
+                if locate:
+                    neurons = (active & below).nonzero()[0]
+                    crossing = self._above_threshold(P, S3[:, neurons], neurons)
+                    if len(crossing):
+                        self._locate(P, crossing, S[:, crossing], S3[:, crossing],
+                                     k1[:, crossing], k4[:, crossing], t, h)
+                        active[crossing] = False
+                        self._lag[crossing] = tend - self.crossing_times[crossing]
+                        S3[:, crossing] = S[:, crossing] # located states
+                S[:] = S3
+                t += h
+                k1 = k4
+            else:
+                self.rejected += 1
+            # Step size control (third order method)
+            if err > 0:
+                h *= min(5., max(.2, .9 * err ** (-1. / 3)))
+            else:
+                h *= 5.
+        self._h = min(h, P.clock._dt)
+
+    def _catch_up(self, S, t, h):
+        '''
+        Integrates each neuron over its own time step (array h, zero for
+        the neurons which are not updated) before time t, with the third
+        order method.
+        '''
+        t = t - h
+        k1 = self._derivatives(S, t)
+        k2 = self._derivatives(S + .5 * h * k1, t + .5 * h)
+        k3 = self._derivatives(S + .75 * h * k2, t + .75 * h)
+        S += h * (2. / 9 * k1 + 1. / 3 * k2 + 4. / 9 * k3)
+
+    def _locate(self, P, neurons, S0, S1, k0, k1, t, h, iterations=20):
+        '''
+        Locates the threshold crossings of the given neurons between the
+        states S0 (time t, derivative k0) and S1 (time t+h, derivative k1),
+        by bisection on the cubic Hermite interpolation. The states just
+        after the crossings are written into P._S.
+        '''
+        def interpolate(s):
+            return ((1 + 2 * s) * (1 - s) ** 2 * S0 + s ** 2 * (3 - 2 * s) * S1 +
+                    h * s * (1 - s) ** 2 * k0 - h * s ** 2 * (1 - s) * k1)
+        lower = zeros(len(neurons))
+        upper = ones(len(neurons))
+        for _ in xrange(iterations):
+            s = .5 * (lower + upper)
+            above = in1d(neurons, self._above_threshold(P, interpolate(s), neurons))
+            upper[above] = s[above]
+            lower[~above] = s[~above]
+        self.crossing_times[neurons] = t + upper * h
+        P._S[:, neurons] = interpolate(upper)
+
+
 class SynapticNoise(StateUpdater):
     '''
     Synaptic noise mechanism, plugged into another StateUpdater.
@@ -438,6 +438,8 @@ class STDP(NetworkOperation):
             # only provide lookup of variable names if we have some variable names, i.e.
             # if the var_index attribute exists
             raise AttributeError
+        if name not in self.var_group:
+            raise AttributeError(name)
         G = self.var_group[name]
         return G.state_(name)
 
@@ -45,14 +45,9 @@ Main methods:
     homogeneous.
 """
 import numpy as np
-try:
-    import pylab
-except:
-    pass
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from brian.utils.lazyimport import LazyModule
+pylab = LazyModule('pylab')
+from brian.utils.kernelcache import weave
 
 from brian.globalprefs import get_global_preference, exists_global_preference, define_global_preference
 from brian.monitor import SpikeMonitor
@@ -129,7 +124,18 @@ class SpikeQueue(SpikeMonitor):
     (faster), or determined at run time (saves memory). Note that if they
     are determined at run time, then it is possible to also vectorise over
     presynaptic spikes.
+    
+    If the C++ version (``brian.experimental.cspikequeue``) is compiled,
+    creating a SpikeQueue returns an instance of a wrapper to it instead. The
+    extension is imported when the first SpikeQueue is created.
     '''
+    def __new__(cls, *args, **kwds):
+        if cls is SpikeQueue:
+            CSpikeQueue = _c_spike_queue()
+            if CSpikeQueue is not None:
+                return CSpikeQueue(*args, **kwds)
+        return object.__new__(cls)
+
     def __init__(self, source, synapses, delays,
                  max_delay = 0*ms, maxevents = INITIAL_MAXSPIKESPER_DT,
                  precompute_offsets = True):
@@ -430,65 +436,74 @@ class SpikeQueue(SpikeMonitor):
         if display:
             pylab.show()
 
-try:
-    ## CSpikeQueue support!
-    # replaces the SpikeQueue object by a wrapper for the C++ version
-    # this is only if the import statement below doesn't fail (i.e. the c version is compiled)
-
-    ## try to import the CSpikeQueue
-    import brian.experimental.cspikequeue.cspikequeue as _cspikequeue
-    has_cspikequeue = True
-
-    ## OK, now replace SpikeQueue by a wrapper to the C version
-    # this adds compatibility easily to all usual the arguments of SpikeQueue
-    # hence the arguments should match those of the class above
-    class SpikeQueue(_cspikequeue.SpikeQueue, SpikeMonitor):
-        def __init__(self, source, synapses, delays,
-                     max_delay = 60*ms, maxevents = INITIAL_MAXSPIKESPER_DT,
-                     precompute_offsets = True):
-            self._precompute_offsets = precompute_offsets
-            SpikeMonitor.__init__(self, source, record = False)
-
-            nsteps = int(np.floor(max_delay/self.source.clock.dt))+1
-
-            self._max_delay = max_delay
-
-            self.synapses = synapses
-            self.delays = delays # Delay handling should also be in C
-
-            _cspikequeue.SpikeQueue.__init__(self, nsteps, int(maxevents))
-
-#            self._spikequeue = _cspikequeue.SpikeQueue(nsteps, int(maxevents))
+_CSpikeQueue = []
 
-        def compress(self):
-            nsteps=max(self.delays)+1
-
-            # Check whether some delays are too long
-            if (nsteps>self.n_delays):
-                desired_max_delay = nsteps * self.source.clock.dt
-                raise ValueError,"Synaptic delays exceed maximum delay, set max_delay to %.1f ms" % (desired_max_delay/ms)
-
-            if hasattr(self, '_iscompressed') and self._iscompressed:
-                return
-
-            self._iscompressed = True
-
-            # Adjust the maximum delay and number of events per timestep if necessary
-            maxevents=self.n_maxevents
-            if maxevents==INITIAL_MAXSPIKESPER_DT: # automatic resize
-                maxevents=max(INITIAL_MAXSPIKESPER_DT, max([len(targets) for targets in self.synapses]))
-
-            # Resize
-
-            self.expand(int(maxevents))
-        def propagate(self, spikes):
-            '''
-            Called by the network object at every timestep.
-            Spikes produce synaptic events that are inserted in the queue. 
-            '''
-            if len(spikes):
-                synaptic_events=np.hstack([self.synapses[i].data for i in spikes]) # could be not efficient
-                self.insert(synaptic_events, self.delays[synaptic_events])   
-        warnings.warn('Using C++ SpikeQueue')
-except ImportError:
-    has_cspikequeue = False
+def _c_spike_queue():
+    '''
+    Returns the wrapper for the C++ version of SpikeQueue, or None if it is not
+    compiled. The extension is only imported the first time.
+    '''
+    if not _CSpikeQueue:
+        try:
+            ## CSpikeQueue support!
+            # replaces the SpikeQueue object by a wrapper for the C++ version
+            # this is only if the import statement below doesn't fail (i.e. the c version is compiled)
+
+            ## try to import the CSpikeQueue
+            import brian.experimental.cspikequeue.cspikequeue as _cspikequeue
+
+            ## OK, now replace SpikeQueue by a wrapper to the C version
+            # this adds compatibility easily to all usual the arguments of SpikeQueue
+            # hence the arguments should match those of the class above
+            class CSpikeQueue(_cspikequeue.SpikeQueue, SpikeMonitor):
+                def __init__(self, source, synapses, delays,
+                             max_delay = 60*ms, maxevents = INITIAL_MAXSPIKESPER_DT,
+                             precompute_offsets = True):
+                    self._precompute_offsets = precompute_offsets
+                    SpikeMonitor.__init__(self, source, record = False)
+
+                    nsteps = int(np.floor(max_delay/self.source.clock.dt))+1
+
+                    self._max_delay = max_delay
+
+                    self.synapses = synapses
+                    self.delays = delays # Delay handling should also be in C
+
+                    _cspikequeue.SpikeQueue.__init__(self, nsteps, int(maxevents))
+
+        #            self._spikequeue = _cspikequeue.SpikeQueue(nsteps, int(maxevents))
+
+                def compress(self):
+                    nsteps=max(self.delays)+1
+
+                    # Check whether some delays are too long
+                    if (nsteps>self.n_delays):
+                        desired_max_delay = nsteps * self.source.clock.dt
+                        raise ValueError,"Synaptic delays exceed maximum delay, set max_delay to %.1f ms" % (desired_max_delay/ms)
+
+                    if hasattr(self, '_iscompressed') and self._iscompressed:
+                        return
+
+                    self._iscompressed = True
+
+                    # Adjust the maximum delay and number of events per timestep if necessary
+                    maxevents=self.n_maxevents
+                    if maxevents==INITIAL_MAXSPIKESPER_DT: # automatic resize
+                        maxevents=max(INITIAL_MAXSPIKESPER_DT, max([len(targets) for targets in self.synapses]))
+
+                    # Resize
+
+                    self.expand(int(maxevents))
+                def propagate(self, spikes):
+                    '''
+                    Called by the network object at every timestep.
+                    Spikes produce synaptic events that are inserted in the queue. 
+                    '''
+                    if len(spikes):
+                        synaptic_events=np.hstack([self.synapses[i].data for i in spikes]) # could be not efficient
+                        self.insert(synaptic_events, self.delays[synaptic_events])   
+                warnings.warn('Using C++ SpikeQueue')
+        except ImportError:
+            CSpikeQueue = None
+        _CSpikeQueue.append(CSpikeQueue)
+    return _CSpikeQueue[0]
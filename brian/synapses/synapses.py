@@ -23,12 +23,12 @@ from brian.synapses.synapticvariable import (SynapticDelayVariable,
 from brian.utils.documentation import flattened_docstring
 from brian.utils.dynamicarray import DynamicArray, DynamicArray1D 
 
-try:
-    import sympy
-    use_sympy = True
-except:
+from brian.utils.lazyimport import LazyModule, module_available
+
+sympy = LazyModule('sympy')
+use_sympy = module_available('sympy')
+if not use_sympy:
     warnings.warn('sympy not installed: some features in Synapses will not be available')
-    use_sympy = False
 
 __all__ = ['Synapses','invert_array']
 
@@ -86,6 +86,12 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         equations. TODO: more details.
     ``code_namespace=None``
         Namespace for the pre and post codes.
+    ``dtype=None``
+        The floating point type of the synaptic variables (e.g. ``float32``),
+        by default ``float64`` whatever the type of the target group. The
+        variable ``lastupdate`` and the delays have this type too, so single
+        precision should only be used for short simulations (times have a
+        resolution of about 1 us after 10 s).
         
     **Methods**
     
@@ -150,7 +156,8 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
              max_delay = 0*ms,
              level = 0,
              clock = None, code_namespace=None,
-             unit_checking = True, method = None, freeze = False, implicit = False, order = 1): # model (state updater) related
+             unit_checking = True, method = None, freeze = False, implicit = False, order = 1, # model (state updater) related
+             dtype = None):
         
         target=target or source # default is target=source
 
@@ -218,11 +225,14 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
 
         self.source=source
         self.target=target
+        if dtype is None:
+            dtype=np.float64 # lastupdate and delays are stored in _S
         
         NeuronGroup.__init__(self, 0,
                              model=model, clock=clock, level=level+1,
                              unit_checking=unit_checking, method=method,
-                             freeze=freeze, implicit=implicit, order=order)
+                             freeze=freeze, implicit=implicit, order=order,
+                             dtype=dtype)
         
         # Dynamical delays
         if "delay" in self.var_index: # if there is a "delay" variable specified in the model eqns
@@ -304,7 +314,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
 
         # _S is turned to a dynamic array - OK this is probably not good! we may lose references at this point
         S=self._S
-        self._S=DynamicArray(S.shape)
+        self._S=DynamicArray(S.shape,dtype=S.dtype)
         self._S[:]=S
 
         # Pre and postsynaptic delays (synapse -> delay_pre/delay_post)
@@ -901,7 +911,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
     def uncompress(self):
         # make the state matrix a dynamic array again
         S = self._S
-        self._S = DynamicArray(S.shape)
+        self._S = DynamicArray(S.shape, dtype=S.dtype)
         self._S[:] = S
         # now isn't compressed
         self._iscompressed = False
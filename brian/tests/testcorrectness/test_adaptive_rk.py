@@ -0,0 +1,56 @@
+from brian import *
+
+def test_adaptive_rk_accuracy():
+    '''
+    The adaptive Runge-Kutta method reaches the requested accuracy
+    '''
+    reinit_default_clock()
+    tau = 10 * ms
+    G = NeuronGroup(5, 'dv/dt = -v ** 2 / tau : 1', method='adaptive_RK')
+    G._state_updater = AdaptiveRKStateUpdater(G._state_updater.eqs, G.clock,
+                                              rtol=1e-7, atol=1e-9)
+    v0 = linspace(1, 10, 5)
+    G.v = v0
+    run(20 * ms)
+    assert abs(G.v - v0 / (1 + v0 * 2)).max() < 1e-5
+
+def test_threshold_location():
+    '''
+    Threshold crossings are located within a tick, and the reset is done at
+    the crossing time
+    '''
+    reinit_default_clock()
+    tau = 10 * ms
+    clock = Clock(dt=1 * ms)
+    G = NeuronGroup(1, 'dv/dt = (2 - v) / tau : 1', threshold=1, reset=0,
+                    method='adaptive_RK', clock=clock)
+    crossings = []
+    def f(spikes):
+        crossings.extend(G._state_updater.crossing_times[spikes])
+    M = SpikeMonitor(G)
+    C = SpikeMonitor(G, function=f)
+    run(100 * ms)
+    period = float(tau) * log(2)
+    expected = period * arange(1, len(crossings) + 1)
+    assert len(crossings) == int(.1 / period)
+    assert abs(array(crossings) - expected).max() < 1e-5
+    # spikes are emitted on the tick of the crossing
+    assert all(array(M[0] / clock.dt, dtype=int) == array(expected / clock.dt, dtype=int))
+
+def test_threshold_without_reset():
+    '''
+    Neurons which are not reset after a crossing are integrated over the
+    rest of the tick
+    '''
+    reinit_default_clock()
+    G = NeuronGroup(1, 'dx/dt = 1 / ms : 1', threshold='x > 0.55',
+                    method='adaptive_RK')
+    M = SpikeMonitor(G)
+    run(2 * ms)
+    assert M.nspikes > 0
+    assert abs(G.x[0] - 2) < 1e-6
+
+if __name__ == '__main__':
+    test_adaptive_rk_accuracy()
+    test_threshold_location()
+    test_threshold_without_reset()
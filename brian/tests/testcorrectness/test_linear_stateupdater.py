@@ -0,0 +1,181 @@
+from brian import *
+from brian.stateupdater import linear_update_steps
+
+def test_structured_linear_update():
+    '''
+    The structured update of :class:`LinearStateUpdater` gives the same
+    results as the matrix product
+    '''
+    reinit_default_clock()
+    tau = 10 * ms
+    taue = 5 * ms
+    tauw = 100 * ms
+    El = -70 * mV
+    eqs = '''
+    dv/dt = (ge - (v - El) - w) / tau : volt
+    dw/dt = (0.5 * (v - El) - w) / tauw : volt
+    dge/dt = -ge / taue : volt
+    dx/dt = -x / tau : 1
+    dy/dt = -y / tauw : 1
+    dp1/dt = (p2 - p1) / tau : 1
+    dp2/dt = (p3 - p2) / tau : 1
+    dp3/dt = (p4 - p3 + x) / tau : 1
+    dp4/dt = (p1 - p4) / tau : 1
+    '''
+    G = NeuronGroup(10, eqs)
+    U = G._state_updater
+    assert isinstance(U, LinearStateUpdater)
+    assert sorted(set(step[0] for step in U._steps)) == ['block', 'dense', 'scale']
+    # exact zeros in the update matrix
+    assert U.A[G.get_var_index('ge'), G.get_var_index('v')] == 0
+    assert U.A[G.get_var_index('p1'), G.get_var_index('y')] == 0
+    G._S[:] = rand(*G._S.shape)
+    S = G._S.copy()
+    expected = dot(U.A, S)
+    if U._useB:
+        expected += U._C
+    U(G)
+    assert abs(G._S - expected).max() < 1e-12
+    # without constant term
+    A = U.A
+    steps = linear_update_steps(A)
+    U._steps, U._useB = steps, False
+    G._S[:] = S
+    U(G)
+    assert abs(G._S - dot(A, S)).max() < 1e-12
+    # the matrix product is used when switched off
+    set_global_preferences(usestructured_linear_diffeq=False)
+    try:
+        H = NeuronGroup(10, eqs)
+    finally:
+        set_global_preferences(usestructured_linear_diffeq=True)
+    assert H._state_updater._steps is None
+    H._S[:] = S
+    H._state_updater(H)
+    assert abs(H._S - expected).max() < 1e-12
+    # diagonal matrix and dense matrix
+    assert [step[0] for step in linear_update_steps(diag([0.5, 0.2]))] == ['scale']
+    assert linear_update_steps(ones((2, 2))) is None
+    # unchanged variables are skipped
+    assert linear_update_steps(diag([1., 0.5])) == [('scale', 1, 2, array([[0.5]]), None)]
+
+def test_heterogeneous_linear_update():
+    '''
+    Exact integration of linear equations with parameters which differ
+    between neurons
+    '''
+    reinit_default_clock()
+    eqs = '''
+    dv/dt = (ge - v) / tau : 1
+    dge/dt = -ge / taue : 1
+    du/dt = (1 - u) / tau : 1
+    tau : second
+    taue : second
+    '''
+    G = NeuronGroup(3, eqs)
+    assert isinstance(G._state_updater, HeterogeneousLinearStateUpdater)
+    tau = array([5., 10., 20.]) * ms
+    taue = array([1., 2., 3.]) * ms
+    G.tau = tau
+    G.taue = taue
+    G.ge = 1
+    net = Network(G)
+    net.run(10 * ms)
+    t = 10 * ms
+    assert abs(G.ge - exp(-t / taue)).max() < 1e-10
+    v = taue * (exp(-t / taue) - exp(-t / tau)) / (taue - tau)
+    assert abs(G.v - v).max() < 1e-10
+    assert abs(G.u - (1 - exp(-t / tau))).max() < 1e-10
+    # changing the parameters during the run
+    G.u = 0
+    G.tau = 2 * tau
+    net.run(10 * ms)
+    assert abs(G.u - (1 - exp(-t / (2 * tau)))).max() < 1e-10
+    # diagonal equations
+    H = NeuronGroup(3, '''
+                       dv/dt = (1 - v) / tau : 1
+                       tau : second
+                       ''')
+    assert isinstance(H._state_updater, HeterogeneousLinearStateUpdater)
+    H.tau = tau
+    Network(H).run(10 * ms)
+    assert H._state_updater._diagonal
+    assert abs(H.v - (1 - exp(-t / tau))).max() < 1e-10
+
+def test_split_state_updater():
+    '''
+    The linear subsystem of a nonlinear model is updated exactly, the other
+    variables numerically
+    '''
+    reinit_default_clock()
+    taum, taue, taui = 20 * ms, 5 * ms, 10 * ms
+    Ee, Ei, El = 0 * mV, -80 * mV, -60 * mV
+    eqs = '''
+    dv/dt = (ge * (Ee - v) + gi * (Ei - v) + (El - v)) / taum : volt
+    dge/dt = -ge / taue : 1
+    dgi/dt = (u - gi) / taui : 1
+    du/dt = -u / taui : 1
+    dw/dt = (v - El) / (100 * mV * taum) - w * ge / taue : 1
+    '''
+    namespace = dict(taum=taum, taue=taue, taui=taui, Ee=Ee, Ei=Ei, El=El)
+    model = Equations(eqs, **namespace)
+    model.prepare()
+    assert model.linear_variables() == ['ge', 'gi', 'u']
+    def run_model(dt, method, order=1, compile=False):
+        reinit_default_clock()
+        clock = Clock(dt=dt)
+        G = NeuronGroup(10, Equations(eqs, **namespace), method=method, order=order, compile=compile,
+                        freeze=compile, clock=clock)
+        G.v = El
+        G.ge = linspace(0, 1, 10)
+        G.u = linspace(0, .5, 10)
+        Network(G).run(20 * ms)
+        return G
+    reference = run_model(.001 * ms, 'RK', order=2)
+    for order, compile, tolerance in [(1, False, .1), (1, True, .1), (2, False, .001)]:
+        G = run_model(.1 * ms, None, order=order, compile=compile)
+        U = G._state_updater
+        assert isinstance(U, SplitStateUpdater)
+        assert U.nonlinear_updater.eqs._diffeq_names_nonzero == ['v', 'w']
+        t = 20 * ms
+        assert abs(G.ge - linspace(0, 1, 10) * exp(-t / taue)).max() < 1e-10
+        u0 = linspace(0, .5, 10)
+        assert abs(G.gi - u0 * t / taui * exp(-t / taui)).max() < 1e-10
+        assert abs(G.v - reference.v).max() < float(tolerance * mV)
+        assert abs(G.w - reference.w).max() < tolerance * 1e-2
+
+def test_split_state_updater_exp():
+    '''
+    The linear subsystem is also found when the membrane equation calls a
+    function (exponential integrate-and-fire model)
+    '''
+    reinit_default_clock()
+    # Brian's exp (a Python function), as found in the namespace of a script
+    namespace = dict(taum=20 * ms, taue=5 * ms, El=-70 * mV, DeltaT=2 * mV,
+                     VT=-50 * mV, Ee=0 * mV, exp=exp)
+    eqs = '''
+    dv/dt = (El - v + DeltaT * exp((v - VT) / DeltaT) + ge * (Ee - v)) / taum : volt
+    dge/dt = -ge / taue : 1
+    '''
+    model = Equations(eqs, **namespace)
+    model.prepare()
+    assert model.linear_variables() == ['ge']
+    def run_model(dt, method, order=1):
+        reinit_default_clock()
+        clock = Clock(dt=dt)
+        G = NeuronGroup(10, Equations(eqs, **namespace), method=method, order=order, clock=clock)
+        G.v = -60 * mV
+        G.ge = linspace(0, .3, 10)
+        Network(G).run(20 * ms)
+        return G
+    reference = run_model(.001 * ms, 'RK', order=2)
+    G = run_model(.1 * ms, None, order=2)
+    assert isinstance(G._state_updater, SplitStateUpdater)
+    assert abs(G.ge - linspace(0, .3, 10) * exp(-20 * ms / (5 * ms))).max() < 1e-10
+    assert abs(G.v - reference.v).max() < float(.001 * mV)
+
+if __name__ == '__main__':
+    test_structured_linear_update()
+    test_heterogeneous_linear_update()
+    test_split_state_updater()
+    test_split_state_updater_exp()
@@ -0,0 +1,159 @@
+from brian import *
+from brian.optimiser import InPlaceCode, numexpr_available, fold_constants, \
+    common_subexpressions
+
+def test_inplace_code():
+    '''
+    The in-place code gives the same results as evaluating the expressions
+    '''
+    v = rand(10)
+    w = rand(10)
+    x = rand(10)
+    namespace = {'exp': exp, 'x': x, 'tau': 0.01}
+    expressions = ['-(v - 0.5) / 0.01 + w ** 3 * exp(-v) + x',
+                   '2 * 3 + t',
+                   'v ** 2 + abs(w - 0.5) ** 0.5 - exp(t * 2)',
+                   'w']
+    code = InPlaceCode(['v', 'w'], ['t'])
+    for i, expr in enumerate(expressions):
+        code.assign(code.new_row('y' + str(i)), expr, namespace)
+    assert code.scalar('exp(-1 / tau)', namespace) == repr(exp(-1 / 0.01))
+    assert code.scalar('v * 2') is None
+    ns = dict(code.namespace, v=v, w=w, t=0.3)
+    for name in code.rows:
+        ns[name] = zeros(10)
+    exec code.code in ns
+    for i, expr in enumerate(expressions):
+        expected = eval(expr, {'v': v, 'w': w, 't': 0.3, 'x': x, 'exp': exp})
+        assert abs(ns['y' + str(i)] - expected).max() < 1e-12
+    # function calls that cannot be translated
+    try:
+        InPlaceCode(['v']).assign('y', 'f(v)', {'f': lambda v: v})
+    except NotImplementedError:
+        pass
+    else:
+        raise AssertionError('Expected NotImplementedError')
+
+def test_compound_powers():
+    '''
+    Small integer powers of intermediate results
+    '''
+    v = array([1., 2.])
+    w = array([0.5, 3.])
+    expressions = ['(v + 1) ** 3', '(v + 1) ** 4', '(v + 1) ** 2 * (w - 1) ** 3',
+                   '(v + 1) ** 3 + (w + v) ** 3 + w ** 3']
+    code = InPlaceCode(['v', 'w'])
+    for i, expr in enumerate(expressions):
+        code.assign(code.new_row('y' + str(i)), expr)
+    ns = dict(code.namespace, v=v, w=w)
+    for name in code.rows:
+        ns[name] = zeros(2)
+    exec code.code in ns
+    for i, expr in enumerate(expressions):
+        expected = eval(expr, {'v': v, 'w': w})
+        assert abs(ns['y' + str(i)] - expected).max() < 1e-12
+    # in a compiled state updater
+    results = []
+    for compile in [False, True]:
+        reinit_default_clock()
+        G = NeuronGroup(2, 'dv/dt = -(v + 1) ** 3 / (10 * ms) : 1',
+                        compile=compile, freeze=True)
+        G.v = [1, 2]
+        run(1 * ms)
+        results.append(G.v.copy())
+    assert abs(results[0] - results[1]).max() < 1e-10
+
+def test_common_subexpressions():
+    '''
+    Constant folding and common subexpression elimination
+    '''
+    assert fold_constants('v * (2 * 3) - (1 - 1) * w') == '((v*6)-(0*w))'
+    assert fold_constants('v * (2 * 3) - (1 - 1) * w', zeros=True) == '((v*6)-0.0)'
+    assert fold_constants('(-2) ** v + 1 / 0') == '(((-2)**v)+(1/0))'
+    exprs = ['exp(-v) * w + (v - 1) ** 2', 'exp(-v) - w * (v - 1) ** 2', '2 * 3 + w']
+    definitions, shared = common_subexpressions(exprs, ['v', 'w'])
+    # -v only occurs in exp(-v)
+    assert definitions == [('_cse0', 'exp((-v))'), ('_cse1', '((v-1)**2)')]
+    assert shared == ['((_cse0*w)+_cse1)', '(_cse0-(w*_cse1))', '((2*3)+w)']
+    # subexpressions containing excluded names are not shared
+    assert common_subexpressions(exprs, ['v', 'w'], exclude=['w'])[0] == definitions
+    assert common_subexpressions(exprs, ['v', 'w'], exclude=['v'])[0] == []
+    # in-place code
+    v = rand(10)
+    w = rand(10)
+    namespace = {'exp': exp}
+    code = InPlaceCode(['v', 'w'])
+    shared = code.share(exprs, [namespace] * 3)
+    for i, expr in enumerate(shared):
+        code.assign(code.new_row('y' + str(i)), expr, namespace)
+    assert code.code.count('_exp(') == 1
+    ns = dict(code.namespace, v=v, w=w)
+    for name in code.rows:
+        ns[name] = zeros(10)
+    exec code.code in ns
+    for i, expr in enumerate(exprs):
+        expected = eval(expr, {'v': v, 'w': w, 'exp': exp})
+        assert abs(ns['y' + str(i)] - expected).max() < 1e-12
+    # the rate functions are computed once for the two evaluations of the
+    # right hand side in the exponential Euler method
+    eqs = Equations('''
+    dm/dt = alpha * (1 - m) - beta * m : 1
+    alpha = exp(v) / (1 + exp(v)) / tau : Hz
+    beta = exp(-v) / tau : Hz
+    v : 1
+    ''', tau=10 * ms)
+    eqs.prepare()
+    code = eqs.exponential_euler_inplace_code()
+    assert code.code.count('_exp(') == 3
+
+def test_compiled_nonlinear_stateupdater():
+    '''
+    The compiled Euler and exponential Euler state updaters give the same
+    results as the uncompiled ones
+    '''
+    tau = 10 * ms
+    Vt = 1.
+    I = linspace(1, 2, 10)
+    eqs = '''
+    dv/dt = (I - v + w ** 2 - g * v) / tau : 1
+    dw/dt = (exp(-v) - w) / (5 * tau) : 1
+    dg/dt = -g / tau : 1
+    '''
+    for implicit in [False, True]:
+        for usenumexpr in [False, True]:
+            if usenumexpr and not numexpr_available:
+                continue
+            set_global_preferences(usenumexpr=usenumexpr)
+            try:
+                results = []
+                for compile in [False, True]:
+                    reinit_default_clock()
+                    G = NeuronGroup(10, eqs, compile=compile, freeze=True,
+                                    implicit=implicit)
+                    G.v = linspace(0, 1, 10)
+                    G.g = 0.5
+                    run(10 * ms)
+                    results.append(G._S.copy())
+                    if compile:
+                        # g is linear and updated separately from v and w
+                        updater = G._state_updater
+                        assert updater.linear_variables == ['g']
+                        assert updater.nonlinear_updater._inplace is not None
+            finally:
+                set_global_preferences(usenumexpr=False)
+            assert abs(results[0] - results[1]).max() < 1e-10
+    # equations that cannot be translated (comparisons) use the former
+    # generated code
+    reinit_default_clock()
+    I0 = 1.5
+    G = NeuronGroup(10, 'dv/dt = (I0 * (v < 2) - v) / tau : 1', compile=True,
+                    method='Euler')
+    assert G._state_updater._inplace is None
+    run(10 * ms)
+    assert abs(G.v - I0 * (1 - exp(-1))).max() < 0.01
+
+if __name__ == '__main__':
+    test_inplace_code()
+    test_compound_powers()
+    test_common_subexpressions()
+    test_compiled_nonlinear_stateupdater()
@@ -0,0 +1,98 @@
+from brian import *
+from brian.library.ionic_currents import *
+
+def hh_equations():
+    eqs = MembraneEquation(1 * uF) + leak_current(.3 * msiemens, 10.6 * mV)
+    eqs += K_current_HH(36 * msiemens, -12 * mV) + Na_current_HH(120 * msiemens, 115 * mV)
+    eqs += Current('I:amp')
+    return eqs
+
+hh_model = '''
+dvm/dt = (gl * (El - vm) + gK * n ** 4 * (EK - vm) + gNa * m ** 3 * h * (ENa - vm) + I) / C : volt
+dm/dt = alpham * (1 - m) - betam * m : 1
+dn/dt = alphan * (1 - n) - betan * n : 1
+dh/dt = alphah * (1 - h) - betah * h : 1
+alpham = .1 * (25 * mV - vm) / (exp(2.5 - .1 * vm / mV) - 1) / mV / ms : Hz
+betam = 4 * exp(-.0556 * vm / mV) / ms : Hz
+alphah = .07 * exp(-.05 * vm / mV) / ms : Hz
+betah = 1. / (1 + exp(3. - .1 * vm / mV)) / ms : Hz
+alphan = .01 * (10 * mV - vm) / (exp(1 - .1 * vm / mV) - 1) / mV / ms : Hz
+betan = .125 * exp(-.0125 * vm / mV) / ms : Hz
+I : amp
+'''
+
+def test_gating_variables():
+    '''
+    Gating variables are detected in Hodgkin-Huxley and simple models
+    '''
+    eqs = hh_equations()
+    eqs.prepare()
+    assert sorted(eqs.gating_variables()) == ['h', 'm', 'n']
+    eqs = Equations(hh_model, C=1 * uF, gl=.3 * msiemens, El=10.6 * mV,
+                    gK=36 * msiemens, EK=-12 * mV, gNa=120 * msiemens,
+                    ENa=115 * mV)
+    eqs.prepare()
+    assert sorted(eqs.gating_variables()) == ['h', 'm', 'n']
+    eqs = Equations('''
+    dv/dt = (w - v) / (10 * ms) : 1
+    dw/dt = (v ** 2 - w) / (20 * ms) : 1
+    dx/dt = (v - x) * (w - x) / (5 * ms) : 1
+    dy/dt = (1 / (1 + exp(-v)) - y) / (5 * ms) + w / (10 * ms) : 1
+    dz/dt = y / (5 * ms) : 1
+    ''')
+    eqs.prepare()
+    # w depends on v only, x is nonlinear, y depends on w, z does not
+    # depend on z
+    assert eqs.gating_variables() == ['w']
+
+def test_rush_larsen_exact():
+    '''
+    With the membrane potential fixed, gating variables are updated exactly
+    '''
+    reinit_default_clock()
+    eqs = '''
+    dv/dt = 0 * volt / second : volt
+    dm/dt = (1 / (1 + exp(-v / (10 * mV))) - m) / (5 * ms) : 1
+    '''
+    for compile in [False, True]:
+        clock = Clock(dt=2 * ms)
+        G = NeuronGroup(10, eqs, method='rush_larsen', compile=compile,
+                        freeze=compile, clock=clock)
+        G.v = linspace(-50, 50, 10) * mV
+        run(10 * ms)
+        m_inf = 1 / (1 + exp(-G.v / (10 * mV)))
+        assert abs(G.m - m_inf * (1 - exp(-10. / 5))).max() < 1e-10
+
+def test_rush_larsen_hh():
+    '''
+    The Rush-Larsen method is close to a reference solution, and stays
+    stable with large time steps
+    '''
+    def run_hh(dt, method, order=1, compile=False):
+        reinit_default_clock()
+        clock = Clock(dt=dt)
+        C = 1 * uF
+        gl, El = .3 * msiemens, 10.6 * mV
+        gK, EK = 36 * msiemens, -12 * mV
+        gNa, ENa = 120 * msiemens, 115 * mV
+        G = NeuronGroup(3, hh_model, method=method, order=order,
+                        compile=compile, freeze=True, clock=clock)
+        G.I = array([5, 10, 20]) * uA
+        M = StateMonitor(G, 'vm', record=True, clock=clock,
+                         timestep=int(.1 * ms / dt + .5))
+        net = Network(G, M)
+        net.run(5 * ms)
+        return M.values
+    reference = run_hh(.001 * ms, 'RK', order=2)
+    for order in [1, 2]:
+        V = run_hh(.01 * ms, 'rush_larsen', order=order)
+        assert abs(V - reference).max() < float(5 * mV)
+    V1 = run_hh(.05 * ms, 'rush_larsen')
+    V2 = run_hh(.05 * ms, 'rush_larsen', compile=True)
+    assert abs(V1 - V2).max() < float(1e-9 * mV)
+    assert isfinite(run_hh(.1 * ms, 'rush_larsen')).all()
+
+if __name__ == '__main__':
+    test_gating_variables()
+    test_rush_larsen_exact()
+    test_rush_larsen_hh()
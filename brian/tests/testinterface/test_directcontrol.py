@@ -254,6 +254,53 @@ def test_poissoninput():
     #only checks that there some spikes
     assert (m.nspikes >= 1)
 
+def test_spikegeneratorgroup_stream():
+    '''
+    Tests that a SpikeGeneratorGroup reading its spikes during the run, from
+    memory-mapped arrays or from chunks, gives the same spikes as with arrays.
+    '''
+    import os
+    import shutil
+    import tempfile
+    from brian.directcontrol import StreamingSpikeGeneratorThreshold
+    seed(3)
+    times = sort(rand(5000)) * 50 * ms
+    indices = randint(0, 100, 5000)
+    path = tempfile.mkdtemp()
+    try:
+        save(os.path.join(path, 'indices.npy'), indices)
+        save(os.path.join(path, 'times.npy'), times)
+        mindices = load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+        mtimes = load(os.path.join(path, 'times.npy'), mmap_mode='r')
+        def chunks():
+            for k in xrange(0, 5000, 700):
+                yield indices[k:k + 700], times[k:k + 700]
+        def run(spiketimes, start=0 * ms, **kwds):
+            reinit_default_clock(start)
+            G = SpikeGeneratorGroup(100, spiketimes, **kwds)
+            if isinstance(G._threshold, StreamingSpikeGeneratorThreshold):
+                G._threshold.blocksize = 300
+            M = SpikeMonitor(G)
+            net = Network(G, M)
+            net.run(60 * ms)
+            return sorted((i, int(round(t / defaultclock.dt))) for i, t in M.spikes)
+        for start in [0 * ms, 20 * ms]:
+            for period in [None, 30 * ms]:
+                reference = run((indices, times), start=start, period=period)
+                assert len(reference) > 0
+                assert run((mindices, mtimes), start=start, period=period) == reference
+                assert run(chunks, start=start, period=period, stream=True) == reference
+                assert run((indices, times), start=start, period=period, stream=True) == reference
+        # unsorted spikes
+        assert_raises(ValueError, run, (indices, times[::-1]), stream=True)
+        # an iterator cannot be restarted at each period
+        assert_raises(ValueError, run, chunks(), period=30 * ms, stream=True)
+        assert run(chunks(), stream=True) == run((indices, times))
+        del mindices, mtimes
+    finally:
+        shutil.rmtree(path)
+
 if __name__ == '__main__':
     test()
     test_poissoninput()
+    test_spikegeneratorgroup_stream()
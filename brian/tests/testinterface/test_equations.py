@@ -107,5 +107,53 @@ def test():
     eqs.prepare()
     assert eqs.is_conditionally_linear() is False
 
+def test_tabulate():
+    '''
+    Tabulation of the subexpressions depending on one variable.
+    '''
+    reinit_default_clock()
+    tau = 10 * ms
+    model = '''
+    dv/dt = (w - v) / tau + I : 1
+    dw/dt = alpha * (1 - w) - exp(-v) * w / tau - v * exp(-w) / tau : 1
+    alpha = 1 / (1 + exp(-v)) / tau : Hz
+    I : Hz
+    '''
+    eqs = Equations(model)
+    eqs.prepare()
+    errors = eqs.tabulate('v', -5, 5, 1001)
+    # alpha and exp(-v)*w/tau, but not v*exp(-w)/tau
+    assert len(errors) == 2
+    assert all(error < 1e-3 for error in errors.values())
+    assert eqs._string['w'].count('(v)') == 2
+    assert '_tab_' not in eqs._string['v']
+    # simulations with and without tabulation
+    results = []
+    for tabulate in [None, {'v': (-5, 5, 1001)}]:
+        for compile in [False, True]:
+            reinit_default_clock()
+            G = NeuronGroup(10, model, tabulate=tabulate, compile=compile, freeze=compile)
+            G.I = linspace(-100, 100, 10) * Hz
+            G.v = linspace(-1, 1, 10)
+            Network(G).run(20 * ms)
+            results.append(G.w.copy())
+    for w in results[1:]:
+        assert abs(w - results[0]).max() < 1e-3
+
+def test_tabulate_range():
+    '''
+    Values outside the tables give NaN, element by element.
+    '''
+    table = TabulateInterp(exp, -5, 5, 1001)
+    y = table(array([-7, -5, 0, 1, 5, 7]))
+    assert isnan(y[0]) and isnan(y[5])
+    assert abs(y[1:5] - exp(array([-5, 0, 1, 5]))).max() < 1e-3
+    assert isnan(table(-7)) and isnan(table(7))
+    table = Tabulate(exp, -5, 5, 1001)
+    y = table(array([-7, 0, 7]))
+    assert isnan(y[0]) and abs(y[1] - 1) < 1e-2 and isnan(y[2])
+
 if __name__ == '__main__':
     test()
+    test_tabulate()
+    test_tabulate_range()
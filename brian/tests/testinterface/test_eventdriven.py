@@ -0,0 +1,75 @@
+from brian import *
+from nose.tools import assert_raises
+import random as pyrandom
+
+eqs = '''
+dv/dt = (ge + gi - w - (v + 49 * mV)) / (20 * ms) : volt
+dge/dt = -ge / (5 * ms) : volt
+dgi/dt = -gi / (10 * ms) : volt
+dw/dt = (0.5 * (v + 60 * mV) - w) / (50 * ms) : volt
+'''
+
+
+def simulate(cls, synapses, **kwds):
+    reinit_default_clock()
+    seed(1)
+    pyrandom.seed(1)
+    G = cls(100, eqs, threshold=-50 * mV, **kwds)
+    G.v = -60 * mV + 10 * mV * rand(len(G))
+    P = PoissonGroup(50, 40 * Hz)
+    if synapses:
+        C = Synapses(P, G[20:], 'we : volt', pre='ge += we')
+        C[:, :] = 'rand() < 0.2'
+        C.we = 3 * mV
+    else:
+        C = Connection(P, G[20:], 'ge', weight=3 * mV, sparseness=0.2)
+    R = Connection(G, G, 'gi', weight=-1 * mV, sparseness=0.1, delay=2 * ms)
+    M = SpikeMonitor(G)
+    V = StateMonitor(G, 'v', record=[0, 50])
+    net = Network(G, P, C, R, M, V)
+    net.run(100 * ms)
+    G.ge_[::3] = 40 * mV
+    net.run(100 * ms)
+    return M.spikes, G._S.copy(), V.values
+
+
+def test_eventdriven():
+    '''
+    Tests that an event-driven group gives the same spikes and states as a
+    NeuronGroup, with connections and synapses.
+    '''
+    for synapses in [False, True]:
+        for kwds in [dict(reset=-60 * mV),
+                     dict(reset=-60 * mV, refractory=3 * ms),
+                     dict(reset=Refractoriness(-60 * mV, 3 * ms, 'v')),
+                     dict()]:
+            spikes, S, V = simulate(NeuronGroup, synapses, **kwds)
+            ed_spikes, ed_S, ed_V = simulate(EventDrivenNeuronGroup, synapses, **kwds)
+            assert len(spikes) > 0
+            assert len(ed_spikes) == len(spikes)
+            for (i1, t1), (i2, t2) in zip(ed_spikes, spikes):
+                assert i1 == i2 and abs(t1 - t2) < 1e-10 * second
+            assert abs(ed_S - S).max() < 1e-12
+            assert abs(ed_V - V).max() < 1e-12
+
+
+def test_eventdriven_unsupported():
+    '''
+    Tests that unsupported models, thresholds, resets and inputs raise errors.
+    '''
+    reinit_default_clock()
+    assert_raises(TypeError, EventDrivenNeuronGroup, 10,
+                  'dv/dt = -v ** 2 / (10 * ms) : 1', threshold=1)
+    assert_raises(TypeError, EventDrivenNeuronGroup, 10,
+                  'dv/dt = -v / (10 * ms) + xi / (10 * ms) ** .5 : 1', threshold=1)
+    assert_raises(TypeError, EventDrivenNeuronGroup, 10,
+                  'dv/dt = -v / (10 * ms) : 1', threshold='v > 1 + rand()')
+    assert_raises(TypeError, EventDrivenNeuronGroup, 10,
+                  'dv/dt = -v / (10 * ms) : 1', threshold=1, reset='v -= 1')
+    G = EventDrivenNeuronGroup(10, 'dv/dt = -v / (10 * ms) : 1', threshold=1, reset=0)
+    C = Connection(G, G, 'v', delay=True, max_delay=2 * ms)
+    assert_raises(TypeError, Network(G, C).prepare)
+
+if __name__ == '__main__':
+    test_eventdriven()
+    test_eventdriven_unsupported()
@@ -0,0 +1,42 @@
+import brian
+from brian.utils.lazyimport import LazyModule, module_available
+from nose.tools import *
+
+def test_lazy_names():
+    '''
+    Names from the plotting module and the tools package, which are imported
+    on first use, are the same objects as in the modules
+    '''
+    import brian.plotting
+    import brian.tools
+    for module in [brian.plotting, brian.tools.io, brian.tools.tabulate,
+                   brian.tools.statistics, brian.tools.parameters,
+                   brian.tools.correlatedspikes, brian.tools.remotecontrol]:
+        for name in module.__all__:
+            if getattr(module, name) is not None: # plot etc. if no pylab
+                assert getattr(brian, name) is getattr(module, name)
+    namespace = {}
+    exec 'from brian import *' in namespace
+    assert namespace['raster_plot'] is brian.plotting.raster_plot
+    assert namespace['firing_rate'] is brian.tools.statistics.firing_rate
+    assert namespace['NeuronGroup'] is brian.NeuronGroup
+    assert 'x' not in namespace and 'f' not in namespace
+    assert_raises(AttributeError, getattr, brian, 'not_a_brian_name')
+
+def test_lazy_module():
+    '''
+    :class:`LazyModule` only imports the module on first attribute access
+    '''
+    import sys
+    m = LazyModule('not_a_module', 'os.path')
+    assert m.__dict__['_module'] is None
+    assert m.join('a', 'b') == sys.modules['os.path'].join('a', 'b')
+    assert m.__dict__['_module'] is sys.modules['os.path']
+    m = LazyModule('not_a_module')
+    assert_raises(ImportError, getattr, m, 'anything')
+    assert module_available('os')
+    assert not module_available('not_a_module')
+
+if __name__ == '__main__':
+    test_lazy_names()
+    test_lazy_module()
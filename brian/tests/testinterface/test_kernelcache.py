@@ -0,0 +1,71 @@
+from brian import *
+from brian.utils.kernelcache import KernelCache, _customize_items
+import os
+import shutil
+import tempfile
+import time
+
+def test_kernel_cache():
+    '''
+    Keys, storage and LRU policy of the cache of compiled kernels.
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        cache = KernelCache(os.path.join(directory, 'cache'), maxsize=250)
+        # keys depend on all the items, and only on their values and classes
+        key = cache.key('code', (('ndarray', '<f8', 1), int), 'gcc', ['-O3'])
+        assert key == cache.key('code', (('ndarray', '<f8', 1), int), 'gcc', ['-O3'])
+        assert key != cache.key('code', (('ndarray', '<f4', 1), int), 'gcc', ['-O3'])
+        assert key != cache.key('code', (('ndarray', '<f8', 1), int), 'gcc', ['-O2'])
+        assert key != cache.key('code ', (('ndarray', '<f8', 1), int), 'gcc', ['-O3'])
+        assert cache.key(Clock()) == cache.key(Clock())
+        # weave customize objects are described by their contents
+        class Customize(object):
+            def __init__(self, headers, libraries):
+                self._headers = headers
+                self._libraries = libraries
+                self._support_code = []
+        customize = Customize(['<math.h>'], ['m'])
+        assert cache.key(_customize_items(customize)) == \
+               cache.key(_customize_items(Customize(['<math.h>'], ['m'])))
+        assert cache.key(_customize_items(customize)) != \
+               cache.key(_customize_items(Customize(['<math.h>'], ['gsl'])))
+        assert cache.key(_customize_items(customize)) != \
+               cache.key(_customize_items(Customize(['"mylib.h"'], ['m'])))
+        assert cache.key(_customize_items(customize)) != cache.key(None)
+        # storage
+        def build(key, size):
+            filename = os.path.join(directory, cache.module_name(key) + '.so')
+            open(filename, 'wb').write('x' * size)
+            return cache.store(key, filename)
+        assert cache.filename(key) is None
+        lock = cache.lock(key)
+        filename = build(key, 100)
+        cache.unlock(lock)
+        assert cache.filename(key) == filename
+        assert os.path.dirname(filename) == cache.directory
+        # the same kernel stored twice (by concurrent processes)
+        assert build(key, 100) == filename
+        assert len(cache.entries()) == 1
+        # least recently used kernels are removed first
+        keys = [cache.key(i) for i in range(3)]
+        t = time.time()
+        build(keys[0], 100)
+        os.utime(cache.filename(keys[0]), (t - 10, t - 10))
+        os.utime(filename, (t - 5, t - 5))
+        build(keys[1], 100)
+        assert cache.filename(keys[0]) is None
+        assert cache.filename(key) is not None
+        assert cache.filename(keys[1]) is not None
+        os.utime(cache.filename(keys[1]), (t - 2, t - 2))
+        os.utime(filename, (t - 1, t - 1))
+        build(keys[2], 100)
+        assert cache.filename(keys[1]) is None
+        assert cache.filename(key) is not None
+        cache.clear()
+        assert cache.entries() == []
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    test_kernel_cache()
@@ -471,7 +471,37 @@ def test_coincidencecounter():
 #    raster_plot(M)
 #    show()
 
+def test_memory_budget():
+    '''
+    Tests that monitors warn or raise when their memory budget is exceeded.
+    '''
+    import warnings
+    reinit_default_clock()
+    G = NeuronGroup(100, 'dv/dt = 1 / (1 * ms) : 1', threshold=1, reset=0)
+    M = SpikeMonitor(G)
+    M.set_memory_budget(10000, action='raise')
+    assert_raises(MemoryError, Network(G, M).run, 10 * ms)
+    assert M.memory_usage() > 10000
+    assert_raises(ValueError, M.set_memory_budget, 10000, action='ignore')
+
+    reinit_default_clock()
+    G = NeuronGroup(100, 'dv/dt = 1 / (1 * ms) : 1')
+    M = StateMonitor(G, 'v', record=True)
+    M.set_memory_budget(50000)
+    warnings.simplefilter('error', UserWarning)
+    try:
+        assert_raises(UserWarning, Network(G, M).run, 10 * ms)
+    finally:
+        warnings.resetwarnings()
+    # no budget
+    reinit_default_clock()
+    M = StateMonitor(G, 'v', record=True)
+    Network(G, M).run(10 * ms)
+    assert M._memory_check_at is None
+
+
 if __name__ == '__main__':
     test_spikemonitor()
     test_counter()
+    test_memory_budget()
 #    test_coincidencecounter()
@@ -1,9 +1,15 @@
+import os
+import shutil
 import sys
+import tempfile
+import threading
 from StringIO import StringIO
 
-from numpy.testing.utils import assert_raises
+from numpy.testing.utils import assert_raises, assert_array_equal
 
 from brian import *
+from __builtin__ import min, sum
+from brian.network import GroupBlockUpdater
 from brian.utils.progressreporting import ProgressReporter
 
 
@@ -195,10 +201,379 @@ def test_network_operation():
     # test that there is some decay
     assert(all(mon[0] < 1.0))
 
+
+def test_fused_schedule():
+    '''
+    Tests that a network prepared with a fused update schedule gives the same
+    results as the standard one, and that stopping still works.
+    '''
+    def build():
+        reinit_default_clock()
+        G = NeuronGroup(10, model='dv/dt = (2 - v) / (10 * ms) : 1',
+                        threshold=1, reset=0)
+        G.v = linspace(0, 1, 10)
+        H = NeuronGroup(10, model='dv/dt = -v / (5 * ms) : 1')
+        L = NeuronGroup(5, model=LazyStateUpdater())
+        C = Connection(G, H, 'v', weight=0.1)
+        M = SpikeMonitor(G)
+        S = StateMonitor(H, 'v', record=True)
+        @network_operation
+        def empty():
+            pass
+        return Network(G, H, L, C, M, S, empty), M, S
+
+    net, M_standard, S_standard = build()
+    net.prepare(fused=False)
+    net.run(20 * ms)
+    assert len(net._fused_schedule) == 0
+
+    net, M_fused, S_fused = build()
+    net.prepare(fused=True)
+    assert len(net._fused_schedule) == 1
+    net.run(10 * ms)
+    net.run(10 * ms, report=StringIO())
+    assert defaultclock.t == 20 * ms
+    assert M_fused.spikes == M_standard.spikes
+    assert (S_fused.values == S_standard.values).all()
+
+    # stopping from a network operation stops at the same time step
+    reinit_default_clock()
+    G = NeuronGroup(1, model=LazyStateUpdater())
+    @network_operation
+    def stopper(clock):
+        if clock.t >= 5 * defaultclock.dt:
+            stop()
+    net = Network(G, stopper)
+    net.prepare(fused=True)
+    net.run(1 * second)
+    assert defaultclock.t == 6 * defaultclock.dt
+
+
+def test_multiple_clocks_ordering():
+    '''
+    Tests that network operations on several clocks are called in the order
+    given by repeatedly choosing the clock with the smallest time (and the
+    smallest order for equal times).
+    '''
+    for clockclass in [Clock, FloatClock]:
+        clocks = [clockclass(dt=3 * ms, order=1), clockclass(dt=5 * ms),
+                  clockclass(dt=3 * ms), clockclass(dt=0.1 * ms, order=-1)]
+        calls = []
+        def make_op(i):
+            @network_operation(clock=clocks[i])
+            def op(clock):
+                calls.append((i, float(clock.t)))
+            return op
+        net = Network([make_op(i) for i in range(len(clocks))])
+        net.run(20 * ms)
+        net.run(10 * ms)
+        # reference ordering, computed as in the original scheduler (which
+        # takes the first of the minimal clocks in the order of net.clocks)
+        for c in clocks:
+            c.reinit()
+        expected = []
+        for duration in [20 * ms, 10 * ms]:
+            for c in clocks:
+                c.set_duration(duration)
+            clk = min(net.clocks)
+            while clk.still_running():
+                expected.append((clocks.index(clk), float(clk.t)))
+                clk.tick()
+                clk = min(net.clocks)
+        assert calls == expected
+        assert net.clock is min(net.clocks)
+
+
+def test_threaded_run():
+    '''
+    Tests that running with several threads gives the same results as
+    running with a single thread.
+    '''
+    def build():
+        reinit_default_clock()
+        eqs = '''
+        dv/dt = (ge - v) / (10 * ms) : 1
+        dge/dt = -ge / (5 * ms) : 1
+        '''
+        groups = [NeuronGroup(100, eqs, threshold=1, reset=0) for _ in range(4)]
+        for i, G in enumerate(groups):
+            G.v = linspace(0, 1, 100)
+            G.ge = 2 + 0.1 * i
+        connections = [Connection(groups[i], groups[(i + 1) % 4], 'ge', weight=0.05)
+                       for i in range(4)]
+        monitors = [SpikeMonitor(G) for G in groups]
+        return Network(groups, connections, monitors), monitors
+
+    net, serial_monitors = build()
+    net.run(50 * ms)
+    net, threaded_monitors = build()
+    nthreads = threading.active_count()
+    net.run(25 * ms, threads=3)
+    net.run(25 * ms, threads=2)
+    for serial, threaded in zip(serial_monitors, threaded_monitors):
+        assert serial.nspikes > 0
+        assert serial.spikes == threaded.spikes
+    # the worker threads are stopped at the end of each run
+    assert net._thread_pool is None
+    assert threading.active_count() == nthreads
+
+def test_profiled_run():
+    '''
+    Tests the profile returned by Network.run(profile=True).
+    '''
+    reinit_default_clock()
+    G = NeuronGroup(10, 'dv/dt = (2 - v) / (10 * ms) : 1', threshold=1, reset=0)
+    G.v = linspace(0, 1, 10)
+    H = NeuronGroup(5, 'dv/dt = -v / (10 * ms) : 1')
+    C = Connection(G, H, 'v', weight=0.1)
+    S = Synapses(G, H, model='w : 1', pre='v += w')
+    S[:, :] = True
+    M = SpikeMonitor(G)
+    calls = []
+    @network_operation
+    def op():
+        calls.append(1)
+    net = Network(G, H, C, S, M, op)
+    profile = net.run(20 * ms, profile=True)
+    assert net.last_profile is profile
+    assert M.nspikes > 0
+    assert len(calls) == 200
+    names = [entry['name'] for entry in profile.report()]
+    assert 'NetworkOperation op' in names
+    for entry in profile.entries:
+        assert entry.calls == 200
+        assert entry.time >= 0
+        # C and M have the same source and delay, so they are merged into a
+        # MultiConnection
+        if C in getattr(entry.obj, 'connections', [entry.obj]):
+            assert M in getattr(entry.obj, 'connections', [entry.obj])
+            assert entry.spikes == M.nspikes
+            assert entry.synaptic_events == 5 * M.nspikes
+        if entry.obj is S and entry.method == 'update':
+            # spikes of the last step are delivered at the next step
+            assert 0 < entry.synaptic_events <= 5 * M.nspikes
+            assert entry.synaptic_events % 5 == 0
+    assert profile.total_time >= sum(entry.time for entry in profile.entries)
+    assert len(str(profile).split('\n')) == len(profile.entries) + 2
+    # the schedule is restored after the run
+    net.run(10 * ms)
+    assert len(calls) == 300
+    assert profile.entries[0].calls == 200
+
+def test_profiled_run_delays():
+    '''
+    Tests that connections with homogeneous and heterogeneous delays give the
+    same results with and without profiling, and that their spikes are
+    counted when they are propagated.
+    '''
+    def build():
+        reinit_default_clock()
+        G = NeuronGroup(10, 'dv/dt = (2 - v) / (10 * ms) : 1', threshold=1, reset=0)
+        G.v = linspace(0, 1, 10)
+        H = NeuronGroup(5, 'dv/dt = -v / (10 * ms) : 1')
+        K = NeuronGroup(5, 'dv/dt = -v / (10 * ms) : 1')
+        C = Connection(G, H, 'v', weight=0.1, delay=2 * ms)
+        D = DelayConnection(G, K, 'v', max_delay=5 * ms)
+        D.connect_full(G, K, weight=0.1, delay=lambda i, j: (i + j) * 0.3 * ms)
+        M = SpikeMonitor(G)
+        return Network(G, H, K, C, D, M), H, K, C, D, M
+
+    net, H, K, C, D, M = build()
+    net.run(20 * ms)
+    net, profiled_H, profiled_K, C, D, M = build()
+    profile = net.run(20 * ms, profile=True)
+    assert_array_equal(profiled_H.v, H.v)
+    assert_array_equal(profiled_K.v, K.v)
+    entries = dict((entry.obj, entry) for entry in profile.entries)
+    # spikes reach the connection with a homogeneous delay 2 ms later
+    assert M.nspikes > len([i for i, t in M.spikes if t >= 18 * ms]) > 0
+    assert entries[C].spikes == len([i for i, t in M.spikes if t < 18 * ms])
+    assert entries[C].synaptic_events == 5 * entries[C].spikes
+    assert entries[D].spikes == M.nspikes
+    assert entries[D].synaptic_events == 5 * M.nspikes
+    # the connections are restored after the run
+    assert 'propagate' not in C.__dict__
+    assert 'propagate' not in D.__dict__
+
+def test_checkpoint():
+    '''
+    Tests that a network restored from a checkpoint continues exactly as the
+    original network (including the set of refractory neurons with
+    refractory_mode='inactive', and the state of an event-driven group).
+    '''
+    def build(mode, cls):
+        reinit_default_clock()
+        eqs = '''
+        dv/dt = (2 - v + ge) / (10 * ms) : 1
+        dge/dt = -ge / (5 * ms) : 1
+        '''
+        G = NeuronGroup(20, eqs, threshold=1, reset=0, refractory=2 * ms,
+                        refractory_mode=mode)
+        G.v = linspace(0, 1, 20)
+        H = cls(10, 'dv/dt = -v / (10 * ms) : 1', threshold=1, reset=0)
+        C = Connection(G, H, 'v')
+        C.connect_random(G, H, 0.5, weight=0.2, seed=3)
+        D = Connection(G, G, 'ge', delay=True, max_delay=5 * ms,
+                       structure='dense')
+        D.connect_full(G, G, weight=0.05,
+                       delay=lambda i, j: (1 + (i + j) % 4) * ms)
+        S = Synapses(G, H, model='w : 1', pre='v += w')
+        S[:, :] = 'i % 3 == j % 3'
+        S.w = 0.1
+        S.delay = '(i + j) % 5 * ms'
+        M = SpikeMonitor(H)
+        return Network(G, H, C, D, S, M), M
+
+    path = tempfile.mkdtemp()
+    try:
+        for mode, cls in [('clamp', NeuronGroup), ('inactive', NeuronGroup),
+                          ('clamp', EventDrivenNeuronGroup)]:
+            net, M = build(mode, cls)
+            net.run(20 * ms)
+            net.checkpoint(path)
+            assert os.path.exists(os.path.join(path, 'manifest.pkl'))
+            n = len(M.spikes)
+            net.run(20 * ms)
+            reference = M.spikes[n:]
+            assert len(reference) > 0
+            net, M = build(mode, cls)
+            net.restore(path)
+            assert abs(net.clock.t - 20 * ms) < 1e-10 * second
+            net.run(20 * ms)
+            assert len(M.spikes) == len(reference)
+            for (i1, t1), (i2, t2) in zip(M.spikes, reference):
+                assert i1 == i2 and abs(t1 - t2) < 1e-10 * second
+        # a network with a different structure cannot be restored
+        reinit_default_clock()
+        G = NeuronGroup(10, 'dv/dt = -v / (10 * ms) : 1')
+        assert_raises(ValueError, Network(G).restore, path)
+    finally:
+        shutil.rmtree(path)
+
+def test_memory_usage():
+    '''
+    Tests the memory report of Network.memory_usage().
+    '''
+    reinit_default_clock()
+    G = NeuronGroup(100, 'dv/dt = (2 - v) / (10 * ms) : 1', threshold=1, reset=0)
+    C = Connection(G, G, 'v', weight=0.01, structure='dense')
+    M = SpikeMonitor(G)
+    Mv = StateMonitor(G, 'v', record=True)
+    net = Network(G, C, M, Mv)
+    net.run(10 * ms)
+    usage = net.memory_usage()
+    entries = dict((id(obj), (kind, buffers)) for obj, kind, buffers in usage.entries)
+    assert entries[id(G)][0] == 'group'
+    assert entries[id(G)][1]['_S'] == G._S.nbytes
+    assert entries[id(C)][0] == 'connection'
+    assert entries[id(C)][1]['W'] >= 100 * 100 * 8
+    assert entries[id(M)][0] == 'monitor' and entries[id(Mv)][0] == 'monitor'
+    assert entries[id(Mv)][1]['_values'] + entries[id(Mv)][1].get('_values_cache', 0) >= 100 * 100 * 8
+    assert usage.total == sum(entry['total'] for entry in usage.report())
+    assert 'Total' in str(usage)
+
+def test_block_updates():
+    '''
+    Tests that groups advanced several steps at once give the same results
+    as the standard schedule.
+    '''
+    def build():
+        reinit_default_clock()
+        A = NeuronGroup(10, 'dv/dt = (2 - v) / (10 * ms) : 1', threshold=1,
+                        reset=0, refractory=1 * ms)
+        A.v = linspace(0, 1, 10)
+        B = NeuronGroup(10, 'dv/dt = -v / (10 * ms) : 1', threshold=1, reset=0)
+        C = NeuronGroup(10, 'dv/dt = -v / (10 * ms) : 1', threshold=1, reset=0)
+        AB = Connection(A, B, 'v', weight=0.4, delay=1 * ms)
+        BB = Connection(B, B, 'v', weight=0.05)
+        BC = Connection(B, C, 'v', weight=0.6, delay=0.3 * ms)
+        monitors = [SpikeMonitor(A), SpikeMonitor(B), SpikeMonitor(C)]
+        S = StateMonitor(C, 'v', record=True)
+        return Network(A, B, C, AB, BB, BC, monitors, S), A, B, monitors, S
+
+    net, A, B, standard_monitors, S_standard = build()
+    net.prepare(blocks=False)
+    net.run(25 * ms)
+    for M in standard_monitors:
+        assert M.nspikes > 0
+
+    net, A, B, block_monitors, S_block = build()
+    net.prepare(blocks=True)
+    updaters = [f for f in net._update_schedule[id(net.clock)]
+                if isinstance(f, GroupBlockUpdater)]
+    # C is recorded by a state monitor
+    assert [(u.group, u.steps) for u in updaters] == [(A, 16), (B, 10)]
+    net.run(12.3 * ms)
+    assert A._lead == 0 and B._lead == 0
+    net.run(12.7 * ms)
+    for standard, block in zip(standard_monitors, block_monitors):
+        assert standard.spikes == block.spikes
+    assert (S_standard.values == S_block.values).all()
+
+
+def test_fused_resets():
+    '''
+    Tests that resets done in the update step of the groups give the same
+    results as the standard schedule, and that they are only used when
+    nothing in between depends on them.
+    '''
+    def build():
+        reinit_default_clock()
+        seed(2)
+        eqs = '''
+        dv/dt = (2 * I - v) / (10 * ms) : 1
+        dI/dt = (1 - I) / (20 * ms) : 1
+        dw/dt = -w / (30 * ms) : 1
+        '''
+        A = NeuronGroup(20, eqs, threshold='v > 1 + w', reset='v = 0; w += 0.2',
+                        refractory=2 * ms)
+        A.v = rand(20)
+        B = NeuronGroup(20, eqs, threshold=1, reset=0.1, refractory=1.55 * ms)
+        C = NeuronGroup(20, eqs, threshold=1, reset=0)
+        D = NeuronGroup(20, eqs, threshold='v > 1', reset='v = 0',
+                        refractory=linspace(0, 3, 20) * ms)
+        AB = Connection(A, B, 'I', weight=0.05)
+        BA = Connection(B, A, 'I', weight=-0.05, delay=1 * ms)
+        AC = Connection(A, C, 'v', weight=0.3) # modifies the reset variable
+        DD = Connection(D, D, 'I', weight=0.02, delay=True, max_delay=2 * ms)
+        DD.connect_full(D, D, weight=0.02, delay=(0 * ms, 2 * ms))
+        monitors = [SpikeMonitor(G) for G in [A, B, C, D]]
+        S = [StateMonitor(A, 'v', record=True), StateMonitor(B, 'v', record=True)]
+        R = StateMonitor(D, 'v', record=True, when='before_resets')
+        return Network(A, B, C, D, AB, BA, AC, DD, monitors, S, R), [A, B, C, D], monitors, S
+
+    net, groups, standard_monitors, S_standard = build()
+    net.prepare(fusedresets=False)
+    net.run(50 * ms)
+    for M in standard_monitors:
+        assert M.nspikes > 0
+    for use_blocks in [False, True]:
+        net, groups, fused_monitors, S_fused = build()
+        net.prepare(fusedresets=True, blocks=use_blocks)
+        # C receives input on the reset variable, D is recorded before resets
+        assert [G._threshold_reset is not None for G in groups] == [True, True, False, False]
+        net.run(50 * ms)
+        for standard, fused in zip(standard_monitors, fused_monitors):
+            assert standard.spikes == fused.spikes
+        for standard, fused in zip(S_standard, S_fused):
+            assert (standard.values == fused.values).all()
+    # the kernel is removed when the network is prepared again
+    net.prepare(fusedresets=False)
+    assert groups[0]._threshold_reset is None
+
     
 if __name__ == '__main__':
     test_progressreporting()
     test_network_generation()
     test_network_clocks()
     test_network_operation()
-    test_reinit()
\ No newline at end of file
+    test_reinit()
+    test_fused_schedule()
+    test_multiple_clocks_ordering()
+    test_threaded_run()
+    test_profiled_run()
+    test_profiled_run_delays()
+    test_checkpoint()
+    test_memory_usage()
+    test_block_updates()
+    test_fused_resets()
\ No newline at end of file
@@ -123,7 +123,191 @@ def test_variable_setting():
     assert_raises(ValueError, assign_to_static)
 
 
+def test_trials():
+    '''
+    Test that a network of groups with several trials gives the same results
+    as separate runs of each trial.
+    '''
+    eqs = '''
+    dv/dt = (I - v) / (10 * ms) : 1
+    I : 1
+    '''
+    currents = [array([1.5, 2., 3.]), array([1.2, 1.5, 4.]), 2.5]
+
+    def run_trials(trials, record):
+        reinit_default_clock()
+        G = NeuronGroup(3, eqs, threshold=1, reset=0, trials=trials)
+        H = NeuronGroup(3, 'dv/dt = -v / (5 * ms) : 1', trials=trials)
+        C = Connection(G, H, 'v')
+        C.connect_one_to_one(weight=0.5)
+        M = SpikeMonitor(G)
+        Mv = StateMonitor(H, 'v', record=record)
+        net = Network(G, H, C, M, Mv)
+        return G, H, C, M, Mv, net
+
+    G, H, C, M, Mv, net = run_trials(3, [0, 4, 8])
+    assert len(G) == 9 and G.trial_size == 3 and len(G.trial(2)) == 3
+    assert_raises(ValueError, G.set_trial_values, 'I', currents[:2])
+    G.set_trial_values('I', currents)
+    assert_raises(IndexError, G.trial, 3)
+    # block diagonal connection matrix
+    W = C.W.todense()
+    assert (W == 0.5 * eye(9)).all()
+    net.run(50 * ms)
+    spikes = M.split_trials()
+    values = Mv.split_trials()
+    assert len(spikes) == 3 and len(values) == 3
+
+    for k in range(3):
+        G, H, C, M, Mv, net = run_trials(1, k)
+        G.I = currents[k]
+        net.run(50 * ms)
+        assert len(spikes[k]) == len(M.spikes) > 0
+        for (i1, t1), (i2, t2) in zip(spikes[k], M.spikes):
+            assert i1 == i2 and is_approx_equal(t1, t2)
+        assert values[k].shape == (1, len(Mv.times))
+        assert (abs(values[k][0] - Mv[k]) < 1e-10).all()
+
+def test_dtype():
+    '''
+    The state matrix, connection weights, synaptic variables and monitor
+    buffers have the type given by the dtype keyword or the defaultdtype
+    preference, and single precision tracks double precision.
+    '''
+    tau = 10 * ms
+    eqs = Equations('''
+    dv/dt = (I - v + ge) / tau : 1
+    dge/dt = -ge / (5 * ms) : 1
+    I : 1
+    ''', tau=tau)
+
+    def run_group(dtype):
+        reinit_default_clock()
+        G = NeuronGroup(10, eqs, threshold=1, reset=0, dtype=dtype)
+        G.I = linspace(1.2, 2, 10)
+        C = Connection(G, G, 'ge', weight=0.1, delay=True, max_delay=1 * ms)
+        D = Connection(G, G, 'ge', weight=0.05, structure='dense')
+        S = Synapses(G, G, model='w : 1', pre='ge += w')
+        S[:, :] = 'i == j'
+        S.w = 0.01
+        M = StateMonitor(G, 'v', record=[0, 5])
+        R = RecentStateMonitor(G, 'v', record=True, duration=1 * ms)
+        net = Network(G, C, D, S, M, R)
+        net.run(50 * ms)
+        return G, C, D, S, M, R
+
+    G, C, D, S, M, R = run_group(float32)
+    for x in [G._S, C.W.alldata, C.delayvec.alldata, D.W, M.values, R.values]:
+        assert x.dtype == float32
+    # synapses store times (lastupdate), they are in double precision
+    # unless specified
+    assert S._S.dtype == float64
+    assert Synapses(G, G, model='w : 1', dtype=float32)._S.dtype == float32
+    G64, C, D, S, M64, R = run_group(None)
+    for x in [G64._S, C.W.alldata, D.W, S._S, M64.values, R.values]:
+        assert x.dtype == float64
+    assert abs(M.values - M64.values).max() < 1e-4
+    assert StateMonitor(G64, 'v', dtype=float32)._values_cache.dtype == float32
+    set_global_preferences(defaultdtype='float32')
+    try:
+        assert NeuronGroup(1, eqs)._S.dtype == float32
+    finally:
+        set_global_preferences(defaultdtype='float64')
+    assert NeuronGroup(1, eqs)._S.dtype == float64
+    assert_raises(TypeError, NeuronGroup, 1, eqs, dtype=int)
+
+
+def test_refractory_mode():
+    '''
+    With refractory_mode='inactive', the refractory neurons are those whose
+    next allowed spike is in the future, and their state is held during the
+    refractory period.
+    '''
+    eqs = '''
+    dv/dt = (I - v) / (10 * ms) : 1
+    I : 1
+    '''
+
+    def run_group(mode, N=100, **kwds):
+        reinit_default_clock()
+        G = NeuronGroup(N, eqs, threshold=1, reset=0, refractory_mode=mode, **kwds)
+        G.I = linspace(1.5, 5, N)
+        M = SpikeMonitor(G)
+        V = StateMonitor(G, 'v', record=True)
+        indices = []
+
+        @network_operation
+        def record_refractory():
+            indices.append((G.get_refractory_indices(),
+                            (G._next_allowed_spiketime > G.clock._t).nonzero()[0]))
+        net = Network(G, M, V, record_refractory)
+        net.run(50 * ms)
+        return G, M, V, indices
+
+    # one variable held at the reset value: same as clamping
+    for kwds in [dict(refractory=5 * ms),
+                 dict(refractory=linspace(1, 20, 100) * ms),
+                 dict(refractory=20 * ms)]: # most neurons refractory
+        G, M, V, indices = run_group('clamp', **kwds)
+        G2, M2, V2, indices2 = run_group('inactive', **kwds)
+        assert M.spikes == M2.spikes
+        assert abs(V.values - V2.values).max() < 1e-12
+        for computed, scanned in indices2:
+            assert_equal(sorted(computed), list(scanned))
+        assert len(G2.get_refractory_indices()) > 0
+        assert_equal(sorted(G2[50:].get_refractory_indices()),
+                     sorted(i - 50 for i in G2.get_refractory_indices() if i >= 50))
+        G2.reinit()
+        assert len(G2.get_refractory_indices()) == 0
+
+    # integrating the other neurons only (most neurons are refractory) gives
+    # the same results as holding the refractory neurons
+    values = []
+    for partial in [True, False]:
+        reinit_default_clock()
+        G = NeuronGroup(50, '''
+                        dv/dt = (I - v + x) / (10 * ms) : 1
+                        x = 0.1 * sin(2 * pi * 50 * Hz * t) : 1
+                        dw/dt = (v - w) / (30 * ms) : 1
+                        I : 1
+                        ''', threshold=1, reset=0, refractory=20 * ms,
+                        refractory_mode='inactive')
+        assert G._state_updater.partial_updates
+        G._state_updater.partial_updates = partial
+        G.I = linspace(1.5, 5, 50)
+        M = StateMonitor(G, 'w', record=True)
+        run(50 * ms)
+        values.append(M.values)
+    assert abs(values[0] - values[1]).max() < 1e-12
+
+    # the whole state is held, with refractory periods given by the reset
+    reinit_default_clock()
+    G = NeuronGroup(2, '''
+                    dv/dt = (2 - v) / (10 * ms) : 1
+                    dw/dt = -w / (10 * ms) : 1
+                    ''', threshold=1,
+                    reset=CustomRefractoriness(lambda G, spikes: None, 5 * ms,
+                                               lambda G, indices: None),
+                    refractory_mode='inactive')
+    G.v = [0.5, 0.95]
+    G.w = 1
+    run(0.5 * ms)
+    # neuron 1 spiked and is not reset: it is held above threshold
+    w, v = G.w[1], G.v[1]
+    assert list(G.get_refractory_indices()) == [1]
+    run(4 * ms)
+    assert G.w[1] == w and G.v[1] == v
+    assert G.w[0] < G.w[1]
+    run(5 * ms)
+    assert G.w[1] < w
+
+    assert_raises(ValueError, NeuronGroup, 1, eqs, refractory_mode='skip')
+
+
 if __name__ == '__main__':
     test_poissongroup()
     test_linked_var()
-    test_variable_setting()
\ No newline at end of file
+    test_variable_setting()
+    test_trials()
+    test_dtype()
+    test_refractory_mode()
\ No newline at end of file
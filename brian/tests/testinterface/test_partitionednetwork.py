@@ -0,0 +1,40 @@
+from brian import *
+from brian.experimental.partitionednetwork import PartitionedNetwork
+
+
+def test_partitionednetwork():
+    '''
+    Tests that a network partitioned over two processes gives the same spikes
+    and states as a single process network.
+    '''
+    def build(cls):
+        reinit_default_clock()
+        eqs = '''
+        dv/dt = (I - v) / (10 * ms) : 1
+        I : 1
+        '''
+        G = NeuronGroup(20, eqs, threshold=1, reset=0)
+        G.I = linspace(1.1, 2, 20)
+        H = NeuronGroup(10, 'dv/dt = -v / (10 * ms) : 1', threshold=1, reset=0)
+        C = Connection(G, H, 'v', delay=2 * ms)
+        C.connect_random(G, H, 0.5, weight=0.3, seed=3)
+        MG = SpikeMonitor(G)
+        MH = SpikeMonitor(H)
+        return cls(G, H, C, MG, MH), G, H, MG, MH
+
+    net, G, H, MG, MH = build(Network)
+    net.run(50 * ms)
+    pnet, pG, pH, pMG, pMH = build(PartitionedNetwork)
+    pnet.partition = [[pG], [pH]]
+    pnet.run(50 * ms)
+    assert len(MH.spikes) > 0
+    for M, pM in [(MG, pMG), (MH, pMH)]:
+        assert len(pM.spikes) == len(M.spikes)
+        for (i1, t1), (i2, t2) in zip(pM.spikes, M.spikes):
+            assert i1 == i2 and abs(t1 - t2) < 1e-10 * second
+    assert abs(pG._S - G._S).max() < 1e-12
+    assert abs(pH._S - H._S).max() < 1e-12
+    assert abs(pnet.clock.t - 50 * ms) < 1e-10 * second
+
+if __name__ == '__main__':
+    test_partitionednetwork()
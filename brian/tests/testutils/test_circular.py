@@ -0,0 +1,99 @@
+from numpy import *
+import pickle
+
+from brian.utils.circular import SpikeContainer
+
+
+def test_spikecontainer():
+    '''
+    Tests the SpikeContainer against a list of the spikes of each bin, with a
+    buffer which is too small (so that it wraps around and grows) and unsorted
+    spikes.
+    '''
+    random.seed(1)
+    m = 7
+    S = SpikeContainer(m, expected=1)
+    bins = []
+    for step in xrange(500):
+        # bursts of activity and silent periods
+        rate = [0, 0.05, 0.5][(step // 40) % 3]
+        spikes = nonzero(random.rand(100) < rate)[0]
+        random.shuffle(spikes)
+        S.push(spikes)
+        bins.insert(0, sort(spikes))
+        del bins[m:]
+        for i in xrange(len(bins)):
+            assert (S[i] == bins[i]).all()
+        assert (S.lastspikes() == bins[0]).all()
+        for i in xrange(len(bins)):
+            for j in xrange(i, len(bins) + 1):
+                expected = hstack([zeros(0, dtype=int)] + bins[i:j][::-1])
+                assert (S[i:j] == expected).all()
+        for delay in xrange(len(bins)):
+            for origin, N in [(0, 100), (0, 30), (30, 40), (70, 30)]:
+                spikes = bins[delay]
+                expected = spikes[(spikes >= origin) & (spikes < origin + N)] - origin
+                assert (S.get_spikes(delay, origin, N) == expected).all()
+    # the spikes of a bin and of a full group are views of the buffer
+    assert S[1].base is not None
+    assert S.get_spikes(1, 0, 100).base is not None
+    # pickling and reinit
+    T = pickle.loads(pickle.dumps(S))
+    for i in xrange(m):
+        assert (T[i] == S[i]).all()
+    S.reinit()
+    for i in xrange(m):
+        assert len(S[i]) == 0
+    assert len(S[0:m]) == 0
+
+def test_spikecontainer_random():
+    '''
+    Tests the SpikeContainer against a list of the spikes of each bin, with
+    random sequences of silent periods (all the stored bins are empty),
+    small bins and bursts, and buffers of various sizes.
+    '''
+    def check(S, bins, step):
+        for i in xrange(len(bins)):
+            assert len(S[i]) == len(bins[i]) and (S[i] == bins[i]).all()
+            spikes = bins[i]
+            origin = step * 1000 + 5
+            expected = spikes[(spikes >= origin) & (spikes < origin + 45)] - origin
+            result = S.get_spikes(i, origin, 45)
+            assert len(result) == len(expected) and (result == expected).all()
+        for j in xrange(len(bins) + 1):
+            expected = hstack([zeros(0, dtype=int)] + bins[:j][::-1])
+            assert len(S[0:j]) == len(expected) and (S[0:j] == expected).all()
+
+    # an empty oldest bin does not mark the start of the stored spikes
+    S = SpikeContainer(5, expected=3.)
+    bins = []
+    for step, n in enumerate([1, 2, 20, 0, 0, 0, 0, 60, 1, 0, 5]):
+        spikes = step * 1000 + arange(n)
+        S.push(spikes)
+        bins.insert(0, spikes)
+        del bins[5:]
+        check(S, bins, step)
+
+    random.seed(2)
+    for trial in xrange(300):
+        m = random.randint(2, 10)
+        S = SpikeContainer(m, expected=random.choice([0.1, 1., 3.]))
+        bins = []
+        silent = 0
+        for step in xrange(100):
+            if silent == 0 and random.rand() < 0.2:
+                silent = random.randint(m - 1, m + 2)
+            if silent:
+                silent -= 1
+                n = 0
+            else:
+                n = [0, random.randint(1, 6), random.randint(10, 101)][random.choice(3, p=[0.3, 0.2, 0.5])]
+            spikes = step * 1000 + random.permutation(n)
+            S.push(spikes)
+            bins.insert(0, sort(spikes))
+            del bins[m:]
+            check(S, bins, step)
+
+if __name__ == '__main__':
+    test_spikecontainer()
+    test_spikecontainer_random()
@@ -0,0 +1,29 @@
+from numpy.testing.utils import assert_raises
+
+from brian.utils.threadpool import ThreadPool
+
+def test_threadpool():
+    pool = ThreadPool(3)
+    assert(len(pool) == 4)
+
+    # all functions are called exactly once before run returns
+    results = []
+    funcs = [lambda i=i: results.append(i) for i in range(20)]
+    for _ in range(10):
+        del results[:]
+        pool.run(funcs)
+        assert(sorted(results) == range(20))
+
+    # exceptions are raised again in the calling thread, and the pool can
+    # still be used afterwards
+    def broken():
+        raise ValueError('broken')
+    assert_raises(ValueError, lambda: pool.run(funcs[:5] + [broken]))
+    del results[:]
+    pool.run(funcs)
+    assert(sorted(results) == range(20))
+
+    pool.close()
+
+if __name__ == '__main__':
+    test_threadpool()
@@ -41,10 +41,7 @@ from random import sample # Python standard random module (sample is different)
 
 from numpy import clip, Inf
 from numpy.random import rand, randn
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from brian.utils.kernelcache import weave
 from scipy import random
 
 from brian.clock import guess_clock
@@ -0,0 +1,436 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+'''
+Threshold, refractoriness and reset in a single pass
+
+At each time step, a :class:`NeuronGroup` with a string threshold and reset
+goes several times over its neurons: the threshold condition is evaluated
+for all neurons, the spiking neurons are extracted, the refractory ones are
+removed, and the reset is applied to the others (later, in the reset phase
+of the network). The :class:`FusedThresholdReset` kernel does all of this in
+one function, generated once for the group: with weave, a single loop over
+the neurons tests the threshold and the refractory period, writes the
+spikes and resets the neurons; otherwise, the same operations are done with
+NumPy, without the overhead of preparing the namespaces at every step.
+
+The kernel replaces the threshold and reset of a group when
+:meth:`Network.prepare` is called with the global preference
+``usefusedresets`` (see :meth:`Network._build_threshold_reset_schedule`).
+'''
+import re
+import ast
+import numpy
+from numpy.random import rand, randn
+
+from brian.globalprefs import get_global_preference
+from brian.inspection import get_identifiers
+from brian.log import log_warn
+from brian.optimiser import freeze
+from brian.reset import Reset, StringReset, VariableReset, Refractoriness, NoReset
+from brian.threshold import Threshold, StringThreshold, VariableThreshold
+from brian.utils.kernelcache import weave
+
+__all__ = ['FusedThresholdReset', 'fused_threshold_reset']
+
+_c_binary_symbols = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+_c_unary_symbols = {ast.UAdd: '+', ast.USub: '-', ast.Not: '!'}
+_c_compare_symbols = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+                      ast.Eq: '==', ast.NotEq: '!='}
+_c_bool_symbols = {ast.And: ' && ', ast.Or: ' || '}
+_c_logical_symbols = {ast.BitAnd: ' && ', ast.BitOr: ' || '}
+# functions of the namespaces (by their name) and their C equivalent
+_c_functions = {'exp': 'exp', 'log': 'log', 'log10': 'log10', 'sqrt': 'sqrt',
+                'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'arcsin': 'asin',
+                'arccos': 'acos', 'arctan': 'atan', 'sinh': 'sinh',
+                'cosh': 'cosh', 'tanh': 'tanh', 'abs': 'fabs',
+                'absolute': 'fabs', 'fabs': 'fabs', 'floor': 'floor',
+                'ceil': 'ceil'}
+
+
+def _c_source(node, names):
+    # C source code of a (frozen) expression node, where names is the set of
+    # the allowed identifiers (variables)
+    if isinstance(node, ast.Num):
+        return '(' + repr(node.n) + ')'
+    if isinstance(node, ast.Name):
+        if node.id in names:
+            return node.id
+        if node.id in ('True', 'False'):
+            return str(int(node.id == 'True'))
+    if isinstance(node, ast.BinOp):
+        left, right = _c_source(node.left, names), _c_source(node.right, names)
+        if type(node.op) in _c_binary_symbols:
+            return '(' + left + _c_binary_symbols[type(node.op)] + right + ')'
+        if isinstance(node.op, ast.Pow):
+            return 'pow(' + left + ', ' + right + ')'
+        if type(node.op) in _c_logical_symbols: # on booleans, e.g. (v>1)&(w<1)
+            return '(' + left + _c_logical_symbols[type(node.op)] + right + ')'
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _c_unary_symbols:
+        return '(' + _c_unary_symbols[type(node.op)] + _c_source(node.operand, names) + ')'
+    if isinstance(node, ast.BoolOp):
+        return ('(' + _c_bool_symbols[type(node.op)].join(_c_source(value, names)
+                                                           for value in node.values) + ')')
+    if isinstance(node, ast.Compare) and all(type(op) in _c_compare_symbols for op in node.ops):
+        # a<b<c is a<b and b<c
+        operands = [_c_source(operand, names) for operand in [node.left] + node.comparators]
+        return ('(' + ' && '.join('(' + left + _c_compare_symbols[type(op)] + right + ')'
+                                  for left, op, right in zip(operands[:-1], node.ops, operands[1:])) +
+                ')')
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+            node.func.id in _c_functions and not (node.keywords or node.starargs or node.kwargs)):
+        return (_c_functions[node.func.id] + '(' +
+                ', '.join(_c_source(arg, names) for arg in node.args) + ')')
+    raise NotImplementedError('Unsupported expression')
+
+
+def c_expression(expr, names):
+    """
+    Translates the Python expression expr (a string, where all the
+    identifiers are numbers, variables in names, or elementary functions) to
+    C. Raises ``NotImplementedError`` if the expression cannot be translated.
+    """
+    return _c_source(ast.parse(expr.strip(), mode='eval').body, set(names))
+
+
+def c_statement(statement, names, declared):
+    """
+    Translates the Python statement (an assignment, possibly augmented, of
+    an expression to a name) to C. Names in ``names`` are variables, other
+    assigned names are temporary variables which are declared as doubles on
+    their first assignment and added to the set ``declared``.
+    """
+    node = ast.parse(statement.strip()).body
+    if len(node) != 1:
+        raise NotImplementedError('Unsupported statement')
+    node = node[0]
+    if isinstance(node, ast.Assign) and len(node.targets) == 1:
+        target, op = node.targets[0], ''
+    elif isinstance(node, ast.AugAssign) and type(node.op) in _c_binary_symbols:
+        target, op = node.target, _c_binary_symbols[type(node.op)]
+    else:
+        raise NotImplementedError('Unsupported statement')
+    if not isinstance(target, ast.Name):
+        raise NotImplementedError('Unsupported statement')
+    value = _c_source(node.value, set(names) | declared)
+    name = target.id
+    if name not in names and name not in declared:
+        if op:
+            raise NotImplementedError('Unsupported statement')
+        declared.add(name)
+        return 'double ' + name + ' = ' + value + ';'
+    return name + ' ' + op + '= ' + value + ';'
+
+
+def _statements(code):
+    # the statements of a multiline reset, separated by newlines or semicolons
+    return [statement.strip() for line in code.split('\n') for statement in line.split(';')
+            if statement.strip() and not statement.strip().startswith('#')]
+
+
+class FusedThresholdReset(object):
+    '''
+    Threshold, refractoriness and reset of a group in a single kernel
+
+    **Initialised as:** ::
+
+        FusedThresholdReset(group, threshold, reset, namespace[, clamp[, useweave]])
+
+    with arguments:
+
+    ``group``
+        The :class:`NeuronGroup`, which has the refractoriness defined by its
+        ``refractory`` and ``max_refractory`` arguments.
+    ``threshold``
+        The threshold condition, a Python expression (string) of the state
+        variables of the group, ``t``, and the names of ``namespace``.
+    ``reset``
+        The list of the statements of the reset (strings).
+    ``namespace``
+        The values of the other names in the threshold and reset.
+    ``clamp``
+        ``None`` or a triple ``(var, value, period)`` for a reset that holds
+        the state variable ``var`` at ``value`` during ``period`` time steps
+        after a spike, including the spike (as :class:`Refractoriness`).
+    ``useweave``
+        Whether to use the C++ kernel (defaults to the global preference
+        ``useweave``). It is only used if the threshold and reset can be
+        translated to C (``rand()`` and ``randn()``, arrays and functions
+        other than elementary functions are not supported). If compilation
+        fails, the NumPy kernel is used.
+
+    Called with the group at each update step, in place of its threshold
+    (the reset is done at the same time, see :meth:`NeuronGroup.update`),
+    it returns the array of the indices of the neurons that spiked. The
+    results are the same as with the separate threshold and reset (the C++
+    kernel evaluates expressions in double precision for single precision
+    states, so the results may differ in the last bit).
+
+    Attributes:
+
+    ``reset_variables``
+        The indexes of the state variables that the reset reads or modifies.
+    ``python_code``, ``c_code``
+        The generated code (``c_code`` is ``None`` if the C++ kernel is not
+        used).
+    '''
+    def __init__(self, group, threshold, reset, namespace, clamp=None, useweave=None):
+        if useweave is None:
+            useweave = get_global_preference('useweave')
+        self.threshold = threshold
+        self.reset = reset
+        self.clamp = clamp
+        self.variables = dict((name, i) for name, i in group.var_index.iteritems()
+                              if isinstance(name, str) and name not in group.staticvars)
+        self.reset_variables = set(self.variables[name] for statement in reset
+                                   for name in get_identifiers(statement)
+                                   if name in self.variables)
+        self._refractory = group._use_next_allowed_spiketime_refractoriness
+        if group._variable_refractory_time:
+            if group._refractory_variable is not None:
+                self._refractime = group.state_(group._refractory_variable)
+            else:
+                self._refractime = numpy.asarray(group._refractory_array, dtype=float)
+        else:
+            self._refractime = None
+        if clamp is not None:
+            var, value, self._period = clamp
+            self.reset_variables.add(self.variables[var])
+            # neurons which spiked in the last period time steps, i.e., with
+            # t<t_spike+(period-0.5)*dt where t_spike=next-refractory_time
+            self._clamp_offset = (self._period - 0.5) * group.clock._dt - group._refractory_time
+        self.python_code = self._python_code(group)
+        ns = dict(namespace)
+        ns.update(_next=group._next_allowed_spiketime, _refractory_time=group._refractory_time,
+                  _refractime=self._refractime, _rand=rand, _randn=randn,
+                  _num_neurons=len(group))
+        for name, i in self.variables.iteritems():
+            ns[name] = group._S[i]
+        if clamp is not None:
+            ns.update(_clamped_state=group._S[self.variables[clamp[0]]],
+                      _clamp_value=float(clamp[1]))
+        exec compile(self.python_code, 'FusedThresholdReset', 'exec') in ns
+        self._python_kernel = ns['_threshold_reset']
+        self.c_code = None
+        if useweave:
+            try:
+                self.c_code = self._c_code(group, namespace)
+            except NotImplementedError:
+                pass
+        if self.c_code is not None:
+            self._weave_compiler = get_global_preference('weavecompiler')
+            self._extra_compile_args = ['-O3']
+            if self._weave_compiler == 'gcc':
+                self._extra_compile_args += get_global_preference('gcc_options')
+            self._arguments = {'_S': group._S, '_next': group._next_allowed_spiketime,
+                               '_spikes': group._spikesarray, '_num_neurons': len(group),
+                               '_refractory_time': float(group._refractory_time),
+                               't': 0.}
+            if self._refractime is not None:
+                self._arguments['_refractime'] = self._refractime
+            if clamp is not None:
+                self._arguments['_clamp_offset'] = float(self._clamp_offset)
+
+    def _python_code(self, group):
+        arrays = '|'.join(sorted(self.variables, key=len, reverse=True))
+        threshold = re.sub(r'\brand\(\s*\)', '_rand(_num_neurons)', self.threshold)
+        threshold = re.sub(r'\brandn\(\s*\)', '_randn(_num_neurons)', threshold)
+        lines = ['def _threshold_reset(_group, _t):']
+        if 't' in get_identifiers(self.threshold):
+            lines.append("    t = _group.state_('t')")
+        lines.append('    _spikes = (%s).nonzero()[0]' % threshold)
+        if self._refractory:
+            lines.append('    _spikes = _spikes[_next[_spikes] <= _t]')
+            if self._refractime is not None:
+                lines.append('    _next[_spikes] = _t + _refractime[_spikes]')
+            else:
+                lines.append('    _next[_spikes] = _t + _refractory_time')
+        if any('t' in get_identifiers(statement) for statement in self.reset):
+            lines.append('    t = _t')
+        for statement in self.reset:
+            if arrays:
+                statement = re.sub(r'\b(%s)\b' % arrays, r'\1[_spikes]', statement)
+            statement = re.sub(r'\brand\(\s*\)', '_rand(len(_spikes))', statement)
+            statement = re.sub(r'\brandn\(\s*\)', '_randn(len(_spikes))', statement)
+            lines.append('    ' + statement)
+        if self.clamp is not None and self._period > 1:
+            # the neurons which spiked in the previous period-1 steps
+            lines.append('    _clamped = _group.LS[0:%d]' % (self._period - 1))
+            if self._refractime is not None:
+                lines.append('    _clamped = _clamped[_next[_clamped] > _t - _group.clock._dt * 0.25]')
+            lines.append('    _clamped_state[_clamped] = _clamp_value')
+        lines.append('    return _spikes')
+        return '\n'.join(lines) + '\n'
+
+    def _c_code(self, group, namespace):
+        if self.clamp is not None and self._refractime is not None:
+            raise NotImplementedError('Variable refractoriness with clamping')
+        # temporary variables of the reset
+        temporaries = set(re.match(r'\s*(\w*)', statement).group(1) for statement in self.reset)
+        names = set(self.variables) | temporaries | set(['t'])
+        vartype = 'float' if group._S.dtype == numpy.float32 else 'double'
+        functions = [name for name, value in namespace.iteritems()
+                     if name in _c_functions and getattr(value, '__name__', None) == name]
+        def frozen(expr):
+            expr = freeze(expr, names, namespace)
+            if expr is None:
+                raise NotImplementedError('Unknown names')
+            for name in get_identifiers(expr):
+                if name not in names and name not in functions:
+                    raise NotImplementedError('Unsupported name ' + name)
+            return expr
+        threshold = c_expression(frozen(self.threshold), names)
+        if self._refractory:
+            threshold = threshold + ' && _next[_i] <= t'
+        declared = set()
+        reset = [c_statement(frozen(statement), set(self.variables) | set(['t']), declared)
+                 for statement in self.reset]
+        used = set(name for expr in [self.threshold] + self.reset
+                   for name in get_identifiers(expr) if name in self.variables)
+        if self.clamp is not None:
+            used.add(self.clamp[0])
+        lines = ['long _numspikes = 0;']
+        for name in sorted(used):
+            lines.append('%s *%s__base = _S + %d * _num_neurons;' % (vartype, name, self.variables[name]))
+        lines.append('for(int _i = 0; _i < _num_neurons; _i++) {')
+        for name in sorted(used):
+            lines.append('    %s &%s = %s__base[_i];' % (vartype, name, name))
+        lines.append('    if(%s) {' % threshold)
+        if self._refractory:
+            if self._refractime is not None:
+                lines.append('        _next[_i] = t + _refractime[_i];')
+            else:
+                lines.append('        _next[_i] = t + _refractory_time;')
+        for statement in reset:
+            lines.append('        ' + statement)
+        lines.append('        _spikes[_numspikes++] = _i;')
+        lines.append('    }')
+        if self.clamp is not None:
+            lines.append('    else if(t < _next[_i] + _clamp_offset)')
+            lines.append('        %s = %r;' % (self.clamp[0], float(self.clamp[1])))
+        lines.append('}')
+        lines.append('return_val = _numspikes;')
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, P):
+        if self.c_code is not None:
+            self._arguments['t'] = P.clock._t
+            try:
+                numspikes = weave.inline(self.c_code, self._arguments.keys(),
+                                         local_dict=self._arguments,
+                                         compiler=self._weave_compiler,
+                                         extra_compile_args=self._extra_compile_args)
+                return P._spikesarray[:numspikes]
+            except Exception:
+                log_warn('brian.thresholdreset',
+                         'C compilation failed, falling back on Python.')
+                self.c_code = None
+        return self._python_kernel(P, P.clock._t)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__, self.threshold, self.reset)
+
+
+def fused_threshold_reset(group, useweave=None):
+    '''
+    Returns a :class:`FusedThresholdReset` kernel equivalent to the
+    threshold, refractoriness and reset of the group, or ``None`` if they
+    are not supported. Supported thresholds are :class:`Threshold`,
+    :class:`VariableThreshold` and :class:`StringThreshold`, supported resets
+    are :class:`Reset`, :class:`VariableReset`, :class:`StringReset`,
+    :class:`NoReset` and :class:`Refractoriness` (as created by
+    :class:`NeuronGroup` for a fixed reset value with a refractory period).
+    The expressions may only refer to the state variables of the group (not
+    to static variables), ``t``, and names of their namespaces.
+    '''
+    threshold, reset = group._threshold, group._resetfun
+    names = dict((i, name) for name, i in group.var_index.iteritems()
+                 if isinstance(name, str) and name not in group.staticvars)
+    states = [] # the state variables given by their name or index
+    def var(state):
+        if not isinstance(state, str):
+            state = names.get(state)
+        states.append(state)
+        return state
+    namespace = {}
+    if type(threshold) is Threshold:
+        condition = '%s > _threshold_value' % var(threshold.state)
+        namespace['_threshold_value'] = float(threshold.threshold)
+    elif type(threshold) is VariableThreshold:
+        condition = '%s > %s' % (var(threshold.state), var(threshold.threshold_state))
+    elif type(threshold) is StringThreshold:
+        condition = threshold._expr
+        namespace.update(threshold._namespace)
+    else:
+        return None
+    clamp = None
+    if type(reset) is NoReset:
+        statements = []
+    elif type(reset) in (Reset, Refractoriness):
+        statements = ['%s = _reset_value' % var(reset.state)]
+        namespace['_reset_value'] = float(reset.resetvalue)
+        if type(reset) is Refractoriness:
+            if not group._use_next_allowed_spiketime_refractoriness:
+                return None
+            clamp = (var(reset.state), reset.resetvalue,
+                     int(reset.period / group.clock.dt) + 1)
+    elif type(reset) is VariableReset:
+        statements = ['%s = %s' % (var(reset.state), var(reset.resetvaluestate))]
+    elif type(reset) is StringReset:
+        statements = _statements(reset._expr)
+        for name, value in reset._namespace.iteritems():
+            if name in namespace and namespace[name] is not value:
+                return None
+            namespace[name] = value
+    else:
+        return None
+    if None in states or any(name not in names.values() for name in states):
+        return None
+    try:
+        identifiers = set(get_identifiers(condition))
+        for statement in statements:
+            identifiers.update(get_identifiers(statement))
+    except SyntaxError:
+        return None
+    temporaries = set(re.match(r'\s*(\w*)', statement).group(1) for statement in statements)
+    for name in identifiers:
+        if not (name in names.values() or name in namespace or name in temporaries or
+                name in ('t', 'rand', 'randn')):
+            return None # e.g. a static variable
+    for name in names.values():
+        # the state variables replace the values found in the namespaces
+        namespace.pop(name, None)
+    namespace.pop('t', None)
+    return FusedThresholdReset(group, condition, statements, namespace, clamp=clamp,
+                               useweave=useweave)
@@ -4,9 +4,9 @@ import neurongroup
 from units import second, check_units
 import numpy
 import warnings
-try:
-    import pylab
-except:
+from utils.lazyimport import LazyModule, module_available
+pylab = LazyModule('pylab')
+if not module_available('pylab'):
     warnings.warn("Couldn't import pylab.")
 
 __all__ = ['TimedArray', 'TimedArraySetter', 'set_group_var_by_array']
@@ -40,7 +40,7 @@ __all__ = ['Tabulate', 'TabulateInterp']
 
 from brian.units import get_unit, Quantity, is_dimensionless
 from brian.unitsafefunctions import array, arange, zeros
-from numpy import NaN
+from numpy import NaN, asarray, ndim
 
 
 class Tabulate(object):
@@ -54,10 +54,11 @@ class Tabulate(object):
       v=g([.1,.3])
       v=g(array([.1,.3]))
       
-    Arguments of g must lie in [xmin,xmax).
-    An IndexError is raised is arguments are above xmax, but
-    not always when they are below xmin (it can give weird results).
+    Arguments of g must lie in [xmin,xmax), values outside this
+    interval give NaN (element by element for arrays).
     '''
+    elementwise = True # applies to arrays elementwise (see brian.optimiser)
+
     def __init__(self, f, xmin, xmax, n):
         self.xmin = xmin
         self.xmax = xmax
@@ -75,10 +76,16 @@ class Tabulate(object):
                 self.f[i] = f(x[i])
 
     def __call__(self, x):
-        try: # possible problem if x is an array and an array is wanted
-            return self.f[array((array(x) - self.xmin) * self.invdx, dtype=int)]
-        except IndexError: # out of bounds
+        y = (asarray(x) - float(self.xmin)) * float(self.invdx) # position in the table
+        outside = ~((y >= 0) & (y < len(self.f))) # including NaN
+        if not outside.any():
+            return self.f[y.astype(int)]
+        if ndim(y) == 0:
             return NaN * self.unit
+        y[outside] = 0
+        values = asarray(self.f, dtype=float)[y.astype(int)]
+        values[outside] = NaN
+        return values * self.unit
 
     def __repr__(self):
         return 'Tabulated function with ' + str(len(self.f)) + ' points'
@@ -95,10 +102,11 @@ class TabulateInterp(object):
       v=g([.1,.3])
       v=g(array([.1,.3]))
       
-    Arguments of g must lie in [xmin,xmax).
-    An IndexError is raised is arguments are above xmax, but
-    not always when they are below xmin (it can give weird results).
+    Arguments of g must lie in [xmin,xmax], values outside this
+    interval give NaN (element by element for arrays).
     '''
+    elementwise = True
+
     def __init__(self, f, xmin, xmax, n):
         self.xmin = xmin
         self.xmax = xmax
@@ -116,17 +124,28 @@ class TabulateInterp(object):
                 self.f[i] = f(x[i])
         self.f = array(self.f)
         self.df = (self.f[range(1, n)] - self.f[range(n - 1)]) * float(self.invdx)
+        # Plain arrays for the vectorised interpolation: values and increments
+        # between consecutive points
+        self._values = asarray(self.f, dtype=float)
+        self._increments = asarray(self.df, dtype=float) * float(self.dx)
 
     def __call__(self, x): # the units of x is not checked
-        y = array(x) - self.xmin
-        ind = array(y * self.invdx, dtype=int)
-        try:
-            if is_dimensionless(x): # could be a problem if it is a Quantity with units=1
-                return self.f[ind] + self.df[ind] * (y - array(ind) * self.dx)
-            else:
-                return array(self.f[ind] + self.df[ind] * (y - array(ind) * self.dx)) * self.unit
-        except IndexError: # out of bounds
-            return NaN * self.unit
+        y = asarray((asarray(x) - float(self.xmin)) * float(self.invdx)) # position in the table
+        ind = y.astype(int)
+        ind.clip(0, len(self._increments) - 1, out=ind)
+        y -= ind
+        # y is now in [0,1] for values in [xmin,xmax]
+        outside = ~((y >= 0) & (y <= 1)) # including NaN
+        y *= self._increments.take(ind)
+        y += self._values.take(ind)
+        if outside.any():
+            y[outside] = NaN
+        if y.ndim == 0:
+            y = y[()] # a scalar, as for a scalar argument
+        if is_dimensionless(x): # could be a problem if it is a Quantity with units=1
+            return y
+        else:
+            return array(y) * self.unit
 
     def __repr__(self):
         return 'Tabulated function with ' + str(len(self.f)) + ' points (interpolated)'
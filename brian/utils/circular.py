@@ -38,16 +38,14 @@ Circular arrays
 Ideas for speed improvements: use put, putmask and take with mode='wrap' and out=...
 '''
 from numpy import *
-try:
-    import weave
-except ImportError:
-    from scipy import weave
+from kernelcache import weave
 import bisect
 import os
+from collections import deque
 import warnings
 from ..globalprefs import get_global_preference
 
-__all__ = ['CircularVector', 'SpikeContainer']
+__all__ = ['CircularVector', 'SpikeContainer', 'RefractorySet']
 
 
 class CircularVector(object):
@@ -171,71 +169,168 @@ class SpikeContainer(object):
     S[0] is an array of the last spikes (neuron indexes).
     S[1] is an array with the spikes at time t-dt, etc.
     S[0:50] contains all spikes in last 50 bins.
+
+    The spikes of each time bin are stored sorted, in a contiguous segment of
+    a ring buffer, so that S[i] is a view of the buffer (without copy), and
+    the spikes of a range of neurons in a bin (``get_spikes``, used by
+    subgroups) are found with two binary searches. The buffer is sized when
+    the container is created, from the number of bins and the expected
+    number of spikes per bin; it only grows (and is then compacted) if more
+    spikes are stored. Variables:
+    * X = the buffer
+    * start, stop = bounds of the segment of each bin in X (ring of m bins)
+    * lap = number of times the buffer was filled from the start when each
+      bin was stored (the bins of a lap are contiguous)
+    * cursor = position of the last bin in start and stop
+    * nonempty = positions of the stored bins which are not empty, oldest
+      first (the start of the first one is the start of the stored spikes;
+      empty bins may point anywhere in the buffer)
+
+    If the C++ extension (``brian.utils.ccircular``) is compiled, creating a
+    SpikeContainer returns an instance of the C++ version instead. The
+    extension is imported when the first SpikeContainer is created.
     '''
-    def __init__(self, m, useweave=False, compiler=None):
+    def __new__(cls, *args, **kwds):
+        if cls is SpikeContainer:
+            CSpikeContainer = _c_spike_container()
+            if CSpikeContainer is not None:
+                return CSpikeContainer(*args, **kwds)
+        return object.__new__(cls)
+
+    def __init__(self, m, useweave=False, compiler=None, expected=None):
         '''
-        n = maximum number of spikes stored (not used anymore)
         m = maximum number of bins stored
+        expected = expected number of spikes per bin, used to size the buffer
+        (useweave and compiler are not used anymore)
         '''
         if m < 2: m = 2
-        self.S = CircularVector(2, dtype=int, useweave=useweave, compiler=compiler)
-        self.ind = CircularVector(m + 1, dtype=int, useweave=useweave, compiler=compiler) # indexes of bins
-        self.remaining_space = 1
-        self._useweave = useweave
         self.m = m
+        if expected is None:
+            expected = 1
+        self.size = max(int(2 * m * expected) + 1, 2 * m, 64)
+        self.reinit()
 
     def reinit(self):
-        self.S.reinit()
-        self.ind.reinit()
+        self.X = zeros(self.size, dtype=int)
+        self.start = zeros(self.m, dtype=int)
+        self.stop = zeros(self.m, dtype=int)
+        self.lap = zeros(self.m, dtype=int)
+        self.cursor = 0
+        self.head = 0 # end of the last bin in X
+        self.laps = 0
+        self.count = 0 # number of spikes stored
+        self.nonempty = deque()
 
     def push(self, spikes):
         '''
         Stores spikes in the array at time dt.
         '''
+        spikes = asarray(spikes)
         ns = len(spikes)
-        self.remaining_space += (self.ind[2] - self.ind[1]) % self.S.n
-        while ns >= self.remaining_space:
-            # double size of array
-            S = self.S
-            newS = CircularVector(2 * S.n, dtype=int, useweave=S._useweave, compiler=S._cpp_compiler)
-            newS.X[:S.n - S.cursor] = S.X[S.cursor:]
-            newS.X[S.n - S.cursor:S.n] = S.X[:S.cursor]
-            newS.cursor = S.n
-            self.S = newS
-            self.ind.X = (self.ind.X - S.cursor) % S.n
-            self.ind.X[self.ind.X == 0] = S.n
-            self.remaining_space += S.n
-        self.S[0:ns] = spikes
-        self.S.advance(ns)
-        self.ind.advance(1)
-        self.ind[0] = self.S.cursor
-        self.remaining_space -= ns
+        if ns > 1 and (spikes[1:] < spikes[:-1]).any():
+            spikes = sort(spikes)
+        cursor = (self.cursor + 1) % self.m
+        # the oldest bin is discarded
+        if self.nonempty and self.nonempty[0] == cursor:
+            self.nonempty.popleft()
+            self.count -= self.stop[cursor] - self.start[cursor]
+        self.cursor = cursor
+        position = self._allocate(ns)
+        self.X[position:position + ns] = spikes
+        self.start[cursor] = position
+        self.stop[cursor] = position + ns
+        self.lap[cursor] = self.laps
+        self.head = position + ns
+        self.count += ns
+        if ns:
+            self.nonempty.append(cursor)
+
+    def _allocate(self, ns):
+        '''
+        Returns the position of a free segment of ns elements after the
+        stored bins, growing the buffer if there is none.
+        '''
+        head = self.head
+        if self.count == 0:
+            if ns <= self.size:
+                self.laps += 1
+                return 0
+        else:
+            # start of the oldest non-empty bin (the stored spikes are between
+            # tail and head, possibly wrapping around the end of the buffer)
+            tail = self.start[self.nonempty[0]]
+            if head > tail:
+                if head + ns <= self.size:
+                    return head
+                if ns <= tail:
+                    self.laps += 1
+                    return 0
+            elif head + ns <= tail:
+                return head
+        self._grow(ns)
+        return self.head
+
+    def _grow(self, ns):
+        '''
+        Copies the stored bins to a larger buffer with space for ns more
+        spikes, in order and without gaps.
+        '''
+        order = [(self.cursor - i) % self.m for i in xrange(self.m - 1, 0, -1)]
+        bins = [self.X[self.start[b]:self.stop[b]] for b in order]
+        self.size = max(2 * self.size, 2 * (self.count + ns))
+        X = zeros(self.size, dtype=int)
+        position = 0
+        for b, spikes in zip(order, bins):
+            X[position:position + len(spikes)] = spikes
+            self.start[b] = position
+            position += len(spikes)
+            self.stop[b] = position
+        self.X = X
+        self.head = position
+        self.laps += 1
+        self.lap[:] = self.laps
 
     def lastspikes(self):
         '''
         Returns S[0].
         '''
-        return self.S[self.ind[-1] - self.S.cursor:self.S.n]
+        return self.X[self.start[self.cursor]:self.stop[self.cursor]]
 
     def __getitem__(self, i):
         '''
         S[i]: returns the spikes at time t-i*dt.
         '''
-        # NB: this could be optimized
-        return self.S[self.ind[-i - 1] - self.S.cursor:self.ind[-i] - self.S.cursor + self.S.n]
+        b = (self.cursor - i) % self.m
+        return self.X[self.start[b]:self.stop[b]]
 
-    # optimised version of the above, but the speed improvement is not very much, might be
-    # better to just wait and write a fully C/C++ version of the whole library
     def get_spikes(self, delay, origin, N):
         """
         Returns those spikes in self[delay] between origin and origin+N
         """
-        return self.S.get_conditional(self.ind[-delay - 1] - self.S.cursor, \
-                                     self.ind[-delay] - self.S.cursor + self.S.n, \
-                                     origin, origin + N, origin)
+        b = (self.cursor - delay) % self.m
+        start, stop = self.start[b], self.stop[b]
+        if start == stop:
+            return self.X[start:stop]
+        spikes = self.X[start:stop]
+        if origin == 0 and spikes[-1] < N:
+            return spikes
+        spikes = spikes[spikes.searchsorted(origin):spikes.searchsorted(origin + N)]
+        if origin: spikes = spikes - origin
+        return spikes
 
     def __getslice__(self, i, j):
-        return self.S[self.ind[-j] - self.S.cursor:self.ind[-i] - self.S.cursor + self.S.n]
+        '''
+        S[i:j]: returns the spikes in bins i to j-1 (oldest first).
+        '''
+        j = min(j, self.m)
+        if j <= i:
+            return self.X[0:0]
+        first = (self.cursor - j + 1) % self.m
+        last = (self.cursor - i) % self.m
+        if self.lap[first] == self.lap[last]:
+            # contiguous segment
+            return self.X[self.start[first]:self.stop[last]]
+        return hstack([self[k] for k in xrange(j - 1, i - 1, -1)])
 
     def __repr__(self):
         return "Spike container."
@@ -246,17 +341,27 @@ class SpikeContainer(object):
     def __reduce__(self):
         return (unpickle_SpikeContainer, (self.m, tuple(self[i].copy() for i in xrange(self.m))))
 
-try:
-    import ccircular.ccircular as _ccircular
-    class SpikeContainer(_ccircular.SpikeContainer):
-        def __init__(self, m, useweave=False, compiler=None):
-            _ccircular.SpikeContainer.__init__(self, m)
-            self.m = m
-        def __reduce__(self):
-            return (unpickle_SpikeContainer, (self.m, tuple(self[i].copy() for i in xrange(self.m))))
-    #warnings.warn('Using C++ SpikeContainer')
-except ImportError:
-    pass
+_CSpikeContainer = []
+
+def _c_spike_container():
+    '''
+    Returns the C++ version of SpikeContainer, or None if the extension is
+    not compiled. The extension is only imported the first time.
+    '''
+    if not _CSpikeContainer:
+        try:
+            import ccircular.ccircular as _ccircular
+            class CSpikeContainer(_ccircular.SpikeContainer):
+                def __init__(self, m, useweave=False, compiler=None, expected=None):
+                    _ccircular.SpikeContainer.__init__(self, m)
+                    self.m = m
+                def __reduce__(self):
+                    return (unpickle_SpikeContainer, (self.m, tuple(self[i].copy() for i in xrange(self.m))))
+            #warnings.warn('Using C++ SpikeContainer')
+        except ImportError:
+            CSpikeContainer = None
+        _CSpikeContainer.append(CSpikeContainer)
+    return _CSpikeContainer[0]
 
 
 def unpickle_SpikeContainer(m, allspikes):
@@ -266,6 +371,90 @@ def unpickle_SpikeContainer(m, allspikes):
     return newsc
 
 
+class RefractorySet(object):
+    '''
+    The set of neurons of a group which are in their refractory period,
+    updated incrementally.
+
+    Neurons are added with the number of time steps until they leave the set,
+    and stored in a ring of ``m`` buckets indexed by the time step at which
+    they leave it, so that advancing by one time step only looks at the
+    neurons leaving the set at that step, and the set is obtained without
+    scanning the whole group. Variables:
+    * mask = boolean array of size N, True for the neurons in the set
+    * indices = the indexes of the neurons in the set (in no particular order)
+    '''
+    def __init__(self, N, m):
+        '''
+        N = number of neurons
+        m = number of buckets, i.e., maximum number of time steps in the set + 1
+        '''
+        self.N = N
+        self.m = max(m, 2)
+        self.reinit()
+
+    def reinit(self):
+        self.mask = zeros(self.N, dtype=bool)
+        self.buckets = [[] for _ in xrange(self.m)]
+        self.cursor = 0
+        self.count = 0
+        self._indices = zeros(0, dtype=int)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, indices, steps):
+        '''
+        Adds the neurons with the given indexes (which must not be in the set),
+        which leave it after steps calls to advance(). steps is an integer or
+        an array of integers, clipped to 1..m-1.
+        '''
+        if not len(indices):
+            return
+        indices = asarray(indices, dtype=int)
+        steps = clip(steps, 1, self.m - 1)
+        if isinstance(steps, ndarray) and steps.ndim:
+            for k in unique(steps):
+                self.buckets[(self.cursor + k) % self.m].append(indices[steps == k])
+        else:
+            self.buckets[(self.cursor + int(steps)) % self.m].append(indices)
+        self.mask[indices] = True
+        self.count += len(indices)
+        self._indices = None
+
+    def advance(self):
+        '''
+        Advances by one time step and returns the neurons which leave the set.
+        '''
+        self.cursor = (self.cursor + 1) % self.m
+        bucket = self.buckets[self.cursor]
+        if not bucket:
+            return zeros(0, dtype=int)
+        self.buckets[self.cursor] = []
+        if len(bucket) == 1:
+            expired = bucket[0]
+        else:
+            expired = hstack(bucket)
+        self.mask[expired] = False
+        self.count -= len(expired)
+        self._indices = None
+        return expired
+
+    def get_indices(self):
+        if self._indices is None:
+            buckets = [b for bucket in self.buckets for b in bucket]
+            if buckets:
+                self._indices = hstack(buckets)
+            else:
+                self._indices = zeros(0, dtype=int)
+        return self._indices
+
+    indices = property(fget=get_indices)
+
+    def __repr__(self):
+        return 'Refractory set of %d neurons out of %d' % (self.count, self.N)
+
+
 # I am not sure that class below is useful!
 class ModInt(object):
     '''
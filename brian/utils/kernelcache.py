@@ -0,0 +1,368 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+#
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+#
+'''
+Persistent on-disk cache of compiled weave kernels
+
+Each process using weave normally looks up its compiled extension modules in
+the weave catalog, a shelve file shared by all the processes of a user, and
+recompiles the code if the catalog has no match. With many simulations
+started at the same time (e.g. on a cluster), the processes compile the same
+code concurrently and compete for the catalog.
+
+The :class:`KernelCache` stores compiled extension modules in a directory,
+under a name which is a hash of everything that determines the compiled code:
+the C++ source and support code, the types of the arguments, the compiler,
+its version and flags, the headers, libraries and other options of the
+``customize`` object, and the versions of Python, numpy and weave. It is
+safe for concurrent processes: a kernel is compiled in a private directory
+while holding a lock on its key (so that other processes wait for it instead
+of compiling it too) and moved to the cache with an atomic rename. The total
+size of the cache is limited, the least recently used kernels being deleted
+first.
+
+Brian modules refer to weave through the ``weave`` object defined here (a
+:class:`~brian.utils.lazyimport.LazyModule` whose ``inline`` function uses the
+cache), which is controlled by the global preferences ``useweavecache``,
+``weavecachedir`` and ``weavecachesize``.
+'''
+import os
+import sys
+import imp
+import errno
+import shutil
+import hashlib
+import platform
+import tempfile
+import subprocess
+from lazyimport import LazyModule
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+import numpy
+
+__all__ = ['KernelCache', 'get_kernel_cache', 'weave']
+
+_extension_suffixes = [suffix for suffix, _, kind in imp.get_suffixes()
+                       if kind == imp.C_EXTENSION]
+
+
+def _describe(value):
+    '''
+    A string describing value, which does not depend on the process (the
+    description of objects other than strings, numbers and sequences is
+    their class, e.g. for type converters).
+    '''
+    if value is None or isinstance(value, (bool, int, long, float, str, unicode)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_describe(x) for x in value) + ']'
+    if isinstance(value, dict):
+        return '{' + ','.join(_describe(k) + ':' + _describe(value[k])
+                              for k in sorted(value.keys())) + '}'
+    return value.__class__.__module__ + '.' + value.__class__.__name__
+
+
+def _customize_items(customize):
+    '''
+    The contents of a weave ``customize`` object (headers, libraries,
+    include and library directories, support code, compiler and linker
+    arguments...), as a dictionary of its attributes, so that kernels
+    compiled with different options have different keys.
+    '''
+    if customize is None:
+        return None
+    return dict(vars(customize))
+
+
+def _signature(value):
+    '''
+    Type of an argument of a kernel, as used by weave to generate the
+    conversion code.
+    '''
+    if isinstance(value, numpy.ndarray):
+        return ('ndarray', value.dtype.str, value.ndim)
+    return type(value)
+
+
+class KernelCache(object):
+    '''
+    Content-addressed cache of compiled extension modules in a directory.
+
+    Initialised with the directory (created if needed) and the maximum total
+    size of the cached modules in bytes. Methods:
+
+    ``key(*items)``
+        The key of a kernel, a hash of the descriptions of the items.
+    ``filename(key)``
+        The file of the kernel with this key, or ``None`` if it is not in the
+        cache. Its modification time is updated, for the LRU policy.
+    ``lock(key)``
+        Acquires a lock on the key, shared between processes; returns the
+        lock, to be released with ``unlock(lock)``. The (empty) lock files
+        are never removed. Without ``fcntl`` (Windows), there is no lock and
+        concurrent processes may build the same kernel, which is safe but
+        wasteful.
+    ``store(key, filename)``
+        Moves the file into the cache (with an atomic rename) and removes
+        the least recently used kernels if the cache is full. Returns the
+        new filename.
+    ``prune(keep=None)``
+        Removes the least recently used kernels (except the file keep) until
+        the total size is below the limit.
+    '''
+    def __init__(self, directory, maxsize=500 * 1024 ** 2):
+        self.directory = directory
+        self.maxsize = maxsize
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, *items):
+        return hashlib.sha1('\0'.join(_describe(item) for item in items)).hexdigest()
+
+    def module_name(self, key):
+        return 'brian_kernel_' + key
+
+    def filename(self, key):
+        name = os.path.join(self.directory, self.module_name(key))
+        for suffix in _extension_suffixes:
+            if os.path.exists(name + suffix):
+                try:
+                    os.utime(name + suffix, None)
+                except OSError: # read-only cache, or deleted in the meantime
+                    if not os.path.exists(name + suffix):
+                        continue
+                return name + suffix
+        return None
+
+    def lock(self, key):
+        if fcntl is None:
+            return None
+        f = open(os.path.join(self.directory, key + '.lock'), 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    def unlock(self, lock):
+        if lock is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            lock.close()
+
+    def store(self, key, filename):
+        target = os.path.join(self.directory, self.module_name(key) +
+                              os.path.splitext(filename)[1])
+        try:
+            os.rename(filename, target)
+        except OSError:
+            # on Windows, rename fails if the target exists, i.e., if another
+            # process has stored the same kernel
+            if not os.path.exists(target):
+                raise
+        self.prune(keep=target)
+        return target
+
+    def entries(self):
+        '''
+        List of (time of last use, size, filename) of the cached kernels,
+        most recently used first.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('brian_kernel_'):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort(reverse=True)
+        return entries
+
+    def prune(self, keep=None):
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        for _, filesize, filename in reversed(entries):
+            if size <= self.maxsize:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(filename)
+            except OSError: # removed by another process
+                pass
+            size -= filesize
+
+    def clear(self):
+        '''
+        Removes all the kernels.
+        '''
+        maxsize = self.maxsize
+        self.maxsize = 0
+        try:
+            self.prune()
+        finally:
+            self.maxsize = maxsize
+
+_kernel_caches = {}
+
+
+def get_kernel_cache():
+    '''
+    The :class:`KernelCache` defined by the global preferences, or ``None``
+    if the ``useweavecache`` preference is ``False``.
+    '''
+    from ..globalprefs import get_global_preference
+    if not get_global_preference('useweavecache'):
+        return None
+    directory = get_global_preference('weavecachedir')
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'), '.brian', 'kernelcache')
+    maxsize = int(get_global_preference('weavecachesize') * 1024 ** 2)
+    if directory not in _kernel_caches:
+        _kernel_caches[directory] = KernelCache(directory, maxsize)
+    cache = _kernel_caches[directory]
+    cache.maxsize = maxsize
+    return cache
+
+_compiler_versions = {}
+
+
+def _compiler_version(compiler):
+    if compiler not in _compiler_versions:
+        try:
+            process = subprocess.Popen([compiler or 'gcc', '-dumpversion'],
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _compiler_versions[compiler] = process.communicate()[0].strip()
+        except OSError: # e.g. msvc
+            _compiler_versions[compiler] = ''
+    return _compiler_versions[compiler]
+
+
+class CachedWeave(LazyModule):
+    '''
+    The weave module, with an ``inline`` function using the kernel cache
+    (see :func:`get_kernel_cache`). All the other attributes are those of
+    the weave module, imported on first use.
+    '''
+    def __init__(self):
+        LazyModule.__init__(self, 'weave', 'scipy.weave')
+        self.__dict__['_functions'] = {}
+
+    def inline(self, code, arg_names=[], local_dict=None, global_dict=None,
+               force=0, compiler='', verbose=0, support_code=None, headers=[],
+               customize=None, type_converters=None, auto_downcast=1, **kw):
+        '''
+        Same as ``weave.inline``. As in weave, the compiled kernels are
+        remembered in the process by their code and argument types (not by
+        their compilation options).
+        '''
+        if local_dict is None or global_dict is None:
+            frame = sys._getframe(1)
+            if local_dict is None:
+                local_dict = frame.f_locals
+            if global_dict is None:
+                global_dict = frame.f_globals
+        values = [local_dict[name] if name in local_dict else global_dict.get(name)
+                  for name in arg_names]
+        signature = (code, tuple(_signature(value) for value in values))
+        function = self._functions.get(signature)
+        if function is None or force:
+            cache = get_kernel_cache()
+            weave = self._load()
+            if cache is None:
+                return weave.inline(code, arg_names, local_dict, global_dict,
+                                    force=force, compiler=compiler, verbose=verbose,
+                                    support_code=support_code, headers=headers,
+                                    customize=customize, type_converters=type_converters,
+                                    auto_downcast=auto_downcast, **kw)
+            key = cache.key(code, signature[1], compiler, _compiler_version(compiler),
+                            support_code, headers, _customize_items(customize), type_converters,
+                            auto_downcast, kw, sys.version, platform.machine(),
+                            numpy.__version__, getattr(weave, '__version__', ''))
+            filename = None if force else cache.filename(key)
+            if filename is None:
+                lock = cache.lock(key)
+                try:
+                    # another process may have built it while we were waiting
+                    filename = None if force else cache.filename(key)
+                    if filename is None:
+                        filename = self._build(cache, key, code, arg_names, local_dict,
+                                               global_dict, compiler, verbose,
+                                               support_code, headers, customize,
+                                               type_converters, auto_downcast, kw)
+                finally:
+                    cache.unlock(lock)
+            function = imp.load_dynamic(cache.module_name(key), filename).compiled_func
+            self._functions[signature] = function
+        return function(local_dict, global_dict)
+
+    def _build(self, cache, key, code, arg_names, local_dict, global_dict,
+               compiler, verbose, support_code, headers, customize,
+               type_converters, auto_downcast, kw):
+        '''
+        Compiles the kernel in a private directory (as
+        ``weave.inline_tools.compile_function``) and stores it in the cache.
+        '''
+        inline_tools = self._load().inline_tools
+        module_name = cache.module_name(key)
+        build_dir = tempfile.mkdtemp(prefix='build_', dir=cache.directory)
+        try:
+            mod = inline_tools.inline_ext_module(module_name, compiler)
+            ext_func = inline_tools.inline_ext_function('compiled_func',
+                                                        inline_tools.ndarray_api_version + '\n' + code,
+                                                        arg_names, local_dict, global_dict,
+                                                        auto_downcast, type_converters=type_converters)
+            mod.add_function(ext_func)
+            if customize:
+                mod.customize = customize
+            if support_code:
+                mod.customize.add_support_code(support_code)
+            for header in headers:
+                mod.customize.add_header(header)
+            if verbose > 0:
+                print '<weave: compiling>'
+            mod.compile(location=build_dir, compiler=compiler, verbose=verbose, **kw)
+            for suffix in _extension_suffixes:
+                filename = os.path.join(build_dir, module_name + suffix)
+                if os.path.exists(filename):
+                    return cache.store(key, filename)
+            raise IOError('Compiled module ' + module_name + ' not found')
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+weave = CachedWeave()
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+'''
+Deferred imports of optional and slow-to-import modules
+
+Brian uses a number of packages which are expensive to import but only
+needed for some features (weave, sympy, pylab, the compiled C++ extensions).
+Modules refer to them through a :class:`LazyModule`, which only imports the
+real module the first time one of its attributes is accessed, so that
+``import brian`` does not pay for features which are not used.
+'''
+import imp
+import sys
+
+__all__ = ['LazyModule', 'module_available']
+
+
+class LazyModule(object):
+    '''
+    Stand-in for a module which is imported on first attribute access
+    
+    Initialised with one or more module names, which are tried in order, e.g.
+    ``LazyModule('weave', 'scipy.weave')``. Attribute access imports the first
+    module which can be imported (raising the last ``ImportError`` if none
+    can) and forwards to it, so that ``weave.inline(...)`` works as with the
+    real module.
+    '''
+    def __init__(self, *names):
+        self.__dict__['_names'] = names
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            error = None
+            for name in self._names:
+                try:
+                    __import__(name)
+                except ImportError, error:
+                    continue
+                module = sys.modules[name]
+                break
+            else:
+                raise error
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        module = self.__dict__['_module']
+        if module is None:
+            return '<lazily imported module ' + repr(self._names[0]) + '>'
+        return repr(module)
+
+
+def module_available(name):
+    '''
+    Whether or not the top level module ``name`` can be imported, without
+    importing it.
+    '''
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    try:
+        f = imp.find_module(name)[0]
+    except ImportError:
+        return False
+    if f is not None:
+        f.close()
+    return True
@@ -0,0 +1,133 @@
+# ----------------------------------------------------------------------------------
+# Copyright ENS, INRIA, CNRS
+# Contributors: Romain Brette (brette@di.ens.fr) and Dan Goodman (goodman@di.ens.fr)
+# 
+# Brian is a computer program whose purpose is to simulate models
+# of biological neural networks.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+# ----------------------------------------------------------------------------------
+# 
+'''
+A simple persistent pool of worker threads
+
+Used by :meth:`Network.run` with ``threads>1`` to run the state updates,
+thresholds and resets of independent groups concurrently. This only gives a
+speed improvement if most of the work is done in functions that release the
+GIL, which is the case for large NumPy operations.
+'''
+import sys
+import threading
+import Queue
+
+__all__ = ['ThreadPool']
+
+
+def _worker(tasks, errors):
+    # The worker only holds references to the task queue and the error list
+    # and not to the pool itself, so that the pool can be garbage collected
+    # (which stops the workers, see ThreadPool.__del__)
+    while True:
+        f = tasks.get()
+        try:
+            if f is None:
+                return
+            f()
+        except:
+            errors.append(sys.exc_info())
+        finally:
+            tasks.task_done()
+
+
+class ThreadPool(object):
+    '''
+    A pool of persistent worker threads
+    
+    Initialised with the number of worker threads. The calling thread also
+    does work in :meth:`run`, so a pool with ``numthreads-1`` workers uses
+    ``numthreads`` threads in total.
+    
+    **Methods**
+    
+    .. method:: run(funcs)
+    
+        Calls each function in the sequence ``funcs`` (without arguments),
+        distributing them over the worker threads and the calling thread, and
+        returns when all of them have finished. If any of them raised an
+        exception, it is raised again in the calling thread.
+    
+    .. method:: close()
+    
+        Stops the worker threads and waits until they have returned.
+    '''
+    def __init__(self, numworkers):
+        self.numworkers = numworkers
+        self._tasks = Queue.Queue()
+        self._errors = []
+        self._threads = []
+        for _ in xrange(numworkers):
+            thread = threading.Thread(target=_worker,
+                                      args=(self._tasks, self._errors))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def run(self, funcs):
+        tasks = self._tasks
+        errors = self._errors
+        for f in funcs:
+            tasks.put(f)
+        # the calling thread takes tasks from the queue too until it is empty
+        while True:
+            try:
+                f = tasks.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                f()
+            except:
+                errors.append(sys.exc_info())
+            finally:
+                tasks.task_done()
+        tasks.join()
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            del errors[:]
+            raise exc_type, exc_value, exc_traceback
+
+    def close(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return self.numworkers + 1
@@ -0,0 +1,59 @@
+"""
+Event-driven simulation of linear integrate-and-fire neurons (see
+brian.eventdriven) against the standard clock-driven simulation.
+
+A group of integrate-and-fire neurons with exponential synaptic currents
+(without recurrent connections) receives the spikes of a Poisson group
+through sparse random connections. The input rate is varied, so that each
+neuron receives from a few events per second to several events per time
+step. The time per step is printed for the NeuronGroup and for the
+EventDrivenNeuronGroup, with the output firing rate and the fraction of the
+spikes of the NeuronGroup which are emitted at the same time steps by the
+EventDrivenNeuronGroup.
+
+The event-driven group only updates the neurons which receive events or
+spike, so it is faster when few neurons receive events at each time step,
+i.e., at low input rates.
+"""
+from brian import *
+from time import time
+import random as pyrandom
+
+N = 100000
+inputs = 1000
+connections = 10 # synapses per neuron
+rates = [0.1 * Hz, 0.3 * Hz, 1 * Hz, 3 * Hz, 10 * Hz]
+duration = 500 * ms
+
+eqs = '''
+dv/dt = (ge - (v + 70 * mV)) / (20 * ms) : volt
+dge/dt = -ge / (5 * ms) : volt
+'''
+
+
+def simulate(cls, rate):
+    reinit_default_clock()
+    seed(1)
+    pyrandom.seed(1)
+    G = cls(N, eqs, threshold=-55 * mV, reset=-70 * mV, refractory=2 * ms)
+    G.v = -70 * mV + 10 * mV * rand(N)
+    P = PoissonGroup(inputs, rate)
+    C = Connection(P, G, 'ge', weight=60 * mV, sparseness=float(connections) / inputs)
+    M = SpikeMonitor(G)
+    net = Network(G, P, C, M)
+    net.prepare()
+    start = time()
+    net.run(duration)
+    elapsed = time() - start
+    spikes = set((i, int(round(t / defaultclock.dt))) for i, t in M.spikes)
+    return elapsed * float(defaultclock.dt / duration), spikes
+
+print 'input rate (Hz)  events/step  clock (ms/step)  event (ms/step)  speedup  rate (Hz)  same spikes'
+for rate in rates:
+    clock_time, reference = simulate(NeuronGroup, rate)
+    event_time, spikes = simulate(EventDrivenNeuronGroup, rate)
+    same = len(reference & spikes) / float(max(len(reference), 1))
+    print '%15.1f  %11.1f  %15.3f  %15.3f  %7.2f  %9.2f  %10.1f%%' % (
+          rate, float(rate * defaultclock.dt) * inputs * N * connections / inputs,
+          clock_time * 1000, event_time * 1000, clock_time / event_time,
+          len(reference) / (N * float(duration)), 100 * same)
@@ -0,0 +1,111 @@
+"""
+Single versus double precision storage (``dtype`` keyword of NeuronGroup) on
+the CUBA and COBA benchmark networks (see examples/misc/CUBA.py and COBA.py),
+at the standard size and at a larger size with the same number of synapses
+per neuron.
+
+For each network and type, the simulation time, the memory used by the state
+matrix and the weights, and the firing rate are printed. Both simulations
+start from the same initial conditions and connectivity. Since the networks
+are chaotic, single neurons crossing the threshold one step apart make the
+trajectories diverge, so the accuracy is measured at the beginning of the
+simulation: the fraction of the spikes of the first 20 ms that are emitted at
+the same time step in both simulations, and the maximum difference of the
+membrane potential over the first 10 ms for the recorded neurons that did not
+spike in that period (integration error).
+
+The last table gives the time per step of the state updaters alone, with a
+million neurons.
+"""
+from brian import *
+from time import time
+import random as pyrandom
+
+sizes = [4000, 40000]
+connections = 80 # synapses per neuron
+duration = 500 * ms
+
+taum = 20 * ms
+taue = 5 * ms
+taui = 10 * ms
+Vt = -50 * mV
+Vr = -60 * mV
+El = -49 * mV
+Ee = 60 * mV
+Ei = -20 * mV
+
+models = {'CUBA': '''
+          dv/dt = (ge + gi - (v - El)) / taum : volt
+          dge/dt = -ge / taue : volt
+          dgi/dt = -gi / taui : volt
+          ''',
+          'COBA': '''
+          dv/dt = (-v + ge * (Ee - v) + gi * (Ei - v)) * (1. / taum) : volt
+          dge/dt = -ge * (1. / taue) : 1
+          dgi/dt = -gi * (1. / taui) : 1
+          '''}
+
+
+def simulate(model, N, dtype):
+    reinit_default_clock()
+    seed(1)
+    pyrandom.seed(1)
+    if model == 'CUBA':
+        P = NeuronGroup(N, models[model], threshold=Vt, reset=Vr,
+                        refractory=5 * ms, dtype=dtype)
+        P.v = Vr + rand(N) * (Vt - Vr)
+        we, wi = 1.62 * mV, -9 * mV
+    else:
+        P = NeuronGroup(N, models[model], threshold=10 * mV, reset=0 * mV,
+                        refractory=5 * ms, compile=True, dtype=dtype)
+        P.v = (randn(N) * 5 - 5) * mV
+        P.ge = randn(N) * 1.5 + 4
+        P.gi = randn(N) * 12 + 20
+        we, wi = .6, 6.7
+    Ne = int(.8 * N)
+    sparseness = float(connections) / N
+    Ce = Connection(P[:Ne], P, 'ge', weight=we, sparseness=sparseness)
+    Ci = Connection(P[Ne:], P, 'gi', weight=wi, sparseness=sparseness)
+    M = SpikeMonitor(P)
+    V = StateMonitor(P, 'v', record=range(100))
+    net = Network(P, Ce, Ci, M, V)
+    net.prepare()
+    start = time()
+    net.run(duration)
+    elapsed = time() - start
+    memory = P._S.nbytes + Ce.W.alldata.nbytes + Ci.W.alldata.nbytes
+    rate = len(M.spikes) / (N * float(duration))
+    spikes = set((i, int(round(t / defaultclock.dt))) for i, t in M.spikes)
+    return elapsed, memory, rate, spikes, V.times, V.values.astype(float)
+
+print 'model  neurons  dtype    time (s)  memory (MB)  rate (Hz)  same spikes  error (uV)'
+for model in ['CUBA', 'COBA']:
+    for N in sizes:
+        results = {}
+        for dtype in [float64, float32]:
+            results[dtype] = simulate(model, N, dtype)
+        _, _, _, reference, times, values64 = results[float64]
+        early = set(s for s in reference if s[1] < 200)
+        for dtype in [float64, float32]:
+            elapsed, memory, rate, spikes, _, values = results[dtype]
+            same = len(early & spikes) / float(len(early))
+            spiking = set(i for i, step in early | spikes if step < 100)
+            quiet = [i for i in range(len(values)) if i not in spiking]
+            error = abs(values[quiet][:, times < .01] - values64[quiet][:, times < .01]).max()
+            print '%-5s  %7d  %-7s  %8.2f  %11.1f  %9.2f  %10.1f%%  %10.3f' % (
+                  model, N, dtype.__name__, elapsed, memory / 1024. ** 2,
+                  rate, 100 * same, error / float(uvolt))
+
+print
+print 'model  dtype    state update (ms/step)'
+for model in ['CUBA', 'COBA']:
+    for dtype in [float64, float32]:
+        P = NeuronGroup(10 ** 6, models[model], compile=(model == 'COBA'),
+                        dtype=dtype)
+        P.v = rand(len(P)) * 10 * mV
+        updater = P._state_updater
+        updater(P)
+        start = time()
+        for _ in range(100):
+            updater(P)
+        print '%-5s  %-7s  %22.2f' % (model, dtype.__name__, (time() - start) * 10)
@@ -0,0 +1,52 @@
+"""
+Threshold, refractoriness and reset in a single pass (global preference
+``usefusedresets``, see brian.thresholdreset), on groups of different sizes
+with a string threshold and reset (adaptive integrate-and-fire neurons with a
+refractory period) and with a scalar threshold and reset (which uses
+Refractoriness).
+
+The groups receive no input, so that the time is that of the state update,
+threshold and reset, and the firing rate is about 20 Hz. The time per step
+is given with the standard schedule and with fused resets, and the spikes are
+checked to be the same. With weave (useweave=True), the threshold and reset
+are done in a single loop over the neurons; otherwise, with NumPy.
+"""
+from brian import *
+from time import time
+
+sizes = [100, 10000, 1000000]
+duration = 200 * ms
+
+eqs = '''
+dv/dt = (I - v - w) / (10 * ms) : 1
+dw/dt = -w / (100 * ms) : 1
+I : 1
+'''
+
+models = {'string': dict(threshold='v > 1 + 0.5 * w', reset='v = 0; w += 0.1',
+                         refractory=2 * ms),
+          'scalar': dict(threshold=1, reset=0, refractory=2 * ms)}
+
+
+def simulate(model, N, fusedresets):
+    reinit_default_clock()
+    seed(1)
+    G = NeuronGroup(N, eqs, **models[model])
+    G.I = 1.2 + rand(N)
+    G.v = rand(N)
+    M = SpikeCounter(G)
+    net = Network(G, M)
+    net.prepare(fusedresets=fusedresets)
+    start = time()
+    net.run(duration)
+    elapsed = time() - start
+    return elapsed * float(defaultclock.dt / duration), M.count
+
+print 'model    neurons  standard (ms/step)  fused (ms/step)  speedup  same spikes'
+for model in ['string', 'scalar']:
+    for N in sizes:
+        standard, count_standard = simulate(model, N, False)
+        fused, count_fused = simulate(model, N, True)
+        print '%-6s  %8d  %18.3f  %15.3f  %7.2f  %s' % (model, N, standard * 1000,
+                                                      fused * 1000, standard / fused,
+                                                      (count_standard == count_fused).all())
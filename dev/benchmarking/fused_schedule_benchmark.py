@@ -0,0 +1,53 @@
+"""
+Per time step overhead of the update schedule, standard versus fused.
+
+Each network consists of a number of tiny groups (one neuron each, with
+NoReset), tiny connections and empty network operations, so that the
+numerical work is negligible and the measured time is essentially the Python
+overhead of going through the update schedule. The fused schedule (see
+Network.prepare(fused=True)) should have a much smaller cost per object.
+"""
+from brian import *
+from time import time
+
+duration = 1 * second
+numobjects = [1, 2, 5, 10, 20, 50, 100]
+
+
+def make_network(n):
+    objects = []
+    for _ in xrange(n):
+        G = NeuronGroup(1, model='dv/dt = -v / (10 * ms) : 1')
+        H = NeuronGroup(1, model='v : 1', threshold=1)
+        C = Connection(H, G, 'v', weight=1)
+        @network_operation
+        def op():
+            pass
+        objects.extend([G, H, C, op])
+    return Network(objects)
+
+
+def time_per_step(n, fused):
+    reinit_default_clock()
+    net = make_network(n)
+    net.prepare(fused=fused)
+    net.run(defaultclock.dt)
+    start = time()
+    net.run(duration)
+    return (time() - start) / (duration / defaultclock.dt)
+
+print 'objects  standard (us/step)  fused (us/step)  speedup'
+standard = []
+fused = []
+for n in numobjects:
+    standard.append(time_per_step(n, False) * 1e6)
+    fused.append(time_per_step(n, True) * 1e6)
+    print '%7d  %19.2f  %15.2f  %7.2f' % (4 * n, standard[-1], fused[-1],
+                                          standard[-1] / fused[-1])
+
+plot(4 * array(numobjects), standard, label='standard')
+plot(4 * array(numobjects), fused, label='fused')
+xlabel('Number of objects in the update schedule')
+ylabel('Time per step (us)')
+legend(loc='upper left')
+show()
@@ -0,0 +1,59 @@
+"""
+Start-up time of Brian.
+
+Each way of importing Brian is timed in a fresh Python process (the best of a
+few repeats is reported), together with the optional packages it ended up
+importing. ``import brian`` and explicit imports of the core classes should
+not import pylab, sympy, weave, the tools package or the C++ extensions,
+which are only imported when they are first used. ``from brian import *``
+still imports pylab, for compatibility with existing scripts.
+"""
+import subprocess
+import sys
+
+repeats = 5
+
+statements = [
+    ('import brian', 'import brian'),
+    ('explicit names', 'from brian import NeuronGroup, Connection, '
+                       'SpikeMonitor, Network, ms, mV'),
+    ('explicit + run', 'from brian import NeuronGroup, Network, ms\n'
+                       'G = NeuronGroup(10, "dv/dt = -v / (10 * ms) : 1", '
+                       'threshold=1, reset=0)\n'
+                       'Network(G).run(10 * ms)'),
+    ('from brian import *', 'from brian import *'),
+    ]
+
+optional = ['pylab', 'matplotlib', 'sympy', 'weave', 'scipy.weave',
+            'brian.plotting', 'brian.tools', 'brian.library', 'brian.hears',
+            'brian.utils.ccircular.ccircular',
+            'brian.experimental.cspikequeue.cspikequeue',
+            'brian.experimental.codegen']
+
+script = """
+import sys, time
+start = time.time()
+exec compile(%r, '<benchmark>', 'exec')
+elapsed = time.time() - start
+loaded = [m for m in %r if sys.modules.get(m) is not None]
+print elapsed, ' '.join(loaded)
+"""
+
+
+def time_statement(statement):
+    best = None
+    for _ in xrange(repeats):
+        output = subprocess.Popen([sys.executable, '-c',
+                                   script % (statement, optional)],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        fields = output.strip().splitlines()[-1].split(' ', 1)
+        elapsed = float(fields[0])
+        loaded = fields[1].split() if len(fields) > 1 else []
+        if best is None or elapsed < best[0]:
+            best = (elapsed, loaded)
+    return best
+
+print '%-20s  %9s  %s' % ('statement', 'time (s)', 'optional modules imported')
+for name, statement in statements:
+    elapsed, loaded = time_statement(statement)
+    print '%-20s  %9.3f  %s' % (name, elapsed, ', '.join(loaded) or '-')
@@ -0,0 +1,58 @@
+"""
+Startup time of simulations using weave, with a cold and a warm cache of
+compiled kernels (see brian.utils.kernelcache).
+
+A number of worker processes are started at the same time, each running a
+short simulation with weave enabled (state updater, threshold, reset,
+sparse and delayed propagation, STDP). With a cold (empty) cache, one worker
+compiles each kernel while the others wait for it; with a warm cache, the
+kernels are only loaded. The times are the wall clock times until all the
+workers have finished. Requires weave and a C++ compiler.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from time import time
+
+numworkers = [1, 4, 16]
+
+worker = '''
+from brian import *
+set_global_preferences(useweave=True, weavecachedir=%r)
+eqs = """
+dv/dt = (ge + gi - (v + 49 * mV)) / (20 * ms) : volt
+dge/dt = -ge / (5 * ms) : volt
+dgi/dt = -gi / (10 * ms) : volt
+"""
+P = NeuronGroup(1000, eqs, threshold=-50 * mV, reset=-60 * mV)
+P.v = -60 * mV + 10 * mV * rand(len(P))
+Ce = Connection(P[:800], P, 'ge', weight=1.62 * mV, sparseness=0.02)
+Ci = Connection(P[800:], P, 'gi', weight=-9 * mV, sparseness=0.02, delay=True,
+                max_delay=5 * ms)
+stdp = ExponentialSTDP(Ce, 20 * ms, 20 * ms, .01 * mV, -.0105 * mV, wmax=5 * mV)
+run(10 * ms)
+'''
+
+
+def start(n, directory):
+    '''
+    Wall clock time to run n workers at the same time.
+    '''
+    t = time()
+    processes = [subprocess.Popen([sys.executable, '-c', worker % directory])
+                 for _ in range(n)]
+    for process in processes:
+        process.wait()
+    return time() - t
+
+print 'workers  cold (s)  warm (s)'
+for n in numworkers:
+    directory = tempfile.mkdtemp()
+    try:
+        cold = start(n, directory)
+        warm = start(n, directory)
+    finally:
+        shutil.rmtree(directory)
+    print '%7d  %8.2f  %8.2f' % (n, cold, warm)
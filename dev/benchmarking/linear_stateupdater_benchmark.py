@@ -0,0 +1,67 @@
+"""
+Time per step of LinearStateUpdater, structured update versus matrix product.
+
+For each model, a NeuronGroup is created with and without the
+``usestructured_linear_diffeq`` preference, and the state updater alone is
+called repeatedly. The models are:
+
+* ``lif``: a single variable (elementwise multiplication)
+* ``cuba``: a membrane potential fed by two synaptic currents (triangular)
+* ``adaptive``: a membrane potential coupled with an adaptation variable and
+  fed by a synaptic current (a 2x2 block and an independent variable)
+* ``dense``: three fully coupled variables (no structure, matrix product in
+  both cases)
+"""
+from brian import *
+from time import time
+
+sizes = [100, 1000, 10000, 100000]
+repeats = 1000
+
+tau = 20 * ms
+taue = 5 * ms
+taui = 10 * ms
+tauw = 100 * ms
+El = -70 * mV
+
+models = [
+    ('lif', '''
+     dv/dt = (El - v) / tau : volt
+     '''),
+    ('cuba', '''
+     dv/dt = (ge + gi - (v - El)) / tau : volt
+     dge/dt = -ge / taue : volt
+     dgi/dt = -gi / taui : volt
+     '''),
+    ('adaptive', '''
+     dv/dt = (ge - (v - El) - w) / tau : volt
+     dw/dt = (0.5 * (v - El) - w) / tauw : volt
+     dge/dt = -ge / taue : volt
+     '''),
+    ('dense', '''
+     dx/dt = (y - x) / tau : 1
+     dy/dt = (z - y) / tau : 1
+     dz/dt = (x - z) / tau : 1
+     '''),
+    ]
+
+
+def time_per_step(model, N, structured):
+    set_global_preferences(usestructured_linear_diffeq=structured)
+    G = NeuronGroup(N, model)
+    G._S[:] = rand(*G._S.shape)
+    update = G._state_updater
+    start = time()
+    for _ in xrange(repeats):
+        update(G)
+    return (time() - start) / repeats
+
+print 'model          N  dot (us/step)  structured (us/step)  speedup'
+for name, model in models:
+    for N in sizes:
+        dot_time = time_per_step(model, N, False) * 1e6
+        structured_time = time_per_step(model, N, True) * 1e6
+        print '%-8s %7d  %13.2f  %20.2f  %7.2f' % (name, N, dot_time,
+                                                   structured_time,
+                                                   dot_time / structured_time)
+set_global_preferences(usestructured_linear_diffeq=True)
@@ -0,0 +1,75 @@
+"""
+Time per step of the compiled Euler and exponential Euler state updaters.
+
+A Hodgkin-Huxley group is created and the state updater alone is called
+repeatedly, with:
+
+* ``python``: ``compile=False``, the equations are evaluated as Python
+  functions
+* ``generated``: the former generated code, which creates temporary arrays
+  for every subexpression (Euler only, as it does not support function
+  calls for exponential Euler)
+* ``in-place``: in-place ufuncs writing into preallocated scratch rows
+* ``numexpr``: each equation evaluated by numexpr (if installed, see the
+  ``usenumexpr`` global preference)
+"""
+from brian import *
+from brian.optimiser import numexpr_available
+from time import time
+
+sizes = [1000, 10000, 100000]
+repeats = 100
+
+El = 10.6 * mV
+EK = -12 * mV
+ENa = 120 * mV
+gl = 0.3 * msiemens
+gNa = 120 * msiemens
+gK = 36 * msiemens
+Cm = 1 * uF
+
+eqs = '''
+dv/dt = (I - gl * (v - El) - gNa * m ** 3 * h * (v - ENa) - gK * n ** 4 * (v - EK)) / Cm : volt
+dm/dt = alpham * (1 - m) - betam * m : 1
+dn/dt = alphan * (1 - n) - betan * n : 1
+dh/dt = alphah * (1 - h) - betah * h : 1
+alpham = 0.1 * (mV ** -1) * (25 * mV - v) / (exp(2.5 - .1 * (mV ** -1) * v) - 1) / ms : Hz
+betam = 4 * exp(-.0556 * (mV ** -1) * v) / ms : Hz
+alphah = 0.07 * exp(-.05 * (mV ** -1) * v) / ms : Hz
+betah = 1. / (1 + exp(3. - .1 * (mV ** -1) * v)) / ms : Hz
+alphan = .01 * (mV ** -1) * (10 * mV - v) / (exp(1 - .1 * (mV ** -1) * v) - 1) / ms : Hz
+betan = .125 * exp(-.0125 * (mV ** -1) * v) / ms : Hz
+I : amp
+'''
+
+modes = ['python', 'generated', 'in-place']
+if numexpr_available:
+    modes.append('numexpr')
+
+
+def time_per_step(N, implicit, mode):
+    set_global_preferences(usenumexpr=(mode == 'numexpr'))
+    G = NeuronGroup(N, eqs, compile=(mode != 'python'), freeze=True,
+                    implicit=implicit)
+    G.v = rand(N) * mV
+    G.m, G.h, G.n = 0.05, 0.6, 0.32
+    update = G._state_updater
+    if mode == 'generated':
+        if implicit:
+            return None
+        update._inplace = None
+        update._code = update.eqs.forward_euler_code()
+    update(G)
+    start = time()
+    for _ in xrange(repeats):
+        update(G)
+    return (time() - start) / repeats
+
+print 'method                  N  ' + '  '.join('%s (ms/step)' % mode for mode in modes)
+for implicit in [False, True]:
+    for N in sizes:
+        times = [time_per_step(N, implicit, mode) for mode in modes]
+        print '%-18s %6d  ' % (['Euler', 'exponential Euler'][implicit], N) + \
+              '  '.join('%*s' % (len(mode) + 12, '-' if t is None else '%.3f' % (t * 1e3))
+                        for mode, t in zip(modes, times))
+set_global_preferences(usenumexpr=False)
@@ -0,0 +1,66 @@
+"""
+Refractory neurons held inactive (``refractory_mode='inactive'`` keyword of
+NeuronGroup) versus clamped at the reset value (default), for groups of
+neurons firing regularly with different refractory periods, so that
+different fractions of the group are refractory at any time.
+
+With the default mode, all the neurons are integrated and the refractory
+neurons are found by scanning the group (``get_refractory_indices``). In the
+inactive mode, the set of refractory neurons is updated from the spikes and
+the ends of the refractory periods, the state of refractory neurons is held
+by copying it before the state update and back after it, except when more
+than 60% of the group is refractory: then only the other neurons are
+integrated (linear equations and Euler integration). The times per step are
+given for the whole simulation and for ``get_refractory_indices``. Copying the
+state of a neuron costs about as much as integrating it with cheap state
+updates, so that the inactive mode is only faster when most of the group is
+refractory.
+"""
+from brian import *
+from time import time
+
+N = 100000
+duration = 200 * ms
+refractory_periods = [2 * ms, 10 * ms, 25 * ms, 50 * ms]
+
+models = {'linear': '''
+          dv/dt = (I - v + ge) / (10 * ms) : 1
+          dge/dt = -ge / (5 * ms) : 1
+          I : 1
+          ''',
+          'nonlinear': '''
+          dv/dt = (I - v + exp(5 * (v - 1)) + ge - w) / (10 * ms) : 1
+          dge/dt = -ge / (5 * ms) : 1
+          dw/dt = (0.1 * v - w) / (100 * ms) : 1
+          I : 1
+          '''}
+
+
+def simulate(model, refractory, mode):
+    reinit_default_clock()
+    seed(1)
+    G = NeuronGroup(N, models[model], threshold=1, reset=0, refractory=refractory,
+                    refractory_mode=mode)
+    G.I = 2 + rand(N)
+    G.v = rand(N)
+    M = SpikeCounter(G)
+    net = Network(G, M)
+    net.prepare()
+    start = time()
+    net.run(duration)
+    elapsed = time() - start
+    fraction = len(G.get_refractory_indices()) / float(N)
+    start = time()
+    for _ in range(100):
+        G.get_refractory_indices()
+    indices = (time() - start) / 100
+    return elapsed * float(defaultclock.dt / duration), indices, fraction
+
+print 'model      refractory  refractory neurons  clamp (ms/step)  inactive (ms/step)  indices clamp (ms)  indices inactive (ms)'
+for model in ['linear', 'nonlinear']:
+    for refractory in refractory_periods:
+        clamp, indices_clamp, _ = simulate(model, refractory, 'clamp')
+        inactive, indices_inactive, fraction = simulate(model, refractory, 'inactive')
+        print '%-9s  %7.0f ms  %17.0f%%  %15.3f  %18.3f  %18.3f  %21.3f' % (
+              model, refractory / ms, 100 * fraction, clamp * 1000, inactive * 1000,
+              indices_clamp * 1000, indices_inactive * 1000)
@@ -0,0 +1,45 @@
+"""
+Spike storage of groups (SpikeContainer, see brian.utils.circular) with many
+subgroups, each with its own connection.
+
+A Poisson group of N neurons is split into subgroups of equal size, and each
+subgroup is connected to a group of 10 neurons with a delay, so that at each
+time step each connection queries the spikes of its subgroup in a past time
+bin. The time per step is given for the whole network and for the spike
+queries alone (get_spikes on each subgroup, as done by the connections).
+"""
+from brian import *
+from time import time
+
+N = 100000
+rate = 20 * Hz
+subgroups = [1, 10, 100, 1000]
+duration = 200 * ms
+
+
+def simulate(n):
+    reinit_default_clock()
+    seed(1)
+    P = PoissonGroup(N, rate)
+    target = NeuronGroup(10, 'v : 1')
+    size = N // n
+    connections = [Connection(P[i * size:(i + 1) * size], target, 'v', weight=1,
+                              sparseness=0.01, delay=2 * ms) for i in xrange(n)]
+    net = Network(P, target, connections)
+    net.prepare()
+    start = time()
+    net.run(duration)
+    step_time = (time() - start) * float(defaultclock.dt / duration)
+    subgroups = [C.source for C in connections]
+    steps = 100
+    start = time()
+    for _ in xrange(steps):
+        for G in subgroups:
+            G.get_spikes(20)
+    query_time = (time() - start) / steps
+    return step_time, query_time
+
+print 'subgroups  network (ms/step)  queries (ms/step)'
+for n in subgroups:
+    step_time, query_time = simulate(n)
+    print '%9d  %17.3f  %17.3f' % (n, step_time * 1000, query_time * 1000)
@@ -0,0 +1,77 @@
+"""
+SpikeGeneratorGroup replaying a large recorded dataset, with the spikes in
+memory (FastSpikeGeneratorThreshold) and read during the run
+(StreamingSpikeGeneratorThreshold, see brian.directcontrol), from
+memory-mapped files or in chunks read from the files.
+
+The dataset (indices and times of the spikes of N neurons firing at 10 Hz
+for the given duration, sorted by time) is saved in .npy files in a
+temporary directory. For each mode, the time to create the group, the time
+per step of the run and the increase of the peak memory of the process
+(resident set size) are printed, with the spike counts. Each mode is run
+in a separate process, so that the peak memory of one does not hide that of
+the other. With memory-mapped files, the resident memory includes the pages
+of the files which have been read, which the system can reclaim.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+N = 100000
+rate = 10.
+duration = 10. # seconds
+
+if len(sys.argv) == 3:
+    import resource
+    from brian import *
+    from time import time
+    import numpy
+    path, mode = sys.argv[1:]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    mmap_mode = 'r' if mode != 'memory' else None
+    indices = numpy.load(os.path.join(path, 'indices.npy'), mmap_mode=mmap_mode)
+    times = numpy.load(os.path.join(path, 'times.npy'), mmap_mode=mmap_mode)
+    def chunks():
+        files = [open(os.path.join(path, name), 'rb') for name in ['indices.npy', 'times.npy']]
+        for f in files:
+            numpy.lib.format.read_magic(f)
+            numpy.lib.format.read_array_header_1_0(f)
+        while True:
+            chunk = numpy.fromfile(files[0], dtype=indices.dtype, count=65536), \
+                    numpy.fromfile(files[1], dtype=times.dtype, count=65536)
+            if not len(chunk[0]):
+                break
+            yield chunk
+    start = time()
+    if mode == 'chunks':
+        G = SpikeGeneratorGroup(N, chunks, stream=True)
+    else:
+        G = SpikeGeneratorGroup(N, (indices, times))
+    creation = time() - start
+    M = SpikeCounter(G)
+    net = Network(G, M)
+    net.prepare()
+    start = time()
+    net.run(duration * second)
+    elapsed = time() - start
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024.
+    steps = int(duration * second / defaultclock.dt)
+    print '%-10s  %12.2f  %13.3f  %15.0f  %d' % (mode, creation, elapsed / steps * 1000,
+                                                memory, M.nspikes)
+    sys.exit()
+
+import numpy
+path = tempfile.mkdtemp()
+try:
+    n = int(N * rate * duration)
+    numpy.save(os.path.join(path, 'indices.npy'), numpy.random.randint(0, N, n))
+    numpy.save(os.path.join(path, 'times.npy'), numpy.sort(numpy.random.rand(n) * duration))
+    print '%d spikes' % n
+    print 'mode        creation (s)  run (ms/step)  peak memory (MB)  spikes'
+    for mode in ['memory', 'mmap', 'chunks']:
+        sys.stdout.flush()
+        subprocess.call([sys.executable, __file__, path, mode])
+finally:
+    shutil.rmtree(path)
@@ -0,0 +1,67 @@
+"""
+Benchmark of Network.run(threads=N) on a COBA network split into groups.
+
+The COBA benchmark network (see examples/misc/COBA.py) is split into
+numgroups separate NeuronGroups of equal size (every group has its own
+excitatory and inhibitory part), so that the state updates, thresholds and
+resets of the groups can be run concurrently. Spike propagation is still
+done serially. The speed improvement depends on the group sizes, since only
+large NumPy operations release the GIL.
+"""
+from brian import *
+from time import time
+
+N = 40000
+numgroups = 8
+duration = 1 * second
+numthreads = [1, 2, 4, 8]
+
+taum = 20 * msecond
+taue = 5 * msecond
+taui = 10 * msecond
+Ee = (0. + 60.) * mvolt
+Ei = (-80. + 60.) * mvolt
+eqs = '''
+dv/dt = (-v+ge*(Ee-v)+gi*(Ei-v))*(1./taum) : volt
+dge/dt = -ge*(1./taue) : 1
+dgi/dt = -gi*(1./taui) : 1 
+'''
+we = 6. / 10. * (4000. / N)
+wi = 67. / 10. * (4000. / N)
+
+
+def make_network():
+    seed(3210)
+    reinit_default_clock()
+    n = N / numgroups
+    groups, exc, inh = [], [], []
+    for _ in xrange(numgroups):
+        P = NeuronGroup(n, model=eqs, threshold=10 * mvolt,
+                        reset=0 * mvolt, refractory=5 * msecond,
+                        compile=True, freeze=True)
+        P.v = (randn(len(P)) * 5 - 5) * mvolt
+        P.ge = randn(len(P)) * 1.5 + 4
+        P.gi = randn(len(P)) * 12 + 20
+        groups.append(P)
+        exc.append(P.subgroup(n * 4 / 5))
+        inh.append(P.subgroup(n / 5))
+    connections = []
+    for source in exc:
+        for target in groups:
+            connections.append(Connection(source, target, 'ge', weight=we,
+                                          sparseness=0.02))
+    for source in inh:
+        for target in groups:
+            connections.append(Connection(source, target, 'gi', weight=wi,
+                                          sparseness=0.02))
+    counter = PopulationSpikeCounter(groups[0])
+    return Network(groups, connections, counter), counter
+
+for threads in numthreads:
+    net, counter = make_network()
+    net.run(defaultclock.dt, threads=threads)
+    start = time()
+    net.run(duration, threads=threads)
+    print '%d threads: %.2f s (%d spikes in the first group)' % (threads,
+                                                              time() - start,
+                                                              counter.nspikes)